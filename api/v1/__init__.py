@@ -6,4 +6,5 @@ from . import health
 from . import moon_calendar
 from . import tarot
 from . import astro_bot
-from . import book_czin 
\ No newline at end of file
+from . import book_czin
+from . import admin 
\ No newline at end of file
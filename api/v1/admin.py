@@ -0,0 +1,179 @@
+"""
+Служебные эндпоинты для мониторинга внутреннего состояния сервиса
+
+Эндпоинты не требуют авторизации: роутер /api/v1/admin должен быть закрыт
+контролем доступа на reverse proxy (nginx).
+"""
+from datetime import date, datetime
+from typing import Dict, Any, Optional
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Request
+
+import config
+from core.cache import CacheManager
+from modules.moon_calendar.parser import date_range
+
+router = APIRouter(prefix="/api/v1/admin", tags=["admin"])
+
+
+@router.get("/cache/stats", response_model=Dict[str, Any])
+async def get_cache_stats(request: Request):
+    """
+    Статистика кэша по уровням
+
+    Возвращает счетчики попаданий/промахов L1-кэша (память процесса) и L2 (Redis),
+    а также заполненность L1. Статистика относится к текущему воркеру.
+    """
+    cache_manager = request.app.state.cache_manager
+    return cache_manager.get_stats()
+
+
+@router.get("/openrouter/stats", response_model=Dict[str, Any])
+async def get_openrouter_stats(request: Request):
+    """
+    Статистика клиентов OpenRouter
+
+    Для каждого клиента: задержки по моделям (p50/p90 по последним успешным ответам)
+    и результаты хеджирования запросов, включая долю побед моделей в гонках.
+    Статистика относится к текущему воркеру.
+    """
+    clients = request.app.state.openrouter_clients
+    return {name: client.get_stats() for name, client in clients.items()}
+
+
+@router.get("/openrouter/scoreboard", response_model=Dict[str, Any])
+async def get_openrouter_scoreboard(request: Request):
+    """
+    Табло маршрутизатора OpenRouter
+
+    Для каждого клиента - пары (модель, ключ) с оценкой, сглаженными задержкой
+    и долей ошибок и оставшейся паузой после 401/403/404/429. Ключи маскируются,
+    лучшие здоровые пары идут первыми. Табло относится к текущему воркеру.
+    """
+    clients = request.app.state.openrouter_clients
+    return {name: client.router.get_scoreboard() for name, client in clients.items()}
+
+
+@router.get("/openrouter/limiter", response_model=Dict[str, Any])
+async def get_openrouter_limiter_stats(request: Request):
+    """
+    Состояние ограничителя запросов к OpenRouter
+
+    Общий для всех клиентов семафор (занятые слоты и насыщение), число запросов
+    в очереди, время ожидания в очереди (среднее, p50/p95, максимум) и ведра токенов
+    по моделям и ключам с оставшейся паузой по Retry-After. Относится к текущему воркеру.
+    """
+    clients = request.app.state.openrouter_clients
+    limiter = next(iter(clients.values())).rate_limiter
+    return limiter.get_stats()
+
+
+@router.get("/openrouter/usage", response_model=Dict[str, Any])
+async def get_openrouter_usage_stats(request: Request):
+    """
+    Учет токенов и задержек запросов к LLM за последние OPENROUTER_USAGE_WINDOW_SECONDS секунд
+
+    Агрегаты по вызывающему коду (moon, moon_background, tarot, tarot_puzzlebot,
+    crypto, crypto_background, *_stream) с разбивкой по моделям и отдельно по моделям:
+    количество запросов, ошибок и повторов, токены промпта и ответа, p50/p95 задержки
+    и суммарное время ожидания LLM. Относится к текущему воркеру.
+    """
+    clients = request.app.state.openrouter_clients
+    tracker = next(iter(clients.values())).usage_tracker
+    return tracker.get_stats()
+
+
+@router.get("/parser/stats", response_model=Dict[str, Any])
+async def get_parser_pool_stats(request: Request):
+    """
+    Состояние пула разбора страниц лунного календаря
+
+    Режим пула (thread, process или inline), задачи в работе и в очереди, отклоненные
+    из-за переполнения очереди, время разбора и ожидания исполнителя (p50/p95).
+    В режиме inline также время, на которое разбор блокировал цикл событий.
+    Относится к текущему воркеру.
+    """
+    return request.app.state.parse_pool.get_stats()
+
+
+@router.get("/moon-calendar/update-stats", response_model=Dict[str, Any])
+async def get_moon_calendar_update_stats(request: Request):
+    """
+    Метрики фонового обновления лунного календаря
+
+    Сколько раз страница Rambler не изменилась (ответ 304 или тот же SHA-256
+    содержимого) и разбор был пропущен, сколько раз изменилась только разметка
+    страницы, а не данные дня, и сколько генераций AI-ответов пропущено и выполнено.
+    Относится к текущему воркеру.
+    """
+    return request.app.state.moon_calendar_tasks.get_stats()
+
+
+@router.post("/moon-calendar/prefetch", response_model=Dict[str, Any])
+async def prefetch_moon_calendar_month(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    month: Optional[str] = Query(None, description="Месяц в формате YYYY-MM (по умолчанию текущий)")
+):
+    """
+    Предзагрузка лунного календаря за месяц
+
+    Запускает фоновую задачу, которая парсит все отсутствующие в кэше дни месяца
+    (с ограничением одновременных запросов и частоты запросов к Rambler) и сохраняет
+    их одним пакетом. Ход выполнения виден в логах.
+
+    Принимаются месяцы от текущего до MOON_CALENDAR_PREFETCH_MAX_MONTHS_AHEAD вперед.
+    """
+    current_month = date.today().replace(day=1)
+    try:
+        month_start = datetime.strptime(month, "%Y-%m").date() if month else current_month
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неверный формат месяца. Используйте YYYY-MM")
+
+    months_ahead = (month_start.year - current_month.year) * 12 + month_start.month - current_month.month
+    if not 0 <= months_ahead <= config.MOON_CALENDAR_PREFETCH_MAX_MONTHS_AHEAD:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Предзагрузка доступна для месяцев от текущего до {config.MOON_CALENDAR_PREFETCH_MAX_MONTHS_AHEAD} вперед"
+        )
+
+    tasks = request.app.state.moon_calendar_tasks
+    background_tasks.add_task(tasks.prefetch_month, month_start.year, month_start.month)
+    return {"scheduled": True, "month": month_start.strftime("%Y-%m")}
+
+
+@router.get("/moon-calendar/astronomy", response_model=Dict[str, Any])
+async def get_moon_calendar_astronomy(
+    request: Request,
+    start: Optional[str] = Query(None, description="Первый день в формате YYYY-MM-DD (по умолчанию сегодня)"),
+    end: Optional[str] = Query(None, description="Последний день (включительно) в формате YYYY-MM-DD")
+):
+    """
+    Локальный расчет Луны за диапазон и сверка с данными Rambler в кэше
+
+    Для каждого дня: рассчитанные фаза, лунные дни и освещенность диска в полдень,
+    моменты главных фаз диапазона. Для дней, спарсенных с Rambler и лежащих в кэше,
+    в validation перечислены расхождения с расчетом (пустой список - данные согласуются).
+    """
+    ephemeris = request.app.state.moon_ephemeris
+    if ephemeris is None:
+        raise HTTPException(status_code=503, detail="Локальный расчет Луны недоступен (не установлен numpy)")
+    try:
+        start_date = datetime.strptime(start, "%Y-%m-%d").date() if start else date.today()
+        end_date = datetime.strptime(end, "%Y-%m-%d").date() if end else start_date
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неверный формат даты. Используйте YYYY-MM-DD")
+    if end_date < start_date or (end_date - start_date).days + 1 > config.MOON_CALENDAR_RANGE_MAX_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Диапазон должен быть непустым и не длиннее {config.MOON_CALENDAR_RANGE_MAX_DAYS} дней"
+        )
+
+    result = ephemeris.describe_range(start_date, end_date)
+    cached = await request.app.state.cache_manager.get_many(
+        CacheManager.NS_MOON_CALENDAR, date_range(start_date, end_date), field=CacheManager.CALENDAR_FIELD
+    )
+    result["validation"] = {
+        calendar_date.isoformat(): ephemeris.validate(data, config.MOON_ASTRONOMY_TOLERANCE_MINUTES)
+        for calendar_date, data in cached.items()
+    }
+    return result
@@ -10,6 +10,7 @@ from modules.moon_calendar import MoonCalendarParser, ApiResponse
 from modules.moon_calendar.openrouter_service import MoonCalendarOpenRouterService
 from core.cache import CacheManager
 from core.openrouter_client import OpenRouterClient
+from core.sse import sse_response
 import config
 
 router = APIRouter(prefix="/api/v1/astro_bot")
@@ -17,28 +18,14 @@ router = APIRouter(prefix="/api/v1/astro_bot")
 # Настройка логгера
 logger = logging.getLogger(__name__)
 
-@router.get("/moon_day", response_model=ApiResponse)
-async def get_moon_day(
-    request: Request,
-    user_type: str = Query("free", description="Тип пользователя: free или premium"),
-    calendar_date: Optional[str] = Query(None, description="Дата в формате YYYY-MM-DD")
-):
+def _validate_params(user_type: str, calendar_date: Optional[str]) -> date:
     """
-    Получение данных лунного календаря с обработкой через OpenRouter
+    Проверка типа пользователя и даты запроса
     
-    - **user_type**: Тип пользователя (free/premium)
-    - **calendar_date**: Дата в формате YYYY-MM-DD (если не указана, используется текущая дата)
+    :param user_type: Тип пользователя (free/premium)
+    :param calendar_date: Дата в формате YYYY-MM-DD (если не указана, используется текущая дата)
+    :return: Дата календаря
     """
-    # Получаем сервис из state приложения
-    openrouter_service: MoonCalendarOpenRouterService = request.app.state.moon_openrouter_service
-    
-    # Проверяем, что Redis подключен
-    if not openrouter_service.cache_manager.redis:
-        logger.error("Redis не подключен при запросе к /moon_day. Пробуем переподключиться...")
-        await openrouter_service.cache_manager.connect()
-        if not openrouter_service.cache_manager.redis:
-            logger.critical("Не удалось подключиться к Redis при запросе к /moon_day!")
-    
     if user_type not in ["free", "premium"]:
         raise HTTPException(
             status_code=400,
@@ -47,20 +34,63 @@ async def get_moon_day(
     
     try:
         if calendar_date:
-            date_obj = datetime.strptime(calendar_date, "%Y-%m-%d").date()
-        else:
-            date_obj = date.today()
+            return datetime.strptime(calendar_date, "%Y-%m-%d").date()
+        return date.today()
     except ValueError:
         raise HTTPException(
             status_code=400,
             detail="Неверный формат даты. Используйте YYYY-MM-DD"
         )
+
+@router.get("/moon_day", response_model=ApiResponse)
+async def get_moon_day(
+    request: Request,
+    user_type: str = Query("free", description="Тип пользователя: free или premium"),
+    calendar_date: Optional[str] = Query(None, description="Дата в формате YYYY-MM-DD")
+):
+    """
+    Получение данных лунного календаря с обработкой через OpenRouter
+    
+    - **user_type**: Тип пользователя (free/premium)
+    - **calendar_date**: Дата в формате YYYY-MM-DD (если не указана, используется текущая дата)
+    """
+    # Получаем сервис из state приложения
+    openrouter_service: MoonCalendarOpenRouterService = request.app.state.moon_openrouter_service
+    
+    # Переподключение к Redis выполняет фоновая проверка CacheManager,
+    # пока Redis недоступен, запрос обслуживается резервным кэшем в памяти
+    if not openrouter_service.cache_manager.is_available:
+        logger.warning("Redis недоступен при запросе к /moon_day, кэш работает в резервном режиме.")
+    
+    date_obj = _validate_params(user_type, calendar_date)
     
     try:
         return await openrouter_service.get_moon_calendar_response(date_obj, user_type)
+    except HTTPException:
+        # Например, 503 при перегрузке пула разбора - клиент может повторить запрос
+        raise
     except Exception as e:
         logger.error(f"Ошибка при получении данных лунного календаря: {e}", exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"Ошибка при получении данных лунного календаря: {str(e)}"
-        ) 
\ No newline at end of file
+        )
+
+@router.get("/moon_day/stream")
+async def stream_moon_day(
+    request: Request,
+    user_type: str = Query("free", description="Тип пользователя: free или premium"),
+    calendar_date: Optional[str] = Query(None, description="Дата в формате YYYY-MM-DD")
+):
+    """
+    Потоковое получение данных лунного календаря (Server-Sent Events)
+    
+    События: `token` (фрагмент текста по мере генерации), `done` (полный очищенный
+    текст, которым клиент заменяет собранные фрагменты) или `error`.
+    
+    - **user_type**: Тип пользователя (free/premium)
+    - **calendar_date**: Дата в формате YYYY-MM-DD (если не указана, используется текущая дата)
+    """
+    openrouter_service: MoonCalendarOpenRouterService = request.app.state.moon_openrouter_service
+    date_obj = _validate_params(user_type, calendar_date)
+    return sse_response(openrouter_service.stream_moon_calendar_response(date_obj, user_type))
@@ -2,9 +2,9 @@
 Эндпоинты лунного календаря
 """
 from datetime import datetime, date
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Query, Request
 
-from modules.moon_calendar import MoonCalendarParser, ApiResponse, MoonCalendarService
+from modules.moon_calendar import MoonCalendarParser, ApiResponse, CalendarRangeResponse, MoonCalendarService
 from core.cache import CacheManager
 import config 
 
@@ -22,6 +22,32 @@ async def get_current_moon_calendar(request: Request):
     service = request.app.state.moon_openrouter_service # Используем MoonCalendarOpenRouterService т.к. он теперь основной для API
     return await service.get_moon_calendar_response(date.today(), user_type="free") # Предполагаем, что это для "free" пользователя
 
+@router.get("/range", response_model=CalendarRangeResponse)
+async def get_moon_calendar_range(
+    request: Request,
+    start: str = Query(..., description="Первый день в формате YYYY-MM-DD"),
+    end: str = Query(..., description="Последний день (включительно) в формате YYYY-MM-DD")
+):
+    """Получение данных лунного календаря за диапазон дней одним запросом"""
+    try:
+        start_date = datetime.strptime(start, "%Y-%m-%d").date()
+        end_date = datetime.strptime(end, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="Неверный формат даты. Используйте YYYY-MM-DD"
+        )
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="Дата end должна быть не раньше даты start")
+    if (end_date - start_date).days + 1 > config.MOON_CALENDAR_RANGE_MAX_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Диапазон не должен превышать {config.MOON_CALENDAR_RANGE_MAX_DAYS} дней"
+        )
+    
+    service = request.app.state.moon_openrouter_service
+    return await service.get_calendar_range(start_date, end_date)
+
 @router.get("/{calendar_date}", response_model=ApiResponse)
 async def get_moon_calendar(calendar_date: str, request: Request):
     """Получение данных лунного календаря на конкретную дату"""
@@ -17,6 +17,7 @@ from modules.tarot.openrouter_service import TarotOpenRouterService
 from modules.tarot.data import get_all_cards, get_card_by_id, get_all_spreads, get_spread_by_id
 from core.cache import CacheManager
 from core.openrouter_client import OpenRouterClient
+from core.sse import sse_response
 import config
 
 router = APIRouter(prefix="/api/v1/tarot")
@@ -227,6 +228,36 @@ async def get_reading_get(
     )
     return await get_reading(request)
 
+@router.get("/reading/stream")
+async def stream_reading(
+    spread_id: int = Query(..., description="ID выбранного расклада"),
+    question: Optional[str] = Query(None, description="Вопрос для гадания"),
+    user_type: str = Query("free", description="Тип пользователя (free/premium)")
+):
+    """
+    Потоковое гадание на картах Таро (Server-Sent Events)
+    
+    События: `cards` (выпавшие карты), `token` (фрагмент интерпретации по мере генерации),
+    `done` (полный ответ) или `error`.
+    
+    - **spread_id**: ID выбранного расклада
+    - **question**: Вопрос для гадания (опционально)
+    - **user_type**: Тип пользователя (free/premium)
+    """
+    if user_type not in ["free", "premium"]:
+        raise HTTPException(
+            status_code=400,
+            detail="Неверный тип пользователя. Допустимые значения: free, premium"
+        )
+    
+    if not get_spread_by_id(spread_id):
+        raise HTTPException(
+            status_code=404,
+            detail=f"Расклад с ID {spread_id} не найден"
+        )
+    
+    return sse_response(tarot_service.stream_tarot_reading(spread_id, question, user_type))
+
 @router.get("/daily_card", response_model=Dict[str, Any])
 async def get_daily_card(
     user_type: str = Query("free", description="Тип пользователя (free/premium)")
@@ -35,7 +35,9 @@ openrouter_client = OpenRouterClient(
 tarot_service = TarotOpenRouterService(
     cache_manager=cache_manager,
     openrouter_client=openrouter_client,
-    prompts_config=config.TAROT_PROMPTS
+    prompts_config=config.TAROT_PROMPTS,
+    deadlines=config.PUZZLEBOT_OPENROUTER_DEADLINES,  # PuzzleBot не ждет ответ долго
+    llm_caller="tarot_puzzlebot"
 )
 
 # Инициализация генератора PDF
@@ -118,8 +120,8 @@ async def get_puzzlebot_reading(
             reading_data["text_result"] = text_result
             
             # Сохраняем данные в кэш для последующего использования при генерации PDF
-            cache_key = f"tarot_reading_data_{spread_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-            await cache_manager.set(cache_key, reading_data, ttl_minutes=60)  # Сохраняем на 1 час
+            cache_key = f"reading_data_{spread_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            await cache_manager.set(CacheManager.NS_TAROT_PDF, cache_key, reading_data)
             
             # Добавляем ссылку на PDF в текстовый результат
             pdf_link = f"/api/v1/puzzlebot/tarot/reading/pdf?cache_key={cache_key}"
@@ -143,7 +145,7 @@ async def get_reading_pdf(
     """
     try:
         # Получаем данные гадания из кэша
-        reading_data = await cache_manager.get(cache_key)
+        reading_data = await cache_manager.get(CacheManager.NS_TAROT_PDF, cache_key)
         if not reading_data:
             raise HTTPException(
                 status_code=404,
@@ -253,47 +255,37 @@ async def get_puzzlebot_daily_card(
         # Получаем текущую дату
         today = date.today()
         
-        # Проверяем, есть ли карта дня в кэше
-        cache_key = f"daily_card_{today.isoformat()}"
-        daily_card_data = await cache_manager.get(cache_key)
+        # Карта дня и интерпретации хранятся в кэше до конца дня
+        tomorrow = today + timedelta(days=1)
+        midnight = datetime.combine(tomorrow, time.min)
+        ttl_seconds = max(60, int((midnight - datetime.now()).total_seconds()))
         
-        # Если карты дня нет в кэше или это первый запрос за день
-        if not daily_card_data:
-            # Генерируем новую карту дня
+        async def choose_daily_card() -> Optional[Dict[str, Any]]:
             all_cards = get_all_cards()
             if not all_cards:
-                return {"api_result_text": "Ошибка: Не удалось получить список карт Таро"}
-            
-            # Выбираем случайную карту
-            daily_card = random.choice(all_cards)
-            # Определяем случайно положение карты (прямое или перевернутое)
-            is_reversed = random.choice([True, False])
+                return None
             
-            # Создаем данные для карты дня
-            daily_card_data = {
-                "card": daily_card,
-                "is_reversed": is_reversed,
-                "date": today.isoformat(),
-                "premium_reading": None,
-                "free_reading": None
+            # Выбираем случайную карту и ее положение (прямое или перевернутое)
+            return {
+                "card": random.choice(all_cards),
+                "is_reversed": random.choice([True, False]),
+                "date": today.isoformat()
             }
-            
-            # Сохраняем в кэш до конца дня
-            tomorrow = today + timedelta(days=1)
-            midnight = datetime.combine(tomorrow, time.min)
-            seconds_until_midnight = (midnight - datetime.now()).total_seconds()
-            ttl_minutes = max(1, seconds_until_midnight // 60)
-            
-            await cache_manager.set(cache_key, daily_card_data, ttl_minutes=ttl_minutes)
+        
+        # Карту выбирает только один запрос, остальные одновременные запросы
+        # (в том числе в других воркерах) получают ту же карту
+        cache_key = f"card_{today.isoformat()}"
+        daily_card_data = await cache_manager.get_or_compute(
+            CacheManager.NS_TAROT_DAILY, cache_key, choose_daily_card, ttl=ttl_seconds
+        )
+        if not daily_card_data:
+            return {"api_result_text": "Ошибка: Не удалось получить список карт Таро"}
         
         # Теперь у нас есть данные карты дня
         card = daily_card_data["card"]
         is_reversed = daily_card_data["is_reversed"]
         
-        # Проверяем, есть ли уже интерпретация для данного типа пользователя
-        interpretation_key = f"{'premium_reading' if user_type == 'premium' else 'free_reading'}"
-        
-        if daily_card_data.get(interpretation_key) is None:
+        async def generate_interpretation() -> str:
             # Генерируем интерпретацию через OpenRouter
             question = f"Карта дня: {card['name']} {'(перевернутая)' if is_reversed else '(прямая)'}."
             
@@ -304,12 +296,15 @@ async def get_puzzlebot_daily_card(
                 fixed_cards=[{"card_id": card["id"], "is_reversed": is_reversed}]
             )
             
-            if response.success:
-                # Сохраняем интерпретацию в кэш
-                daily_card_data[interpretation_key] = response.data["interpretation"]
-                await cache_manager.set(cache_key, daily_card_data, ttl_minutes=ttl_minutes)
-            else:
-                return {"api_result_text": f"Ошибка: {response.error}"}
+            if not response.success:
+                raise ValueError(response.error)
+            return response.data["interpretation"]
+        
+        # Интерпретация для типа пользователя тоже генерируется один раз
+        interpretation_key = f"{cache_key}_{'premium_reading' if user_type == 'premium' else 'free_reading'}"
+        interpretation = await cache_manager.get_or_compute(
+            CacheManager.NS_TAROT_DAILY, interpretation_key, generate_interpretation, ttl=ttl_seconds
+        )
         
         # Формируем текстовое представление карты дня
         text_result = f"🔮 Карта дня - {today.strftime('%d.%m.%Y')} 🔮\n\n"
@@ -328,7 +323,7 @@ async def get_puzzlebot_daily_card(
         
         # Добавляем интерпретацию
         text_result += "🌟 Интерпретация 🌟\n\n"
-        text_result += daily_card_data[interpretation_key]
+        text_result += interpretation
         
         # Формируем данные для PDF
         reading_data = {
@@ -344,13 +339,13 @@ async def get_puzzlebot_daily_card(
                 "position_name": "Карта дня",
                 "position_description": "Энергия и влияние дня"
             }],
-            "interpretation": daily_card_data[interpretation_key],
+            "interpretation": interpretation,
             "card_count": 1
         }
         
         # Сохраняем данные в кэш для последующего использования при генерации PDF
-        pdf_cache_key = f"tarot_daily_card_{today.isoformat()}_{user_type}"
-        await cache_manager.set(pdf_cache_key, reading_data, ttl_minutes=ttl_minutes)
+        pdf_cache_key = f"daily_card_{today.isoformat()}_{user_type}"
+        await cache_manager.set(CacheManager.NS_TAROT_PDF, pdf_cache_key, reading_data, ttl=ttl_seconds)
         
         # Добавляем ссылку на PDF в текстовый результат
         pdf_link = f"/api/v1/puzzlebot/tarot/reading/pdf?cache_key={pdf_cache_key}"
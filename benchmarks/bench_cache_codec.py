@@ -0,0 +1,140 @@
+"""
+Сравнение кодеков кэша (pickle / msgpack / orjson, с zstd и без) на типичных
+данных сервиса: день лунного календаря с AI-ответами, расклад Таро и
+криптопрогноз со свечами.
+
+Запуск из корня проекта:
+    python benchmarks/bench_cache_codec.py
+"""
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.cache import CacheCodec, msgpack, orjson, zstandard  # noqa: E402
+from modules.tarot.data import get_all_cards  # noqa: E402
+
+ITERATIONS = 2000
+
+
+def _ai_text(paragraphs: int) -> str:
+    """Текст, похожий на ответ LLM (~3000 токенов при paragraphs=40)"""
+    sentence = ("Сегодня Луна благоприятствует спокойной работе, завершению начатых дел "
+                "и внимательному отношению к своему самочувствию. ")
+    return "\n\n".join(f"**Раздел {i + 1}.** " + sentence * 4 for i in range(paragraphs))
+
+
+def moon_payload() -> Dict[str, Any]:
+    """День лунного календаря с AI-ответами для free и premium"""
+    return {
+        "date": "2025-05-20",
+        "moon_phase": "Убывающая Луна",
+        "moon_days": [
+            {
+                "name": f"{22 + i}-й лунный день",
+                "start": f"20 мая 2025, {1 + i}:3{i}",
+                "end": f"21 мая 2025, {2 + i}:1{i}",
+                "info": _ai_text(3),
+            }
+            for i in range(2)
+        ],
+        "recommendations": {
+            title: _ai_text(1)
+            for title in ("Стрижка", "Бизнес", "Деньги", "Покупки", "Здоровье", "Свидания")
+        },
+        "openrouter_responses": {
+            "free": {"success": True, "response": _ai_text(15), "model": "deepseek/deepseek-chat:free"},
+            "premium": {"success": True, "response": _ai_text(40), "model": "google/gemini-2.5-flash"},
+        },
+    }
+
+
+def tarot_payload() -> Dict[str, Any]:
+    """Расклад Таро на три карты с интерпретацией"""
+    rng = random.Random(7)
+    cards = rng.sample(get_all_cards(), 3)
+    return {
+        "spread_id": 2,
+        "question": "Что ждет меня в работе в ближайший месяц?",
+        "cards": [dict(card, position=i + 1, is_reversed=bool(i % 2)) for i, card in enumerate(cards)],
+        "interpretation": _ai_text(20),
+        "model": "google/gemini-2.5-flash",
+    }
+
+
+def crypto_payload() -> Dict[str, Any]:
+    """Криптопрогноз с историей свечей"""
+    rng = random.Random(42)
+    price = 65000.0
+    klines: List[List[Any]] = []
+    for i in range(600):
+        open_price = price
+        price = max(1.0, price + rng.uniform(-300, 300))
+        klines.append([
+            1716163200000 + i * 3600000,
+            round(open_price, 2),
+            round(max(open_price, price) + rng.uniform(0, 100), 2),
+            round(min(open_price, price) - rng.uniform(0, 100), 2),
+            round(price, 2),
+            round(rng.uniform(10, 500), 4),
+        ])
+    return {
+        "symbol": "BTCUSDT",
+        "period": "day",
+        "current_price": round(price, 2),
+        "klines": klines,
+        "forecast": _ai_text(10),
+        "generated_at": "2025-05-20T12:00:00",
+    }
+
+
+def _codecs() -> List[Tuple[str, CacheCodec]]:
+    variants = [("pickle", "pickle")]
+    if msgpack is not None:
+        variants.append(("msgpack", "msgpack"))
+    if orjson is not None:
+        variants.append(("orjson", "orjson"))
+
+    codecs = []
+    for label, serializer in variants:
+        codecs.append((label, CacheCodec(serializer=serializer, compression_threshold=None)))
+        if zstandard is not None:
+            codecs.append((f"{label}+zstd", CacheCodec(serializer=serializer, compression_threshold=1024)))
+    return codecs
+
+
+def _measure(codec: CacheCodec, payload: Any) -> Tuple[int, float, float]:
+    encoded = codec.encode(payload)
+    assert codec.decode(encoded) == payload, "Кодек изменил данные"
+
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        codec.encode(payload)
+    encode_us = (time.perf_counter() - started) / ITERATIONS * 1e6
+
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        codec.decode(encoded)
+    decode_us = (time.perf_counter() - started) / ITERATIONS * 1e6
+
+    return len(encoded), encode_us, decode_us
+
+
+def main() -> None:
+    payloads = {"moon": moon_payload(), "tarot": tarot_payload(), "crypto": crypto_payload()}
+    codecs = _codecs()
+    if zstandard is None:
+        print("zstandard не установлен - варианты со сжатием пропущены")
+
+    print(f"{'данные':<8} {'кодек':<14} {'байт':>9} {'encode, мкс':>12} {'decode, мкс':>12}")
+    for name, payload in payloads.items():
+        for label, codec in codecs:
+            size, encode_us, decode_us = _measure(codec, payload)
+            print(f"{name:<8} {label:<14} {size:>9} {encode_us:>12.1f} {decode_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
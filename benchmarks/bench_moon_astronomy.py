@@ -0,0 +1,109 @@
+"""
+Локальный расчет Луны (modules/moon_calendar/astronomy.py): время построения
+таблиц на год, задержка получения дня календаря (первый и повторный запрос) и
+точность расчета.
+
+Точность моментов фаз сверяется с опубликованными моментами новолуний и
+полнолуний 2025 г. (UTC). Если установлен пакет ephem (PyEphem), восходы Луны
+за год сверяются с его расчетом для того же места наблюдения.
+
+Запуск из корня проекта:
+    python benchmarks/bench_moon_astronomy.py [--year 2025] [--iterations 100000]
+"""
+import argparse
+import math
+import os
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.moon_calendar.astronomy import (  # noqa: E402
+    FULL_MOON, NEW_MOON, SYNODIC_MONTH, UNIX_EPOCH_JD, MoonEphemeris, moonrises, phase_times
+)
+
+LATITUDE, LONGITUDE = 55.7558, 37.6173
+
+# Опубликованные моменты фаз (UTC, с точностью до минуты)
+REFERENCE_PHASES = [
+    (NEW_MOON, datetime(2025, 1, 29, 12, 36)), (NEW_MOON, datetime(2025, 2, 28, 0, 45)),
+    (NEW_MOON, datetime(2025, 3, 29, 10, 58)), (NEW_MOON, datetime(2025, 4, 27, 19, 31)),
+    (NEW_MOON, datetime(2025, 5, 27, 3, 2)), (FULL_MOON, datetime(2025, 1, 13, 22, 27)),
+    (FULL_MOON, datetime(2025, 2, 12, 13, 53)), (FULL_MOON, datetime(2025, 3, 14, 6, 55)),
+    (FULL_MOON, datetime(2025, 4, 13, 0, 22)), (FULL_MOON, datetime(2025, 5, 12, 16, 56))
+]
+
+
+def _jd(moment: datetime) -> float:
+    return moment.replace(tzinfo=timezone.utc).timestamp() / 86400 + UNIX_EPOCH_JD
+
+
+def _phase_errors() -> None:
+    errors = []
+    for phase, expected in REFERENCE_PHASES:
+        jd = _jd(expected)
+        k = round((jd - 2451550.09766) / SYNODIC_MONTH - phase / 4)
+        errors.append(abs(phase_times(np.array([k]), phase)[0] - jd) * 1440)
+    print(f"моменты фаз: {len(errors)} эталонов, расхождение до {max(errors):.1f} мин "
+          f"(эталоны округлены до минуты)")
+
+
+def _rise_errors(year: int) -> None:
+    try:
+        import ephem
+    except ImportError:
+        print("ephem не установлен - сверка восходов пропущена")
+        return
+    observer = ephem.Observer()
+    observer.lat, observer.lon, observer.elevation = str(LATITUDE), str(LONGITUDE), 0
+    observer.date = f"{year}/01/01"
+    moon = ephem.Moon()
+    reference = []
+    while observer.date < ephem.Date(f"{year + 1}/01/01"):
+        rise = observer.next_rising(moon)
+        reference.append(ephem.julian_date(rise))
+        observer.date = rise + ephem.minute
+    reference = np.array(reference)
+
+    computed = moonrises(reference[0] - 0.5, reference[-1] + 0.5, math.radians(LATITUDE), math.radians(LONGITUDE))
+    nearest = np.clip(np.searchsorted(computed, reference), 1, len(computed) - 1)
+    errors = np.minimum(abs(computed[nearest] - reference), abs(computed[nearest - 1] - reference)) * 1440
+    print(f"восходы Луны {year}: {len(reference)} восходов, расхождение с ephem "
+          f"среднее {errors.mean():.2f} мин, максимум {errors.max():.2f} мин")
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--year", type=int, default=2025)
+    arg_parser.add_argument("--iterations", type=int, default=100000)
+    args = arg_parser.parse_args()
+
+    ephemeris = MoonEphemeris(latitude=LATITUDE, longitude=LONGITUDE)
+    started = time.perf_counter()
+    ephemeris.prepare(date(args.year, 1, 1), date(args.year, 12, 31))
+    print(f"таблицы на {args.year} г.: {(time.perf_counter() - started) * 1000:.0f} мс")
+
+    dates = [date(args.year, 1, 1) + timedelta(days=i) for i in range(365)]
+    cold = []
+    for calendar_date in dates:
+        started = time.perf_counter()
+        ephemeris.calendar_day(calendar_date)
+        cold.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for i in range(args.iterations):
+        ephemeris.calendar_day(dates[i % len(dates)])
+    warm = (time.perf_counter() - started) / args.iterations
+    print(f"день календаря: первый запрос медиана {statistics.median(cold) * 1e6:.1f} мкс, "
+          f"повторный {warm * 1e6:.2f} мкс")
+
+    _phase_errors()
+    _rise_errors(args.year)
+
+
+if __name__ == "__main__":
+    main()
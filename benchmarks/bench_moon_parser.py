@@ -0,0 +1,170 @@
+"""
+Сравнение бэкендов разбора страницы лунного календаря (bs4 / lxml / selectolax):
+совпадение результата с исходным разбором BeautifulSoup, время разбора одной
+страницы и пиковая память.
+
+По умолчанию используется синтетическая страница с разметкой Rambler (классы
+блоков, комментарии React между частями текста, шум страницы и крупный
+встроенный скрипт состояния). Сохраненные страницы можно передать аргументами:
+    curl -s https://horoscopes.rambler.ru/moon/calendar/2025-05-20/ > day.html
+
+Каждый бэкенд измеряется в отдельном процессе, чтобы пиковая память (RSS,
+включая память libxml2 и Lexbor) не смешивалась между бэкендами.
+
+Запуск из корня проекта:
+    python benchmarks/bench_moon_parser.py [--iterations 50] [day.html ...]
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.moon_calendar.html_backends import HTML_BACKENDS, create_html_backend  # noqa: E402
+from modules.moon_calendar.parser import MoonCalendarParser  # noqa: E402
+
+CALENDAR_DATE = date(2025, 5, 20)
+RECOMMENDATIONS = ("Стрижка", "Бизнес", "Деньги", "Покупки", "Здоровье", "Свидания", "Сад и огород", "Уборка")
+
+
+def _paragraph(seed: int) -> str:
+    return ("Сегодня&nbsp;Луна благоприятствует <b>спокойной</b> работе, завершению начатых дел "
+            f"и внимательному отношению к своему самочувствию ({seed}). ") * 3
+
+
+def _noise(blocks: int) -> str:
+    """Разметка вокруг полезных блоков: навигация, карточки, ссылки"""
+    return "".join(
+        f'<div class="card c{i % 7}"><a class="link" href="/news/{i}/">Новость {i}<!-- --> дня</a>'
+        f'<span class="meta">{i} мин.</span><img src="/i/{i}.jpg" alt=""></div>'
+        for i in range(blocks)
+    )
+
+
+def synthetic_page() -> bytes:
+    """Синтетическая страница дня лунного календаря с разметкой Rambler"""
+    days = [("22", "20 мая 01:34", "21 мая 02:05"), ("23", "21 мая 02:05", "22 мая 02:31")]
+    moon_info = "".join(
+        f'<div class="Tb3dE"><span class="ZciAj">{num}<!-- -->-й&nbsp;лунный день</span>'
+        f'<span class="_4FHaJ DSpR9 v5AKG">{start} — {end}</span></div>'
+        for num, start, end in days
+    )
+    descriptions = "".join(
+        f'<div class="_1uCdn iVDG2"><h2 class="Hh8yK">{num}-й лунный день</h2></div>'
+        + "".join(f'<p class="_5yHoW AjIPq">{_paragraph(i)}</p>' for i in range(4))
+        for num, _, _ in days
+    )
+    recommendations = "".join(
+        f'<div class="Rk1sd"><h3 class="PzAWM AW4W0">{title}</h3>'
+        f'<p class="_5yHoW AjIPq">{_paragraph(i)}</p></div>'
+        for i, title in enumerate(RECOMMENDATIONS)
+    )
+    state = json.dumps({"items": [{"id": i, "title": f"Материал {i}", "text": "x" * 200} for i in range(400)]})
+    html = (
+        '<!DOCTYPE html><html lang="ru"><head><meta charset="utf-8"><title>Лунный календарь</title>'
+        '<style>.card{display:block}</style></head><body><div id="app">'
+        f'<header class="Hdr">{_noise(150)}</header><main class="Mn">'
+        '<div class="eG1Gp s63PD _3IJOS">'
+        '<svg class="Pf77m Xy1" title="Фаза луны - Убывающая Луна" viewBox="0 0 24 24"><path d="M0 0h24v24H0z"></path></svg>'
+        f'{moon_info}</div>'
+        f'<div class="dGWT9 cidDQ">{descriptions}</div>'
+        f'<div class="R2dbF inVfT _8OzEU">Рекомендации</div>{recommendations}'
+        f'</main><footer class="Ftr">{_noise(250)}</footer></div>'
+        f'<script>window.__STATE__ = {state};</script></body></html>'
+    )
+    return html.encode("utf-8")
+
+
+def _max_rss_mb() -> float:
+    # ru_maxrss в килобайтах на Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _worker(backend_name: str, paths: List[str], iterations: int) -> None:
+    """Замеры одного бэкенда (выполняется в отдельном процессе), результат - JSON в stdout"""
+    parser = MoonCalendarParser(backend=backend_name)
+    pages = _load_pages(paths)
+    baseline_rss = _max_rss_mb()
+    report: Dict[str, Any] = {"backend": parser.backend.name, "pages": {}}
+    for name, content in pages:
+        tracemalloc.start()
+        result = parser.parse_html(content, CALENDAR_DATE)
+        _, python_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            parser.parse_html(content, CALENDAR_DATE)
+            timings.append(time.perf_counter() - started)
+
+        report["pages"][name] = {
+            "result": result,
+            "median_ms": statistics.median(timings) * 1000,
+            "min_ms": min(timings) * 1000,
+            "python_peak_mb": python_peak / 2 ** 20
+        }
+    report["rss_growth_mb"] = _max_rss_mb() - baseline_rss
+    print(json.dumps(report, ensure_ascii=False))
+
+
+def _load_pages(paths: List[str]) -> List[Tuple[str, bytes]]:
+    if not paths:
+        return [("synthetic", synthetic_page())]
+    pages = []
+    for path in paths:
+        with open(path, "rb") as f:
+            pages.append((os.path.basename(path), f.read()))
+    return pages
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("pages", nargs="*", help="Сохраненные HTML страницы Rambler")
+    arg_parser.add_argument("--iterations", type=int, default=50)
+    arg_parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.worker:
+        _worker(args.worker, args.pages, args.iterations)
+        return
+
+    for name, content in _load_pages(args.pages):
+        print(f"{name}: {len(content) / 1024:.0f} КБ")
+
+    reports = []
+    for backend_name in HTML_BACKENDS:
+        if create_html_backend(backend_name).name != backend_name:
+            print(f"{backend_name}: пакет не установлен - пропущен")
+            continue
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", backend_name,
+             "--iterations", str(args.iterations), *args.pages],
+            check=True,
+            capture_output=True,
+            text=True
+        ).stdout
+        reports.append(json.loads(output.strip().splitlines()[-1]))
+
+    reference = reports[0]
+    print(f"{'страница':<16} {'бэкенд':<11} {'медиана, мс':>12} {'мин, мс':>9} {'Python пик, МБ':>15} {'совпадает':>10}")
+    for report in reports:
+        for name, page in report["pages"].items():
+            same = page["result"] == reference["pages"][name]["result"]
+            print(f"{name:<16} {report['backend']:<11} {page['median_ms']:>12.2f} {page['min_ms']:>9.2f} "
+                  f"{page['python_peak_mb']:>15.2f} {'да' if same else 'НЕТ':>10}")
+    print()
+    for report in reports:
+        print(f"{report['backend']:<11} прирост пикового RSS процесса: {report['rss_growth_mb']:.1f} МБ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Задержка запросов OpenRouterClient к локальному серверу-заглушке: новая сессия
+aiohttp на каждый запрос (как было раньше) против общей сессии с пулом соединений.
+
+С флагом --tls заглушка работает по HTTPS с самоподписанным сертификатом
+(нужен openssl в PATH), тогда в разницу входит и TLS-рукопожатие.
+
+Запуск из корня проекта:
+    python benchmarks/bench_openrouter_pool.py [--requests 200] [--tls]
+"""
+import argparse
+import asyncio
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+import config  # noqa: E402
+from core.openrouter_client import OpenRouterClient  # noqa: E402
+
+MODEL = "bench/stub-model"
+FAKE_KEY = "sk-or-bench-" + "x" * 40
+COMPLETION = {
+    "id": "bench",
+    "choices": [{"message": {"role": "assistant", "content": "Луна в Тельце, день подходит для спокойной работы."}}]
+}
+
+
+async def _completions(request: web.Request) -> web.Response:
+    await request.read()
+    return web.json_response(COMPLETION)
+
+
+def _self_signed_cert(directory: str) -> Tuple[str, str]:
+    """Самоподписанный сертификат для localhost (через openssl)"""
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=localhost", "-keyout", key_path, "-out", cert_path
+        ],
+        check=True,
+        capture_output=True
+    )
+    return cert_path, key_path
+
+
+async def _start_stub(ssl_context: Optional[ssl.SSLContext]) -> Tuple[web.AppRunner, int]:
+    app = web.Application()
+    app.router.add_post("/api/v1/chat/completions", _completions)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0, ssl_context=ssl_context)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, port
+
+
+async def _per_request_session(url: str, requests: int) -> List[float]:
+    """Прежнее поведение: новая ClientSession (и новое соединение) на каждый запрос"""
+    latencies = []
+    payload = {"model": MODEL, "messages": [{"role": "user", "content": "ping"}]}
+    for _ in range(requests):
+        started = time.perf_counter()
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as session:
+            async with session.post(url, json=payload, ssl=False) as response:
+                await response.text()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+async def _pooled_client(url: str, requests: int) -> List[float]:
+    """OpenRouterClient с общей сессией: соединение открывается один раз"""
+    client = OpenRouterClient(
+        api_url=url,
+        api_keys=[FAKE_KEY],
+        models=[MODEL],
+        model_configs={MODEL: {"request_type": "standard", "timeout": 60}}
+    )
+    await client.start()
+    latencies = []
+    try:
+        for _ in range(requests):
+            started = time.perf_counter()
+            await client.make_request([{"role": "user", "content": "ping"}], model=MODEL, retry_count=1)
+            latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        await client.close()
+    return latencies
+
+
+def _report(label: str, latencies: List[float]) -> None:
+    ordered = sorted(latencies)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    print(f"{label:<28} {statistics.mean(latencies):>9.3f} {statistics.median(latencies):>9.3f} {p95:>9.3f}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="Количество последовательных запросов")
+    parser.add_argument("--tls", action="store_true", help="Заглушка по HTTPS с самоподписанным сертификатом")
+    args = parser.parse_args()
+
+    ssl_context = None
+    with tempfile.TemporaryDirectory() as cert_dir:
+        if args.tls:
+            cert_path, key_path = _self_signed_cert(cert_dir)
+            ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            ssl_context.load_cert_chain(cert_path, key_path)
+            # Самоподписанный сертификат заглушки не проверяется
+            config.OPENROUTER_SSL_VERIFY = False
+
+        runner, port = await _start_stub(ssl_context)
+        scheme = "https" if args.tls else "http"
+        url = f"{scheme}://127.0.0.1:{port}/api/v1/chat/completions"
+        try:
+            # Прогрев интерпретатора и заглушки
+            await _per_request_session(url, 5)
+
+            per_request = await _per_request_session(url, args.requests)
+            pooled = await _pooled_client(url, args.requests)
+        finally:
+            await runner.cleanup()
+
+    print(f"{args.requests} последовательных запросов к заглушке ({scheme})")
+    print(f"{'вариант':<28} {'ср., мс':>9} {'медиана':>9} {'p95':>9}")
+    _report("сессия на каждый запрос", per_request)
+    _report("общая сессия (пул)", pooled)
+    saved = statistics.mean(per_request) - statistics.mean(pooled)
+    print(f"Экономия на запрос: {saved:.3f} мс")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+"""
+Блокировка цикла событий при разборе страниц лунного календаря: разбор в цикле
+событий (inline, как было раньше) против пула потоков и пула процессов.
+
+Пока разбираются страницы (как при фоновом обновлении календаря), в цикле работает
+тикер с периодом 1 мс. Его опоздания - это задержка, которую получил бы любой
+другой запрос воркера. Страница - синтетическая из bench_moon_parser.py или
+сохраненные страницы, переданные аргументами.
+
+Запуск из корня проекта:
+    python benchmarks/bench_parse_pool.py [--pages 20] [--workers 2] [day.html ...]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_moon_parser import CALENDAR_DATE, _load_pages  # noqa: E402
+from core.parse_pool import ParsePool  # noqa: E402
+from modules.moon_calendar.html_backends import HTML_BACKENDS, create_html_backend  # noqa: E402
+from modules.moon_calendar.parser import parse_calendar_html  # noqa: E402
+
+TICK_SECONDS = 0.001
+
+
+async def _ticker(lags: List[float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(time.perf_counter() - started - TICK_SECONDS)
+
+
+async def _measure(mode: str, backend: str, contents: List[bytes], workers: int) -> Dict[str, float]:
+    pool = ParsePool(mode=mode, workers=workers, queue_size=len(contents))
+    try:
+        # Прогрев: запуск процессов и создание парсеров в исполнителях
+        await asyncio.gather(*(pool.run(parse_calendar_html, backend, contents[0], CALENDAR_DATE) for _ in range(workers)))
+
+        lags: List[float] = []
+        stop = asyncio.Event()
+        ticker = asyncio.create_task(_ticker(lags, stop))
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        await asyncio.gather(*(pool.run(parse_calendar_html, backend, content, CALENDAR_DATE) for content in contents))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await ticker
+    finally:
+        pool.shutdown()
+
+    lags.sort()
+    return {
+        "elapsed_ms": elapsed * 1000,
+        "lag_p50_ms": statistics.median(lags) * 1000,
+        "lag_p99_ms": lags[int(len(lags) * 0.99)] * 1000,
+        "lag_max_ms": lags[-1] * 1000
+    }
+
+
+async def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("files", nargs="*", help="Сохраненные HTML страницы Rambler")
+    arg_parser.add_argument("--pages", type=int, default=20, help="Количество разбираемых страниц")
+    arg_parser.add_argument("--workers", type=int, default=2)
+    args = arg_parser.parse_args()
+
+    pages = [content for _, content in _load_pages(args.files)]
+    contents = [pages[i % len(pages)] for i in range(args.pages)]
+
+    print(f"{args.pages} страниц, {args.workers} исполнителя, тикер {TICK_SECONDS * 1000:.0f} мс")
+    print(f"{'бэкенд':<11} {'режим':<8} {'всего, мс':>10} {'лаг p50, мс':>12} {'лаг p99, мс':>12} {'лаг макс, мс':>13}")
+    for backend in HTML_BACKENDS:
+        if create_html_backend(backend).name != backend:
+            print(f"{backend}: пакет не установлен - пропущен")
+            continue
+        for mode in ("inline", "thread", "process"):
+            result = await _measure(mode, backend, contents, args.workers)
+            print(f"{backend:<11} {mode:<8} {result['elapsed_ms']:>10.0f} {result['lag_p50_ms']:>12.2f} "
+                  f"{result['lag_p99_ms']:>12.2f} {result['lag_max_ms']:>13.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -52,9 +52,98 @@ if os.getenv("ADDITIONAL_CORS_ORIGINS"):
 # Настройки кэша
 CACHE_TTL_MINUTES = int(os.getenv("CACHE_TTL_MINUTES", "180"))  # 3 часа
 CACHE_CLEANUP_INTERVAL = int(os.getenv("CACHE_CLEANUP_INTERVAL", "600"))  # 10 минут
+# Время жизни ключей по пространствам имен кэша (в секундах). Для пространств,
+# которых нет в словаре, используется CACHE_TTL_MINUTES
+CACHE_NAMESPACE_TTL = {
+    "moon_calendar": int(os.getenv("CACHE_TTL_MOON_CALENDAR", str(CACHE_TTL_MINUTES * 60))),
+    "crypto_forecast": int(os.getenv("CACHE_TTL_CRYPTO_FORECAST", "28800")),  # 8 часов
+    "tarot_reading": int(os.getenv("CACHE_TTL_TAROT_READING", "3600")),  # 1 час
+    "tarot_daily": int(os.getenv("CACHE_TTL_TAROT_DAILY", "86400")),  # 24 часа (обычно до полуночи)
+    "tarot_pdf": int(os.getenv("CACHE_TTL_TAROT_PDF", "3600")),  # 1 час
+    "crypto_symbols": int(os.getenv("CACHE_TTL_CRYPTO_SYMBOLS", "3600")),  # 1 час
+    "llm_response": int(os.getenv("CACHE_TTL_LLM_RESPONSE", "86400")),  # 24 часа
+    "moon_page_meta": int(os.getenv("CACHE_TTL_MOON_PAGE_META", "172800")),  # 2 дня
+}
+# Негативное кэширование (в секундах): ошибки внешних сервисов запоминаются
+# на короткое время, чтобы повторные запросы не обращались к ним снова
+NEGATIVE_CACHE_TTL_SYMBOL_NOT_FOUND = int(os.getenv("NEGATIVE_CACHE_TTL_SYMBOL_NOT_FOUND", "600"))  # 10 минут
+NEGATIVE_CACHE_TTL_PARSER_ERROR = int(os.getenv("NEGATIVE_CACHE_TTL_PARSER_ERROR", "60"))  # 1 минута
+NEGATIVE_CACHE_TTL_LLM_FAILURE = int(os.getenv("NEGATIVE_CACHE_TTL_LLM_FAILURE", "30"))  # 30 секунд
+# Снимок кэша на диске для быстрого старта после деплоя или очистки Redis:
+# выбранные пространства имен сохраняются при остановке и по таймеру
+# и загружаются при старте до приема запросов
+CACHE_SNAPSHOT_ENABLED = os.getenv("CACHE_SNAPSHOT_ENABLED", "true").lower() == "true"
+CACHE_SNAPSHOT_PATH = os.getenv("CACHE_SNAPSHOT_PATH", "data/cache_snapshot.bin")
+CACHE_SNAPSHOT_INTERVAL_SECONDS = int(os.getenv("CACHE_SNAPSHOT_INTERVAL_SECONDS", "900"))  # 15 минут
+CACHE_SNAPSHOT_NAMESPACES = [
+    ns.strip()
+    for ns in os.getenv("CACHE_SNAPSHOT_NAMESPACES", "moon_calendar,tarot_daily,crypto_symbols").split(",")
+    if ns.strip()
+]
+
+# Circuit breaker для Redis: после REDIS_CB_FAILURE_THRESHOLD ошибок соединения подряд
+# кэш переходит на резервное хранилище в памяти процесса, а восстановление Redis
+# проверяется в фоне раз в REDIS_CB_RECOVERY_SECONDS
+REDIS_CB_FAILURE_THRESHOLD = int(os.getenv("REDIS_CB_FAILURE_THRESHOLD", "3"))
+REDIS_CB_RECOVERY_SECONDS = float(os.getenv("REDIS_CB_RECOVERY_SECONDS", "5"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "2"))  # секунды
+CACHE_FALLBACK_MAX_BYTES = int(os.getenv("CACHE_FALLBACK_MAX_BYTES", str(64 * 1024 * 1024)))  # 64 МБ
+
+# Настройки локального L1-кэша в памяти процесса (перед Redis)
+CACHE_L1_ENABLED = os.getenv("CACHE_L1_ENABLED", "true").lower() == "true"
+CACHE_L1_MAX_BYTES = int(os.getenv("CACHE_L1_MAX_BYTES", str(32 * 1024 * 1024)))  # 32 МБ
+CACHE_L1_TTL_SECONDS = int(os.getenv("CACHE_L1_TTL_SECONDS", "300"))  # 5 минут
+# Канал Redis pub/sub для инвалидации L1-кэша между воркерами uvicorn
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache_invalidation")
+# Формат хранения записей лунного календаря: "hash" - календарь и каждый AI-ответ
+# в отдельных полях хэша (HSET/HGET), "blob" - одна строка (старый формат)
+CACHE_STORAGE_MODE = os.getenv("CACHE_STORAGE_MODE", "hash")
+# Кодек значений кэша: msgpack, orjson или pickle (при отсутствии пакета - pickle)
+CACHE_CODEC = os.getenv("CACHE_CODEC", "msgpack")
+# Сжатие zstd для значений больше порога (в байтах); 0 - без сжатия
+CACHE_COMPRESSION_THRESHOLD_BYTES = int(os.getenv("CACHE_COMPRESSION_THRESHOLD_BYTES", "1024")) or None
+CACHE_COMPRESSION_LEVEL = int(os.getenv("CACHE_COMPRESSION_LEVEL", "3"))
+# Защита от одновременного пересчета (get_or_compute): время жизни блокировки Redis,
+# сколько ждать результата другого воркера и как часто проверять кэш при ожидании
+CACHE_LOCK_TIMEOUT_SECONDS = float(os.getenv("CACHE_LOCK_TIMEOUT_SECONDS", "90"))
+CACHE_LOCK_WAIT_TIMEOUT_SECONDS = float(os.getenv("CACHE_LOCK_WAIT_TIMEOUT_SECONDS", "90"))
+CACHE_LOCK_POLL_INTERVAL_SECONDS = float(os.getenv("CACHE_LOCK_POLL_INTERVAL_SECONDS", "0.2"))
+# Срок свежести AI-ответов лунного календаря (soft TTL, в секундах). Более старый ответ
+# отдается сразу и обновляется в фоне; hard TTL записи дня - CACHE_TTL_MINUTES
+MOON_CALENDAR_AI_SOFT_TTL_SECONDS = int(os.getenv("MOON_CALENDAR_AI_SOFT_TTL_SECONDS", "3600"))  # 1 час
 
 # Настройки парсера
 PARSER_TIMEOUT = int(os.getenv("PARSER_TIMEOUT", "10"))  # 10 секунд
+# Бэкенд разбора страниц лунного календаря: lxml (XPath), selectolax (CSS, опциональный
+# пакет) или bs4 (BeautifulSoup html.parser). При отсутствии пакета - bs4
+MOON_PARSER_BACKEND = os.getenv("MOON_PARSER_BACKEND", "lxml")
+# Вежливость к Rambler: одновременные запросы и частота запросов к сайту
+MOON_PARSER_MAX_CONCURRENT_FETCHES = int(os.getenv("MOON_PARSER_MAX_CONCURRENT_FETCHES", "4"))
+MOON_PARSER_FETCH_RATE_PER_SECOND = float(os.getenv("MOON_PARSER_FETCH_RATE_PER_SECOND", "2"))
+# Максимальный диапазон /api/v1/moon-calendar/range в днях
+MOON_CALENDAR_RANGE_MAX_DAYS = int(os.getenv("MOON_CALENDAR_RANGE_MAX_DAYS", "31"))
+# Время жизни дней, загруженных предзагрузкой месяца (данные прошлых и будущих дат не меняются).
+# Запись AI-ответа в день возвращает записи TTL пространства имен moon_calendar
+MOON_CALENDAR_PREFETCH_TTL_SECONDS = int(os.getenv("MOON_CALENDAR_PREFETCH_TTL_SECONDS", "3024000"))  # 35 дней
+# Предзагрузка месяца разрешена от текущего месяца до стольких месяцев вперед
+MOON_CALENDAR_PREFETCH_MAX_MONTHS_AHEAD = int(os.getenv("MOON_CALENDAR_PREFETCH_MAX_MONTHS_AHEAD", "2"))
+# Пул разбора страниц вне цикла событий: thread (потоки), process (процессы) или
+# inline (разбор в цикле событий, как раньше)
+PARSE_POOL_MODE = os.getenv("PARSE_POOL_MODE", "thread")
+PARSE_POOL_WORKERS = int(os.getenv("PARSE_POOL_WORKERS", "2"))
+# Задачи, ожидающие свободного исполнителя; сверх этого запрос ждет места не дольше таймаута
+PARSE_POOL_QUEUE_SIZE = int(os.getenv("PARSE_POOL_QUEUE_SIZE", "16"))
+PARSE_POOL_QUEUE_TIMEOUT_SECONDS = float(os.getenv("PARSE_POOL_QUEUE_TIMEOUT_SECONDS", "10"))
+# Локальный расчет фаз Луны и лунных дней (нужен numpy). Место наблюдения определяет
+# время восхода Луны, т.е. границы лунных дней; по умолчанию Москва, как на Rambler
+MOON_ASTRONOMY_LATITUDE = float(os.getenv("MOON_ASTRONOMY_LATITUDE", "55.7558"))
+MOON_ASTRONOMY_LONGITUDE = float(os.getenv("MOON_ASTRONOMY_LONGITUDE", "37.6173"))
+MOON_ASTRONOMY_UTC_OFFSET_HOURS = float(os.getenv("MOON_ASTRONOMY_UTC_OFFSET_HOURS", "3"))
+# Рассчитанные фаза и лунные дни вместо данных Rambler, когда страница недоступна
+MOON_ASTRONOMY_FALLBACK_ENABLED = os.getenv("MOON_ASTRONOMY_FALLBACK_ENABLED", "true").lower() == "true"
+# Сверка спарсенных дней с расчетом в фоновом обновлении (расхождения пишутся в лог)
+MOON_ASTRONOMY_VALIDATION_ENABLED = os.getenv("MOON_ASTRONOMY_VALIDATION_ENABLED", "true").lower() == "true"
+MOON_ASTRONOMY_TOLERANCE_MINUTES = float(os.getenv("MOON_ASTRONOMY_TOLERANCE_MINUTES", "15"))
 MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "100"))
 
 # Настройки логирования
@@ -85,6 +174,78 @@ OPENROUTER_API_KEYS = [
     ] if key
 ]
 
+# Пул HTTP-соединений клиента OpenRouter: одна долгоживущая сессия на клиент,
+# соединения переиспользуются (keep-alive), DNS-ответы кэшируются
+OPENROUTER_POOL_LIMIT = int(os.getenv("OPENROUTER_POOL_LIMIT", "100"))
+OPENROUTER_POOL_LIMIT_PER_HOST = int(os.getenv("OPENROUTER_POOL_LIMIT_PER_HOST", "20"))
+OPENROUTER_KEEPALIVE_SECONDS = float(os.getenv("OPENROUTER_KEEPALIVE_SECONDS", "60"))
+OPENROUTER_DNS_CACHE_SECONDS = int(os.getenv("OPENROUTER_DNS_CACHE_SECONDS", "300"))
+# Проверка TLS-сертификата OpenRouter (отключать только для отладки)
+OPENROUTER_SSL_VERIFY = os.getenv("OPENROUTER_SSL_VERIFY", "true").lower() == "true"
+
+# Хеджирование запросов: если модель не ответила за свой p90 (по последним ответам),
+# параллельно запрашивается следующая модель, побеждает первый успешный ответ
+OPENROUTER_HEDGING_ENABLED = os.getenv("OPENROUTER_HEDGING_ENABLED", "false").lower() == "true"
+OPENROUTER_HEDGE_PERCENTILE = float(os.getenv("OPENROUTER_HEDGE_PERCENTILE", "0.9"))
+# Задержка хеджа, пока по модели накоплено меньше OPENROUTER_HEDGE_MIN_SAMPLES замеров
+OPENROUTER_HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("OPENROUTER_HEDGE_DEFAULT_DELAY_SECONDS", "10"))
+OPENROUTER_HEDGE_MIN_SAMPLES = int(os.getenv("OPENROUTER_HEDGE_MIN_SAMPLES", "20"))
+# Количество последних замеров задержки на модель
+OPENROUTER_LATENCY_WINDOW = int(os.getenv("OPENROUTER_LATENCY_WINDOW", "200"))
+
+# Выбор пары (модель, ключ) по сглаженным задержке и доле ошибок (вместо ротации по кругу)
+OPENROUTER_ROUTER_EWMA_ALPHA = float(os.getenv("OPENROUTER_ROUTER_EWMA_ALPHA", "0.2"))
+# Во сколько раз доля ошибок увеличивает оценку пары
+OPENROUTER_ROUTER_ERROR_PENALTY = float(os.getenv("OPENROUTER_ROUTER_ERROR_PENALTY", "4"))
+# Паузы для пар (модель, ключ): после 429, после 401/403 и после 404 (модель не найдена)
+OPENROUTER_RATE_LIMIT_COOLDOWN_SECONDS = float(os.getenv("OPENROUTER_RATE_LIMIT_COOLDOWN_SECONDS", "60"))
+OPENROUTER_AUTH_COOLDOWN_SECONDS = float(os.getenv("OPENROUTER_AUTH_COOLDOWN_SECONDS", "600"))
+OPENROUTER_NOT_FOUND_COOLDOWN_SECONDS = float(os.getenv("OPENROUTER_NOT_FOUND_COOLDOWN_SECONDS", "3600"))
+
+# Ограничение запросов к OpenRouter (общее для всех клиентов процесса): одновременные
+# запросы и ведра токенов на модель и на ключ (запросов в секунду и допустимый всплеск)
+OPENROUTER_MAX_CONCURRENT_REQUESTS = int(os.getenv("OPENROUTER_MAX_CONCURRENT_REQUESTS", str(MAX_CONCURRENT_REQUESTS)))
+OPENROUTER_MODEL_RATE_PER_SECOND = float(os.getenv("OPENROUTER_MODEL_RATE_PER_SECOND", "2"))
+OPENROUTER_MODEL_BURST = float(os.getenv("OPENROUTER_MODEL_BURST", "5"))
+OPENROUTER_KEY_RATE_PER_SECOND = float(os.getenv("OPENROUTER_KEY_RATE_PER_SECOND", "3"))
+OPENROUTER_KEY_BURST = float(os.getenv("OPENROUTER_KEY_BURST", "10"))
+# Дольше этого Retry-After внутри запроса не ждем - запрос переходит к другой модели
+OPENROUTER_MAX_RETRY_AFTER_SECONDS = float(os.getenv("OPENROUTER_MAX_RETRY_AFTER_SECONDS", "10"))
+# Кэш ответов LLM по хэшу запроса: одинаковый запрос (модели, сообщения, max_tokens,
+# temperature) не отправляется повторно, пока ответ в кэше (TTL - CACHE_TTL_LLM_RESPONSE).
+# По умолчанию выключен, чтобы повторные толкования не возвращали один и тот же текст сутки
+OPENROUTER_RESPONSE_CACHE_ENABLED = os.getenv("OPENROUTER_RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+# Одинаковые одновременные запросы к LLM выполняются один раз (между воркерами - через
+# блокировку Redis). При выключенном кэше ответов общий ответ хранится столько секунд
+OPENROUTER_INFLIGHT_RESULT_TTL_SECONDS = int(os.getenv("OPENROUTER_INFLIGHT_RESULT_TTL_SECONDS", "30"))
+# Бюджет времени на генерацию текста (все попытки, ключи и модели). Таймаут попытки -
+# оставшийся бюджет за вычетом OPENROUTER_MIN_ATTEMPT_TIMEOUT_SECONDS на следующую попытку;
+# если не осталось и минимума, запрос сразу завершается ошибкой DeadlineExceededException
+OPENROUTER_DEFAULT_DEADLINE_SECONDS = float(os.getenv("OPENROUTER_DEFAULT_DEADLINE_SECONDS", "120"))
+OPENROUTER_MIN_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("OPENROUTER_MIN_ATTEMPT_TIMEOUT_SECONDS", "5"))
+# Бюджеты по типам пользователей для эндпоинтов API
+OPENROUTER_DEADLINES = {
+    "free": float(os.getenv("OPENROUTER_DEADLINE_FREE_SECONDS", "60")),
+    "premium": float(os.getenv("OPENROUTER_DEADLINE_PREMIUM_SECONDS", "90")),
+}
+# PuzzleBot не ждет ответ дольше ~30 секунд
+PUZZLEBOT_OPENROUTER_DEADLINES = {
+    "free": float(os.getenv("PUZZLEBOT_DEADLINE_FREE_SECONDS", "25")),
+    "premium": float(os.getenv("PUZZLEBOT_DEADLINE_PREMIUM_SECONDS", "25")),
+}
+# Фоновая генерация AI-ответов лунного календаря не ограничена ожиданием клиента
+OPENROUTER_BACKGROUND_DEADLINE_SECONDS = float(os.getenv("OPENROUTER_BACKGROUND_DEADLINE_SECONDS", "180"))
+# Экспоненциальная пауза между попытками со случайным разбросом (full jitter)
+OPENROUTER_BACKOFF_BASE_SECONDS = float(os.getenv("OPENROUTER_BACKOFF_BASE_SECONDS", "0.3"))
+OPENROUTER_BACKOFF_MAX_SECONDS = float(os.getenv("OPENROUTER_BACKOFF_MAX_SECONDS", "5"))
+# Кэширование промптов на стороне провайдера: для моделей с "prompt_cache" в
+# OPENROUTER_MODEL_CONFIGS статический префикс (системное сообщение) отправляется
+# с блоком cache_control, если он не короче OPENROUTER_PROMPT_CACHE_MIN_CHARS
+OPENROUTER_PROMPT_CACHE_ENABLED = os.getenv("OPENROUTER_PROMPT_CACHE_ENABLED", "true").lower() == "true"
+OPENROUTER_PROMPT_CACHE_MIN_CHARS = int(os.getenv("OPENROUTER_PROMPT_CACHE_MIN_CHARS", "1024"))
+# Окно скользящих агрегатов учета токенов и задержек запросов к LLM (в секундах)
+OPENROUTER_USAGE_WINDOW_SECONDS = int(os.getenv("OPENROUTER_USAGE_WINDOW_SECONDS", "3600"))
+
 # Модели OpenRouter
 OPENROUTER_MODELS = [
     "google/gemini-2.0-flash-001",
@@ -107,11 +268,13 @@ OPENROUTER_MODEL_API_KEYS = {
 OPENROUTER_MODEL_CONFIGS = {
     "google/gemini-2.0-flash-001": {
         "request_type": "openai",
-        "timeout": 60
+        "timeout": 60,
+        "prompt_cache": True  # Провайдер поддерживает cache_control
     },
     "google/gemini-2.0-flash-exp:free": {
         "request_type": "openai",
-        "timeout": 60
+        "timeout": 60,
+        "prompt_cache": True
     },
     "deepseek/deepseek-prover-v2:free": {
         "request_type": "standard",
@@ -175,13 +338,23 @@ CRYPTO_FORECAST_PROMPTS = {
     }
 }
 
-# Настройки TTL для кеширования прогнозов (в секундах)
+# Настройки TTL для кеширования прогнозов (в секундах).
+# После этого срока прогноз считается устаревшим: он еще отдается пользователю,
+# а новый генерируется в фоне (stale-while-revalidate)
 CRYPTO_FORECAST_CACHE_TTL = {
     "hour": 1800,    # 30 минут для часового прогноза
     "day": 7200,     # 2 часа для дневного прогноза
     "week": 14400    # 4 часа для недельного прогноза
 }
 
+# Максимальный срок хранения прогноза (hard TTL, в секундах), после которого
+# пользователь ждет генерацию нового прогноза
+CRYPTO_FORECAST_CACHE_HARD_TTL = {
+    "hour": 7200,    # 2 часа
+    "day": 28800,    # 8 часов
+    "week": 57600    # 16 часов
+}
+
 # Настройки фоновых задач
 BACKGROUND_TASKS = {
     "enabled": True,
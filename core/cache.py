@@ -1,110 +1,913 @@
 """
 Менеджер кэша для API
 """
+from collections import OrderedDict
 from datetime import datetime, date
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Set, Tuple, Callable, Awaitable, Union, Type
+import asyncio
 import logging
 import copy
+import os
 import pickle
+import time
+import uuid
 import aioredis
 import config
+from core.circuit_breaker import CircuitBreaker
+from core.exceptions import CacheDecodeError
+
+# Опциональные зависимости для компактной сериализации и сжатия
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - зависит от окружения
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - зависит от окружения
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - зависит от окружения
+    zstandard = None
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
+# Снятие блокировки только её владельцем (сравнение токена и удаление атомарно)
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Ошибки, которые означают недоступность Redis (учитываются circuit breaker)
+REDIS_FAILURE_ERRORS = (
+    aioredis.exceptions.ConnectionError,
+    aioredis.exceptions.TimeoutError,
+    asyncio.TimeoutError,
+    OSError
+)
+
+# Версия формата файла снимка кэша (dump_snapshot/load_snapshot)
+SNAPSHOT_FORMAT_VERSION = 1
+
+# Ошибки, которые означают поврежденную или нечитаемую запись кэша
+DECODE_ERRORS = (CacheDecodeError, pickle.UnpicklingError, EOFError, AttributeError, ValueError, TypeError)
+
+
+class CacheCodec:
+    """
+    Кодек значений кэша: сериализация (msgpack, orjson или pickle) и сжатие zstd
+    для значений больше порога.
+
+    Формат записи: байт версии формата, байт флагов (идентификатор сериализатора
+    и признак сжатия), затем данные. Записи старого формата (чистый pickle,
+    начинаются с байта 0x80) читаются без изменений, поэтому миграция не требует
+    сброса кэша.
+    """
+
+    FORMAT_VERSION = 1
+    PICKLE_PROTOCOL_MARKER = 0x80
+    FLAG_ZSTD = 0x80
+    SERIALIZER_IDS = {"pickle": 0, "msgpack": 1, "orjson": 2}
+
+    def __init__(
+        self,
+        serializer: str = "msgpack",
+        compression_threshold: Optional[int] = 1024,
+        compression_level: int = 3
+    ):
+        """
+        :param serializer: Предпочтительный сериализатор: msgpack, orjson или pickle.
+        :param compression_threshold: Минимальный размер (в байтах) для сжатия zstd; None - без сжатия.
+        :param compression_level: Уровень сжатия zstd.
+        """
+        serializer = serializer.lower()
+        if serializer not in self.SERIALIZER_IDS:
+            logger.warning(f"Неизвестный сериализатор кэша '{serializer}', используется pickle.")
+            serializer = "pickle"
+        if serializer == "msgpack" and msgpack is None:
+            logger.warning("Пакет msgpack не установлен, сериализатор кэша заменен на pickle.")
+            serializer = "pickle"
+        if serializer == "orjson" and orjson is None:
+            logger.warning("Пакет orjson не установлен, сериализатор кэша заменен на pickle.")
+            serializer = "pickle"
+        self.serializer = serializer
+
+        if compression_threshold is not None and zstandard is None:
+            logger.warning("Пакет zstandard не установлен, сжатие значений кэша отключено.")
+            compression_threshold = None
+        self.compression_threshold = compression_threshold
+        self._compressor = zstandard.ZstdCompressor(level=compression_level) if compression_threshold is not None else None
+        self._decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+    def _serialize(self, value: Any) -> Tuple[int, bytes]:
+        """
+        Сериализация предпочтительным сериализатором. Значения, которые он не
+        поддерживает (datetime, bytes для orjson, нестроковые ключи и т.п.),
+        сохраняются через pickle, чтобы не терять типы.
+        """
+        try:
+            if self.serializer == "msgpack":
+                return self.SERIALIZER_IDS["msgpack"], msgpack.packb(value, use_bin_type=True)
+            if self.serializer == "orjson":
+                return self.SERIALIZER_IDS["orjson"], orjson.dumps(value, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except (TypeError, ValueError, OverflowError) as e:
+            logger.debug(f"Сериализатор {self.serializer} не поддерживает значение ({e}), используется pickle.")
+        return self.SERIALIZER_IDS["pickle"], pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def encode(self, value: Any) -> bytes:
+        """Кодирование значения в байты для записи в Redis"""
+        serializer_id, payload = self._serialize(value)
+        flags = serializer_id
+        if self._compressor is not None and len(payload) >= self.compression_threshold:
+            compressed = self._compressor.compress(payload)
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags |= self.FLAG_ZSTD
+        return bytes((self.FORMAT_VERSION, flags)) + payload
+
+    def decode(self, data: bytes) -> Any:
+        """
+        Декодирование значения из Redis.
+
+        :raises CacheDecodeError: Неизвестный формат или поврежденные данные.
+        """
+        if not data:
+            raise CacheDecodeError("Пустое значение в кэше")
+
+        # Старый формат: значение целиком сериализовано pickle
+        if data[0] == self.PICKLE_PROTOCOL_MARKER:
+            return pickle.loads(data)
+
+        if data[0] != self.FORMAT_VERSION or len(data) < 2:
+            raise CacheDecodeError(f"Неизвестная версия формата кэша: {data[0]}")
+
+        flags = data[1]
+        payload = data[2:]
+        if flags & self.FLAG_ZSTD:
+            if self._decompressor is None:
+                raise CacheDecodeError("Значение сжато zstd, но пакет zstandard не установлен")
+            try:
+                payload = self._decompressor.decompress(payload)
+            except zstandard.ZstdError as e:
+                raise CacheDecodeError(f"Ошибка распаковки zstd: {e}")
+
+        serializer_id = flags & ~self.FLAG_ZSTD
+        if serializer_id == self.SERIALIZER_IDS["pickle"]:
+            return pickle.loads(payload)
+        if serializer_id == self.SERIALIZER_IDS["msgpack"]:
+            if msgpack is None:
+                raise CacheDecodeError("Значение сериализовано msgpack, но пакет msgpack не установлен")
+            return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+        if serializer_id == self.SERIALIZER_IDS["orjson"]:
+            if orjson is None:
+                raise CacheDecodeError("Значение сериализовано orjson, но пакет orjson не установлен")
+            return orjson.loads(payload)
+        raise CacheDecodeError(f"Неизвестный сериализатор кэша: {serializer_id}")
+
+class LocalLRUCache:
+    """
+    Локальный (L1) LRU-кэш в памяти процесса с TTL и бюджетом по размеру в байтах.
+    Размер записи оценивается по длине её сериализованного представления.
+    Записи отдельных полей хранятся под ключами вида "<ключ>#<поле>" и
+    инвалидируются вместе с основным ключом.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: int):
+        """
+        :param max_bytes: Максимальный суммарный размер записей в байтах.
+        :param ttl_seconds: Время жизни записи в секундах.
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._groups: Dict[str, Set[str]] = {}
+        self._size_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        """Текущий суммарный размер записей в байтах"""
+        return self._size_bytes
+
+    @staticmethod
+    def _group_of(key: str) -> str:
+        return key.split("#", 1)[0]
+
+    def get(self, key: str) -> Optional[Any]:
+        """Получение значения по ключу. Просроченные записи удаляются."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        value, _, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, size_bytes: int, ttl_seconds: Optional[int] = None) -> None:
+        """
+        Сохранение значения. Записи, которые больше всего бюджета, не кэшируются.
+
+        :param key: Ключ.
+        :param value: Значение.
+        :param size_bytes: Размер значения в байтах.
+        :param ttl_seconds: Время жизни записи (не больше TTL кэша по умолчанию).
+        """
+        self.invalidate(key)
+        if size_bytes > self.max_bytes:
+            logger.debug(f"L1: запись {key} ({size_bytes} байт) больше бюджета {self.max_bytes} байт, не кэширую.")
+            return
+
+        ttl = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        if ttl <= 0:
+            return
+
+        self._entries[key] = (value, size_bytes, time.monotonic() + ttl)
+        self._groups.setdefault(self._group_of(key), set()).add(key)
+        self._size_bytes += size_bytes
+
+        # Вытесняем самые давно использованные записи, пока не уложимся в бюджет
+        while self._size_bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._size_bytes -= entry[1]
+        group = self._groups.get(self._group_of(key))
+        if group is not None:
+            group.discard(key)
+            if not group:
+                del self._groups[self._group_of(key)]
+        return True
+
+    def invalidate(self, key: str) -> bool:
+        """
+        Удаление записи по ключу. Для основного ключа удаляются и записи его полей.
+        Возвращает True, если хотя бы одна запись была удалена.
+        """
+        if "#" in key:
+            return self._remove(key)
+        removed = False
+        for member in list(self._groups.get(key, ())):
+            removed = self._remove(member) or removed
+        return removed
+
+    def clear(self) -> None:
+        """Полная очистка кэша"""
+        self._entries.clear()
+        self._groups.clear()
+        self._size_bytes = 0
+
+
+class _ComputeFlight:
+    """Вычисление get_or_compute, общее для одновременных промахов по одному ключу"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[Any]"):
+        self.task = task
+        self.waiters = 0
+
+
 class CacheManager:
-    """Асинхронный менеджер кэша с TTL на базе Redis"""
+    """Асинхронный менеджер кэша с TTL на базе Redis и опциональным L1-кэшем в памяти процесса"""
+
+    # Пространства имен ключей (ключ Redis - "<пространство>:<ключ>")
+    NS_MOON_CALENDAR = "moon_calendar"
+    NS_CRYPTO_FORECAST = "crypto_forecast"
+    NS_TAROT_READING = "tarot_reading"
+    NS_TAROT_DAILY = "tarot_daily"
+    NS_TAROT_PDF = "tarot_pdf"
+    NS_CRYPTO_SYMBOLS = "crypto_symbols"
+    # Ответы LLM по хэшу нормализованного запроса (модели, сообщения, параметры генерации)
+    NS_LLM_RESPONSE = "llm_response"
+    # ETag, Last-Modified и SHA-256 страниц лунного календаря для условных запросов
+    NS_MOON_PAGE_META = "moon_page_meta"
+    # Негативный кэш: ошибки вычислений get_or_compute с коротким TTL
+    NS_NEGATIVE = "negative"
+
+    # Пространства, значения которых - записи дня из нескольких полей
+    # (календарь + AI-ответы); остальные хранят значения целиком
+    RECORD_NAMESPACES = frozenset({NS_MOON_CALENDAR})
 
-    def __init__(self, ttl_minutes: int = 60):
+    # Поля хэша записи дня в режиме хранения "hash"
+    CALENDAR_FIELD = "calendar"
+    AI_RESPONSE_FIELD_PREFIX = "openrouter_responses."
+
+    def __init__(
+        self,
+        ttl_minutes: int = 60,
+        l1_enabled: Optional[bool] = None,
+        l1_max_bytes: Optional[int] = None,
+        l1_ttl_seconds: Optional[int] = None,
+        storage_mode: Optional[str] = None,
+        codec: Optional[CacheCodec] = None
+    ):
         """
         Инициализация менеджера кэша с подключением к Redis.
 
         :param ttl_minutes: Время жизни кэша в минутах.
+        :param l1_enabled: Включить L1-кэш в памяти процесса (по умолчанию из config).
+        :param l1_max_bytes: Бюджет L1-кэша в байтах (по умолчанию из config).
+        :param l1_ttl_seconds: Время жизни записей L1-кэша в секундах (по умолчанию из config).
+        :param storage_mode: Формат хранения записей дня: "hash" (поля HSET) или "blob" (одна строка).
+        :param codec: Кодек значений (по умолчанию собирается из настроек config).
         """
         self._ttl_seconds = ttl_minutes * 60
         self.redis: Optional[aioredis.Redis] = None # Будет инициализирован в connect()
 
+        self._storage_mode = (storage_mode or config.CACHE_STORAGE_MODE).lower()
+        if self._storage_mode not in ("hash", "blob"):
+            logger.warning(f"Неизвестный режим хранения кэша '{self._storage_mode}', используется 'hash'.")
+            self._storage_mode = "hash"
+
+        self._codec = codec or CacheCodec(
+            serializer=config.CACHE_CODEC,
+            compression_threshold=config.CACHE_COMPRESSION_THRESHOLD_BYTES,
+            compression_level=config.CACHE_COMPRESSION_LEVEL
+        )
+
+        if l1_enabled is None:
+            l1_enabled = config.CACHE_L1_ENABLED
+        self._l1: Optional[LocalLRUCache] = None
+        if l1_enabled:
+            self._l1 = LocalLRUCache(
+                max_bytes=l1_max_bytes if l1_max_bytes is not None else config.CACHE_L1_MAX_BYTES,
+                ttl_seconds=l1_ttl_seconds if l1_ttl_seconds is not None else config.CACHE_L1_TTL_SECONDS
+            )
+
+        # Circuit breaker для Redis: при недоступности Redis запросы не ждут таймаутов
+        # и не переподключаются на каждом вызове, а обслуживаются резервным хранилищем
+        # в памяти. Восстановление проверяет фоновая задача.
+        self._breaker = CircuitBreaker(
+            name="redis",
+            failure_threshold=config.REDIS_CB_FAILURE_THRESHOLD,
+            recovery_timeout=config.REDIS_CB_RECOVERY_SECONDS
+        )
+        self._breaker.add_listener(self._on_breaker_state_change)
+        self._health_task: Optional[asyncio.Task] = None
+        self._connect_lock = asyncio.Lock()
+        self._fallback = LocalLRUCache(
+            max_bytes=config.CACHE_FALLBACK_MAX_BYTES,
+            ttl_seconds=self._ttl_seconds
+        )
+
+        # Идентификатор экземпляра, чтобы не инвалидировать L1 собственными сообщениями pub/sub
+        self._instance_id = uuid.uuid4().hex
+        self._invalidation_task: Optional[asyncio.Task] = None
+
+        # Счетчики попаданий/промахов по уровням кэша
+        self._stats: Dict[str, Dict[str, int]] = {
+            "l1": {"hits": 0, "misses": 0},
+            "l2": {"hits": 0, "misses": 0},
+            "fallback": {"hits": 0, "misses": 0, "writes": 0}
+        }
+
+        # Вычисления get_or_compute, выполняемые в этом процессе: ключ -> общая задача
+        self._inflight: Dict[str, _ComputeFlight] = {}
+        self._single_flight_stats: Dict[str, int] = {
+            "computed": 0,       # значение вычислено этим процессом
+            "coalesced": 0,      # запрос дождался вычисления в этом же процессе
+            "remote_waits": 0,   # запрос дождался значения, вычисленного другим воркером
+            "lock_timeouts": 0   # не дождались другого воркера и вычислили сами
+        }
+
+        # Stale-while-revalidate: фоновые обновления устаревших значений (по одному на ключ)
+        # и локально запомненные сроки свежести (monotonic), чтобы не спрашивать Redis на каждом чтении
+        self._refresh_tasks: Dict[str, asyncio.Task] = {}
+        self._fresh_until: Dict[str, float] = {}
+        self._swr_stats: Dict[str, int] = {
+            "stale_hits": 0,             # отдано устаревшее значение
+            "background_refreshes": 0,   # успешные фоновые обновления
+            "refresh_errors": 0,         # ошибки фоновых обновлений
+            "refresh_skipped": 0         # обновление уже выполняет другой воркер
+        }
+
+        # Негативный кэш: сколько раз ошибка отдана из кэша вместо повторного
+        # обращения к внешнему сервису (по пространствам имен) и сколько ошибок запомнено
+        self._negative_stats: Dict[str, Any] = {
+            "hits": 0,
+            "stored": 0,
+            "saved_calls_by_namespace": {}
+        }
+
     async def connect(self):
-        """Устанавливает асинхронное подключение к Redis."""
+        """
+        Устанавливает асинхронное подключение к Redis.
+        При неудаче открывает circuit breaker: дальше подключение восстанавливает
+        фоновая проверка, а запросы обслуживаются резервным хранилищем в памяти.
+        """
+        async with self._connect_lock:
+            try:
+                # Если соединение уже есть, сначала закроем его
+                if self.redis:
+                    try:
+                        await self.redis.close()
+                        logger.info("Закрыто предыдущее соединение с Redis перед повторным подключением.")
+                    except Exception as e:
+                        logger.warning(f"Ошибка при закрытии предыдущего соединения с Redis: {e}")
+
+                # Используем from_url для подключения с пулом соединений
+                self.redis = self._create_client()
+                logger.info(f"Успешно подключено к Redis по адресу: {config.REDIS_URL}")
+
+                # Проверяем соединение
+                await self.redis.ping()
+                logger.info("Redis connection ping successful.")
+                self._breaker.reset()
+
+                # Подписываемся на инвалидацию L1-кэша от других воркеров
+                self._start_invalidation_listener()
+            except aioredis.RedisError as e:
+                logger.critical(f"НЕ УДАЛОСЬ ПОДКЛЮЧИТЬСЯ К REDIS по адресу {config.REDIS_URL}: {e}", exc_info=True)
+                self.redis = None
+                self._breaker.trip()
+            except Exception as e:
+                logger.critical(f"Неожиданная ошибка при подключении к REDIS по адресу {config.REDIS_URL}: {e}", exc_info=True)
+                self.redis = None # Убедимся, что self.redis None при ошибке
+                self._breaker.trip()
+
+    def _create_client(self) -> aioredis.Redis:
+        """Создание клиента Redis с таймаутами, чтобы зависший Redis не блокировал запросы"""
+        return aioredis.from_url(
+            config.REDIS_URL,
+            encoding="utf-8",
+            decode_responses=False, # decode_responses=False для работы с бинарными значениями кодека
+            socket_timeout=config.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=config.REDIS_SOCKET_TIMEOUT
+        )
+
+    @property
+    def is_available(self) -> bool:
+        """Redis подключен и circuit breaker закрыт"""
+        return self.redis is not None and self._breaker.is_closed
+
+    def _on_breaker_state_change(self, old_state: str, new_state: str) -> None:
+        """Реакция на смену состояния circuit breaker"""
+        if new_state == CircuitBreaker.OPEN:
+            if old_state == CircuitBreaker.CLOSED:
+                logger.warning("Redis недоступен: кэш переведен в резервный режим (память процесса).")
+            self._start_health_check()
+        elif new_state == CircuitBreaker.CLOSED and old_state != CircuitBreaker.CLOSED:
+            # Пока Redis был недоступен, сообщения об инвалидации терялись, а записи шли
+            # в резервное хранилище. Источник истины снова Redis - сбрасываем локальные данные.
+            if self._l1 is not None:
+                self._l1.clear()
+            self._fallback.clear()
+            logger.info("Redis снова доступен: L1 и резервное хранилище сброшены.")
+
+    def _start_health_check(self) -> None:
+        """Запуск фоновой проверки восстановления Redis (если еще не запущена)"""
+        if self._health_task is not None and not self._health_task.done():
+            return
         try:
-            # Если соединение уже есть, сначала закроем его
-            if self.redis:
-                try:
-                    await self.redis.close()
-                    logger.info("Закрыто предыдущее соединение с Redis перед повторным подключением.")
-                except Exception as e:
-                    logger.warning(f"Ошибка при закрытии предыдущего соединения с Redis: {e}")
-            
-            # Используем from_url для подключения с пулом соединений
-            self.redis = aioredis.from_url(config.REDIS_URL, encoding="utf-8", decode_responses=False) # decode_responses=False для работы с pickle
-            logger.info(f"Успешно подключено к Redis по адресу: {config.REDIS_URL}")
-            
-            # Проверяем соединение
-            await self.redis.ping()
-            logger.info("Redis connection ping successful.")
-        except aioredis.RedisError as e:
-            logger.critical(f"НЕ УДАЛОСЬ ПОДКЛЮЧИТЬСЯ К REDIS по адресу {config.REDIS_URL}: {e}", exc_info=True)
-            self.redis = None
+            self._health_task = asyncio.get_running_loop().create_task(self._health_check_loop())
+        except RuntimeError:
+            # Нет запущенного event loop (например, при импорте модуля) - проверку запустит первый запрос
+            self._health_task = None
+
+    async def _health_check_loop(self) -> None:
+        """
+        Фоновая проверка Redis, пока circuit breaker не закрыт: раз в recovery_timeout
+        выключатель переводится в half_open и выполняется пробный PING.
+        """
+        while not self._breaker.is_closed:
+            await asyncio.sleep(self._breaker.recovery_timeout)
+            self._breaker.half_open()
+            if await self._probe():
+                self._breaker.reset()
+                self._start_invalidation_listener()
+            else:
+                self._breaker.trip()
+
+    async def _probe(self) -> bool:
+        """Пробное обращение к Redis (PING), при необходимости с созданием клиента"""
+        try:
+            if self.redis is None:
+                self.redis = self._create_client()
+            await asyncio.wait_for(self.redis.ping(), timeout=config.REDIS_SOCKET_TIMEOUT)
+            logger.info("Проверка Redis: PING успешен.")
+            return True
         except Exception as e:
-            logger.critical(f"Неожиданная ошибка при подключении к REDIS по адресу {config.REDIS_URL}: {e}", exc_info=True)
-            # В продакшене, возможно, стоит здесь предпринять другие действия (например, завершить приложение)
-            # В рамках текущей задачи просто логируем критическую ошибку.
-            self.redis = None # Убедимся, что self.redis None при ошибке
+            logger.warning(f"Проверка Redis: PING не прошел ({e}). Следующая попытка через {self._breaker.recovery_timeout} сек.")
+            return False
+
+    def _record_redis_failure(self, operation: str, key: str, error: Exception) -> None:
+        """Учет ошибки соединения с Redis в circuit breaker"""
+        logger.error(f"Ошибка соединения с Redis при {operation} для ключа {key}: {error}")
+        self._breaker.record_failure()
 
     async def close(self):
         """Закрывает соединение с Redis."""
+        await self._stop_invalidation_listener()
+        await self._cancel_refresh_tasks()
+        if self._health_task is not None and not self._health_task.done():
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+        self._health_task = None
         if self.redis:
             await self.redis.close()
             logger.info("Соединение с Redis закрыто.")
 
-    def _generate_key(self, date_obj: date) -> str:
-        """Генерация ключа для кэша"""
-        return f"moon_calendar_{date_obj.isoformat()}"
+    def _start_invalidation_listener(self) -> None:
+        """Запуск фоновой подписки на канал инвалидации L1-кэша"""
+        if self._l1 is None:
+            return
+        if self._invalidation_task and not self._invalidation_task.done():
+            self._invalidation_task.cancel()
+        self._invalidation_task = asyncio.create_task(self._listen_for_invalidations())
 
-    async def get(self, date_obj: date) -> Optional[Dict]:
+    async def _stop_invalidation_listener(self) -> None:
+        """Остановка фоновой подписки на канал инвалидации"""
+        if self._invalidation_task and not self._invalidation_task.done():
+            self._invalidation_task.cancel()
+            try:
+                await self._invalidation_task
+            except asyncio.CancelledError:
+                pass
+        self._invalidation_task = None
+
+    async def _listen_for_invalidations(self) -> None:
+        """
+        Прослушивание канала Redis pub/sub с ключами, измененными другими воркерами.
+        Сообщение имеет формат "<instance_id>|<ключ>".
         """
-        Получение данных из кэша Redis.
+        channel = config.CACHE_INVALIDATION_CHANNEL
+        while True:
+            pubsub = None
+            try:
+                if not self.is_available:
+                    await asyncio.sleep(1)
+                    continue
+                pubsub = self.redis.pubsub()
+                await pubsub.subscribe(channel)
+                logger.info(f"L1: подписка на канал инвалидации '{channel}' установлена.")
+
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if not message:
+                        continue
+                    data = message.get("data")
+                    if isinstance(data, bytes):
+                        data = data.decode("utf-8", errors="replace")
+                    sender_id, _, key = str(data).partition("|")
+                    if sender_id != self._instance_id and key and self._l1 is not None:
+                        if self._l1.invalidate(key):
+                            logger.debug(f"L1: ключ {key} инвалидирован по сообщению от другого воркера.")
+            except asyncio.CancelledError:
+                if pubsub is not None:
+                    try:
+                        await pubsub.unsubscribe(channel)
+                        await pubsub.close()
+                    except Exception:
+                        pass
+                raise
+            except Exception as e:
+                logger.warning(f"L1: ошибка подписки на канал инвалидации: {e}. Сбрасываю L1 и переподписываюсь.")
+                # Пока подписки нет, сообщения об изменениях могли быть потеряны
+                if self._l1 is not None:
+                    self._l1.clear()
+                await asyncio.sleep(1)
 
-        :param date_obj: Дата, для которой нужно получить данные.
-        :return: Данные из кэша или None, если нет данных или Redis недоступен.
+    async def _publish_invalidation(self, key: str) -> None:
+        """Публикация сообщения об изменении ключа для L1-кэшей других воркеров"""
+        if self._l1 is None or not self.is_available:
+            return
+        try:
+            await self.redis.publish(config.CACHE_INVALIDATION_CHANNEL, f"{self._instance_id}|{key}")
+        except Exception as e:
+            logger.warning(f"L1: не удалось опубликовать инвалидацию ключа {key}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
         """
-        if not self.redis:
-            logger.error("Попытка GET из кэша, но Redis не подключен. Пробуем переподключиться...")
-            await self.connect()
-            if not self.redis:
-                logger.error("Переподключение к Redis не удалось. GET невозможен.")
-                return None
+        Статистика попаданий/промахов по уровням кэша (L1 - память процесса, L2 - Redis).
 
-        key = self._generate_key(date_obj)
-        logger.info(f"Попытка кэширования GET для ключа: {key}")
+        :return: Словарь со счетчиками и заполненностью L1.
+        """
+        stats: Dict[str, Any] = {}
+        for tier, counters in self._stats.items():
+            total = counters["hits"] + counters["misses"]
+            stats[tier] = {
+                **counters,
+                "hit_ratio": round(counters["hits"] / total, 4) if total else 0.0
+            }
+
+        stats["l1"]["enabled"] = self._l1 is not None
+        if self._l1 is not None:
+            stats["l1"].update({
+                "entries": len(self._l1),
+                "size_bytes": self._l1.size_bytes,
+                "max_bytes": self._l1.max_bytes,
+                "ttl_seconds": self._l1.ttl_seconds
+            })
+        stats["l2"]["connected"] = self.redis is not None
+        stats["fallback"].update({
+            "active": not self._breaker.is_closed,
+            "entries": len(self._fallback),
+            "size_bytes": self._fallback.size_bytes,
+            "max_bytes": self._fallback.max_bytes
+        })
+        stats["circuit_breaker"] = self._breaker.get_stats()
+        stats["single_flight"] = {**self._single_flight_stats, "inflight": len(self._inflight)}
+        stats["negative_cache"] = {
+            **self._negative_stats,
+            "saved_calls_by_namespace": dict(self._negative_stats["saved_calls_by_namespace"])
+        }
+        stats["stale_while_revalidate"] = {
+            **self._swr_stats,
+            "refreshing": sum(1 for task in self._refresh_tasks.values() if not task.done())
+        }
+        return stats
+
+    @staticmethod
+    def make_key(ns: str, key: Union[str, date]) -> str:
+        """
+        Ключ Redis для ключа в пространстве имен.
+
+        :param ns: Пространство имен (например, `tarot_reading`).
+        :param key: Ключ внутри пространства; даты записываются в формате ISO.
+        :return: Ключ вида `<пространство>:<ключ>`.
+        """
+        if isinstance(key, date):
+            key = key.isoformat()
+        return f"{ns}:{key}"
+
+    def namespace_ttl(self, ns: str) -> int:
+        """Время жизни ключей пространства имен по умолчанию, в секундах"""
+        return int(config.CACHE_NAMESPACE_TTL.get(ns) or self._ttl_seconds)
+
+    def _is_record_ns(self, ns: str) -> bool:
+        """Хранит ли пространство имен записи дня из нескольких полей"""
+        return ns in self.RECORD_NAMESPACES
+
+    def _require_record_ns(self, ns: str) -> None:
+        """Операции с полями доступны только для пространств с записями дня"""
+        if not self._is_record_ns(ns):
+            raise ValueError(f"Пространство имен '{ns}' не хранит записи с полями")
+
+    @staticmethod
+    def _l1_field_key(key: str, field: str) -> str:
+        """Ключ L1-кэша для отдельного поля хэша"""
+        return f"{key}#{field}"
+
+    @staticmethod
+    def _is_wrong_type(error: Exception) -> bool:
+        """Проверка, что Redis вернул WRONGTYPE (ключ хранится в другом формате)"""
+        return "WRONGTYPE" in str(error)
+
+    def _split_into_fields(self, data: Any) -> Dict[str, bytes]:
+        """
+        Разбиение данных дня на поля хэша: спарсенный календарь отдельно,
+        каждый AI-ответ - в отдельном поле `openrouter_responses.<тип пользователя>`.
+
+        :param data: Данные для сохранения.
+        :return: Сериализованные значения по именам полей.
+        """
+        if not isinstance(data, dict):
+            return {self.CALENDAR_FIELD: self._codec.encode(data)}
+
+        fields: Dict[str, bytes] = {}
+        calendar_part = {k: v for k, v in data.items() if k != "openrouter_responses"}
+        if calendar_part:
+            fields[self.CALENDAR_FIELD] = self._codec.encode(calendar_part)
+
+        responses = data.get("openrouter_responses")
+        if isinstance(responses, dict):
+            for user_type, response in responses.items():
+                if response:
+                    fields[f"{self.AI_RESPONSE_FIELD_PREFIX}{user_type}"] = self._codec.encode(response)
+        return fields
+
+    def _assemble_from_fields(self, key: str, raw_fields: Dict[Any, bytes]) -> Optional[Dict]:
+        """
+        Сборка словаря в прежнем формате (календарь + `openrouter_responses`) из полей хэша.
+        Поврежденные поля пропускаются.
+        """
+        data: Dict[str, Any] = {}
+        responses: Dict[str, Any] = {}
+        for raw_name, raw_value in raw_fields.items():
+            name = raw_name.decode("utf-8") if isinstance(raw_name, bytes) else str(raw_name)
+            try:
+                value = self._codec.decode(raw_value)
+            except DECODE_ERRORS as e:
+                logger.error(f"Ошибка десериализации поля {name} ключа {key}: {e}. Поле пропущено.")
+                continue
+
+            if name == self.CALENDAR_FIELD:
+                if isinstance(value, dict):
+                    data.update(value)
+            elif name.startswith(self.AI_RESPONSE_FIELD_PREFIX):
+                responses[name[len(self.AI_RESPONSE_FIELD_PREFIX):]] = value
+
+        if responses:
+            data["openrouter_responses"] = responses
+        return data or None
+
+    def _extract_field(self, data: Optional[Dict], field: str) -> Optional[Any]:
+        """Извлечение значения поля из словаря в прежнем (blob) формате"""
+        if not isinstance(data, dict):
+            return None
+        if field == self.CALENDAR_FIELD:
+            calendar_part = {k: v for k, v in data.items() if k != "openrouter_responses"}
+            return calendar_part or None
+        if field.startswith(self.AI_RESPONSE_FIELD_PREFIX):
+            responses = data.get("openrouter_responses")
+            if isinstance(responses, dict):
+                return responses.get(field[len(self.AI_RESPONSE_FIELD_PREFIX):])
+        return None
 
+    async def _read_blob(self, key: str) -> Tuple[Optional[Any], int]:
+        """
+        Чтение значения, сохраненного одной строкой.
+
+        :return: Кортеж (данные или None, размер в байтах).
+        """
+        cached_data_bytes = await self.redis.get(key)
+        if cached_data_bytes is None:
+            return None, 0
         try:
-            cached_data_bytes = await self.redis.get(key)
+            return self._codec.decode(cached_data_bytes), len(cached_data_bytes)
+        except DECODE_ERRORS as e:
+            logger.error(f"Ошибка десериализации данных для ключа {key}: {e}. Удаляю некорректную запись.", exc_info=True)
+            await self.redis.delete(key) # Удаляем поврежденную запись
+            logger.info(f"Удалена некорректная запись для ключа {key}")
+            return None, 0
 
-            if cached_data_bytes is not None:
-                try:
-                    # Десериализация данных из байтов
-                    cached_data = pickle.loads(cached_data_bytes)
-                    logger.info(f"Получен HIT для ключа: {key} (date: {date_obj})")
-                    # Redis TTL управляет сроком жизни, отдельная проверка не нужна
-                    return cached_data
-                except (pickle.UnpicklingError, EOFError, AttributeError) as e:
-                    logger.error(f"Ошибка десериализации данных для ключа {key}: {e}. Удаляю некорректную запись.", exc_info=True)
-                    await self.redis.delete(key) # Удаляем поврежденную запись
-                    logger.info(f"Удалена некорректная запись для ключа {key}")
-                    return None # Возвращаем None после удаления некорректных данных
+    async def _read_hash(self, key: str) -> Tuple[Optional[Dict], int]:
+        """
+        Чтение всех полей хэша и сборка их в словарь.
+        Записи в старом формате (одна строка) читаются как есть.
+
+        :return: Кортеж (данные или None, суммарный размер полей в байтах).
+        """
+        try:
+            raw_fields = await self.redis.hgetall(key)
+        except aioredis.exceptions.ResponseError as e:
+            if self._is_wrong_type(e):
+                return await self._read_blob(key)
+            raise
+        if not raw_fields:
+            return None, 0
+        size = sum(len(value) for value in raw_fields.values())
+        return self._assemble_from_fields(key, raw_fields), size
+
+    async def _migrate_legacy_blob(self, key: str, ttl: int) -> None:
+        """Перевод записи из старого формата (одна строка) в хэш с сохранением TTL"""
+        default_ttl = ttl
+        legacy_data, _ = await self._read_blob(key)
+        ttl = await self.redis.ttl(key)
+        await self.redis.delete(key)
+        fields = self._split_into_fields(legacy_data) if legacy_data is not None else {}
+        if fields:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.hset(key, mapping=fields)
+                pipe.expire(key, ttl if ttl and ttl > 0 else default_ttl)
+                await pipe.execute()
+        logger.info(f"Запись {key} переведена из строкового формата в хэш ({len(fields)} полей).")
+
+    async def _write_hash_fields(self, key: str, fields: Dict[str, bytes], ttl: int) -> None:
+        """
+        Атомарная запись полей хэша (HSET + EXPIRE в одной транзакции).
+        Остальные поля ключа не затрагиваются, поэтому параллельные записи разных
+        полей (например, AI-ответов разных типов пользователей) не теряются.
+        """
+        for attempt in range(2):
+            try:
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.hset(key, mapping=fields)
+                    pipe.expire(key, ttl)
+                    await pipe.execute()
+                return
+            except aioredis.exceptions.ResponseError as e:
+                if attempt == 0 and self._is_wrong_type(e):
+                    await self._migrate_legacy_blob(key, ttl)
+                    continue
+                raise
+
+    async def _ensure_connected(self, operation: str) -> bool:
+        """
+        Можно ли выполнить операцию в Redis. Пока circuit breaker открыт, сразу
+        возвращает False (операция обслуживается резервным хранилищем) без попыток
+        переподключения. Подключение выполняется только при первом обращении,
+        если connect() еще не вызывался.
+        """
+        if not self._breaker.allow_request():
+            logger.debug(f"{operation}: circuit breaker открыт, используется резервное хранилище.")
+            self._start_health_check()
+            return False
+        if self.redis:
+            return True
+        if self._connect_lock.locked():
+            # Подключение уже выполняет другой запрос - дожидаемся его результата
+            async with self._connect_lock:
+                pass
+            return self.is_available
+        await self.connect()
+        return self.is_available
+
+    def _fallback_get(self, key: str) -> Optional[Any]:
+        """Чтение из резервного хранилища в памяти (когда Redis недоступен)"""
+        value = self._fallback.get(key)
+        if value is None:
+            self._stats["fallback"]["misses"] += 1
+            return None
+        self._stats["fallback"]["hits"] += 1
+        return copy.deepcopy(value)
+
+    def _fallback_set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        """Запись в резервное хранилище в памяти (когда Redis недоступен)"""
+        try:
+            size = len(self._codec.encode(value))
+        except Exception:
+            size = len(str(value))
+        self._fallback.set(key, copy.deepcopy(value), size, ttl or self._ttl_seconds)
+        self._stats["fallback"]["writes"] += 1
+        # L1 мог хранить прежнее значение ключа
+        if self._l1 is not None:
+            self._l1.invalidate(key)
+
+    def _fallback_set_record(self, key: str, data: Dict, ttl: Optional[int] = None) -> None:
+        """Запись данных дня в резервное хранилище со слиянием, как в режиме blob"""
+        existing = self._fallback.get(key)
+        self._fallback_set(key, self._merge_data(copy.deepcopy(existing), data), ttl)
+
+    def _field_to_record(self, field: str, value: Any) -> Optional[Dict]:
+        """Представление одного поля записи дня в виде словаря прежнего (blob) формата"""
+        if field == self.CALENDAR_FIELD:
+            return value
+        if field.startswith(self.AI_RESPONSE_FIELD_PREFIX):
+            user_type = field[len(self.AI_RESPONSE_FIELD_PREFIX):]
+            return {"openrouter_responses": {user_type: value}}
+        return None
+
+    async def get(self, ns: str, key: Union[str, date]) -> Optional[Any]:
+        """
+        Получение значения из кэша по ключу в пространстве имен.
+        Для пространств с записями дня (лунный календарь) запись собирается из всех полей.
+
+        :param ns: Пространство имен (например, `CacheManager.NS_TAROT_READING`).
+        :param key: Ключ внутри пространства (строка или дата).
+        :return: Данные из кэша или None, если нет данных.
+        """
+        if not self._is_record_ns(ns):
+            return await self._get_value(self.make_key(ns, key))
+
+        date_obj = key
+        key = self.make_key(ns, key)
+
+        # Сначала проверяем L1-кэш в памяти процесса
+        if self._l1 is not None:
+            local_data = self._l1.get(key)
+            if local_data is not None:
+                self._stats["l1"]["hits"] += 1
+                logger.debug(f"L1 HIT для ключа: {key}")
+                # Возвращаем копию, чтобы изменения вызывающего кода не портили L1
+                return copy.deepcopy(local_data)
+            self._stats["l1"]["misses"] += 1
+
+        if not await self._ensure_connected("GET"):
+            return self._fallback_get(key)
+
+        logger.info(f"Попытка кэширования GET для ключа: {key}")
+
+        try:
+            if self._storage_mode == "hash":
+                cached_data, size = await self._read_hash(key)
             else:
+                cached_data, size = await self._read_blob(key)
+            self._breaker.record_success()
+
+            if cached_data is None:
+                self._stats["l2"]["misses"] += 1
                 logger.info(f"Кэш MISS для ключа: {key} (date: {date_obj})")
                 return None
 
-        except aioredis.exceptions.ConnectionError as e:
-            logger.error(f"Ошибка соединения с Redis при GET для ключа {key}: {e}", exc_info=True)
-            logger.info("Пробуем переподключиться к Redis...")
-            await self.connect()
-            if self.redis:
-                logger.info("Переподключение к Redis успешно. Повторяем GET...")
-                return await self.get(date_obj) # Рекурсивно повторяем запрос после переподключения
-            return None
+            self._stats["l2"]["hits"] += 1
+            logger.info(f"Получен HIT для ключа: {key} (date: {date_obj})")
+            # Redis TTL управляет сроком жизни, отдельная проверка не нужна
+            if self._l1 is not None:
+                self._l1.set(key, cached_data, size, self.namespace_ttl(ns))
+                return copy.deepcopy(cached_data)
+            return cached_data
+
+        except REDIS_FAILURE_ERRORS as e:
+            self._record_redis_failure("GET", key, e)
+            return self._fallback_get(key)
         except aioredis.exceptions.RedisError as e:
             logger.error(f"Redis error during GET operation for key {key}: {e}", exc_info=True)
             return None
@@ -112,95 +915,1283 @@ class CacheManager:
             logger.error(f"Неожиданная ошибка в CacheManager.get для ключа {key}: {e}", exc_info=True)
             return None
 
-    async def set(self, date_obj: date, data: Dict) -> None:
+    async def get_field(self, ns: str, key: Union[str, date], field: str) -> Optional[Any]:
         """
-        Сохранение данных в кэш Redis с установленным TTL.
-        Обрабатывает слияние данных при частичном обновлении (например, добавлении AI-ответа).
+        Получение одного поля записи дня без чтения остальных
+        (например, `calendar` или `openrouter_responses.free`).
 
-        :param date_obj: Дата, для которой нужно сохранить данные.
-        :param data: Данные для сохранения (словарь).
+        :param ns: Пространство имен с записями дня.
+        :param key: Ключ записи (дата).
+        :param field: Имя поля.
+        :return: Значение поля или None.
         """
-        if not self.redis:
-            logger.error("Попытка SET в кэш, но Redis не подключен. Пробуем переподключиться...")
-            await self.connect()
-            if not self.redis:
-                logger.error("Переподключение к Redis не удалось. SET невозможен.")
-                return
+        self._require_record_ns(ns)
+        if self._storage_mode != "hash":
+            return self._extract_field(await self.get(ns, key), field)
+        key = self.make_key(ns, key)
+
+        l1_key = self._l1_field_key(key, field)
+        if self._l1 is not None:
+            local_value = self._l1.get(l1_key)
+            if local_value is not None:
+                self._stats["l1"]["hits"] += 1
+                logger.debug(f"L1 HIT для поля {field} ключа: {key}")
+                return copy.deepcopy(local_value)
+            self._stats["l1"]["misses"] += 1
+
+        if not await self._ensure_connected("HGET"):
+            return self._extract_field(self._fallback_get(key), field)
+
+        try:
+            try:
+                raw_value = await self.redis.hget(key, field)
+            except aioredis.exceptions.ResponseError as e:
+                if not self._is_wrong_type(e):
+                    raise
+                # Запись еще в старом строковом формате
+                legacy_data, _ = await self._read_blob(key)
+                return self._extract_field(legacy_data, field)
+            self._breaker.record_success()
+
+            if raw_value is None:
+                self._stats["l2"]["misses"] += 1
+                logger.info(f"Кэш MISS для поля {field} ключа: {key}")
+                return None
+
+            try:
+                value = self._codec.decode(raw_value)
+            except DECODE_ERRORS as e:
+                logger.error(f"Ошибка десериализации поля {field} ключа {key}: {e}. Удаляю поле.", exc_info=True)
+                await self.redis.hdel(key, field)
+                return None
+
+            self._stats["l2"]["hits"] += 1
+            logger.info(f"Получен HIT для поля {field} ключа: {key}")
+            if self._l1 is not None:
+                self._l1.set(l1_key, value, len(raw_value), self.namespace_ttl(ns))
+                return copy.deepcopy(value)
+            return value
+
+        except REDIS_FAILURE_ERRORS as e:
+            self._record_redis_failure("HGET", key, e)
+            return self._extract_field(self._fallback_get(key), field)
+        except aioredis.exceptions.RedisError as e:
+            logger.error(f"Redis error during HGET operation for key {key}, field {field}: {e}", exc_info=True)
+            return None
+        except Exception as e:
+            logger.error(f"Неожиданная ошибка в CacheManager.get_field для ключа {key}, поле {field}: {e}", exc_info=True)
+            return None
+
+    async def set(self, ns: str, key: Union[str, date], value: Any, ttl: Optional[int] = None) -> None:
+        """
+        Сохранение значения в кэш Redis по ключу в пространстве имен.
+        Для записей дня обрабатывает слияние данных при частичном обновлении (например,
+        добавлении AI-ответа): в режиме хранения `hash` календарь и каждый AI-ответ
+        записываются отдельными полями одной атомарной командой, без предварительного чтения.
+
+        :param ns: Пространство имен (например, `CacheManager.NS_TAROT_READING`).
+        :param key: Ключ внутри пространства (строка или дата).
+        :param value: Значение для сохранения.
+        :param ttl: Время жизни в секундах (по умолчанию TTL пространства имен из config).
+        """
+        ttl = int(ttl) if ttl else self.namespace_ttl(ns)
+        if not self._is_record_ns(ns):
+            await self._set_value(self.make_key(ns, key), value, ttl)
+            return
+
+        date_obj, data = key, value
+        key = self.make_key(ns, key)
+        if not await self._ensure_connected("SET"):
+            self._fallback_set_record(key, data, ttl)
+            return
 
-        key = self._generate_key(date_obj)
         logger.info(f"Попытка кэширования SET для ключа: {key} (date: {date_obj})")
         logger.debug(f"Данные для сохранения (начало): {str(data)[:200]}...") # Логируем начало данных
 
         try:
-            # Перед сохранением новых данных, попробуем получить текущие из Redis
-            # Это нужно для реализации логики слияния данных (парсинг + AI-ответы)
-            existing_data_bytes = await self.redis.get(key)
-            existing_data = None
-            if existing_data_bytes:
-                try:
-                     existing_data = pickle.loads(existing_data_bytes)
-                     # Проверяем, что существующие данные - это словарь, иначе игнорируем их
-                     if not isinstance(existing_data, dict):
-                         logger.warning(f"Существующие данные для ключа {key} не являются словарем. Игнорирую их.")
-                         existing_data = None
-                except (pickle.UnpicklingError, EOFError, AttributeError) as e:
-                     logger.warning(f"Ошибка десериализации существующих данных для ключа {key} при SET: {e}. Игнорирую их.", exc_info=True)
-                     existing_data = None # Игнорируем поврежденные данные
-
-            data_to_save = data # Начинаем с данных, которые переданы в SET
-
-            # Логика слияния данных:
-            # Если существующие данные есть И это словари, пытаемся их объединить.
-            # Предполагается, что data_to_save уже содержит спарсенные данные (если они были получены)
-            # и может содержать новый AI-ответ вложенный в 'openrouter_responses'.
-            # Цель: сохранить ВСЕ AI-ответы, которые уже есть в кеше, если их нет в текущих data_to_save.
-            if existing_data and isinstance(existing_data, dict) and isinstance(data_to_save, dict):
-                # Создаем копию существующих данных, чтобы не модифицировать их напрямую, если они используются где-то еще (хотя CacheManager.get уже возвращает копию)
-                merged_data = existing_data #existing_data уже является копией из get()
-
-                # Если в новых данных есть openrouter_responses, сливаем их с существующими
-                if 'openrouter_responses' in data_to_save and isinstance(data_to_save['openrouter_responses'], dict):
-                     if 'openrouter_responses' not in merged_data or not isinstance(merged_data['openrouter_responses'], dict):
-                        merged_data['openrouter_responses'] = {}
-
-                     # Объединяем ответы для разных типов пользователей
-                     merged_data['openrouter_responses'].update(data_to_save['openrouter_responses'])
-
-                     # Удаляем openrouter_responses из data_to_save, чтобы избежать их дублирования
-                     # (остальные поля из data_to_save будут просто обновлены)
-                     data_without_ai_responses = {k: v for k, v in data_to_save.items() if k != 'openrouter_responses'}
-                else:
-                     # Если в новых данных нет openrouter_responses, используем data_to_save как есть
-                     # и сохраняем существующие AI-ответы из merged_data (если они были)
-                     data_without_ai_responses = data_to_save # просто переименовываем для ясности
+            if self._storage_mode == "hash":
+                fields = self._split_into_fields(data)
+                if not fields:
+                    logger.warning(f"Нет данных для сохранения по ключу {key}. SET пропущен.")
+                    return
+                await self._write_hash_fields(key, fields, ttl)
+                self._breaker.record_success()
 
-                # Обновляем остальные поля в merged_data из data_to_save
-                # Важно: это перезапишет не-AI поля из existing_data данными из data_to_save
-                # Это правильно, т.к. SET вызывается для сохранения свежих данных (либо парсинга, либо после парсинга+AI)
-                merged_data.update(data_without_ai_responses)
+                # Состав записи изменился - сбрасываем L1 для ключа и всех его полей
+                if self._l1 is not None:
+                    self._l1.invalidate(key)
+                    await self._publish_invalidation(key)
 
-                data_to_save = merged_data # Теперь сохраняем объединенные данные
+                logger.info(f"Кэширование HSET успешно для ключа: {key} (поля: {', '.join(fields)}) с TTL {ttl} сек.")
+                return
+
+            data_to_save = await self._merge_with_existing_blob(key, data)
 
             # Сериализация данных в байты
-            pickled_data = pickle.dumps(data_to_save)
+            encoded_data = self._codec.encode(data_to_save)
 
             # Сохранение данных в Redis с TTL
-            await self.redis.set(key, pickled_data, ex=self._ttl_seconds)
+            await self.redis.set(key, encoded_data, ex=ttl)
+            self._breaker.record_success()
+
+            # Обновляем L1 (копией, чтобы последующие изменения объекта вызывающим кодом
+            # не попали в кэш) и оповещаем остальные воркеры
+            if self._l1 is not None:
+                self._l1.set(key, copy.deepcopy(data_to_save), len(encoded_data), ttl)
+                await self._publish_invalidation(key)
 
-            logger.info(f"Кэширование SET успешно для ключа: {key} (date: {date_obj}) с TTL {self._ttl_seconds} сек.")
+            logger.info(f"Кэширование SET успешно для ключа: {key} (date: {date_obj}) с TTL {ttl} сек.")
 
-        except aioredis.exceptions.ConnectionError as e:
-            logger.error(f"Ошибка соединения с Redis при SET для ключа {key}: {e}", exc_info=True)
-            logger.info("Пробуем переподключиться к Redis...")
-            await self.connect()
-            if self.redis:
-                logger.info("Переподключение к Redis успешно. Повторяем SET...")
-                await self.set(date_obj, data) # Рекурсивно повторяем запрос после переподключения
+        except REDIS_FAILURE_ERRORS as e:
+            self._record_redis_failure("SET", key, e)
+            self._fallback_set_record(key, data, ttl)
         except aioredis.exceptions.RedisError as e:
             logger.error(f"Redis error during SET operation for key {key}: {e}", exc_info=True)
         except Exception as e:
             logger.error(f"Неожиданная ошибка в CacheManager.set для ключа {key}: {e}", exc_info=True)
 
+    async def set_field(
+        self,
+        ns: str,
+        key: Union[str, date],
+        field: str,
+        value: Any,
+        ttl: Optional[int] = None
+    ) -> None:
+        """
+        Атомарная запись одного поля записи дня (например, `openrouter_responses.premium`)
+        без чтения и перезаписи остальных полей.
+
+        :param ns: Пространство имен с записями дня.
+        :param key: Ключ записи (дата).
+        :param field: Имя поля.
+        :param value: Значение поля.
+        :param ttl: Время жизни записи в секундах (по умолчанию TTL пространства имен).
+        """
+        self._require_record_ns(ns)
+        ttl = int(ttl) if ttl else self.namespace_ttl(ns)
+        record = self._field_to_record(field, value)
+        if self._storage_mode != "hash":
+            if record is None:
+                logger.error(f"Неизвестное поле {field} для режима хранения blob. SET пропущен.")
+                return
+            await self.set(ns, key, record, ttl)
+            return
+
+        key = self.make_key(ns, key)
+        if not await self._ensure_connected("HSET"):
+            if record is not None:
+                self._fallback_set_record(key, record, ttl)
+            return
+
+        try:
+            raw_value = self._codec.encode(value)
+            await self._write_hash_fields(key, {field: raw_value}, ttl)
+            self._breaker.record_success()
+
+            if self._l1 is not None:
+                self._l1.invalidate(key)
+                self._l1.set(self._l1_field_key(key, field), copy.deepcopy(value), len(raw_value), ttl)
+                await self._publish_invalidation(key)
+
+            logger.info(f"Кэширование HSET успешно для поля {field} ключа: {key} с TTL {ttl} сек.")
+
+        except REDIS_FAILURE_ERRORS as e:
+            self._record_redis_failure("HSET", key, e)
+            if record is not None:
+                self._fallback_set_record(key, record, ttl)
+        except aioredis.exceptions.RedisError as e:
+            logger.error(f"Redis error during HSET operation for key {key}, field {field}: {e}", exc_info=True)
+        except Exception as e:
+            logger.error(f"Неожиданная ошибка в CacheManager.set_field для ключа {key}, поле {field}: {e}", exc_info=True)
+
+    async def _get_value(self, key: str) -> Optional[Any]:
+        """
+        Получение значения, хранимого целиком одной строкой (не записи дня).
+
+        :param key: Ключ Redis.
+        :return: Значение или None.
+        """
+        if self._l1 is not None:
+            local_value = self._l1.get(key)
+            if local_value is not None:
+                self._stats["l1"]["hits"] += 1
+                logger.debug(f"L1 HIT для ключа: {key}")
+                return copy.deepcopy(local_value)
+            self._stats["l1"]["misses"] += 1
+
+        if not await self._ensure_connected("GET"):
+            return self._fallback_get(key)
+
+        try:
+            value, size = await self._read_blob(key)
+            self._breaker.record_success()
+            if value is None:
+                self._stats["l2"]["misses"] += 1
+                logger.info(f"Кэш MISS для ключа: {key}")
+                return None
+
+            self._stats["l2"]["hits"] += 1
+            logger.info(f"Получен HIT для ключа: {key}")
+            if self._l1 is not None:
+                ttl = await self.redis.ttl(key)
+                self._l1.set(key, value, size, ttl if ttl and ttl > 0 else self._ttl_seconds)
+                return copy.deepcopy(value)
+            return value
+
+        except REDIS_FAILURE_ERRORS as e:
+            self._record_redis_failure("GET", key, e)
+            return self._fallback_get(key)
+        except aioredis.exceptions.RedisError as e:
+            logger.error(f"Redis error during GET operation for key {key}: {e}", exc_info=True)
+            return None
+        except Exception as e:
+            logger.error(f"Неожиданная ошибка в CacheManager.get для ключа {key}: {e}", exc_info=True)
+            return None
+
+    async def _set_value(self, key: str, value: Any, ttl: int) -> None:
+        """
+        Сохранение значения целиком одной строкой.
+
+        :param key: Ключ Redis.
+        :param value: Значение.
+        :param ttl: Время жизни в секундах.
+        """
+        if not await self._ensure_connected("SET"):
+            self._fallback_set(key, value, ttl)
+            return
+
+        try:
+            encoded_data = self._codec.encode(value)
+            await self.redis.set(key, encoded_data, ex=ttl)
+            self._breaker.record_success()
+
+            if self._l1 is not None:
+                self._l1.set(key, copy.deepcopy(value), len(encoded_data), ttl)
+                await self._publish_invalidation(key)
+
+            logger.info(f"Кэширование SET успешно для ключа: {key} с TTL {ttl} сек.")
+
+        except REDIS_FAILURE_ERRORS as e:
+            self._record_redis_failure("SET", key, e)
+            self._fallback_set(key, value, ttl)
+        except aioredis.exceptions.RedisError as e:
+            logger.error(f"Redis error during SET operation for key {key}: {e}", exc_info=True)
+        except Exception as e:
+            logger.error(f"Неожиданная ошибка в CacheManager.set для ключа {key}: {e}", exc_info=True)
+
+    def _fallback_read(self, ns: str, key: Union[str, date], field: Optional[str]) -> Optional[Any]:
+        """Чтение ключа (или поля записи дня) из резервного хранилища"""
+        value = self._fallback_get(self.make_key(ns, key))
+        if self._is_record_ns(ns) and field is not None:
+            return self._extract_field(value, field)
+        return value
+
+    def _fallback_write(
+        self,
+        ns: str,
+        key: Union[str, date],
+        value: Any,
+        ttl: Optional[int],
+        field: Optional[str]
+    ) -> None:
+        """Запись ключа (или поля записи дня) в резервное хранилище"""
+        redis_key = self.make_key(ns, key)
+        if not self._is_record_ns(ns):
+            self._fallback_set(redis_key, value, ttl)
+            return
+        record = self._field_to_record(field, value) if field is not None else value
+        if record is not None:
+            self._fallback_set_record(redis_key, record, ttl)
+
+    async def get_many(
+        self,
+        ns: str,
+        keys: List[Union[str, date]],
+        field: Optional[str] = None
+    ) -> Dict[Union[str, date], Any]:
+        """
+        Пакетное чтение за один запрос к Redis: значения (и записи дня в режиме blob)
+        читаются одной командой MGET, записи дня в режиме hash - HGET/HGETALL
+        в том же конвейере. Кодек, L1 и резервный режим - как у одиночных операций.
+
+        :param ns: Пространство имен ключей.
+        :param keys: Ключи внутри пространства (строки или даты).
+        :param field: Поле записи дня, например `calendar`.
+        :return: Словарь найденных значений по исходным ключам; промахи в нем отсутствуют.
+        """
+        if field is not None:
+            self._require_record_ns(ns)
+        is_record = self._is_record_ns(ns)
+        is_hash = is_record and self._storage_mode == "hash"
+        key_ttl = self.namespace_ttl(ns)
+        result: Dict[Union[str, date], Any] = {}
+        pending: List[Union[str, date]] = []
+
+        for key in dict.fromkeys(keys):
+            redis_key = self.make_key(ns, key)
+            if self._l1 is not None:
+                l1_key = self._l1_field_key(redis_key, field) if is_hash and field is not None else redis_key
+                local_value = self._l1.get(l1_key)
+                if local_value is not None:
+                    self._stats["l1"]["hits"] += 1
+                    if field is not None and not is_hash:
+                        local_value = self._extract_field(local_value, field)
+                    if local_value is not None:
+                        result[key] = copy.deepcopy(local_value)
+                    continue
+                self._stats["l1"]["misses"] += 1
+            pending.append(key)
+
+        if not pending:
+            return result
+
+        if not await self._ensure_connected("MGET"):
+            for key in pending:
+                value = self._fallback_read(ns, key, field)
+                if value is not None:
+                    result[key] = value
+            return result
+
+        blob_keys = [] if is_hash else pending
+        hash_keys = pending if is_hash else []
+        blob_redis_keys = [self.make_key(ns, key) for key in blob_keys]
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                if blob_redis_keys:
+                    pipe.mget(blob_redis_keys)
+                    for redis_key in blob_redis_keys:
+                        pipe.pttl(redis_key)
+                for key in hash_keys:
+                    redis_key = self.make_key(ns, key)
+                    if field is not None:
+                        pipe.hget(redis_key, field)
+                    else:
+                        pipe.hgetall(redis_key)
+                replies = await pipe.execute(raise_on_error=False)
+            self._breaker.record_success()
+        except REDIS_FAILURE_ERRORS as e:
+            self._record_redis_failure("MGET", ",".join(map(str, pending[:5])), e)
+            for key in pending:
+                value = self._fallback_read(ns, key, field)
+                if value is not None:
+                    result[key] = value
+            return result
+        except Exception as e:
+            logger.error(f"Ошибка пакетного чтения из кэша ({len(pending)} ключей): {e}", exc_info=True)
+            return result
+
+        position = 0
+        if blob_redis_keys:
+            raw_values = replies[0]
+            ttls = replies[1:1 + len(blob_redis_keys)]
+            position = 1 + len(blob_redis_keys)
+            if isinstance(raw_values, Exception):
+                logger.error(f"Ошибка MGET: {raw_values}")
+                raw_values = [None] * len(blob_redis_keys)
+            for key, redis_key, raw_value, ttl_ms in zip(blob_keys, blob_redis_keys, raw_values, ttls):
+                if raw_value is None:
+                    self._stats["l2"]["misses"] += 1
+                    continue
+                try:
+                    value = self._codec.decode(raw_value)
+                except DECODE_ERRORS as e:
+                    logger.error(f"Ошибка десериализации данных для ключа {redis_key}: {e}. Удаляю некорректную запись.")
+                    await self.redis.delete(redis_key)
+                    self._stats["l2"]["misses"] += 1
+                    continue
+                self._stats["l2"]["hits"] += 1
+                if self._l1 is not None:
+                    ttl = ttl_ms / 1000 if isinstance(ttl_ms, int) and ttl_ms > 0 else key_ttl
+                    self._l1.set(redis_key, value, len(raw_value), int(ttl) or 1)
+                    value = copy.deepcopy(value)
+                if field is not None:
+                    value = self._extract_field(value, field)
+                if value is not None:
+                    result[key] = value
+
+        for key, reply in zip(hash_keys, replies[position:]):
+            redis_key = self.make_key(ns, key)
+            if isinstance(reply, Exception):
+                if not self._is_wrong_type(reply):
+                    logger.error(f"Ошибка чтения ключа {redis_key} в пакете: {reply}")
+                    continue
+                # Запись еще в старом строковом формате - читаем ее отдельно
+                value = await (self.get_field(ns, key, field) if field is not None else self.get(ns, key))
+            elif field is not None:
+                if reply is None:
+                    self._stats["l2"]["misses"] += 1
+                    continue
+                try:
+                    value = self._codec.decode(reply)
+                except DECODE_ERRORS as e:
+                    logger.error(f"Ошибка десериализации поля {field} ключа {redis_key}: {e}. Удаляю поле.")
+                    await self.redis.hdel(redis_key, field)
+                    self._stats["l2"]["misses"] += 1
+                    continue
+                self._stats["l2"]["hits"] += 1
+                if self._l1 is not None:
+                    self._l1.set(self._l1_field_key(redis_key, field), value, len(reply), key_ttl)
+                    value = copy.deepcopy(value)
+            else:
+                value = self._assemble_from_fields(redis_key, reply) if reply else None
+                if value is None:
+                    self._stats["l2"]["misses"] += 1
+                    continue
+                self._stats["l2"]["hits"] += 1
+                if self._l1 is not None:
+                    self._l1.set(redis_key, value, sum(len(v) for v in reply.values()), key_ttl)
+                    value = copy.deepcopy(value)
+            if value is not None:
+                result[key] = value
+
+        logger.info(f"Пакетное чтение из кэша: {len(result)} из {len(keys)} ключей найдено.")
+        return result
+
+    async def set_many(
+        self,
+        ns: str,
+        items: Dict[Union[str, date], Any],
+        ttl: Optional[int] = None,
+        field: Optional[str] = None,
+        soft_ttl: Optional[int] = None
+    ) -> None:
+        """
+        Пакетная запись за один запрос к Redis (конвейер SET EX / HSET + EXPIRE).
+        Для записей дня в режиме blob сохраненные данные сначала читаются одной
+        командой MGET и сливаются с новыми, как в set().
+
+        :param ns: Пространство имен ключей.
+        :param items: Значения по ключам внутри пространства (строки или даты).
+        :param ttl: Время жизни в секундах (по умолчанию TTL пространства имен).
+        :param field: Поле записи дня, например `calendar`.
+        :param soft_ttl: Срок свежести значений для get_or_compute (stale-while-revalidate).
+        """
+        if not items:
+            return
+
+        if field is not None:
+            self._require_record_ns(ns)
+        is_record = self._is_record_ns(ns)
+        is_hash = is_record and self._storage_mode == "hash"
+        ttl = int(ttl) if ttl else self.namespace_ttl(ns)
+        if not await self._ensure_connected("SET"):
+            for key, value in items.items():
+                self._fallback_write(ns, key, value, ttl, field)
+            return
+
+        try:
+            # Записи дня в формате blob сливаются с уже сохраненными данными
+            existing: Dict[str, Any] = {}
+            if is_record and not is_hash:
+                blob_date_keys = [self.make_key(ns, key) for key in items]
+                for redis_key, raw_value in zip(blob_date_keys, await self.redis.mget(blob_date_keys)):
+                    if raw_value is None:
+                        continue
+                    try:
+                        existing[redis_key] = self._codec.decode(raw_value)
+                    except DECODE_ERRORS as e:
+                        logger.warning(f"Ошибка десериализации существующих данных для ключа {redis_key} при SET: {e}. Игнорирую их.")
+
+            written: List[Tuple[Union[str, date], str, Any, int]] = []
+            # Ключ вызывающего кода для каждой команды пакета; None - служебные команды
+            # (метки свежести, публикация инвалидации), их ошибки не требуют перезаписи
+            commands: List[Optional[Union[str, date]]] = []
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, value in items.items():
+                    redis_key = self.make_key(ns, key)
+                    if is_hash:
+                        if field is not None:
+                            fields = {field: self._codec.encode(value)}
+                        else:
+                            fields = self._split_into_fields(value)
+                        if not fields:
+                            continue
+                        pipe.hset(redis_key, mapping=fields)
+                        pipe.expire(redis_key, ttl)
+                        commands.extend([key, key])
+                        written.append((key, redis_key, value, sum(len(v) for v in fields.values())))
+                        continue
+
+                    if is_record:
+                        record = self._field_to_record(field, value) if field is not None else value
+                        if record is None:
+                            logger.error(f"Неизвестное поле {field} для режима хранения blob. SET {redis_key} пропущен.")
+                            continue
+                        value = self._merge_data(existing.get(redis_key), record)
+                    encoded_data = self._codec.encode(value)
+                    pipe.set(redis_key, encoded_data, ex=ttl)
+                    commands.append(key)
+                    written.append((key, redis_key, value, len(encoded_data)))
+
+                if soft_ttl:
+                    for key, _, _, _ in written:
+                        pipe.set(self._fresh_marker_key(self._flight_key(ns, key, field)), b"1", ex=int(soft_ttl))
+                        commands.append(None)
+                if self._l1 is not None:
+                    for _, redis_key, _, _ in written:
+                        pipe.publish(config.CACHE_INVALIDATION_CHANNEL, f"{self._instance_id}|{redis_key}")
+                        commands.append(None)
+                replies = await pipe.execute(raise_on_error=False)
+            self._breaker.record_success()
+        except REDIS_FAILURE_ERRORS as e:
+            self._record_redis_failure("SET", ",".join(map(str, list(items)[:5])), e)
+            for key, value in items.items():
+                self._fallback_write(ns, key, value, ttl, field)
+            return
+        except Exception as e:
+            logger.error(f"Ошибка пакетной записи в кэш ({len(items)} ключей): {e}", exc_info=True)
+            return
+
+        # Записи в старом строковом формате (WRONGTYPE для HSET) пишем по одной с миграцией
+        failed = {
+            commands[i] for i, reply in enumerate(replies)
+            if isinstance(reply, Exception) and commands[i] is not None
+        }
+        for key in failed:
+            if not is_record:
+                logger.error(f"Ошибка записи ключа {self.make_key(ns, key)} в пакете.")
+                continue
+            if field is not None:
+                await self.set_field(ns, key, field, items[key], ttl)
+            else:
+                await self.set(ns, key, items[key], ttl)
+
+        for key, redis_key, value, size in written:
+            if key in failed:
+                continue
+            if soft_ttl:
+                self._fresh_until[self._flight_key(ns, key, field)] = time.monotonic() + soft_ttl
+            if self._l1 is None:
+                continue
+            if is_record:
+                self._l1.invalidate(redis_key)
+                if is_hash and field is not None:
+                    self._l1.set(self._l1_field_key(redis_key, field), copy.deepcopy(value), size, ttl)
+            else:
+                self._l1.set(redis_key, copy.deepcopy(value), size, ttl)
+
+        logger.info(f"Пакетная запись в кэш: {sum(1 for key, _, _, _ in written if key not in failed)} ключей с TTL {ttl} сек.")
+
+    async def _read_entry(self, ns: str, key: Union[str, date], field: Optional[str]) -> Optional[Any]:
+        """Чтение значения для get_or_compute: значение целиком либо поле записи дня"""
+        if field is not None:
+            return await self.get_field(ns, key, field)
+        return await self.get(ns, key)
+
+    async def _write_entry(
+        self,
+        ns: str,
+        key: Union[str, date],
+        field: Optional[str],
+        value: Any,
+        ttl: Optional[int]
+    ) -> None:
+        """Запись значения, вычисленного в get_or_compute"""
+        if field is not None:
+            await self.set_field(ns, key, field, value, ttl)
+        else:
+            await self.set(ns, key, value, ttl)
+
+    def _flight_key(self, ns: str, key: Union[str, date], field: Optional[str]) -> str:
+        """Строковый идентификатор вычисления (для карты future и имени блокировки)"""
+        redis_key = self.make_key(ns, key)
+        return self._l1_field_key(redis_key, field) if field is not None else redis_key
+
+    async def _acquire_lock(self, lock_key: str, token: str, timeout: float) -> Optional[bool]:
+        """
+        Попытка взять короткую блокировку Redis (SET NX PX).
+
+        :return: True - блокировка взята, False - занята другим воркером, None - Redis недоступен.
+        """
+        if not self.is_available:
+            return None
+        try:
+            return bool(await self.redis.set(lock_key, token, nx=True, px=int(timeout * 1000)))
+        except REDIS_FAILURE_ERRORS as e:
+            self._record_redis_failure("SET NX", lock_key, e)
+            return None
+        except aioredis.exceptions.RedisError as e:
+            logger.warning(f"Не удалось взять блокировку {lock_key}: {e}. Вычисляю без межпроцессной блокировки.")
+            return None
+
+    async def _is_locked(self, lock_key: str) -> bool:
+        """Проверка, что блокировку все еще держит кто-то"""
+        if not self.is_available:
+            return False
+        try:
+            return bool(await self.redis.exists(lock_key))
+        except (aioredis.exceptions.RedisError,) + REDIS_FAILURE_ERRORS:
+            return False
+
+    async def _release_lock(self, lock_key: str, token: str) -> None:
+        """Снятие блокировки, если она все еще принадлежит этому вычислению"""
+        if not self.is_available:
+            return
+        try:
+            await self.redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+        except (aioredis.exceptions.RedisError,) + REDIS_FAILURE_ERRORS as e:
+            logger.warning(f"Не удалось снять блокировку {lock_key}: {e}. Она истечет по TTL.")
+
+    @staticmethod
+    def _fresh_marker_key(flight_key: str) -> str:
+        """Ключ-маркер свежести значения: живет soft TTL, после его истечения значение устарело"""
+        return f"fresh:{flight_key}"
+
+    async def _is_fresh(self, flight_key: str) -> bool:
+        """
+        Проверка, что значение еще не превысило soft TTL.
+        Если Redis недоступен, значение считается свежим (обновлять его все равно некуда).
+        """
+        now = time.monotonic()
+        fresh_until = self._fresh_until.get(flight_key)
+        if fresh_until is not None and fresh_until > now:
+            return True
+        if not self.is_available:
+            return True
+        try:
+            remaining_ms = await self.redis.pttl(self._fresh_marker_key(flight_key))
+        except (aioredis.exceptions.RedisError,) + REDIS_FAILURE_ERRORS as e:
+            logger.warning(f"Не удалось проверить свежесть {flight_key}: {e}")
+            return True
+        if remaining_ms == -1:
+            # Маркер без срока жизни - значение не устаревает
+            return True
+        if remaining_ms and remaining_ms > 0:
+            self._fresh_until[flight_key] = now + remaining_ms / 1000
+            return True
+        self._fresh_until.pop(flight_key, None)
+        return False
+
+    async def mark_fresh(self, ns: str, key: Union[str, date], soft_ttl: int, field: Optional[str] = None) -> None:
+        """
+        Отметка значения свежим на soft_ttl секунд. Вызывается после записи значения
+        в обход get_or_compute (например, фоновыми задачами), чтобы первое чтение
+        не запускало лишнее обновление.
+
+        :param ns: Пространство имен ключа.
+        :param key: Ключ внутри пространства (строка или дата).
+        :param soft_ttl: Срок свежести в секундах.
+        :param field: Поле записи дня.
+        """
+        flight_key = self._flight_key(ns, key, field)
+        self._fresh_until[flight_key] = time.monotonic() + soft_ttl
+        if not self.is_available:
+            return
+        try:
+            await self.redis.set(self._fresh_marker_key(flight_key), b"1", ex=int(soft_ttl))
+        except (aioredis.exceptions.RedisError,) + REDIS_FAILURE_ERRORS as e:
+            logger.warning(f"Не удалось сохранить маркер свежести {flight_key}: {e}")
+
+    def _schedule_refresh(
+        self,
+        ns: str,
+        key: Union[str, date],
+        field: Optional[str],
+        producer: Callable[[], Awaitable[Any]],
+        ttl: Optional[int],
+        soft_ttl: int,
+        lock_timeout: float
+    ) -> None:
+        """Запуск фонового обновления устаревшего значения, не более одного на ключ в процессе"""
+        flight_key = self._flight_key(ns, key, field)
+        task = self._refresh_tasks.get(flight_key)
+        if task is not None and not task.done():
+            return
+        if flight_key in self._inflight:
+            # Значение уже вычисляется запросом на переднем плане
+            return
+        self._refresh_tasks[flight_key] = asyncio.create_task(
+            self._refresh_in_background(ns, key, field, producer, ttl, soft_ttl, lock_timeout)
+        )
+
+    async def _refresh_in_background(
+        self,
+        ns: str,
+        key: Union[str, date],
+        field: Optional[str],
+        producer: Callable[[], Awaitable[Any]],
+        ttl: Optional[int],
+        soft_ttl: int,
+        lock_timeout: float
+    ) -> None:
+        """
+        Фоновое обновление значения. Между воркерами дедуплицируется блокировкой Redis:
+        если её держит другой воркер, обновление пропускается. При ошибке остается
+        устаревшее значение до истечения hard TTL.
+        """
+        flight_key = self._flight_key(ns, key, field)
+        lock_key = f"lock:{flight_key}"
+        token = f"{self._instance_id}:{uuid.uuid4().hex}"
+        acquired = await self._acquire_lock(lock_key, token, lock_timeout)
+        if acquired is False:
+            self._swr_stats["refresh_skipped"] += 1
+            logger.debug(f"Фоновое обновление {flight_key} уже выполняет другой воркер.")
+            self._refresh_tasks.pop(flight_key, None)
+            return
+
+        try:
+            logger.info(f"Фоновое обновление устаревшего значения {flight_key}...")
+            value = await producer()
+            if value is not None:
+                await self._write_entry(ns, key, field, value, ttl)
+                await self.mark_fresh(ns, key, soft_ttl, field)
+            self._swr_stats["background_refreshes"] += 1
+            logger.info(f"Фоновое обновление {flight_key} завершено.")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._swr_stats["refresh_errors"] += 1
+            logger.error(f"Ошибка фонового обновления {flight_key}: {e}. Остается устаревшее значение.", exc_info=True)
+        finally:
+            if acquired:
+                await self._release_lock(lock_key, token)
+            self._refresh_tasks.pop(flight_key, None)
+
+    async def _cancel_refresh_tasks(self) -> None:
+        """Отмена незавершенных фоновых обновлений (при остановке приложения)"""
+        tasks = [task for task in self._refresh_tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._refresh_tasks.clear()
+
+    async def _compute_once(
+        self,
+        ns: str,
+        key: Union[str, date],
+        field: Optional[str],
+        producer: Callable[[], Awaitable[Any]],
+        ttl: Optional[int],
+        soft_ttl: Optional[int],
+        force_refresh: bool,
+        lock_timeout: float,
+        wait_timeout: float,
+        negative_ttls: Optional[Dict[Type[BaseException], int]] = None
+    ) -> Any:
+        """
+        Вычисление значения ровно одним воркером: берем блокировку Redis и вычисляем,
+        либо ждем, пока значение запишет воркер, держащий блокировку.
+        """
+        lock_key = f"lock:{self._flight_key(ns, key, field)}"
+        token = f"{self._instance_id}:{uuid.uuid4().hex}"
+        deadline = time.monotonic() + wait_timeout
+        waited = False
+
+        while True:
+            acquired = await self._acquire_lock(lock_key, token, lock_timeout)
+            if acquired is not False:
+                break
+
+            # Блокировку держит другой воркер - ждем его результат
+            waited = True
+            await asyncio.sleep(config.CACHE_LOCK_POLL_INTERVAL_SECONDS)
+            # При принудительном обновлении в кэше лежит старое значение - ждем снятия блокировки
+            still_locked = force_refresh and await self._is_locked(lock_key)
+            value = None if still_locked else await self._read_entry(ns, key, field)
+            if value is not None:
+                self._single_flight_stats["remote_waits"] += 1
+                return value
+            if time.monotonic() >= deadline:
+                self._single_flight_stats["lock_timeouts"] += 1
+                logger.warning(f"Не дождались вычисления {lock_key} другим воркером за {wait_timeout} сек. Вычисляю сами.")
+                acquired = None
+                break
+
+        try:
+            if (waited or acquired) and not force_refresh:
+                # Значение могло появиться, пока мы брали блокировку
+                value = await self._read_entry(ns, key, field)
+                if value is not None:
+                    return value
+                # ...или другой воркер запомнил ошибку вычисления
+                if waited and negative_ttls:
+                    cached_error = await self._read_negative(ns, self._flight_key(ns, key, field), negative_ttls)
+                    if cached_error is not None:
+                        raise cached_error
+
+            self._single_flight_stats["computed"] += 1
+            try:
+                value = await producer()
+            except Exception as e:
+                negative_ttl = self._match_negative_ttl(e, negative_ttls) if negative_ttls else None
+                if negative_ttl:
+                    await self._store_negative(self._flight_key(ns, key, field), e, negative_ttl)
+                raise
+            if value is not None:
+                await self._write_entry(ns, key, field, value, ttl)
+                if soft_ttl:
+                    await self.mark_fresh(ns, key, soft_ttl, field)
+            return value
+        finally:
+            if acquired:
+                await self._release_lock(lock_key, token)
+
+    @staticmethod
+    def _match_negative_ttl(error: BaseException, negative_ttls: Dict[Type[BaseException], int]) -> Optional[int]:
+        """TTL негативного кэша для ошибки: берется самый близкий по иерархии классов тип"""
+        for error_type in type(error).__mro__:
+            if error_type in negative_ttls:
+                return negative_ttls[error_type]
+        return None
+
+    @staticmethod
+    def _exception_type_name(error_type: type) -> str:
+        """Полное имя класса ошибки (модуль и имя класса)"""
+        return f"{error_type.__module__}.{error_type.__qualname__}"
+
+    def _resolve_exception_type(
+        self,
+        type_name: str,
+        negative_ttls: Dict[Type[BaseException], int]
+    ) -> Optional[Type[BaseException]]:
+        """Поиск класса сохраненной ошибки среди зарегистрированных типов и их подклассов"""
+        pending = list(negative_ttls)
+        seen: Set[type] = set()
+        while pending:
+            error_type = pending.pop()
+            if error_type in seen:
+                continue
+            seen.add(error_type)
+            if self._exception_type_name(error_type) == type_name:
+                return error_type
+            pending.extend(error_type.__subclasses__())
+        return None
+
+    @staticmethod
+    def _plain_attributes(error: BaseException) -> Dict[str, Any]:
+        """Атрибуты ошибки простых типов, которые можно сохранить в кэше"""
+        return {
+            name: value
+            for name, value in vars(error).items()
+            if isinstance(value, (str, int, float, bool, type(None), list, dict))
+        }
+
+    async def _read_negative(
+        self,
+        ns: str,
+        flight_key: str,
+        negative_ttls: Dict[Type[BaseException], int]
+    ) -> Optional[BaseException]:
+        """
+        Чтение запомненной ошибки вычисления. Не учитывается в счетчиках
+        попаданий/промахов уровней кэша.
+
+        :return: Восстановленное исключение или None.
+        """
+        negative_key = self.make_key(self.NS_NEGATIVE, flight_key)
+        entry = self._l1.get(negative_key) if self._l1 is not None else None
+        if entry is None:
+            if self.is_available and self.redis is not None:
+                try:
+                    raw_entry = await self.redis.get(negative_key)
+                    entry = self._codec.decode(raw_entry) if raw_entry is not None else None
+                except (aioredis.exceptions.RedisError,) + REDIS_FAILURE_ERRORS + DECODE_ERRORS as e:
+                    logger.warning(f"Не удалось прочитать негативный кэш {negative_key}: {e}")
+                    return None
+            else:
+                entry = self._fallback.get(negative_key)
+        if not isinstance(entry, dict):
+            return None
+
+        error_type = self._resolve_exception_type(entry.get("type", ""), negative_ttls)
+        if error_type is None:
+            return None
+        # Исключение восстанавливается без вызова __init__, т.к. его сигнатура у разных классов своя
+        error = error_type.__new__(error_type, *entry.get("args", []))
+        error.args = tuple(entry.get("args", []))
+        error.__dict__.update(entry.get("attrs", {}))
+
+        self._negative_stats["hits"] += 1
+        saved_by_ns = self._negative_stats["saved_calls_by_namespace"]
+        saved_by_ns[ns] = saved_by_ns.get(ns, 0) + 1
+        logger.info(f"Негативный кэш HIT для {flight_key}: {entry.get('type')}. Обращение к внешнему сервису пропущено.")
+        return error
+
+    async def _store_negative(self, flight_key: str, error: BaseException, ttl: int) -> None:
+        """Запоминание ошибки вычисления в негативном кэше на ttl секунд"""
+        entry = {
+            "type": self._exception_type_name(type(error)),
+            "args": [arg if isinstance(arg, (str, int, float, bool, type(None))) else str(arg) for arg in error.args],
+            "attrs": self._plain_attributes(error)
+        }
+        await self.set(self.NS_NEGATIVE, flight_key, entry, ttl)
+        self._negative_stats["stored"] += 1
+        logger.info(f"Ошибка вычисления {flight_key} ({entry['type']}) запомнена в негативном кэше на {ttl} сек.")
+
+    async def get_or_compute(
+        self,
+        ns: str,
+        key: Union[str, date],
+        producer: Callable[[], Awaitable[Any]],
+        ttl: Optional[int] = None,
+        field: Optional[str] = None,
+        soft_ttl: Optional[int] = None,
+        force_refresh: bool = False,
+        lock_timeout: Optional[float] = None,
+        wait_timeout: Optional[float] = None,
+        negative_ttls: Optional[Dict[Type[BaseException], int]] = None
+    ) -> Any:
+        """
+        Получение значения из кэша, а при промахе - вычисление через producer ровно один раз.
+
+        Одновременные промахи в одном процессе ждут общую задачу вычисления, а между
+        воркерами вычисление защищено короткой блокировкой Redis: остальные воркеры ждут,
+        пока значение появится в кэше. Задача принадлежит всем ожидающим, а не первому
+        вызывающему: отмена любого из них только прекращает его ожидание, а вычисление
+        отменяется, когда не осталось ни одного ожидающего. Если блокировку держат дольше wait_timeout
+        (например, воркер упал), значение вычисляется без нее. Ошибки producer
+        передаются всем ожидающим; None не кэшируется.
+
+        Если задан soft_ttl, значение старше soft_ttl (но моложе hard TTL - времени
+        жизни ключа в Redis) возвращается сразу, а обновление запускается в фоне,
+        не более одного на ключ.
+
+        Если задан negative_ttls, ошибки producer указанных типов запоминаются
+        в негативном кэше на соответствующий TTL: до его истечения повторные
+        промахи сразу получают ту же ошибку, не обращаясь к внешнему сервису.
+
+        :param ns: Пространство имен ключа.
+        :param key: Ключ внутри пространства (строка или дата).
+        :param producer: Асинхронная функция без аргументов, вычисляющая значение.
+        :param ttl: Hard TTL значения в секундах (по умолчанию TTL пространства имен).
+        :param field: Поле записи дня (например, `openrouter_responses.free`).
+        :param soft_ttl: Срок свежести в секундах, после которого значение обновляется в фоне.
+        :param force_refresh: Вычислить значение заново, не читая кэш.
+        :param lock_timeout: Время жизни блокировки Redis в секундах.
+        :param wait_timeout: Сколько ждать вычисления другим воркером, в секундах.
+        :param negative_ttls: TTL негативного кэша в секундах по типам ошибок producer.
+        :return: Значение из кэша или результат producer.
+        """
+        flight_key = self._flight_key(ns, key, field)
+        if lock_timeout is None:
+            lock_timeout = config.CACHE_LOCK_TIMEOUT_SECONDS
+
+        if not force_refresh:
+            value = await self._read_entry(ns, key, field)
+            if value is not None:
+                if soft_ttl and not await self._is_fresh(flight_key):
+                    self._swr_stats["stale_hits"] += 1
+                    logger.info(f"Значение {flight_key} устарело (soft TTL {soft_ttl} сек.), отдаю его и обновляю в фоне.")
+                    self._schedule_refresh(ns, key, field, producer, ttl, soft_ttl, lock_timeout)
+                return value
+
+            if negative_ttls:
+                cached_error = await self._read_negative(ns, flight_key, negative_ttls)
+                if cached_error is not None:
+                    raise cached_error
+
+        flight = self._inflight.get(flight_key)
+        joined = flight is not None
+        if joined:
+            self._single_flight_stats["coalesced"] += 1
+            logger.info(f"Ожидаю вычисление {flight_key}, уже запущенное в этом процессе.")
+        else:
+            flight = _ComputeFlight(asyncio.create_task(self._run_compute_flight(
+                flight_key,
+                self._compute_once(
+                    ns,
+                    key,
+                    field,
+                    producer,
+                    ttl,
+                    soft_ttl,
+                    force_refresh,
+                    lock_timeout,
+                    wait_timeout if wait_timeout is not None else config.CACHE_LOCK_WAIT_TIMEOUT_SECONDS,
+                    negative_ttls
+                )
+            )))
+            self._inflight[flight_key] = flight
+
+        flight.waiters += 1
+        try:
+            # shield: отмена ожидающего, в том числе первого, не отменяет общее вычисление
+            value = await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Новые промахи не должны присоединиться к отменяемой задаче
+                self._forget_compute_flight(flight_key, flight.task)
+                flight.task.cancel()
+        return copy.deepcopy(value) if joined else value
+
+    async def _run_compute_flight(self, flight_key: str, computation: Awaitable[Any]) -> Any:
+        """Выполнение общего вычисления; запись о нем снимается до того, как ожидающие получат результат"""
+        try:
+            return await computation
+        finally:
+            self._forget_compute_flight(flight_key, asyncio.current_task())
+
+    def _forget_compute_flight(self, flight_key: str, task: Optional["asyncio.Task[Any]"]) -> None:
+        """Снятие записи об общем вычислении, если она относится к этой задаче"""
+        flight = self._inflight.get(flight_key)
+        if flight is not None and flight.task is task:
+            del self._inflight[flight_key]
+
+    async def _scan_keys(self, pattern: str) -> List[str]:
+        """Все ключи Redis по шаблону (через SCAN, без блокировки сервера)"""
+        keys = []
+        async for raw_key in self.redis.scan_iter(match=pattern, count=500):
+            keys.append(raw_key.decode("utf-8") if isinstance(raw_key, bytes) else str(raw_key))
+        return keys
+
+    async def dump_snapshot(self, path: str, namespaces: List[str]) -> int:
+        """
+        Сохранение ключей выбранных пространств имен (вместе с маркерами свежести)
+        в локальный файл снимка. Значения сохраняются в закодированном виде вместе
+        с оставшимся временем жизни; файл заменяется атомарно.
+
+        :param path: Путь к файлу снимка.
+        :param namespaces: Пространства имен для сохранения.
+        :return: Количество сохраненных ключей.
+        """
+        if not await self._ensure_connected("SNAPSHOT"):
+            logger.warning("Снимок кэша не сохранен: Redis недоступен.")
+            return 0
+
+        started = time.monotonic()
+        try:
+            keys: List[str] = []
+            for ns in namespaces:
+                keys.extend(await self._scan_keys(f"{ns}:*"))
+                keys.extend(await self._scan_keys(self._fresh_marker_key(f"{ns}:*")))
+            if not keys:
+                logger.info(f"Снимок кэша не сохранен: нет ключей в пространствах {', '.join(namespaces)}.")
+                return 0
+
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.type(key)
+                    pipe.pttl(key)
+                meta = await pipe.execute(raise_on_error=False)
+
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for index, key in enumerate(keys):
+                    key_type = meta[index * 2]
+                    if key_type in (b"hash", "hash"):
+                        pipe.hgetall(key)
+                    else:
+                        pipe.get(key)
+                values = await pipe.execute(raise_on_error=False)
+            self._breaker.record_success()
+        except REDIS_FAILURE_ERRORS as e:
+            self._record_redis_failure("SNAPSHOT", ",".join(namespaces), e)
+            return 0
+        except Exception as e:
+            logger.error(f"Ошибка чтения ключей для снимка кэша: {e}", exc_info=True)
+            return 0
+
+        entries = []
+        for index, (key, value) in enumerate(zip(keys, values)):
+            ttl_ms = meta[index * 2 + 1]
+            if value is None or isinstance(value, Exception) or isinstance(ttl_ms, Exception) or ttl_ms == -2:
+                continue
+            if isinstance(value, dict):
+                fields = {
+                    name.decode("utf-8") if isinstance(name, bytes) else str(name): raw
+                    for name, raw in value.items()
+                }
+                entries.append((key, "hash", fields, ttl_ms))
+            else:
+                entries.append((key, "string", value, ttl_ms))
+
+        snapshot = {
+            "version": SNAPSHOT_FORMAT_VERSION,
+            "created_at": time.time(),
+            "entries": entries
+        }
+        try:
+            await asyncio.to_thread(self._write_snapshot_file, path, self._codec.encode(snapshot))
+        except OSError as e:
+            logger.error(f"Не удалось записать снимок кэша в {path}: {e}", exc_info=True)
+            return 0
+
+        logger.info(f"Снимок кэша сохранен в {path}: {len(entries)} ключей за {time.monotonic() - started:.3f} сек.")
+        return len(entries)
+
+    def _write_snapshot_file(self, path: str, data: bytes) -> None:
+        """Атомарная запись файла снимка (через временный файл и os.replace)"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{self._instance_id}.tmp"
+        with open(tmp_path, "wb") as snapshot_file:
+            snapshot_file.write(data)
+        os.replace(tmp_path, path)
+
+    async def load_snapshot(self, path: str) -> int:
+        """
+        Загрузка ключей из файла снимка. Ключи, срок жизни которых истек с момента
+        сохранения, и ключи, уже существующие в Redis, пропускаются. Если Redis
+        недоступен, значения загружаются в резервное хранилище в памяти.
+
+        :param path: Путь к файлу снимка.
+        :return: Количество восстановленных ключей.
+        """
+        started = time.monotonic()
+        try:
+            data = await asyncio.to_thread(self._read_snapshot_file, path)
+        except FileNotFoundError:
+            logger.info(f"Снимок кэша {path} не найден, загрузка пропущена.")
+            return 0
+        except OSError as e:
+            logger.error(f"Не удалось прочитать снимок кэша {path}: {e}", exc_info=True)
+            return 0
+
+        try:
+            snapshot = self._codec.decode(data)
+        except DECODE_ERRORS as e:
+            logger.error(f"Снимок кэша {path} поврежден: {e}. Загрузка пропущена.")
+            return 0
+        if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_FORMAT_VERSION:
+            logger.warning(f"Неподдерживаемый формат снимка кэша {path}. Загрузка пропущена.")
+            return 0
+
+        elapsed_ms = int((time.time() - snapshot.get("created_at", 0)) * 1000)
+        entries = []
+        for key, key_type, value, ttl_ms in snapshot.get("entries", []):
+            if ttl_ms is not None and ttl_ms >= 0:
+                ttl_ms -= elapsed_ms
+                if ttl_ms <= 0:
+                    continue
+            else:
+                ttl_ms = None
+            entries.append((key, key_type, value, ttl_ms))
+        if not entries:
+            logger.info(f"В снимке кэша {path} нет актуальных ключей.")
+            return 0
+
+        if await self._ensure_connected("RESTORE"):
+            restored = await self._restore_to_redis(entries)
+        else:
+            restored = self._restore_to_fallback(entries)
+
+        logger.info(
+            f"Загружен снимок кэша {path}: восстановлено {restored} из {len(entries)} ключей "
+            f"за {time.monotonic() - started:.3f} сек."
+        )
+        return restored
+
+    @staticmethod
+    def _read_snapshot_file(path: str) -> bytes:
+        """Чтение файла снимка целиком"""
+        with open(path, "rb") as snapshot_file:
+            return snapshot_file.read()
+
+    async def _restore_to_redis(self, entries: List[Tuple[str, str, Any, Optional[int]]]) -> int:
+        """Запись ключей снимка в Redis; уже существующие ключи не перезаписываются"""
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, _, _, _ in entries:
+                    pipe.exists(key)
+                existing = await pipe.execute(raise_on_error=False)
+
+            restored = 0
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for (key, key_type, value, ttl_ms), exists in zip(entries, existing):
+                    if exists:
+                        continue
+                    if key_type == "hash":
+                        pipe.hset(key, mapping=value)
+                        if ttl_ms:
+                            pipe.pexpire(key, ttl_ms)
+                    else:
+                        pipe.set(key, value, px=ttl_ms)
+                    restored += 1
+                if restored:
+                    await pipe.execute(raise_on_error=False)
+            self._breaker.record_success()
+            return restored
+        except REDIS_FAILURE_ERRORS as e:
+            self._record_redis_failure("RESTORE", "snapshot", e)
+            return self._restore_to_fallback(entries)
+        except Exception as e:
+            logger.error(f"Ошибка восстановления снимка кэша в Redis: {e}", exc_info=True)
+            return 0
+
+    def _restore_to_fallback(self, entries: List[Tuple[str, str, Any, Optional[int]]]) -> int:
+        """Загрузка ключей снимка в резервное хранилище (Redis недоступен)"""
+        restored = 0
+        for key, key_type, value, ttl_ms in entries:
+            if key.startswith(self._fresh_marker_key("")):
+                # Без Redis значения и так считаются свежими
+                continue
+            try:
+                if key_type == "hash":
+                    decoded = self._assemble_from_fields(key, value)
+                    size = sum(len(raw) for raw in value.values())
+                else:
+                    decoded = self._codec.decode(value)
+                    size = len(value)
+            except DECODE_ERRORS as e:
+                logger.warning(f"Ключ {key} из снимка не удалось декодировать: {e}. Пропускаю.")
+                continue
+            if decoded is None:
+                continue
+            ttl = max(1, ttl_ms // 1000) if ttl_ms else self._ttl_seconds
+            self._fallback.set(key, decoded, size, ttl)
+            restored += 1
+        return restored
+
+    async def _merge_with_existing_blob(self, key: str, data: Dict) -> Dict:
+        """
+        Слияние новых данных с уже сохраненными в строковом формате (режим blob).
+        Сохраняет AI-ответы, которых нет в новых данных.
+        """
+        # Перед сохранением новых данных, попробуем получить текущие из Redis
+        # Это нужно для реализации логики слияния данных (парсинг + AI-ответы)
+        existing_data_bytes = await self.redis.get(key)
+        existing_data = None
+        if existing_data_bytes:
+            try:
+                 existing_data = self._codec.decode(existing_data_bytes)
+                 # Проверяем, что существующие данные - это словарь, иначе игнорируем их
+                 if not isinstance(existing_data, dict):
+                     logger.warning(f"Существующие данные для ключа {key} не являются словарем. Игнорирую их.")
+                     existing_data = None
+            except DECODE_ERRORS as e:
+                 logger.warning(f"Ошибка десериализации существующих данных для ключа {key} при SET: {e}. Игнорирую их.", exc_info=True)
+                 existing_data = None # Игнорируем поврежденные данные
+
+        return self._merge_data(existing_data, data)
+
+    @staticmethod
+    def _merge_data(existing_data: Optional[Any], data: Any) -> Any:
+        """
+        Слияние новых данных дня с сохраненными: AI-ответы, которых нет в новых
+        данных, сохраняются, остальные поля обновляются.
+        """
+        data_to_save = data # Начинаем с данных, которые переданы в SET
+
+        # Если существующие данные есть И это словари, объединяем их:
+        # сохраняем ВСЕ AI-ответы, которые уже есть в кеше, если их нет в текущих data_to_save,
+        # а остальные поля обновляем свежими данными.
+        if existing_data and isinstance(existing_data, dict) and isinstance(data_to_save, dict):
+            merged_data = existing_data
+
+            # Если в новых данных есть openrouter_responses, сливаем их с существующими
+            if 'openrouter_responses' in data_to_save and isinstance(data_to_save['openrouter_responses'], dict):
+                 if 'openrouter_responses' not in merged_data or not isinstance(merged_data['openrouter_responses'], dict):
+                    merged_data['openrouter_responses'] = {}
+
+                 # Объединяем ответы для разных типов пользователей
+                 merged_data['openrouter_responses'].update(data_to_save['openrouter_responses'])
+
+                 # Остальные поля из data_to_save будут просто обновлены
+                 data_without_ai_responses = {k: v for k, v in data_to_save.items() if k != 'openrouter_responses'}
+            else:
+                 data_without_ai_responses = data_to_save
+
+            # Обновляем остальные поля в merged_data из data_to_save
+            merged_data.update(data_without_ai_responses)
+
+            data_to_save = merged_data # Теперь сохраняем объединенные данные
+
+        return data_to_save
+
     # Метод clear_expired теперь может быть упрощен или удален,
     # так как Redis автоматически удаляет ключи по TTL.
     # Если вам нужна функция очистки для других целей (например, ручного сброса),
@@ -0,0 +1,148 @@
+"""
+Автоматический выключатель (circuit breaker) для внешних зависимостей
+"""
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+import logging
+import time
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель с тремя состояниями:
+
+    - closed: запросы идут к зависимости, подряд идущие ошибки подсчитываются;
+    - open: после failure_threshold ошибок подряд запросы к зависимости не выполняются;
+    - half_open: фоновая проверка (probe) пробует зависимость; при успехе выключатель
+      закрывается, при ошибке снова открывается.
+
+    Сам выключатель не делает проверок: переходы в half_open и обратно выполняет
+    владелец (например, фоновая задача проверки здоровья).
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 3, recovery_timeout: float = 5.0):
+        """
+        :param name: Имя зависимости (для логов и метрик).
+        :param failure_threshold: Количество ошибок подряд, после которого выключатель открывается.
+        :param recovery_timeout: Интервал между проверками восстановления в открытом состоянии, в секундах.
+        """
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_timeout = recovery_timeout
+
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._last_transition_at: Optional[datetime] = None
+        self._listeners: List[Callable[[str, str], None]] = []
+
+        # Метрики
+        self._transitions: Dict[str, int] = {}
+        self._failures = 0
+        self._short_circuited = 0
+        self._total_open_seconds = 0.0
+
+    @property
+    def state(self) -> str:
+        """Текущее состояние выключателя"""
+        return self._state
+
+    @property
+    def is_closed(self) -> bool:
+        return self._state == self.CLOSED
+
+    def add_listener(self, listener: Callable[[str, str], None]) -> None:
+        """
+        Подписка на смену состояния. Слушатель вызывается синхронно
+        с аргументами (старое состояние, новое состояние).
+        """
+        self._listeners.append(listener)
+
+    def allow_request(self) -> bool:
+        """
+        Можно ли выполнять обычный запрос к зависимости.
+        Отклоненные запросы учитываются в метрике short_circuited.
+        """
+        if self._state == self.CLOSED:
+            return True
+        self._short_circuited += 1
+        return False
+
+    def record_success(self) -> None:
+        """Учет успешного обращения к зависимости"""
+        self._consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        """Учет ошибки обращения к зависимости; при достижении порога выключатель открывается"""
+        self._failures += 1
+        self._consecutive_failures += 1
+        if self._state == self.CLOSED and self._consecutive_failures >= self.failure_threshold:
+            self._transition(self.OPEN)
+
+    def trip(self) -> None:
+        """Принудительное открытие выключателя (например, если не удалось подключиться)"""
+        self._failures += 1
+        if self._state != self.OPEN:
+            self._transition(self.OPEN)
+
+    def half_open(self) -> None:
+        """Переход в half_open перед пробным обращением"""
+        if self._state == self.OPEN:
+            self._transition(self.HALF_OPEN)
+
+    def reset(self) -> None:
+        """Закрытие выключателя после успешной проверки"""
+        self._consecutive_failures = 0
+        if self._state != self.CLOSED:
+            self._transition(self.CLOSED)
+
+    def _transition(self, new_state: str) -> None:
+        old_state = self._state
+        now = time.monotonic()
+        if old_state != self.CLOSED and new_state == self.CLOSED and self._opened_at is not None:
+            self._total_open_seconds += now - self._opened_at
+            self._opened_at = None
+        if old_state == self.CLOSED and new_state != self.CLOSED:
+            self._opened_at = now
+
+        self._state = new_state
+        self._last_transition_at = datetime.now()
+        transition = f"{old_state}->{new_state}"
+        self._transitions[transition] = self._transitions.get(transition, 0) + 1
+
+        log = logger.info if new_state != self.OPEN else logger.error
+        log(f"Circuit breaker '{self.name}': {old_state} -> {new_state}")
+
+        for listener in self._listeners:
+            try:
+                listener(old_state, new_state)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика смены состояния circuit breaker '{self.name}': {e}", exc_info=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Метрики выключателя: текущее состояние, количество переходов между состояниями,
+        ошибки, отклоненные запросы и суммарное время в открытом состоянии.
+        """
+        open_seconds = self._total_open_seconds
+        if self._opened_at is not None:
+            open_seconds += time.monotonic() - self._opened_at
+        return {
+            "name": self.name,
+            "state": self._state,
+            "consecutive_failures": self._consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "recovery_timeout": self.recovery_timeout,
+            "failures": self._failures,
+            "short_circuited": self._short_circuited,
+            "transitions": dict(self._transitions),
+            "last_transition_at": self._last_transition_at.isoformat() if self._last_transition_at else None,
+            "open_seconds_total": round(open_seconds, 3)
+        }
@@ -13,18 +13,40 @@ class NetworkException(ParserException):
     """Исключение для сетевых ошибок"""
     pass
 
+class DeadlineExceededException(NetworkException):
+    """Исключение для исчерпанного бюджета времени запроса (все попытки не уложились в срок)"""
+    pass
+
 class ParseException(ParserException):
     """Исключение для ошибок парсинга"""
     pass
 
+class ParseQueueFullException(ParserException):
+    """Исключение для переполненной очереди пула разбора страниц"""
+    pass
+
 class CacheException(Exception):
     """Исключение для ошибок кэша"""
     def __init__(self, message: str):
         self.message = message
         super().__init__(self.message)
 
+class CacheDecodeError(CacheException):
+    """Исключение для некорректных или нечитаемых данных в кэше"""
+    pass
+
 def parser_exception_handler(exc: ParserException):
     """Обработчик исключений парсера"""
+    if isinstance(exc, DeadlineExceededException):
+        return HTTPException(
+            status_code=504,
+            detail=f"Превышено время ожидания: {exc.message}"
+        )
+    if isinstance(exc, ParseQueueFullException):
+        return HTTPException(
+            status_code=503,
+            detail=f"Сервис перегружен: {exc.message}"
+        )
     if isinstance(exc, NetworkException):
         return HTTPException(
             status_code=503,
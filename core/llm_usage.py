@@ -0,0 +1,169 @@
+"""
+Учет токенов и задержек запросов к LLM по вызывающему коду и моделям
+"""
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import logging
+import time
+
+import config
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class UsageRecord:
+    """Один запрос к LLM (все попытки одной модели)"""
+
+    __slots__ = ("at", "prompt_tokens", "completion_tokens", "latency", "total_seconds", "attempts", "success", "error")
+
+    def __init__(
+        self,
+        prompt_tokens: Optional[int],
+        completion_tokens: Optional[int],
+        latency: Optional[float],
+        total_seconds: float,
+        attempts: int,
+        success: bool,
+        error: Optional[str]
+    ):
+        self.at = time.monotonic()
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.latency = latency
+        self.total_seconds = total_seconds
+        self.attempts = attempts
+        self.success = success
+        self.error = error
+
+
+def _percentile(values: List[float], percentile: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(percentile * len(ordered))) - 1))]
+
+
+class LLMUsageTracker:
+    """
+    Скользящие агрегаты запросов к LLM по парам (вызывающий код, модель): токены
+    промпта и ответа, задержка ответа API, общее время с повторами, число повторов
+    и ошибки. Хранятся записи за последние window_seconds секунд (не больше
+    max_records на пару).
+    """
+
+    def __init__(self, window_seconds: int = 3600, max_records: int = 2000):
+        """
+        :param window_seconds: Окно агрегирования в секундах.
+        :param max_records: Максимум записей на пару (вызывающий код, модель).
+        """
+        self.window_seconds = window_seconds
+        self.max_records = max_records
+        self._records: Dict[Tuple[str, str], Deque[UsageRecord]] = {}
+
+    def record(
+        self,
+        caller: str,
+        model: str,
+        usage: Optional[Dict[str, Any]],
+        latency: Optional[float],
+        total_seconds: float,
+        attempts: int,
+        error: Optional[str] = None
+    ) -> None:
+        """
+        Учет запроса к LLM
+
+        :param caller: Вызывающий код (например, moon, moon_background, tarot, crypto)
+        :param model: Модель, фактически ответившая на запрос (или запрошенная, если ответа нет)
+        :param usage: Поле usage ответа OpenRouter (может отсутствовать)
+        :param latency: Задержка успешной попытки в секундах
+        :param total_seconds: Общее время со всеми повторами и паузами
+        :param attempts: Количество выполненных попыток
+        :param error: Тип ошибки, если запрос не удался
+        """
+        usage = usage or {}
+        records = self._records.get((caller, model))
+        if records is None:
+            records = self._records[(caller, model)] = deque(maxlen=self.max_records)
+        records.append(UsageRecord(
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+            latency=latency,
+            total_seconds=total_seconds,
+            attempts=attempts,
+            success=error is None,
+            error=error
+        ))
+        self._prune(records)
+
+    def _prune(self, records: Deque[UsageRecord]) -> None:
+        """Удаление записей старше окна"""
+        threshold = time.monotonic() - self.window_seconds
+        while records and records[0].at < threshold:
+            records.popleft()
+
+    @staticmethod
+    def _aggregate(records: List[UsageRecord]) -> Dict[str, Any]:
+        """Агрегаты по списку записей"""
+        prompt_tokens = [r.prompt_tokens for r in records if r.prompt_tokens is not None]
+        completion_tokens = [r.completion_tokens for r in records if r.completion_tokens is not None]
+        latencies = [r.latency for r in records if r.latency is not None]
+        errors: Dict[str, int] = {}
+        for r in records:
+            if r.error:
+                errors[r.error] = errors.get(r.error, 0) + 1
+        return {
+            "requests": len(records),
+            "failures": sum(1 for r in records if not r.success),
+            "retries": sum(max(0, r.attempts - 1) for r in records),
+            "prompt_tokens": sum(prompt_tokens),
+            "completion_tokens": sum(completion_tokens),
+            "avg_prompt_tokens": round(sum(prompt_tokens) / len(prompt_tokens)) if prompt_tokens else None,
+            "max_prompt_tokens": max(prompt_tokens) if prompt_tokens else None,
+            "avg_completion_tokens": round(sum(completion_tokens) / len(completion_tokens)) if completion_tokens else None,
+            "latency_p50": round(_percentile(latencies, 0.5), 3) if latencies else None,
+            "latency_p95": round(_percentile(latencies, 0.95), 3) if latencies else None,
+            "latency_max": round(max(latencies), 3) if latencies else None,
+            "upstream_seconds": round(sum(r.total_seconds for r in records), 3),
+            "errors": errors
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Агрегаты за окно: по вызывающему коду (итог и разбивка по моделям) и по моделям
+        (итог по всем вызывающим). upstream_seconds - суммарное время ожидания LLM,
+        по нему видно, какой эндпоинт расходует больше всего времени.
+        """
+        by_caller: Dict[str, Dict[str, List[UsageRecord]]] = {}
+        by_model: Dict[str, List[UsageRecord]] = {}
+        for (caller, model), records in self._records.items():
+            self._prune(records)
+            if not records:
+                continue
+            by_caller.setdefault(caller, {})[model] = list(records)
+            by_model.setdefault(model, []).extend(records)
+
+        callers = {}
+        for caller, models in by_caller.items():
+            all_records = [r for records in models.values() for r in records]
+            callers[caller] = {
+                **self._aggregate(all_records),
+                "models": {model: self._aggregate(records) for model, records in models.items()}
+            }
+        return {
+            "window_seconds": self.window_seconds,
+            "callers": callers,
+            "models": {model: self._aggregate(records) for model, records in by_model.items()}
+        }
+
+
+_usage_tracker: Optional[LLMUsageTracker] = None
+
+
+def get_usage_tracker() -> LLMUsageTracker:
+    """Учет запросов к LLM, общий для всех клиентов процесса"""
+    global _usage_tracker
+    if _usage_tracker is None:
+        _usage_tracker = LLMUsageTracker(window_seconds=config.OPENROUTER_USAGE_WINDOW_SECONDS)
+    return _usage_tracker
@@ -2,17 +2,58 @@
 Клиент для работы с OpenRouter API
 """
 import logging
+import hashlib
 import json
-from typing import Dict, List, Any, Optional, Union
+import random
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Any, Optional, Set, Union
 import asyncio
 
 import aiohttp
 from fastapi import HTTPException
 
-from core.exceptions import NetworkException
+from core.exceptions import DeadlineExceededException, NetworkException
+from core.cache import CacheManager
+from core.openrouter_router import OpenRouterRouter
+from core.llm_usage import get_usage_tracker
+from core.rate_limiter import LLMRateLimiter
+import config
 
 logger = logging.getLogger(__name__)
 
+# Метка вызывающего кода в учете токенов, если она не передана
+DEFAULT_CALLER = "other"
+
+_shared_rate_limiter: Optional[LLMRateLimiter] = None
+
+
+class _Flight:
+    """Выполняемый запрос к LLM, общий для одинаковых одновременных вызовов"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[str]"):
+        self.task = task
+        self.waiters = 0
+
+
+def get_shared_rate_limiter() -> LLMRateLimiter:
+    """Ограничитель запросов к OpenRouter, общий для всех клиентов процесса"""
+    global _shared_rate_limiter
+    if _shared_rate_limiter is None:
+        _shared_rate_limiter = LLMRateLimiter(
+            max_concurrent=config.OPENROUTER_MAX_CONCURRENT_REQUESTS,
+            model_rate=config.OPENROUTER_MODEL_RATE_PER_SECOND,
+            model_burst=config.OPENROUTER_MODEL_BURST,
+            key_rate=config.OPENROUTER_KEY_RATE_PER_SECOND,
+            key_burst=config.OPENROUTER_KEY_BURST
+        )
+    return _shared_rate_limiter
+
+
 class OpenRouterClient:
     """
     Клиент для работы с OpenRouter API с механизмом ротации ключей и моделей
@@ -44,8 +85,34 @@ class OpenRouterClient:
         self.model_configs = model_configs or {}
         self.model_api_keys = model_api_keys or {}
         
-        self.current_key_index = 0
-        self.current_model_index = 0
+        # Выбор пары (модель, ключ) для каждого запроса по задержке и ошибкам
+        self.router = OpenRouterRouter(
+            alpha=config.OPENROUTER_ROUTER_EWMA_ALPHA,
+            error_penalty=config.OPENROUTER_ROUTER_ERROR_PENALTY
+        )
+        # Общий семафор и ведра токенов на модель и ключ
+        self.rate_limiter = get_shared_rate_limiter()
+        # Общий учет токенов и задержек по вызывающему коду и моделям
+        self.usage_tracker = get_usage_tracker()
+        
+        # Долгоживущая сессия с пулом соединений создается в start() (или при первом запросе)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_lock = asyncio.Lock()
+        
+        # Последние задержки успешных ответов по моделям (для порога хеджирования)
+        self._latencies: Dict[str, Deque[float]] = {}
+        # Статистика хеджирования: общие счетчики и победы по моделям
+        self._hedge_counters = {"calls": 0, "hedges_launched": 0, "primary_wins": 0, "hedge_wins": 0, "fallback_wins": 0, "failures": 0}
+        self._hedge_model_stats: Dict[str, Dict[str, int]] = {}
+        # Кэширование промптов у провайдера по моделям: токены промпта, из них прочитанные
+        # из кэша, и суммарные задержки ответов с попаданием в кэш и без него
+        self._prompt_cache_stats: Dict[str, Dict[str, float]] = {}
+        
+        # Кэш ответов по хэшу запроса подключается в use_response_cache()
+        self._response_cache: Optional[CacheManager] = None
+        self._response_cache_stats = {"requests": 0, "upstream_calls": 0, "coalesced": 0, "bypassed": 0}
+        # Одинаковые запросы, выполняемые сейчас в этом процессе: хэш запроса -> общий запрос
+        self._inflight: Dict[str, _Flight] = {}
         
         if not self.api_keys:
             logger.critical("ALARM! OpenRouterClient получил ПУСТОЙ список api_keys. Клиент не сможет работать!")
@@ -56,25 +123,91 @@ class OpenRouterClient:
         if not self.models:
             logger.warning("OpenRouterClient получил ПУСТОЙ список models. Некоторые функции могут не работать корректно.")
             # Можно не возбуждать ошибку, если клиент может работать без списка моделей по умолчанию,
-            # но это плохая практика для текущей реализации _get_current_model()
+            # но тогда запросы без явной модели выполнить нельзя
         else:
             logger.info(f"OpenRouterClient: Количество моделей по умолчанию: {len(self.models)}, Первая модель: {self.models[0]}")
     
-    def _get_current_key(self) -> str:
-        """Получение текущего API ключа"""
-        return self.api_keys[self.current_key_index]
+    async def start(self) -> None:
+        """
+        Создание общей сессии aiohttp с пулом соединений. Вызывается при старте
+        приложения (lifespan); если не вызван, сессия создается при первом запросе.
+        """
+        await self._get_session()
+    
+    async def close(self) -> None:
+        """Закрытие общей сессии и всех соединений пула"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info(f"Сессия OpenRouterClient закрыта ({self.api_url}).")
+        self._session = None
+    
+    def use_response_cache(self, cache_manager: CacheManager) -> None:
+        """
+        Подключение кэша ответов: generate_text и generate_text_hedged не обращаются
+        к API, если такой же запрос уже выполнялся (см. OPENROUTER_RESPONSE_CACHE_ENABLED)
+        
+        :param cache_manager: Менеджер кэша
+        """
+        self._response_cache = cache_manager
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Общая сессия клиента: соединения переиспользуются между запросами и попытками"""
+        if self._session is not None and not self._session.closed:
+            return self._session
+        async with self._session_lock:
+            if self._session is None or self._session.closed:
+                connector = aiohttp.TCPConnector(
+                    limit=config.OPENROUTER_POOL_LIMIT,
+                    limit_per_host=config.OPENROUTER_POOL_LIMIT_PER_HOST,
+                    keepalive_timeout=config.OPENROUTER_KEEPALIVE_SECONDS,
+                    ttl_dns_cache=config.OPENROUTER_DNS_CACHE_SECONDS,
+                    ssl=None if config.OPENROUTER_SSL_VERIFY else False
+                )
+                self._session = aiohttp.ClientSession(connector=connector)
+                logger.info(
+                    f"Создана сессия OpenRouterClient: пул {config.OPENROUTER_POOL_LIMIT} соединений "
+                    f"({config.OPENROUTER_POOL_LIMIT_PER_HOST} на хост), keep-alive {config.OPENROUTER_KEEPALIVE_SECONDS} сек."
+                )
+        return self._session
+    
+    def _keys_for_model(self, model: str) -> List[str]:
+        """Ключи, с которыми можно запрашивать модель: сначала выделенный ключ модели, затем общие"""
+        dedicated = self.model_api_keys.get(model)
+        if dedicated:
+            return [dedicated] + [key for key in self.api_keys if key != dedicated]
+        return list(self.api_keys)
+    
+    def _rank_models(self, models: Optional[List[str]] = None) -> List[str]:
+        """Модели по убыванию качества лучшей пары (модель, ключ)"""
+        return self.router.rank_models(list(models or self.models), self._keys_for_model)
     
     def _get_current_model(self) -> str:
-        """Получение текущей модели"""
-        return self.models[self.current_model_index]
+        """Лучшая модель для запроса без явно указанной модели"""
+        return self._rank_models()[0]
     
-    def _get_key_for_model(self, model: str) -> str:
-        """Получение API ключа для конкретной модели"""
-        # Если есть соответствие модели и ключа, используем его
-        if model in self.model_api_keys and self.model_api_keys[model]:
-            return self.model_api_keys[model]
-        # Иначе используем текущий ключ
-        return self._get_current_key()
+    def _next_model(self, model: str) -> str:
+        """Лучшая модель, отличная от model (для смены модели после 404/429)"""
+        for candidate in self._rank_models():
+            if candidate != model:
+                return candidate
+        return model
+    
+    def _select_key(self, model: str, tried_keys: Set[str]) -> Optional[str]:
+        """
+        Выбор ключа для попытки запроса к модели. Выделенный ключ модели предпочтительнее
+        общих; ключи, уже испробованные в этом запросе, берутся, только если других нет.
+        
+        :param model: Модель
+        :param tried_keys: Ключи, уже испробованные в этом запросе
+        :return: Ключ или None, если все ключи модели отстранены
+        """
+        dedicated = [self.model_api_keys[model]] if self.model_api_keys.get(model) else []
+        for exclude in (tried_keys, ()):
+            for keys in (dedicated, self.api_keys):
+                key = self.router.choose_key(model, keys, exclude)
+                if key:
+                    return key
+        return None
     
     def _get_model_config(self, model: str) -> Dict[str, Any]:
         """Получение конфигурации для модели"""
@@ -84,20 +217,6 @@ class OpenRouterClient:
         # Иначе возвращаем конфигурацию по умолчанию
         return {"request_type": "standard", "timeout": self.timeout}
     
-    def _rotate_key(self) -> str:
-        """Ротация API ключа"""
-        self.current_key_index = (self.current_key_index + 1) % len(self.api_keys)
-        logger.info(f"Ротация API ключа на индекс {self.current_key_index}")
-        return self._get_current_key()
-    
-    def _rotate_model(self) -> str:
-        """Ротация модели"""
-        self.current_model_index = (self.current_model_index + 1) % len(self.models)
-        logger.info(f"Ротация модели на индекс {self.current_model_index}")
-        # При смене модели сбрасываем индекс ключа на 0
-        self.current_key_index = 0
-        return self._get_current_model()
-    
     def _prepare_headers(self, api_key: str) -> Dict[str, str]:
         """Подготовка заголовков запроса"""
         return {
@@ -107,6 +226,29 @@ class OpenRouterClient:
             "X-Title": "PuzzleBot"  # Добавлено для требований OpenRouter
         }
     
+    def _apply_prompt_cache(self, model: str, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Пометка статического префикса промпта (первого сообщения - системного или
+        инструкции для Gemini) блоком cache_control, чтобы провайдер кэшировал его
+        между запросами. Применяется к моделям с "prompt_cache" в конфигурации.
+        
+        :param model: Модель
+        :param messages: Сообщения запроса
+        :return: Сообщения с подсказкой кэширования (или исходные)
+        """
+        if not config.OPENROUTER_PROMPT_CACHE_ENABLED or not self._get_model_config(model).get("prompt_cache"):
+            return messages
+        if not messages or not isinstance(messages[0].get("content"), str):
+            return messages
+        prefix = messages[0]
+        if len(prefix["content"]) < config.OPENROUTER_PROMPT_CACHE_MIN_CHARS:
+            return messages
+        cached_prefix = {
+            **prefix,
+            "content": [{"type": "text", "text": prefix["content"], "cache_control": {"type": "ephemeral"}}]
+        }
+        return [cached_prefix] + list(messages[1:])
+    
     def _prepare_standard_payload(
         self, 
         model: str, 
@@ -117,9 +259,11 @@ class OpenRouterClient:
         """Подготовка стандартного payload для запроса"""
         return {
             "model": model,
-            "messages": messages,
+            "messages": self._apply_prompt_cache(model, messages),
             "max_tokens": max_tokens,
-            "temperature": temperature
+            "temperature": temperature,
+            # Учет токенов в ответе, в том числе прочитанных из кэша промптов
+            "usage": {"include": True}
         }
     
     def _prepare_openai_payload(
@@ -178,46 +322,340 @@ class OpenRouterClient:
             # Добавляем дополнительные параметры для deepseek
             payload["response_format"] = {"type": "text"}
         
+        # Статический префикс (после преобразования сообщений) помечается для кэширования
+        payload["messages"] = self._apply_prompt_cache(model, payload["messages"])
+        payload["usage"] = {"include": True}
         return payload
     
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """
+        Разбор заголовка Retry-After (секунды или HTTP-дата)
+        
+        :param value: Значение заголовка
+        :return: Пауза в секундах или None, если заголовка нет или он некорректен
+        """
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    
+    def _handle_error_status(self, status: int, model: str, api_key: str, retry_after: Optional[float] = None) -> str:
+        """
+        Учет ответа API с ошибкой в маршрутизаторе: пара (модель, ключ) отстраняется
+        после 401/403 и 429, модель целиком - после 404. Если сервер прислал Retry-After,
+        пара отстраняется ровно на это время, а ведро токенов ключа приостанавливается,
+        чтобы другие запросы с этим ключом не получили тот же 429.
+        
+        :param status: HTTP-статус ответа
+        :param model: Модель, для которой выполнялся запрос
+        :param api_key: Использованный API ключ
+        :param retry_after: Пауза из заголовка Retry-After в секундах (если есть)
+        :return: Модель для следующей попытки (после 404 и 429 бесплатной модели может смениться)
+        """
+        if status in [401, 403]: # Ошибка авторизации
+            logger.warning(f"Ошибка авторизации (401/403) для ключа {api_key[:10]}... (модель {model}). Ключ отстранен.")
+            self.router.bench(model, api_key, config.OPENROUTER_AUTH_COOLDOWN_SECONDS, f"auth_{status}")
+        elif status == 404: # Модель не найдена
+            logger.warning(f"Модель не найдена (404): {model}. Смена модели.")
+            for key in self._keys_for_model(model):
+                self.router.bench(model, key, config.OPENROUTER_NOT_FOUND_COOLDOWN_SECONDS, "not_found")
+            model = self._next_model(model) # Обновляем модель для следующих попыток
+        elif status == 429: # Превышен лимит запросов
+            logger.warning(f"Превышен лимит запросов (429) для ключа {api_key[:10]}... или модели {model}. Retry-After: {retry_after}")
+            cooldown = retry_after if retry_after is not None else config.OPENROUTER_RATE_LIMIT_COOLDOWN_SECONDS
+            self.router.bench(model, api_key, cooldown, "rate_limited")
+            if retry_after is not None:
+                self.rate_limiter.pause_key(api_key, retry_after)
+            if ":free" in model: # Если бесплатная модель, сразу меняем ее
+                logger.info(f"Бесплатная модель {model} временно недоступна, смена модели.")
+                model = self._next_model(model)
+        elif retry_after is not None: # Например, 503 с Retry-After
+            logger.warning(f"Ошибка API ({status}) для модели {model}, Retry-After: {retry_after} сек.")
+            self.router.bench(model, api_key, retry_after, f"http_{status}")
+        else: # Другие ошибки сервера
+            logger.warning(f"Неизвестная ошибка API ({status}) для модели {model}.")
+            self.router.record_failure(model, api_key, f"http_{status}")
+        return model
+    
+    async def _acquire_key(self, model: str, tried_keys: Set[str], deadline: Optional[float] = None) -> str:
+        """
+        Ключ для очередной попытки. Если все ключи модели отстранены, но ближайший
+        освободится не позже чем через OPENROUTER_MAX_RETRY_AFTER_SECONDS (например,
+        по Retry-After) и до исчерпания бюджета запроса, попытка ждет его вместо
+        немедленного отказа.
+        
+        :param model: Модель
+        :param tried_keys: Ключи, уже испробованные в этом запросе
+        :param deadline: Срок запроса (time.monotonic())
+        :return: Ключ
+        """
+        api_key = self._select_key(model, tried_keys)
+        if api_key is None:
+            wait = self.router.resume_in(model, self._keys_for_model(model))
+            max_wait = config.OPENROUTER_MAX_RETRY_AFTER_SECONDS
+            if deadline is not None:
+                max_wait = min(max_wait, self._remaining(deadline) - config.OPENROUTER_MIN_ATTEMPT_TIMEOUT_SECONDS)
+            if wait > max_wait:
+                raise NetworkException(f"Все API ключи для модели {model} временно отстранены (ближайший освободится через {wait:.0f} сек.).")
+            logger.info(f"Все API ключи для модели {model} на паузе, ожидание {wait:.1f} сек.")
+            await asyncio.sleep(wait)
+            api_key = self._select_key(model, tried_keys)
+            if api_key is None:
+                raise NetworkException(f"Все API ключи для модели {model} временно отстранены.")
+        tried_keys.add(api_key)
+        return api_key
+    
+    @staticmethod
+    def _remaining(deadline: float) -> float:
+        """Оставшийся бюджет времени запроса в секундах"""
+        return deadline - time.monotonic()
+    
+    def _attempt_timeout(self, model_timeout: float, deadline: float, attempts_left: int, model: str) -> float:
+        """
+        Таймаут очередной попытки: весь оставшийся бюджет (не больше таймаута модели) за
+        вычетом запаса OPENROUTER_MIN_ATTEMPT_TIMEOUT_SECONDS на еще одну попытку, если
+        попытки остались. Медленный, но укладывающийся в бюджет ответ не обрывается
+        
+        :param model_timeout: Таймаут модели из конфигурации
+        :param deadline: Срок запроса (time.monotonic())
+        :param attempts_left: Количество оставшихся попыток, включая текущую
+        :param model: Модель (для сообщения об ошибке)
+        :return: Таймаут в секундах
+        """
+        remaining = self._remaining(deadline)
+        if remaining < config.OPENROUTER_MIN_ATTEMPT_TIMEOUT_SECONDS:
+            raise DeadlineExceededException(
+                f"Бюджет времени запроса к модели {model} исчерпан (осталось {max(remaining, 0.0):.1f} сек.)."
+            )
+        reserve = config.OPENROUTER_MIN_ATTEMPT_TIMEOUT_SECONDS if attempts_left > 1 else 0.0
+        if remaining - reserve < config.OPENROUTER_MIN_ATTEMPT_TIMEOUT_SECONDS:
+            # На еще одну попытку бюджета не хватит - текущая получает весь остаток
+            reserve = 0.0
+        return min(model_timeout, remaining - reserve)
+    
+    def _backoff_delay(self, attempt: int, deadline: float) -> float:
+        """
+        Пауза перед повторной попыткой: экспоненциальная со случайным разбросом
+        (full jitter), но не съедающая бюджет, необходимый для самой попытки
+        
+        :param attempt: Номер попытки (с 0)
+        :param deadline: Срок запроса (time.monotonic())
+        :return: Пауза в секундах
+        """
+        cap = min(config.OPENROUTER_BACKOFF_MAX_SECONDS, config.OPENROUTER_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))
+        spare = self._remaining(deadline) - config.OPENROUTER_MIN_ATTEMPT_TIMEOUT_SECONDS
+        return max(0.0, min(random.uniform(0, cap), spare))
+    
+    def _record_latency(self, model: str, seconds: float) -> None:
+        """Учет задержки успешного ответа модели"""
+        samples = self._latencies.get(model)
+        if samples is None:
+            samples = self._latencies[model] = deque(maxlen=config.OPENROUTER_LATENCY_WINDOW)
+        samples.append(seconds)
+    
+    def _record_usage(self, model: str, usage: Optional[Dict[str, Any]], latency: float) -> None:
+        """
+        Учет поля usage успешного ответа: токены промпта и прочитанные из кэша
+        провайдера (prompt_tokens_details.cached_tokens)
+        
+        :param model: Модель
+        :param usage: Поле usage ответа OpenRouter (может отсутствовать)
+        :param latency: Задержка ответа в секундах
+        """
+        if not usage:
+            return
+        stats = self._prompt_cache_stats.setdefault(model, {
+            "requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "cached_requests": 0,
+            "latency_cached_total": 0.0, "latency_uncached_total": 0.0
+        })
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        stats["requests"] += 1
+        stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+        stats["cached_tokens"] += cached_tokens
+        if cached_tokens:
+            stats["cached_requests"] += 1
+            stats["latency_cached_total"] += latency
+        else:
+            stats["latency_uncached_total"] += latency
+    
+    def latency_percentile(self, model: str, percentile: float) -> Optional[float]:
+        """
+        Перцентиль задержки модели по последним успешным ответам
+        
+        :param model: Модель
+        :param percentile: Перцентиль от 0 до 1
+        :return: Задержка в секундах или None, если замеров нет
+        """
+        samples = self._latencies.get(model)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, max(0, int(round(percentile * len(ordered))) - 1))
+        return ordered[index]
+    
+    def _hedge_delay(self, model: str) -> float:
+        """Время ожидания ответа модели, после которого запрашивается следующая модель"""
+        samples = self._latencies.get(model)
+        if not samples or len(samples) < config.OPENROUTER_HEDGE_MIN_SAMPLES:
+            return config.OPENROUTER_HEDGE_DEFAULT_DELAY_SECONDS
+        return self.latency_percentile(model, config.OPENROUTER_HEDGE_PERCENTILE)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Статистика клиента: задержки по моделям (p50/p90 по последним ответам),
+        токены, прочитанные из кэша промптов провайдера, попадания в кэш ответов
+        и результаты хеджирования, включая долю побед каждой модели в гонках
+        """
+        latency = {}
+        for model, samples in self._latencies.items():
+            latency[model] = {
+                "samples": len(samples),
+                "p50": round(self.latency_percentile(model, 0.5), 3),
+                "p90": round(self.latency_percentile(model, 0.9), 3)
+            }
+        
+        hedge_models = {}
+        for model, counters in self._hedge_model_stats.items():
+            races = counters["races"]
+            hedge_models[model] = {
+                **counters,
+                "win_rate": round(counters["wins"] / races, 3) if races else None
+            }
+        
+        prompt_cache = {}
+        for model, stats in self._prompt_cache_stats.items():
+            uncached_requests = stats["requests"] - stats["cached_requests"]
+            prompt_cache[model] = {
+                "requests": stats["requests"],
+                "cached_requests": stats["cached_requests"],
+                "prompt_tokens": stats["prompt_tokens"],
+                "cached_tokens": stats["cached_tokens"],
+                "cached_token_ratio": round(stats["cached_tokens"] / stats["prompt_tokens"], 3) if stats["prompt_tokens"] else None,
+                "avg_latency_cached": round(stats["latency_cached_total"] / stats["cached_requests"], 3) if stats["cached_requests"] else None,
+                "avg_latency_uncached": round(stats["latency_uncached_total"] / uncached_requests, 3) if uncached_requests else None
+            }
+        
+        return {
+            "latency": latency,
+            "prompt_cache": {
+                "enabled": config.OPENROUTER_PROMPT_CACHE_ENABLED,
+                "models": prompt_cache
+            },
+            "response_cache": {
+                "enabled": config.OPENROUTER_RESPONSE_CACHE_ENABLED and self._response_cache is not None,
+                **self._response_cache_stats,
+                # Запросы, обслуженные без обращения к API (кэш или общий одновременный запрос)
+                "saved_calls": self._response_cache_stats["requests"] - self._response_cache_stats["upstream_calls"],
+                "in_flight": len(self._inflight)
+            },
+            "hedging": {
+                "enabled": config.OPENROUTER_HEDGING_ENABLED,
+                **self._hedge_counters,
+                "models": hedge_models
+            }
+        }
+    
     async def make_request(
         self, 
         messages: List[Dict[str, str]], 
         max_tokens: int = 500,
         temperature: float = 0.7,
         model: Optional[str] = None,
-        retry_count: int = 3
+        retry_count: int = 3,
+        deadline: Optional[float] = None,
+        caller: Optional[str] = None
     ) -> Dict[str, Any]:
         """
-        Выполнение запроса к API OpenRouter
+        Выполнение запроса к API OpenRouter (см. _make_request) с учетом токенов,
+        задержки, повторов и фактической модели в usage_tracker
         
         :param messages: Список сообщений для модели
         :param max_tokens: Максимальное количество токенов в ответе
         :param temperature: Температура генерации
         :param model: Модель (если None, используется текущая)
         :param retry_count: Количество попыток при ошибке
+        :param deadline: Срок запроса (time.monotonic()); по умолчанию через OPENROUTER_DEFAULT_DEADLINE_SECONDS
+        :param caller: Метка вызывающего кода для учета (moon, tarot, crypto, ...)
+        :return: Ответ API
+        """
+        trace: Dict[str, Any] = {"model": model or self._get_current_model(), "attempts": 0, "latency": None}
+        started = time.monotonic()
+        try:
+            result = await self._make_request(messages, max_tokens, temperature, model, retry_count, deadline, trace)
+        except Exception as e:
+            self.usage_tracker.record(
+                caller or DEFAULT_CALLER, trace["model"], None, None,
+                time.monotonic() - started, trace["attempts"], error=type(e).__name__
+            )
+            raise
+        self.usage_tracker.record(
+            caller or DEFAULT_CALLER, result.get("model") or trace["model"], result.get("usage"), trace["latency"],
+            time.monotonic() - started, trace["attempts"]
+        )
+        return result
+    
+    async def _make_request(
+        self, 
+        messages: List[Dict[str, str]], 
+        max_tokens: int,
+        temperature: float,
+        model: Optional[str],
+        retry_count: int,
+        deadline: Optional[float],
+        trace: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Выполнение запроса к API OpenRouter. Попытки укладываются в общий срок:
+        таймаут каждой - доля оставшегося бюджета, между попытками - экспоненциальная
+        пауза со случайным разбросом. Когда бюджет исчерпан, выбрасывается
+        DeadlineExceededException.
+        
+        :param messages: Список сообщений для модели
+        :param max_tokens: Максимальное количество токенов в ответе
+        :param temperature: Температура генерации
+        :param model: Модель (если None, используется текущая)
+        :param retry_count: Количество попыток при ошибке
+        :param deadline: Срок запроса (time.monotonic()); по умолчанию через OPENROUTER_DEFAULT_DEADLINE_SECONDS
+        :param trace: Сведения для учета: выполненные попытки, модель, задержка успешной попытки
         :return: Ответ API
         """
         if not model:
             model = self._get_current_model()
+        if deadline is None:
+            deadline = time.monotonic() + config.OPENROUTER_DEFAULT_DEADLINE_SECONDS
         
         # Получаем конфигурацию модели
         model_config = self._get_model_config(model)
         request_type = model_config.get("request_type", "standard")
         model_timeout = model_config.get("timeout", self.timeout)
         
+        # Ключи, испробованные в этом запросе: повторная попытка идет с другим ключом, если он есть
+        tried_keys: Set[str] = set()
+        api_key: Optional[str] = None
+        
         for attempt in range(retry_count):
             try:
-                current_model_for_attempt = model # Используем model, которая может меняться между попытками (из-за ротации)
-                api_key = self._get_key_for_model(current_model_for_attempt)
+                current_model_for_attempt = model # Используем model, которая может меняться между попытками (после 404/429)
+                api_key = await self._acquire_key(current_model_for_attempt, tried_keys, deadline)
+                trace["attempts"] = attempt + 1
+                trace["model"] = current_model_for_attempt
 
                 # Проверка API ключа
-                if not api_key or len(api_key) < 20:
+                if len(api_key) < 20:
                     logger.error(f"Некорректный API ключ для модели {current_model_for_attempt} (попытка {attempt+1}): {api_key}")
+                    self.router.bench(current_model_for_attempt, api_key, config.OPENROUTER_AUTH_COOLDOWN_SECONDS, "invalid_key")
                     if attempt == retry_count - 1:
                         raise NetworkException(f"Некорректный API ключ для модели {current_model_for_attempt} после всех попыток.")
-                    await asyncio.sleep(1) # Небольшая пауза перед сменой ключа/модели
-                    self._rotate_key() # Пробуем другой ключ, если текущий невалиден
                     continue
 
                 # Подготавливаем payload в зависимости от типа запроса
@@ -228,108 +666,101 @@ class OpenRouterClient:
                 
                 logger.info(f"Попытка {attempt+1}/{retry_count}: Запрос к OpenRouter API: модель={current_model_for_attempt}, max_tokens={max_tokens}")
 
-                # Используем увеличенный таймаут для всех моделей
-                actual_timeout = max(model_timeout, 60)  # Минимум 60 секунд для всех запросов
-                
                 if attempt > 0: # Пауза перед повторными попытками
-                    # Используем минимальную фиксированную задержку
-                    backoff_time = 0.3  # Фиксированная задержка 0.5 секунды между попытками
-                    logger.info(f"Пауза перед повторной попыткой: {backoff_time} сек.")
+                    backoff_time = self._backoff_delay(attempt, deadline)
+                    logger.info(f"Пауза перед повторной попыткой: {backoff_time:.2f} сек.")
                     await asyncio.sleep(backoff_time)
                 
-                async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=actual_timeout)) as session:
-                    headers = self._prepare_headers(api_key)
-                    logger.debug(f"Заголовки запроса (попытка {attempt+1}): {headers}")
-                    logger.debug(f"URL запроса (попытка {attempt+1}): {self.api_url}")
-                    logger.debug(f"Payload запроса (попытка {attempt+1}): {json.dumps(payload, ensure_ascii=False)}")
-                    
-                    try:
+                # Таймаут попытки - доля оставшегося бюджета запроса
+                actual_timeout = self._attempt_timeout(model_timeout, deadline, retry_count - attempt, current_model_for_attempt)
+                
+                session = await self._get_session()
+                headers = self._prepare_headers(api_key)
+                logger.debug(f"Заголовки запроса (попытка {attempt+1}): {headers}")
+                logger.debug(f"URL запроса (попытка {attempt+1}): {self.api_url}")
+                logger.debug(f"Payload запроса (попытка {attempt+1}): {json.dumps(payload, ensure_ascii=False)}")
+                
+                try:
+                    async with self.rate_limiter.slot(current_model_for_attempt, api_key):
+                        request_started = time.monotonic()
                         async with session.post(
                             self.api_url,
                             headers=headers,
                             json=payload,
-                            ssl=False
+                            timeout=aiohttp.ClientTimeout(total=actual_timeout)
                         ) as response:
                             response_text = await response.text()
-                            
+                        
                             if response.status == 200:
                                 try:
                                     result = json.loads(response_text)
                                     if not result or 'choices' not in result or not result.get('choices') or \
                                        'message' not in result['choices'][0] or 'content' not in result['choices'][0].get('message', {}):
                                         logger.warning(f"Получен некорректный/пустой успешный ответ от OpenRouter (модель {current_model_for_attempt}, попытка {attempt+1}): {response_text}")
-                                        # Не ротируем ключ сразу, дадим шанс другим моделям или следующей попытке с этим же ключом, если ошибка временная
+                                        self.router.record_failure(current_model_for_attempt, api_key, "invalid_response")
                                         if attempt == retry_count - 1:
                                             raise NetworkException(f"Некорректный ответ от OpenRouter API для модели {current_model_for_attempt} после всех попыток: {response_text}")
-                                        # Продолжаем цикл, возможно, следующая попытка сработает или будет ротация
+                                        # Продолжаем цикл, возможно, следующая попытка сработает
                                         continue
                                     logger.info(f"Успешный ответ от модели {current_model_for_attempt} (попытка {attempt+1})")
+                                    latency = time.monotonic() - request_started
+                                    self._record_latency(current_model_for_attempt, latency)
+                                    trace["latency"] = latency
+                                    self._record_usage(current_model_for_attempt, result.get("usage"), latency)
+                                    self.router.record_success(current_model_for_attempt, api_key, latency)
                                     return result
 
                                 except json.JSONDecodeError as e_json:
                                     logger.error(f"Ошибка декодирования JSON (модель {current_model_for_attempt}, попытка {attempt+1}): {e_json}. Ответ: {response_text}")
+                                    self.router.record_failure(current_model_for_attempt, api_key, "invalid_json")
                                     if attempt == retry_count - 1:
                                         raise NetworkException(f"Ошибка декодирования JSON от OpenRouter для модели {current_model_for_attempt}: {response_text}")
                                     continue # Пробуем следующую попытку
 
                             # Обработка ошибок API (статус не 200)
                             logger.error(f"OpenRouter API ошибка (модель {current_model_for_attempt}, попытка {attempt+1}): Статус={response.status}, Ответ={response_text}")
-                            
+                        
                             error_data = {}
                             try:
                                 error_data = json.loads(response_text)
                             except json.JSONDecodeError:
                                 logger.warning(f"Не удалось декодировать JSON из ответа об ошибке (модель {current_model_for_attempt}): {response_text}")
-                                
+                            
                             extracted_error_message = error_data.get('error', {}).get('message', 'Сообщение об ошибке не найдено в JSON.')
                             detailed_error_for_exception = f"Статус={response.status}, Модель='{current_model_for_attempt}', Сообщение='{extracted_error_message}', ОтветOpenRouter='{response_text}'"
 
-                            if response.status in [401, 403]: # Ошибка авторизации
-                                logger.warning(f"Ошибка авторизации (401/403) для ключа {api_key[:10]}... (модель {current_model_for_attempt}). Ротация ключа.")
-                                self._rotate_key() 
-                            elif response.status == 404: # Модель не найдена
-                                logger.warning(f"Модель не найдена (404): {current_model_for_attempt}. Ротация модели.")
-                                model = self._rotate_model() # Обновляем основную 'model' для следующих попыток
-                                request_type = self._get_model_config(model).get("request_type", "standard") # Обновляем тип запроса для новой модели
-                            elif response.status == 429: # Превышен лимит запросов
-                                logger.warning(f"Превышен лимит запросов (429) для ключа {api_key[:10]}... или модели {current_model_for_attempt}.")
-                                if ":free" in current_model_for_attempt: # Если бесплатная модель, сразу меняем ее
-                                    logger.info(f"Бесплатная модель {current_model_for_attempt} временно недоступна, ротация модели.")
-                                    model = self._rotate_model()
-                                    request_type = self._get_model_config(model).get("request_type", "standard")
-                                else: # Для платных моделей сначала ротируем ключ
-                                    self._rotate_key()
-                                # Фиксированная задержка при 429 вместо экспоненциальной
-                                current_backoff_429 = 0.3  # Минимальная задержка 0.5 секунды при 429
-                                logger.info(f"Дополнительная задержка из-за Rate limit (429): {current_backoff_429} сек.")
-                                await asyncio.sleep(current_backoff_429)
-                            else: # Другие ошибки сервера
-                                logger.warning(f"Неизвестная ошибка API ({response.status}) для модели {current_model_for_attempt}. Ротация ключа.")
-                                self._rotate_key()
-                                
+                            model = self._handle_error_status(
+                                response.status, current_model_for_attempt, api_key,
+                                self._parse_retry_after(response.headers.get("Retry-After"))
+                            )
+                            request_type = self._get_model_config(model).get("request_type", "standard") # Тип запроса мог смениться вместе с моделью
+                            
                             if attempt == retry_count - 1:
                                 raise NetworkException(f"Ошибка OpenRouter API после всех попыток: {detailed_error_for_exception}")
                             # Пауза для остальных ошибок перед следующей попыткой будет в начале цикла
 
-                    except aiohttp.ClientConnectionError as e_conn:
-                        logger.error(f"Ошибка соединения с API (модель {current_model_for_attempt}, попытка {attempt+1}/{retry_count}): {e_conn}")
-                        if attempt == retry_count - 1:
-                            raise NetworkException(f"Ошибка соединения с OpenRouter для модели {current_model_for_attempt}: {str(e_conn)}")
-                        self._rotate_key() # Пробуем другой ключ
-                        # Пауза будет в начале следующей итерации
-                    
-                    except asyncio.TimeoutError as e_timeout: # Отдельно ловим TimeoutError, т.к. он не всегда ClientError
-                        logger.error(f"Таймаут запроса (модель {current_model_for_attempt}, попытка {attempt+1}/{retry_count}): {e_timeout}")
-                        if attempt == retry_count - 1:
-                            raise NetworkException(f"Таймаут при запросе к OpenRouter для модели {current_model_for_attempt}: {str(e_timeout)}")
-                        self._rotate_key() # Пробуем другой ключ
-                        # Пауза будет в начале следующей итерации
+                except aiohttp.ClientConnectionError as e_conn:
+                    logger.error(f"Ошибка соединения с API (модель {current_model_for_attempt}, попытка {attempt+1}/{retry_count}): {e_conn}")
+                    if attempt == retry_count - 1:
+                        raise NetworkException(f"Ошибка соединения с OpenRouter для модели {current_model_for_attempt}: {str(e_conn)}")
+                    self.router.record_failure(current_model_for_attempt, api_key, "connection")
+                    # Пауза будет в начале следующей итерации
+                
+                except asyncio.TimeoutError as e_timeout: # Отдельно ловим TimeoutError, т.к. он не всегда ClientError
+                    logger.error(f"Таймаут запроса ({actual_timeout:.1f} сек., модель {current_model_for_attempt}, попытка {attempt+1}/{retry_count}): {e_timeout}")
+                    if attempt == retry_count - 1:
+                        if self._remaining(deadline) < config.OPENROUTER_MIN_ATTEMPT_TIMEOUT_SECONDS:
+                            raise DeadlineExceededException(f"Модель {current_model_for_attempt} не ответила в пределах бюджета времени запроса.")
+                        raise NetworkException(f"Таймаут при запросе к OpenRouter для модели {current_model_for_attempt}: {str(e_timeout)}")
+                    self.router.record_failure(current_model_for_attempt, api_key, "timeout")
+                    # Пауза будет в начале следующей итерации
 
             except (aiohttp.ClientError) as e_client_other: # Ловим остальные ClientError, которые не ConnectionError
                 logger.error(f"Общая ошибка клиента aiohttp (модель {model}, попытка {attempt+1}/{retry_count}): {e_client_other}") # здесь model - это исходная модель на начало цикла
                 if attempt == retry_count - 1:
                     raise NetworkException(f"Общая ошибка клиента aiohttp при запросе к OpenRouter для модели {model}: {str(e_client_other)}")
-                self._rotate_key()
+                if api_key:
+                    self.router.record_failure(model, api_key, "client_error")
                 # Пауза будет в начале следующей итерации
             
             except NetworkException: # Перехватываем NetworkException, чтобы не попасть в общий Exception ниже
@@ -338,8 +769,9 @@ class OpenRouterClient:
                 logger.error(f"Неожиданная ошибка в make_request (модель {model}, попытка {attempt+1}/{retry_count}): {e_general}", exc_info=True)
                 if attempt == retry_count - 1:
                     raise NetworkException(f"Неожиданная ошибка при запросе к OpenRouter для модели {model}: {str(e_general)}")
-                # При общих ошибках, возможно, стоит просто перейти к следующей попытке без ротации или с ротацией ключа
-                self._rotate_key() # Как минимум, попробуем другой ключ
+                # Следующая попытка пойдет с другим ключом, если он есть
+                if api_key:
+                    self.router.record_failure(model, api_key, "unexpected")
                 # Пауза будет в начале следующей итерации
 
         # Этот код не должен быть достигнут, если retry_count > 0,
@@ -348,6 +780,175 @@ class OpenRouterClient:
         final_model_tried = model # или current_model_for_attempt, если определена в этой области видимости
         raise NetworkException(f"Не удалось выполнить запрос к модели {final_model_tried} после {retry_count} попыток по неизвестной причине (код достиг конца функции make_request).")
 
+    async def stream_request(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 500,
+        temperature: float = 0.7,
+        model: Optional[str] = None,
+        retry_count: int = 3,
+        deadline: Optional[float] = None,
+        caller: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Потоковый запрос к API OpenRouter (см. _stream_request) с учетом токенов,
+        задержки до конца потока и повторов в usage_tracker
+        
+        :param messages: Список сообщений для модели
+        :param max_tokens: Максимальное количество токенов в ответе
+        :param temperature: Температура генерации
+        :param model: Модель (если None, используется текущая)
+        :param retry_count: Количество попыток до начала ответа
+        :param deadline: Срок запроса вместе с потоком ответа (time.monotonic()); по умолчанию через OPENROUTER_DEFAULT_DEADLINE_SECONDS
+        :param caller: Метка вызывающего кода для учета (moon, tarot, ...)
+        :return: Асинхронный итератор фрагментов текста
+        """
+        trace: Dict[str, Any] = {"model": model or self._get_current_model(), "attempts": 0, "latency": None, "usage": None}
+        started = time.monotonic()
+        try:
+            async for chunk in self._stream_request(messages, max_tokens, temperature, model, retry_count, deadline, trace):
+                yield chunk
+        except Exception as e:
+            self.usage_tracker.record(
+                caller or DEFAULT_CALLER, trace["model"], None, None,
+                time.monotonic() - started, trace["attempts"], error=type(e).__name__
+            )
+            raise
+        self.usage_tracker.record(
+            caller or DEFAULT_CALLER, trace["model"], trace["usage"], trace["latency"],
+            time.monotonic() - started, trace["attempts"]
+        )
+    
+    async def _stream_request(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float,
+        model: Optional[str],
+        retry_count: int,
+        deadline: Optional[float],
+        trace: Dict[str, Any]
+    ) -> AsyncIterator[str]:
+        """
+        Потоковый запрос к API OpenRouter (stream: true): фрагменты текста отдаются
+        по мере поступления событий SSE.
+        
+        Повторные попытки с другим ключом или моделью возможны только до первого
+        фрагмента; ошибка после начала ответа пробрасывается как NetworkException,
+        иначе клиент получил бы текст дважды. Попытки и поток ответа укладываются
+        в общий срок, как в _make_request: когда бюджет исчерпан, выбрасывается
+        DeadlineExceededException.
+        
+        :param messages: Список сообщений для модели
+        :param max_tokens: Максимальное количество токенов в ответе
+        :param temperature: Температура генерации
+        :param model: Модель (если None, используется текущая)
+        :param retry_count: Количество попыток до начала ответа
+        :param deadline: Срок запроса вместе с потоком ответа (time.monotonic()); по умолчанию через OPENROUTER_DEFAULT_DEADLINE_SECONDS
+        :param trace: Сведения для учета: выполненные попытки, модель, задержка, usage
+        :return: Асинхронный итератор фрагментов текста
+        """
+        if not model:
+            model = self._get_current_model()
+        if deadline is None:
+            deadline = time.monotonic() + config.OPENROUTER_DEFAULT_DEADLINE_SECONDS
+        
+        model_config = self._get_model_config(model)
+        request_type = model_config.get("request_type", "standard")
+        model_timeout = model_config.get("timeout", self.timeout)
+        tried_keys: Set[str] = set()
+        
+        for attempt in range(retry_count):
+            api_key = await self._acquire_key(model, tried_keys, deadline)
+            trace["attempts"] = attempt + 1
+            trace["model"] = model
+            if len(api_key) < 20:
+                logger.error(f"Некорректный API ключ для модели {model} (потоковый запрос, попытка {attempt+1})")
+                self.router.bench(model, api_key, config.OPENROUTER_AUTH_COOLDOWN_SECONDS, "invalid_key")
+                if attempt == retry_count - 1:
+                    raise NetworkException(f"Некорректный API ключ для модели {model} после всех попыток.")
+                continue
+            
+            if request_type == "openai":
+                payload = self._prepare_openai_payload(model, messages, max_tokens, temperature)
+            else:
+                payload = self._prepare_standard_payload(model, messages, max_tokens, temperature)
+            payload["stream"] = True
+            
+            if attempt > 0: # Пауза перед повторными попытками
+                backoff_time = self._backoff_delay(attempt, deadline)
+                logger.info(f"Пауза перед повторной потоковой попыткой: {backoff_time:.2f} сек.")
+                await asyncio.sleep(backoff_time)
+            
+            # Таймаут попытки (включая чтение потока) - доля оставшегося бюджета запроса
+            actual_timeout = self._attempt_timeout(model_timeout, deadline, retry_count - attempt, model)
+            
+            logger.info(f"Попытка {attempt+1}/{retry_count}: Потоковый запрос к OpenRouter API: модель={model}, max_tokens={max_tokens}")
+            session = await self._get_session()
+            started = False
+            try:
+                async with self.rate_limiter.slot(model, api_key):
+                    request_started = time.monotonic()
+                    async with session.post(
+                        self.api_url,
+                        headers=self._prepare_headers(api_key),
+                        json=payload,
+                        timeout=aiohttp.ClientTimeout(total=actual_timeout)
+                    ) as response:
+                        if response.status != 200:
+                            response_text = await response.text()
+                            logger.error(f"OpenRouter API ошибка потокового запроса (модель {model}, попытка {attempt+1}): Статус={response.status}, Ответ={response_text}")
+                            model = self._handle_error_status(
+                                response.status, model, api_key,
+                                self._parse_retry_after(response.headers.get("Retry-After"))
+                            )
+                            request_type = self._get_model_config(model).get("request_type", "standard")
+                            if attempt == retry_count - 1:
+                                raise NetworkException(f"Ошибка OpenRouter API после всех попыток: Статус={response.status}, Модель='{model}', ОтветOpenRouter='{response_text}'")
+                            continue
+                    
+                        async for raw_line in response.content:
+                            line = raw_line.decode("utf-8").strip()
+                            # Пустые строки разделяют события, строки с ':' - комментарии (keep-alive OpenRouter)
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                break
+                            chunk = json.loads(data)
+                            if chunk.get("error"):
+                                raise NetworkException(f"Ошибка OpenRouter в потоке (модель {model}): {chunk['error']}")
+                            if chunk.get("usage"):
+                                # usage приходит в последнем событии потока
+                                trace["usage"] = chunk["usage"]
+                            choices = chunk.get("choices") or [{}]
+                            content = (choices[0].get("delta") or {}).get("content")
+                            if content:
+                                started = True
+                                yield content
+                    
+                        logger.info(f"Потоковый ответ от модели {model} завершен (попытка {attempt+1})")
+                        trace["latency"] = time.monotonic() - request_started
+                        self.router.record_success(model, api_key, trace["latency"])
+                        return
+            
+            except NetworkException:
+                if started or attempt == retry_count - 1:
+                    raise
+                logger.error(f"Ошибка в потоке до начала ответа (модель {model}, попытка {attempt+1}/{retry_count}).")
+                self.router.record_failure(model, api_key, "stream_error")
+            except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError, UnicodeDecodeError) as e:
+                logger.error(f"Ошибка потокового запроса (модель {model}, попытка {attempt+1}/{retry_count}): {e}")
+                self.router.record_failure(model, api_key, type(e).__name__)
+                if isinstance(e, asyncio.TimeoutError) and self._remaining(deadline) < config.OPENROUTER_MIN_ATTEMPT_TIMEOUT_SECONDS:
+                    raise DeadlineExceededException(f"Потоковый ответ модели {model} не уложился в бюджет времени запроса.")
+                if started:
+                    raise NetworkException(f"Поток ответа модели {model} прерван: {str(e)}")
+                if attempt == retry_count - 1:
+                    raise NetworkException(f"Ошибка потокового запроса к OpenRouter для модели {model}: {str(e)}")
+        
+        raise NetworkException(f"Не удалось выполнить потоковый запрос к модели {model} после {retry_count} попыток.")
+    
     def extract_response_text(self, response: Dict[str, Any]) -> str:
         """
         Извлечение текста ответа из ответа API
@@ -401,57 +1002,235 @@ class OpenRouterClient:
             logger.error(f"Структура ответа: {response}")
             return ""
     
+    @staticmethod
+    def response_cache_key(
+        models: List[str],
+        system_message: str,
+        user_message: str,
+        max_tokens: int,
+        temperature: float
+    ) -> str:
+        """
+        Стабильный ключ кэша ответа: SHA-256 нормализованного запроса. Пробелы по краям
+        сообщений и представление чисел не влияют на ключ, порядок моделей - влияет
+        (он определяет, какая модель ответит первой).
+        
+        :param models: Модели, которые могут ответить на запрос
+        :param system_message: Системное сообщение
+        :param user_message: Сообщение пользователя
+        :param max_tokens: Максимальное количество токенов в ответе
+        :param temperature: Температура генерации
+        :return: Хэш запроса (hex)
+        """
+        normalized = {
+            "models": list(models),
+            "system": system_message.strip(),
+            "user": user_message.strip(),
+            "max_tokens": int(max_tokens),
+            "temperature": round(float(temperature), 3)
+        }
+        payload = json.dumps(normalized, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    async def _single_flight(self, request_key: str, producer: Callable[[], Awaitable[str]]) -> str:
+        """
+        Объединение одинаковых одновременных запросов в этом процессе: API вызывается
+        один раз, результат или исключение получают все ожидающие.
+        
+        Запрос выполняется в отдельной задаче, которая принадлежит всем ожидающим, а не
+        первому вызывающему: отмена любого из них (отключение клиента, проигрыш в гонке
+        hedge) только прекращает его ожидание. Задача отменяется, когда не осталось
+        ни одного ожидающего. Если общий запрос исчерпал бюджет времени первого
+        вызывающего, присоединившиеся выполняют запрос сами - в пределах своего срока.
+        
+        :param request_key: Хэш запроса
+        :param producer: Функция, выполняющая запрос к API
+        :return: Сгенерированный текст
+        """
+        flight = self._inflight.get(request_key)
+        joined = flight is not None
+        if joined:
+            self._response_cache_stats["coalesced"] += 1
+            logger.info(f"Одинаковый запрос к LLM уже выполняется, ожидаю его результат (запрос {request_key[:12]}...)")
+        else:
+            flight = _Flight(asyncio.create_task(self._run_flight(request_key, producer)))
+            self._inflight[request_key] = flight
+        
+        flight.waiters += 1
+        try:
+            # shield: отмена ожидающего не отменяет общий запрос
+            return await asyncio.shield(flight.task)
+        except DeadlineExceededException:
+            if not joined:
+                raise
+            logger.info(f"Общий запрос к LLM не уложился в срок первого вызывающего, выполняю свой (запрос {request_key[:12]}...)")
+            return await producer()
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Новые одинаковые запросы не должны присоединиться к отменяемой задаче
+                self._forget_flight(request_key, flight.task)
+                flight.task.cancel()
+    
+    async def _run_flight(self, request_key: str, producer: Callable[[], Awaitable[str]]) -> str:
+        """Выполнение общего запроса; запись о нем снимается до того, как ожидающие получат результат"""
+        try:
+            return await producer()
+        finally:
+            self._forget_flight(request_key, asyncio.current_task())
+    
+    def _forget_flight(self, request_key: str, task: Optional["asyncio.Task[str]"]) -> None:
+        """Снятие записи об общем запросе, если она относится к этой задаче"""
+        flight = self._inflight.get(request_key)
+        if flight is not None and flight.task is task:
+            del self._inflight[request_key]
+    
+    async def _cached_generation(
+        self,
+        cache_key: str,
+        producer: Callable[[], Awaitable[str]],
+        cache_ttl: Optional[int],
+        bypass_cache: bool
+    ) -> str:
+        """
+        Ответ из кэша по хэшу запроса или результат producer. Одинаковые одновременные
+        запросы выполняются один раз: в процессе - через общий future, между воркерами -
+        через блокировку Redis в CacheManager.get_or_compute (остальные воркеры ждут
+        ответ в кэше, ошибка передается им через негативный кэш). Если кэш ответов
+        выключен, ответ хранится только OPENROUTER_INFLIGHT_RESULT_TTL_SECONDS -
+        столько, чтобы его получили ожидающие воркеры.
+        
+        :param cache_key: Хэш запроса
+        :param producer: Функция, выполняющая запрос к API
+        :param cache_ttl: Время жизни ответа в кэше в секундах (None - TTL пространства llm_response)
+        :param bypass_cache: Не читать кэш, а запросить ответ заново (он обновит кэш)
+        :return: Сгенерированный текст
+        """
+        self._response_cache_stats["requests"] += 1
+        if bypass_cache:
+            self._response_cache_stats["bypassed"] += 1
+        
+        async def call_upstream() -> str:
+            self._response_cache_stats["upstream_calls"] += 1
+            return await producer()
+        
+        if self._response_cache is None:
+            return await self._single_flight(cache_key, call_upstream)
+        
+        if not config.OPENROUTER_RESPONSE_CACHE_ENABLED:
+            cache_ttl = config.OPENROUTER_INFLIGHT_RESULT_TTL_SECONDS
+        return await self._single_flight(
+            cache_key,
+            lambda: self._response_cache.get_or_compute(
+                CacheManager.NS_LLM_RESPONSE,
+                cache_key,
+                call_upstream,
+                ttl=cache_ttl,
+                force_refresh=bypass_cache,
+                negative_ttls={
+                    NetworkException: config.NEGATIVE_CACHE_TTL_LLM_FAILURE,
+                    HTTPException: config.NEGATIVE_CACHE_TTL_LLM_FAILURE,
+                    # TTL 0 - не запоминать: исчерпанный бюджет - свойство вызывающего, а не
+                    # запроса, у других вызывающих (например, фоновой задачи) срок длиннее
+                    DeadlineExceededException: 0
+                }
+            )
+        )
+    
     async def generate_text(
         self,
         system_message: str,
         user_message: str,
         max_tokens: int = 500,
         temperature: float = 0.7,
-        model: Optional[str] = None # Изначально переданная модель (или None)
+        model: Optional[str] = None,
+        cache_ttl: Optional[int] = None,
+        bypass_cache: bool = False,
+        deadline_seconds: Optional[float] = None,
+        caller: Optional[str] = None
+    ) -> str:
+        """
+        Генерация текста с помощью OpenRouter API. Если подключен кэш ответов
+        (use_response_cache), повторный одинаковый запрос отдается из кэша без обращения к API,
+        а одинаковые одновременные запросы (в том числе из разных воркеров) выполняются один раз.
+        
+        :param system_message: Системное сообщение
+        :param user_message: Сообщение пользователя
+        :param max_tokens: Максимальное количество токенов в ответе
+        :param temperature: Температура генерации
+        :param model: Конкретная модель для использования (опционально)
+        :param cache_ttl: Время жизни ответа в кэше в секундах (по умолчанию CACHE_TTL_LLM_RESPONSE)
+        :param bypass_cache: Запросить ответ у API заново, не читая кэш ответов
+        :param deadline_seconds: Бюджет времени на все попытки и модели (по умолчанию OPENROUTER_DEFAULT_DEADLINE_SECONDS)
+        :param caller: Метка вызывающего кода для учета токенов и задержек (moon, tarot, crypto, ...)
+        :return: Сгенерированный текст
+        """
+        deadline = time.monotonic() + (deadline_seconds or config.OPENROUTER_DEFAULT_DEADLINE_SECONDS)
+        cache_key = self.response_cache_key([model] if model else self.models, system_message, user_message, max_tokens, temperature)
+        return await self._cached_generation(
+            cache_key,
+            lambda: self._generate_text(system_message, user_message, max_tokens, temperature, model=model, deadline=deadline, caller=caller),
+            cache_ttl,
+            bypass_cache
+        )
+    
+    async def _generate_text(
+        self,
+        system_message: str,
+        user_message: str,
+        max_tokens: int = 500,
+        temperature: float = 0.7,
+        model: Optional[str] = None, # Изначально переданная модель (или None)
+        deadline: Optional[float] = None,
+        caller: Optional[str] = None
     ) -> str:
         """
-        Генерация текста с помощью OpenRouter API
+        Генерация текста с помощью OpenRouter API (без кэша ответов)
         
         :param system_message: Системное сообщение
         :param user_message: Сообщение пользователя
         :param max_tokens: Максимальное количество токенов в ответе
         :param temperature: Температура генерации
         :param model: Конкретная модель для использования (опционально)
+        :param deadline: Срок генерации (time.monotonic()); по истечении выбрасывается DeadlineExceededException
+        :param caller: Метка вызывающего кода для учета токенов и задержек (moon, tarot, crypto, ...)
         :return: Сгенерированный текст
         """
         
         initial_model_param = model # Сохраняем исходный параметр model
+        if deadline is None:
+            deadline = time.monotonic() + config.OPENROUTER_DEFAULT_DEADLINE_SECONDS
         
         messages = [
             {"role": "system", "content": system_message},
             {"role": "user", "content": user_message}
         ]
         
-        # Если модель не указана явно, начинаем с текущей в ротации клиента
-        current_model_to_try = initial_model_param if initial_model_param else self._get_current_model()
-        
-        # Количество общих попыток, учитывая ротацию моделей и ключей внутри make_request
-        # Здесь retry_count для make_request будет управлять внутренними попытками для ОДНОЙ модели
-        # А этот цикл будет управлять перебором моделей, если make_request для текущей модели фейлится окончательно
-        
-        num_models_available = len(self.models)
+        # Если модель не указана явно, модели перебираются в порядке оценки маршрутизатора
+        # (лучшая здоровая пара первой), иначе пробуется только указанная модель
+        models_to_try = [initial_model_param] if initial_model_param else self._rank_models()
+        num_models_available = len(models_to_try)
         num_keys_available = len(self.api_keys)
         
-        # Попробуем каждую доступную модель хотя бы раз
-        for model_attempt_num in range(num_models_available): 
+        for model_attempt_num, current_model_to_try in enumerate(models_to_try):
             logger.info(f"Попытка генерации текста с моделью: {current_model_to_try} (общая попытка {model_attempt_num+1}/{num_models_available})")
             logger.info(f"Параметры запроса: max_tokens={max_tokens}, temperature={temperature}")
+            
+            if self._remaining(deadline) < config.OPENROUTER_MIN_ATTEMPT_TIMEOUT_SECONDS:
+                raise DeadlineExceededException(
+                    f"Бюджет времени на генерацию текста исчерпан до попытки с моделью {current_model_to_try}."
+                )
 
             try:
-                # make_request теперь сам управляет ротацией ключей и несколькими попытками для ОДНОЙ модели
-                # Передаем current_model_to_try в make_request.
-                # retry_count для make_request можно оставить по умолчанию (e.g., 3) или сделать настраиваемым.
+                # make_request сам выбирает ключи и выполняет несколько попыток для ОДНОЙ модели
                 response_data = await self.make_request(
                     messages=messages,
                     max_tokens=max_tokens,
                     temperature=temperature,
                     model=current_model_to_try, # Передаем текущую модель для попытки
-                    retry_count=max(1, num_keys_available) # Даем шанс каждому ключу для текущей модели
+                    retry_count=max(1, num_keys_available), # Даем шанс каждому ключу для текущей модели
+                    deadline=deadline,
+                    caller=caller
                 )
                 
                 text = self.extract_response_text(response_data)
@@ -462,24 +1241,18 @@ class OpenRouterClient:
                 else:
                     logger.warning(f"Модель {current_model_to_try} вернула пустой ответ. Пробуем следующую модель.")
             
+            except DeadlineExceededException as e:
+                # Бюджет исчерпан: следующая модель тоже не успеет, сразу сообщаем вызывающему
+                logger.error(f"Генерация текста моделью {current_model_to_try} не уложилась в бюджет времени: {e}")
+                raise
             except NetworkException as e:
                 # NetworkException из make_request означает, что все попытки для current_model_to_try провалились
                 logger.error(f"NetworkException при попытке генерации моделью {current_model_to_try}: {e}. Пробуем следующую модель.")
             except Exception as e_gen: # Другие неожиданные ошибки на этом уровне
                 logger.error(f"Неожиданная ошибка на уровне generate_text с моделью {current_model_to_try}: {e_gen}", exc_info=True)
-
-            # Если дошли сюда, значит, текущая модель не сработала или вернула пустой ответ
-            # Ротируем модель для следующей попытки цикла generate_text
-            # Важно: если initial_model_param был задан, мы не должны бесконечно ротировать, а только попробовать 1 раз.
-            if initial_model_param and model_attempt_num == 0: # Если модель была задана явно, и это была первая (и единственная) попытка для нее
-                logger.warning(f"Явно указанная модель {initial_model_param} не смогла сгенерировать текст.")
-                break # Выходим из цикла, если модель была указана и не сработала
-            
-            current_model_to_try = self._rotate_model() # Получаем следующую модель из списка клиента
-            if initial_model_param is None and current_model_to_try == self.models[0] and model_attempt_num > 0:
-                # Если переданная модель была None, и мы сделали полный круг по моделям
-                logger.warning("Сделан полный круг по всем доступным моделям, ни одна не сработала.")
-                break 
+        
+        if initial_model_param:
+            logger.warning(f"Явно указанная модель {initial_model_param} не смогла сгенерировать текст.")
         
         # Если все модели перебраны и текст не получен
         detail_message = f"Не удалось сгенерировать текст после попыток со всеми доступными моделями."
@@ -490,4 +1263,220 @@ class OpenRouterClient:
         raise HTTPException(
             status_code=500,
             detail=detail_message
-        ) 
\ No newline at end of file
+        )
+    
+    async def stream_text(
+        self,
+        system_message: str,
+        user_message: str,
+        max_tokens: int = 500,
+        temperature: float = 0.7,
+        models: Optional[List[str]] = None,
+        deadline_seconds: Optional[float] = None,
+        caller: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Потоковая генерация текста: фрагменты отдаются по мере поступления.
+        Модели перебираются в порядке оценки маршрутизатора, пока одна из них не начнет отвечать.
+        Все модели и поток ответа укладываются в общий бюджет времени.
+        
+        :param system_message: Системное сообщение
+        :param user_message: Сообщение пользователя
+        :param max_tokens: Максимальное количество токенов в ответе
+        :param temperature: Температура генерации
+        :param models: Модели в порядке приоритета (если None, используются модели клиента)
+        :param deadline_seconds: Бюджет времени на все попытки, модели и поток ответа (по умолчанию OPENROUTER_DEFAULT_DEADLINE_SECONDS)
+        :param caller: Метка вызывающего кода для учета токенов и задержек (moon, tarot, crypto, ...)
+        :return: Асинхронный итератор фрагментов текста
+        """
+        deadline = time.monotonic() + (deadline_seconds or config.OPENROUTER_DEFAULT_DEADLINE_SECONDS)
+        messages = [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": user_message}
+        ]
+        
+        for model in self._rank_models(models):
+            if self._remaining(deadline) < config.OPENROUTER_MIN_ATTEMPT_TIMEOUT_SECONDS:
+                raise DeadlineExceededException(
+                    f"Бюджет времени на потоковую генерацию исчерпан до попытки с моделью {model}."
+                )
+            started = False
+            try:
+                async for chunk in self.stream_request(
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    model=model,
+                    retry_count=max(1, len(self.api_keys)),
+                    deadline=deadline,
+                    caller=caller
+                ):
+                    started = True
+                    yield chunk
+                if started:
+                    logger.info(f"Успешно сгенерирован потоковый текст моделью {model}")
+                    return
+                logger.warning(f"Модель {model} вернула пустой потоковый ответ. Пробуем следующую модель.")
+            except DeadlineExceededException as e:
+                # Бюджет исчерпан: следующая модель тоже не успеет
+                logger.error(f"Потоковая генерация моделью {model} не уложилась в бюджет времени: {e}")
+                raise
+            except NetworkException as e:
+                # После начала ответа переключать модель уже нельзя
+                if started:
+                    raise
+                logger.error(f"NetworkException при потоковой генерации моделью {model}: {e}. Пробуем следующую модель.")
+        
+        detail_message = "Не удалось получить потоковый ответ ни от одной из моделей."
+        logger.error(detail_message)
+        raise HTTPException(
+            status_code=500,
+            detail=detail_message
+        )
+    
+    async def generate_text_hedged(
+        self,
+        system_message: str,
+        user_message: str,
+        max_tokens: int = 500,
+        temperature: float = 0.7,
+        models: Optional[List[str]] = None,
+        cache_ttl: Optional[int] = None,
+        bypass_cache: bool = False,
+        deadline_seconds: Optional[float] = None,
+        caller: Optional[str] = None
+    ) -> str:
+        """
+        Генерация текста с хеджированием между моделями (см. _generate_text_hedged)
+        с использованием кэша ответов и объединением одинаковых одновременных запросов
+        
+        :param system_message: Системное сообщение
+        :param user_message: Сообщение пользователя
+        :param max_tokens: Максимальное количество токенов в ответе
+        :param temperature: Температура генерации
+        :param models: Модели в порядке приоритета (если None, используются модели клиента)
+        :param cache_ttl: Время жизни ответа в кэше в секундах (по умолчанию CACHE_TTL_LLM_RESPONSE)
+        :param bypass_cache: Запросить ответ у API заново, не читая кэш ответов
+        :param deadline_seconds: Бюджет времени на генерацию (по умолчанию OPENROUTER_DEFAULT_DEADLINE_SECONDS)
+        :param caller: Метка вызывающего кода для учета токенов и задержек (moon, tarot, crypto, ...)
+        :return: Сгенерированный текст
+        """
+        deadline = time.monotonic() + (deadline_seconds or config.OPENROUTER_DEFAULT_DEADLINE_SECONDS)
+        cache_key = self.response_cache_key(models or self.models, system_message, user_message, max_tokens, temperature)
+        return await self._cached_generation(
+            cache_key,
+            lambda: self._generate_text_hedged(system_message, user_message, max_tokens, temperature, models, deadline, caller),
+            cache_ttl,
+            bypass_cache
+        )
+    
+    async def _generate_text_hedged(
+        self,
+        system_message: str,
+        user_message: str,
+        max_tokens: int = 500,
+        temperature: float = 0.7,
+        models: Optional[List[str]] = None,
+        deadline: Optional[float] = None,
+        caller: Optional[str] = None
+    ) -> str:
+        """
+        Генерация текста с хеджированием: если модель не ответила за свой p90
+        (config.OPENROUTER_HEDGE_PERCENTILE по последним ответам), параллельно
+        запрашивается следующая модель из списка. Побеждает первый успешный ответ,
+        остальные запросы отменяются. Если модель завершилась ошибкой, следующая
+        запрашивается сразу.
+        
+        :param system_message: Системное сообщение
+        :param user_message: Сообщение пользователя
+        :param max_tokens: Максимальное количество токенов в ответе
+        :param temperature: Температура генерации
+        :param models: Модели в порядке приоритета (если None, используются модели клиента)
+        :param deadline: Общий срок всех параллельных запросов (time.monotonic())
+        :param caller: Метка вызывающего кода для учета токенов и задержек (moon, tarot, crypto, ...)
+        :return: Сгенерированный текст
+        """
+        candidates = self._rank_models(models)
+        if len(candidates) < 2:
+            return await self._generate_text(system_message, user_message, max_tokens, temperature, model=candidates[0] if candidates else None, deadline=deadline, caller=caller)
+        
+        self._hedge_counters["calls"] += 1
+        pending: Dict[asyncio.Task, str] = {}
+        launched_at: Dict[asyncio.Task, float] = {}
+        racers: List[str] = []
+        next_index = 0
+        last_error: Optional[Exception] = None
+        
+        def launch() -> str:
+            nonlocal next_index
+            model = candidates[next_index]
+            next_index += 1
+            task = asyncio.create_task(
+                self._generate_text(system_message, user_message, max_tokens, temperature, model=model, deadline=deadline, caller=caller)
+            )
+            pending[task] = model
+            launched_at[task] = time.monotonic()
+            return model
+        
+        primary_model = launch()
+        try:
+            while pending:
+                timeout = None
+                # Хедж запускается, только пока в полете один запрос и есть следующая модель
+                if len(pending) == 1 and next_index < len(candidates):
+                    (task, model), = pending.items()
+                    timeout = max(0.0, launched_at[task] + self._hedge_delay(model) - time.monotonic())
+                
+                done, _ = await asyncio.wait(pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                
+                if not done:
+                    (slow_model,) = pending.values()
+                    hedge_model = launch()
+                    self._hedge_counters["hedges_launched"] += 1
+                    for model in (slow_model, hedge_model):
+                        if model not in racers:
+                            racers.append(model)
+                    logger.info(f"Модель {slow_model} не ответила за {self._hedge_delay(slow_model):.1f} сек., параллельный запрос к {hedge_model}")
+                    continue
+                
+                for task in done:
+                    model = pending.pop(task)
+                    try:
+                        text = task.result()
+                    except Exception as e:
+                        last_error = e
+                        logger.warning(f"Хеджированный запрос к модели {model} завершился ошибкой: {e}")
+                        continue
+                    
+                    self._record_hedge_win(model, primary_model, racers)
+                    return text
+                
+                # Все завершившиеся запросы неуспешны: сразу пробуем следующую модель
+                if not pending and next_index < len(candidates):
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        self._hedge_counters["failures"] += 1
+        if last_error:
+            raise last_error
+        raise HTTPException(status_code=500, detail="Не удалось сгенерировать текст ни одной из моделей.")
+    
+    def _record_hedge_win(self, winner: str, primary_model: str, racers: List[str]) -> None:
+        """Учет победителя хеджированного запроса"""
+        if winner == primary_model:
+            self._hedge_counters["primary_wins"] += 1
+        elif winner in racers:
+            self._hedge_counters["hedge_wins"] += 1
+        else:
+            # Модель запрошена после отказа предыдущей, без гонки
+            self._hedge_counters["fallback_wins"] += 1
+        if winner not in racers:
+            return
+        for model in racers:
+            counters = self._hedge_model_stats.setdefault(model, {"races": 0, "wins": 0})
+            counters["races"] += 1
+            if model == winner:
+                counters["wins"] += 1
+        logger.info(f"Хеджированный запрос выиграла модель {winner} (участники: {', '.join(racers)})")
@@ -0,0 +1,168 @@
+"""
+Выбор пары (модель, API ключ) для запросов к OpenRouter по задержке и ошибкам
+"""
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import logging
+import time
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class RouteState:
+    """Состояние пары (модель, ключ): сглаженные задержка и доля ошибок, пауза после 401/429"""
+
+    def __init__(self):
+        self.latency_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.benched_until = 0.0
+        self.bench_reason: Optional[str] = None
+
+        # Метрики
+        self.successes = 0
+        self.failures = 0
+        self.benched = 0
+        self.last_error: Optional[str] = None
+
+
+class OpenRouterRouter:
+    """
+    Маршрутизатор запросов OpenRouter.
+
+    Для каждой пары (модель, ключ) хранит экспоненциально сглаженные (EWMA) задержку
+    и долю ошибок. Для запроса выбирается здоровая пара с наименьшей оценкой
+    `задержка * (1 + error_penalty * доля ошибок)`. Пары, получившие 401/403 или 429,
+    отстраняются до истечения паузы и не выбираются другими запросами.
+    """
+
+    def __init__(self, alpha: float = 0.2, error_penalty: float = 4.0):
+        """
+        :param alpha: Коэффициент сглаживания EWMA (вес нового замера).
+        :param error_penalty: Во сколько раз доля ошибок увеличивает оценку пары.
+        """
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self._routes: Dict[Tuple[str, str], RouteState] = {}
+
+    def _state(self, model: str, key: str) -> RouteState:
+        state = self._routes.get((model, key))
+        if state is None:
+            state = self._routes[(model, key)] = RouteState()
+        return state
+
+    def is_benched(self, model: str, key: str) -> bool:
+        """Отстранена ли пара (модель, ключ) в данный момент"""
+        state = self._routes.get((model, key))
+        return state is not None and state.benched_until > time.monotonic()
+
+    def resume_in(self, model: str, keys: List[str]) -> float:
+        """Через сколько секунд у модели появится здоровый ключ (0, если он есть сейчас)"""
+        now = time.monotonic()
+        remaining = [max(0.0, self._routes[(model, key)].benched_until - now) if (model, key) in self._routes else 0.0 for key in keys]
+        return min(remaining, default=0.0)
+
+    def _default_latency(self, model: str) -> float:
+        """
+        Задержка для пары без замеров: средняя по модели, иначе средняя по всем парам.
+        Так новые ключи и модели не вытесняют проверенные только из-за отсутствия данных.
+        """
+        model_samples = [s.latency_ewma for (m, _), s in self._routes.items() if m == model and s.latency_ewma is not None]
+        samples = model_samples or [s.latency_ewma for s in self._routes.values() if s.latency_ewma is not None]
+        return sum(samples) / len(samples) if samples else 0.0
+
+    def score(self, model: str, key: str) -> float:
+        """Оценка пары (меньше - лучше)"""
+        state = self._routes.get((model, key))
+        latency = state.latency_ewma if state and state.latency_ewma is not None else self._default_latency(model)
+        error_rate = state.error_ewma if state else 0.0
+        return latency * (1 + self.error_penalty * error_rate) + error_rate
+
+    def choose_key(self, model: str, keys: List[str], exclude: Iterable[str] = ()) -> Optional[str]:
+        """
+        Выбор лучшего здорового ключа для модели
+
+        :param model: Модель
+        :param keys: Ключи-кандидаты в порядке приоритета (он разрешает равенство оценок)
+        :param exclude: Ключи, которые уже пробовались в этом запросе
+        :return: Ключ или None, если подходящих ключей нет
+        """
+        excluded = set(exclude)
+        candidates = [key for key in keys if key not in excluded and not self.is_benched(model, key)]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda key: (self.score(model, key), keys.index(key)))
+
+    def rank_models(self, models: List[str], keys_for_model: Callable[[str], List[str]]) -> List[str]:
+        """
+        Модели по убыванию качества лучшей пары. Модели, у которых все ключи
+        отстранены, идут в конце (раньше та, у которой пауза закончится раньше).
+
+        :param models: Модели в порядке приоритета (он разрешает равенство оценок)
+        :param keys_for_model: Функция, возвращающая ключи модели
+        :return: Отсортированный список моделей
+        """
+        def rank(model: str) -> Tuple[int, float, int]:
+            keys = keys_for_model(model)
+            healthy = [key for key in keys if not self.is_benched(model, key)]
+            if healthy:
+                return 0, min(self.score(model, key) for key in healthy), models.index(model)
+            resume_at = min((self._state(model, key).benched_until for key in keys), default=0.0)
+            return 1, resume_at, models.index(model)
+
+        return sorted(models, key=rank)
+
+    def record_success(self, model: str, key: str, latency: float) -> None:
+        """Учет успешного ответа пары и его задержки"""
+        state = self._state(model, key)
+        state.successes += 1
+        state.latency_ewma = latency if state.latency_ewma is None else (1 - self.alpha) * state.latency_ewma + self.alpha * latency
+        state.error_ewma = (1 - self.alpha) * state.error_ewma
+
+    def record_failure(self, model: str, key: str, reason: str) -> None:
+        """Учет ошибки пары (сеть, таймаут, 5xx, некорректный ответ)"""
+        state = self._state(model, key)
+        state.failures += 1
+        state.error_ewma = (1 - self.alpha) * state.error_ewma + self.alpha
+        state.last_error = reason
+
+    def bench(self, model: str, key: str, seconds: float, reason: str) -> None:
+        """
+        Отстранение пары на seconds секунд (например, после 401/403 или 429)
+
+        :param model: Модель
+        :param key: Ключ
+        :param seconds: Длительность паузы
+        :param reason: Причина (для логов и табло)
+        """
+        self.record_failure(model, key, reason)
+        state = self._state(model, key)
+        state.benched += 1
+        state.benched_until = max(state.benched_until, time.monotonic() + seconds)
+        state.bench_reason = reason
+        logger.warning(f"Пара модель={model}, ключ={key[:10]}... отстранена на {seconds:.0f} сек. ({reason})")
+
+    def get_scoreboard(self) -> List[Dict[str, Any]]:
+        """
+        Табло пар (модель, ключ): оценка, сглаженные задержка и доля ошибок,
+        оставшаяся пауза. Ключи маскируются. Пары отсортированы по оценке.
+        """
+        now = time.monotonic()
+        board = []
+        for (model, key), state in self._routes.items():
+            benched_for = max(0.0, state.benched_until - now)
+            board.append({
+                "model": model,
+                "key": f"{key[:10]}...",
+                "score": round(self.score(model, key), 4),
+                "latency_ewma": round(state.latency_ewma, 3) if state.latency_ewma is not None else None,
+                "error_rate_ewma": round(state.error_ewma, 3),
+                "benched": benched_for > 0,
+                "benched_for_seconds": round(benched_for, 1),
+                "bench_reason": state.bench_reason if benched_for > 0 else None,
+                "successes": state.successes,
+                "failures": state.failures,
+                "times_benched": state.benched,
+                "last_error": state.last_error
+            })
+        board.sort(key=lambda row: (row["benched"], row["score"]))
+        return board
@@ -0,0 +1,158 @@
+"""
+Пул для CPU-емкого разбора HTML вне цикла событий asyncio
+"""
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+import asyncio
+import logging
+import multiprocessing
+import time
+
+from core.exceptions import ParseQueueFullException
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+POOL_MODES = ("thread", "process", "inline")
+
+
+def _timed_call(func: Callable[..., Any], *args: Any) -> Tuple[Any, float]:
+    """Вызов в потоке или процессе пула с замером времени разбора"""
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+class ParsePool:
+    """
+    Пул разбора страниц: thread - пул потоков (lxml и selectolax отпускают GIL
+    во время разбора), process - пул процессов (полностью изолирует разбор
+    BeautifulSoup от цикла событий ценой передачи байтов страницы и результата
+    между процессами), inline - разбор прямо в цикле событий (прежнее поведение).
+
+    Очередь ограничена: одновременно в пуле не больше workers + queue_size задач,
+    остальные ждут места не дольше queue_timeout секунд и получают
+    ParseQueueFullException.
+    """
+
+    def __init__(self, mode: str = "thread", workers: int = 2, queue_size: int = 16, queue_timeout: float = 10.0, window: int = 500):
+        """
+        :param mode: Режим пула: thread, process или inline.
+        :param workers: Количество потоков или процессов.
+        :param queue_size: Количество задач, ожидающих свободного исполнителя.
+        :param queue_timeout: Максимальное ожидание места в очереди в секундах.
+        :param window: Количество последних замеров для перцентилей.
+        """
+        if mode not in POOL_MODES:
+            logger.warning(f"Неизвестный режим пула разбора '{mode}', используется thread.")
+            mode = "thread"
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.queue_timeout = queue_timeout
+
+        self._executor: Optional[Executor] = None
+        if mode == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="parse")
+        elif mode == "process":
+            # spawn: дочерние процессы не наследуют цикл событий и соединения родителя
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self._slots = asyncio.Semaphore(self.workers + self.queue_size)
+
+        # Метрики
+        self._pending = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._parse_times: Deque[float] = deque(maxlen=window)
+        self._queue_waits: Deque[float] = deque(maxlen=window)
+        self._loop_blocked_total = 0.0
+        self._loop_blocked_max = 0.0
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Выполнение func(*args) в пуле. В режиме process функция и аргументы должны
+        сериализоваться pickle (функция уровня модуля, байты страницы).
+
+        :param func: Синхронная функция разбора
+        :param args: Аргументы функции
+        :return: Результат функции
+        """
+        if self._executor is None:
+            return self._run_inline(func, *args)
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._rejected += 1
+            logger.warning(f"Очередь пула разбора заполнена ({self._pending} задач), задача отклонена.")
+            raise ParseQueueFullException(f"Очередь разбора заполнена ({self._pending} задач)")
+
+        self._pending += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, parse_seconds = await loop.run_in_executor(self._executor, _timed_call, func, *args)
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._pending -= 1
+            self._slots.release()
+
+        self._completed += 1
+        self._parse_times.append(parse_seconds)
+        # Ожидание исполнителя и передача данных между процессами
+        self._queue_waits.append(max(0.0, time.perf_counter() - started - parse_seconds))
+        return result
+
+    def _run_inline(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Разбор в цикле событий: все время разбора блокирует цикл"""
+        started = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            blocked = time.perf_counter() - started
+            self._loop_blocked_total += blocked
+            self._loop_blocked_max = max(self._loop_blocked_max, blocked)
+        self._completed += 1
+        self._parse_times.append(blocked)
+        return result
+
+    def shutdown(self) -> None:
+        """Остановка пула без ожидания задач в очереди"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _percentile(values: Deque[float], percentile: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, max(0, int(round(percentile * len(ordered))) - 1))] * 1000, 2)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Метрики пула: задачи в работе и в очереди, выполненные, ошибки и отклоненные,
+        время разбора и ожидания исполнителя (p50/p95 по последним задачам, мс),
+        время блокировки цикла событий (только режим inline)
+        """
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "pending": self._pending,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "parse_p50_ms": self._percentile(self._parse_times, 0.5),
+            "parse_p95_ms": self._percentile(self._parse_times, 0.95),
+            "queue_wait_p50_ms": self._percentile(self._queue_waits, 0.5),
+            "queue_wait_p95_ms": self._percentile(self._queue_waits, 0.95),
+            "loop_blocked_total_seconds": round(self._loop_blocked_total, 3),
+            "loop_blocked_max_ms": round(self._loop_blocked_max * 1000, 2)
+        }
@@ -0,0 +1,198 @@
+"""
+Ограничение частоты и параллельности запросов к внешним API
+"""
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+import asyncio
+import logging
+import time
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class AsyncTokenBucket:
+    """
+    Асинхронное ведро токенов: rate токенов в секунду, не больше capacity в запасе.
+    Ведро можно приостановить (например, по заголовку Retry-After) - тогда
+    acquire ждет окончания паузы.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        :param rate: Скорость пополнения, токенов в секунду.
+        :param capacity: Емкость ведра (допустимый всплеск).
+        """
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self) -> float:
+        """
+        Получение одного токена (с ожиданием, если токенов нет или ведро на паузе)
+
+        :return: Время ожидания в секундах
+        """
+        started = time.monotonic()
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return now - started
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate if self.rate > 0 else 1.0)
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Пауза ведра на seconds секунд (запас токенов после паузы не накапливается сверх емкости)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @property
+    def tokens(self) -> float:
+        self._refill(time.monotonic())
+        return self._tokens
+
+    @property
+    def paused_for(self) -> float:
+        return max(0.0, self._paused_until - time.monotonic())
+
+
+class LLMRateLimiter:
+    """
+    Ограничитель запросов к LLM: общий семафор на количество одновременных запросов
+    и ведра токенов на модель и на API ключ. Один экземпляр разделяется всеми
+    клиентами процесса, поэтому всплеск запросов одного сервиса не вызывает каскад 429
+    у остальных.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        model_rate: float,
+        model_burst: float,
+        key_rate: float,
+        key_burst: float,
+        wait_window: int = 1000
+    ):
+        """
+        :param max_concurrent: Максимум одновременных запросов.
+        :param model_rate: Запросов в секунду на модель.
+        :param model_burst: Допустимый всплеск запросов на модель.
+        :param key_rate: Запросов в секунду на API ключ.
+        :param key_burst: Допустимый всплеск запросов на API ключ.
+        :param wait_window: Количество последних замеров ожидания для перцентилей.
+        """
+        self.max_concurrent = max(1, max_concurrent)
+        self.model_rate = model_rate
+        self.model_burst = model_burst
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._model_buckets: Dict[str, AsyncTokenBucket] = {}
+        self._key_buckets: Dict[str, AsyncTokenBucket] = {}
+
+        # Метрики
+        self._in_flight = 0
+        self._waiting = 0
+        self._waits: Deque[float] = deque(maxlen=wait_window)
+        self._wait_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _model_bucket(self, model: str) -> AsyncTokenBucket:
+        bucket = self._model_buckets.get(model)
+        if bucket is None:
+            bucket = self._model_buckets[model] = AsyncTokenBucket(self.model_rate, self.model_burst)
+        return bucket
+
+    def _key_bucket(self, key: str) -> AsyncTokenBucket:
+        bucket = self._key_buckets.get(key)
+        if bucket is None:
+            bucket = self._key_buckets[key] = AsyncTokenBucket(self.key_rate, self.key_burst)
+        return bucket
+
+    def pause_key(self, key: str, seconds: float) -> None:
+        """Пауза запросов с ключом (по Retry-After)"""
+        self._key_bucket(key).pause(seconds)
+
+    def pause_model(self, model: str, seconds: float) -> None:
+        """Пауза запросов к модели (по Retry-After)"""
+        self._model_bucket(model).pause(seconds)
+
+    @asynccontextmanager
+    async def slot(self, model: str, key: str) -> AsyncIterator[float]:
+        """
+        Место для одного запроса: сначала токены модели и ключа, затем слот семафора.
+        Слот удерживается до выхода из контекста (для потоковых ответов - до конца потока).
+
+        :param model: Модель
+        :param key: API ключ
+        :return: Время ожидания в очереди в секундах
+        """
+        started = time.monotonic()
+        self._waiting += 1
+        try:
+            await self._model_bucket(model).acquire()
+            await self._key_bucket(key).acquire()
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        waited = time.monotonic() - started
+        self._record_wait(waited)
+        self._in_flight += 1
+        try:
+            yield waited
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    def _record_wait(self, seconds: float) -> None:
+        self._waits.append(seconds)
+        self._wait_count += 1
+        self._wait_total += seconds
+        self._wait_max = max(self._wait_max, seconds)
+        if seconds >= 1:
+            logger.info(f"Запрос к LLM ждал в очереди ограничителя {seconds:.2f} сек.")
+
+    def _wait_percentile(self, percentile: float) -> float:
+        ordered = sorted(self._waits)
+        return ordered[min(len(ordered) - 1, max(0, int(round(percentile * len(ordered))) - 1))]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Метрики ограничителя: занятые слоты, ожидающие запросы, время ожидания
+        в очереди (среднее, p50/p95 по последним запросам, максимум), состояние ведер
+        """
+        queue_wait: Dict[str, Optional[float]] = {
+            "count": self._wait_count,
+            "total_seconds": round(self._wait_total, 3),
+            "avg_ms": round(self._wait_total / self._wait_count * 1000, 2) if self._wait_count else None,
+            "p50_ms": round(self._wait_percentile(0.5) * 1000, 2) if self._waits else None,
+            "p95_ms": round(self._wait_percentile(0.95) * 1000, 2) if self._waits else None,
+            "max_ms": round(self._wait_max * 1000, 2)
+        }
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "saturation": round(self._in_flight / self.max_concurrent, 3),
+            "queue_wait": queue_wait,
+            "models": {
+                model: {"tokens": round(bucket.tokens, 2), "paused_for_seconds": round(bucket.paused_for, 1)}
+                for model, bucket in self._model_buckets.items()
+            },
+            "keys": {
+                f"{key[:10]}...": {"tokens": round(bucket.tokens, 2), "paused_for_seconds": round(bucket.paused_for, 1)}
+                for key, bucket in self._key_buckets.items()
+            }
+        }
@@ -0,0 +1,49 @@
+"""
+Вспомогательные функции для ответов Server-Sent Events (SSE)
+"""
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, Tuple
+
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+# Заголовки потокового ответа: без кэширования и без буферизации в nginx
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no"
+}
+
+
+def format_sse_event(event: str, data: Dict[str, Any]) -> str:
+    """
+    Форматирование события SSE. Данные сериализуются в JSON одной строкой,
+    поэтому переносы строк в тексте не ломают формат события.
+
+    :param event: Имя события (token, done, error и т.п.)
+    :param data: Данные события
+    :return: Событие в формате text/event-stream
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _encode_events(events: AsyncIterator[Tuple[str, Dict[str, Any]]]) -> AsyncIterator[str]:
+    try:
+        async for event, data in events:
+            yield format_sse_event(event, data)
+    except Exception as e:
+        # Заголовки уже отправлены, поэтому ошибка передается клиенту отдельным событием
+        logger.error(f"Ошибка при формировании потокового ответа: {e}", exc_info=True)
+        yield format_sse_event("error", {"error": f"Внутренняя ошибка сервера: {str(e)}"})
+
+
+def sse_response(events: AsyncIterator[Tuple[str, Dict[str, Any]]]) -> StreamingResponse:
+    """
+    Потоковый ответ text/event-stream из асинхронного итератора пар (событие, данные)
+
+    :param events: Асинхронный итератор пар (имя события, данные)
+    :return: StreamingResponse
+    """
+    return StreamingResponse(_encode_events(events), media_type="text/event-stream", headers=SSE_HEADERS)
@@ -0,0 +1,58 @@
+"""
+Тестирование объединения одновременных промахов в CacheManager.get_or_compute:
+отмена первого вызывающего не должна обрывать вычисление для остальных
+"""
+import asyncio
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.cache import CacheManager  # noqa: E402
+
+# Настраиваем логирование
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def _run_owner_cancelled():
+    # Без подключения к Redis кэш работает на резервном хранилище в памяти
+    cache_manager = CacheManager()
+    calls = 0
+
+    async def producer():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.5)
+        return {"text": "ответ"}
+
+    owner = asyncio.create_task(cache_manager.get_or_compute(CacheManager.NS_TAROT_DAILY, "card", producer, ttl=60))
+    await asyncio.sleep(0.01)
+    waiter = asyncio.create_task(cache_manager.get_or_compute(CacheManager.NS_TAROT_DAILY, "card", producer, ttl=60))
+    await asyncio.sleep(0.05)
+    owner.cancel()
+
+    assert await waiter == {"text": "ответ"}
+    assert owner.cancelled()
+    assert calls == 1, calls
+    assert await cache_manager.get_or_compute(CacheManager.NS_TAROT_DAILY, "card", producer, ttl=60) == {"text": "ответ"}
+    assert calls == 1, calls
+    logger.info("Ожидающий запрос получил значение после отмены первого вызывающего")
+
+
+def test_owner_cancelled_waiter_gets_value():
+    """
+    Первый вызывающий отменен во время вычисления - присоединившийся запрос
+    получает значение, а producer вызывается один раз
+    """
+    asyncio.run(_run_owner_cancelled())
+
+
+if __name__ == "__main__":
+    test_owner_cancelled_waiter_gets_value()
@@ -0,0 +1,78 @@
+"""
+Тестирование бюджета времени запроса к OpenRouter: медленный ответ,
+укладывающийся в срок, не должен обрываться таймаутом попытки
+"""
+import asyncio
+import os
+import sys
+import time
+import logging
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.openrouter_client import OpenRouterClient  # noqa: E402
+import config  # noqa: E402
+
+# Настраиваем логирование
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_DELAY_SECONDS = 2.0
+DEADLINE_SECONDS = 4.0
+
+
+async def _slow_completion(request: web.Request) -> web.Response:
+    """Заглушка OpenRouter, отвечающая через RESPONSE_DELAY_SECONDS"""
+    await asyncio.sleep(RESPONSE_DELAY_SECONDS)
+    return web.json_response({"choices": [{"message": {"content": "ответ"}}]})
+
+
+async def _run_slow_response_within_deadline():
+    app = web.Application()
+    app.router.add_post("/", _slow_completion)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    # Четыре ключа - четыре попытки: раньше каждая получала лишь четверть бюджета
+    client = OpenRouterClient(
+        api_url=f"http://127.0.0.1:{port}/",
+        api_keys=[f"key-{i}-" + "x" * 20 for i in range(4)],
+        models=["stub/model"],
+        timeout=60
+    )
+    min_attempt_timeout = config.OPENROUTER_MIN_ATTEMPT_TIMEOUT_SECONDS
+    config.OPENROUTER_MIN_ATTEMPT_TIMEOUT_SECONDS = 1.0
+    try:
+        started = time.monotonic()
+        text = await client.generate_text("system", "user", deadline_seconds=DEADLINE_SECONDS)
+        elapsed = time.monotonic() - started
+    finally:
+        config.OPENROUTER_MIN_ATTEMPT_TIMEOUT_SECONDS = min_attempt_timeout
+        await client.close()
+        await runner.cleanup()
+
+    assert text == "ответ", text
+    assert elapsed < DEADLINE_SECONDS, elapsed
+    logger.info(f"Ответ получен за {elapsed:.2f} сек. при бюджете {DEADLINE_SECONDS} сек.")
+
+
+def test_slow_response_within_deadline():
+    """
+    Ответ медленнее равной доли бюджета на попытку, но быстрее срока запроса,
+    возвращается с первой попытки
+    """
+    asyncio.run(_run_slow_response_within_deadline())
+
+
+if __name__ == "__main__":
+    test_slow_response_within_deadline()
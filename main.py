@@ -4,6 +4,7 @@ Moon Calendar API Service - Main Application
 import asyncio
 import logging
 from contextlib import asynccontextmanager
+from datetime import date
 import time
 import os
 from pathlib import Path
@@ -15,9 +16,11 @@ from fastapi.responses import JSONResponse
 
 import config
 from core.cache import CacheManager
-from api.v1 import health, moon_calendar, tarot, astro_bot, book_czin, crypto_forecast
+from core.parse_pool import ParsePool
+from api.v1 import health, moon_calendar, tarot, astro_bot, book_czin, crypto_forecast, admin, tarot_puzzlebot
 from api.middleware import log_request_middleware
 from modules.moon_calendar import MoonCalendarParser, MoonCalendarOpenRouterService, MoonCalendarTasks
+from modules.moon_calendar.astronomy import create_moon_ephemeris
 from modules.moon_calendar.tasks import MoonCalendarTasks
 from api.v1.tarot_puzzlebot import router as tarot_puzzlebot_router
 from core.openrouter_client import OpenRouterClient
@@ -46,11 +49,15 @@ logger = logging.getLogger(__name__)
 async def update_moon_calendar_cache_task(tasks: MoonCalendarTasks):
     """Фоновая задача обновления кэша лунного календаря и генерации AI-ответов"""
     try:
-        # Сначала обновляем кэш и генерируем ответы сразу при запуске
-        logger.info("Запуск начального обновления кэша и генерации AI-ответов...")
+        # Сначала обновляем кэш и генерируем ответы сразу при запуске,
+        # если данные еще не восстановлены из Redis или снимка кэша
         try:
-            await tasks.update_calendar_cache_and_generate_ai_responses()
-            logger.info("Начальное обновление кэша и генерация AI-ответов выполнены успешно.")
+            if await tasks.get_missing_dates():
+                logger.info("Запуск начального обновления кэша и генерации AI-ответов...")
+                await tasks.update_calendar_cache_and_generate_ai_responses()
+                logger.info("Начальное обновление кэша и генерация AI-ответов выполнены успешно.")
+            else:
+                logger.info("Данные лунного календаря уже есть в кэше, начальное обновление пропущено.")
         except Exception as e:
             logger.error(f"Ошибка при начальном обновлении кэша: {e}", exc_info=True)
             logger.info("Несмотря на ошибку, продолжаем запуск периодического обновления.")
@@ -74,6 +81,17 @@ async def update_moon_calendar_cache_task(tasks: MoonCalendarTasks):
         logger.critical(f"Критическая ошибка в фоновой задаче обновления кэша: {e}", exc_info=True)
         # Даже при критической ошибке не завершаем процесс, чтобы API продолжало работать
 
+async def cache_snapshot_task(cache_manager: CacheManager):
+    """Фоновая задача периодического сохранения снимка кэша на диск"""
+    interval = config.CACHE_SNAPSHOT_INTERVAL_SECONDS
+    logger.info(f"Периодическое сохранение снимка кэша каждые {interval} сек. в {config.CACHE_SNAPSHOT_PATH}")
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await cache_manager.dump_snapshot(config.CACHE_SNAPSHOT_PATH, config.CACHE_SNAPSHOT_NAMESPACES)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении снимка кэша: {e}", exc_info=True)
+
 # ================= APPLICATION =================
 
 @asynccontextmanager
@@ -101,9 +119,41 @@ async def lifespan(app: FastAPI):
                 await asyncio.sleep(1)  # Небольшая пауза перед следующей попыткой
     
     if not redis_connected:
-        logger.critical(f"Не удалось подключиться к Redis после {max_redis_connect_attempts} попыток! Приложение может работать некорректно.")
+        logger.critical(f"Не удалось подключиться к Redis после {max_redis_connect_attempts} попыток! Кэш работает в резервном режиме (память процесса), переподключение выполняется в фоне.")
+    
+    # Восстанавливаем кэш из снимка до приема запросов, чтобы первые запросы
+    # после деплоя или очистки Redis не ждали парсинга и генерации AI-ответов
+    snapshot_task = None
+    if config.CACHE_SNAPSHOT_ENABLED:
+        await cache_manager.load_snapshot(config.CACHE_SNAPSHOT_PATH)
+        snapshot_task = asyncio.create_task(cache_snapshot_task(cache_manager))
     
-    parser = MoonCalendarParser(timeout=config.PARSER_TIMEOUT)
+    # Разбор страниц Rambler выполняется вне цикла событий, чтобы фоновое обновление
+    # календаря не задерживало остальные запросы воркера
+    parse_pool = ParsePool(
+        mode=config.PARSE_POOL_MODE,
+        workers=config.PARSE_POOL_WORKERS,
+        queue_size=config.PARSE_POOL_QUEUE_SIZE,
+        queue_timeout=config.PARSE_POOL_QUEUE_TIMEOUT_SECONDS
+    )
+    parser = MoonCalendarParser(
+        timeout=config.PARSER_TIMEOUT,
+        backend=config.MOON_PARSER_BACKEND,
+        pool=parse_pool,
+        max_concurrent_fetches=config.MOON_PARSER_MAX_CONCURRENT_FETCHES,
+        fetch_rate=config.MOON_PARSER_FETCH_RATE_PER_SECOND
+    )
+    
+    # Локальный расчет фаз Луны и лунных дней: резерв при недоступности Rambler и сверка
+    # спарсенных данных. Таблицы на текущий год строятся заранее (около 0,1 с)
+    moon_ephemeris = create_moon_ephemeris(
+        latitude=config.MOON_ASTRONOMY_LATITUDE,
+        longitude=config.MOON_ASTRONOMY_LONGITUDE,
+        utc_offset_hours=config.MOON_ASTRONOMY_UTC_OFFSET_HOURS
+    )
+    if moon_ephemeris is not None:
+        today = date.today()
+        moon_ephemeris.prepare(today, today)
     
     # Инициализация OpenRouter клиента для лунного календаря
     openrouter_client_for_moon_tasks = OpenRouterClient(
@@ -120,7 +170,8 @@ async def lifespan(app: FastAPI):
         cache_manager=cache_manager, # Передаем экземпляр cache_manager
         parser=parser,
         openrouter_client=openrouter_client_for_moon_tasks,
-        prompts_config=config.OPENROUTER_PROMPTS
+        prompts_config=config.OPENROUTER_PROMPTS,
+        ephemeris=moon_ephemeris
     )
     
     moon_calendar_tasks = MoonCalendarTasks(
@@ -160,6 +211,18 @@ async def lifespan(app: FastAPI):
         prompts_config=config.CRYPTO_FORECAST_PROMPTS
     )
     
+    # Открываем пулы HTTP-соединений клиентов OpenRouter (включая клиенты роутеров Таро)
+    # и подключаем к ним кэш ответов LLM
+    openrouter_clients = {
+        "moon_calendar": openrouter_client_for_moon_tasks,
+        "crypto_forecast": openrouter_client_for_crypto,
+        "tarot": tarot.openrouter_client,
+        "tarot_puzzlebot": tarot_puzzlebot.openrouter_client
+    }
+    for client in openrouter_clients.values():
+        client.use_response_cache(cache_manager)
+        await client.start()
+    
     # Запускаем фоновую задачу обновления кэша лунного календаря
     update_calendar_task = asyncio.create_task(update_moon_calendar_cache_task(moon_calendar_tasks))
     
@@ -168,7 +231,11 @@ async def lifespan(app: FastAPI):
     app.state.cache_manager = cache_manager
     # Добавляем другие зависимости в state, если они могут понадобиться в других частях приложения
     app.state.parser = parser
+    app.state.parse_pool = parse_pool
+    app.state.moon_ephemeris = moon_ephemeris
     app.state.openrouter_client_for_moon_tasks = openrouter_client_for_moon_tasks
+    app.state.openrouter_client_for_crypto = openrouter_client_for_crypto
+    app.state.openrouter_clients = openrouter_clients
     app.state.moon_openrouter_service = moon_openrouter_service
     app.state.moon_calendar_tasks = moon_calendar_tasks
     app.state.book_czin_service = book_czin_service
@@ -180,15 +247,29 @@ async def lifespan(app: FastAPI):
     # Shutdown
     logger.info("Выключение Moon Calendar API Service...")
     update_calendar_task.cancel()
+    if snapshot_task:
+        snapshot_task.cancel()
     
-    try:
-        if not update_calendar_task.done():
-             await update_calendar_task
-    except asyncio.CancelledError:
-        pass
-    except Exception as e:
-         logger.error(f"Ошибка при отмене задач: {e}", exc_info=True)
+    for task in (update_calendar_task, snapshot_task):
+        try:
+            if task and not task.done():
+                 await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+             logger.error(f"Ошибка при отмене задач: {e}", exc_info=True)
+    
+    # Сохраняем снимок кэша перед закрытием соединения с Redis
+    if config.CACHE_SNAPSHOT_ENABLED:
+        await cache_manager.dump_snapshot(config.CACHE_SNAPSHOT_PATH, config.CACHE_SNAPSHOT_NAMESPACES)
 
+    # Закрываем пулы HTTP-соединений OpenRouter
+    for client in openrouter_clients.values():
+        await client.close()
+    
+    # Останавливаем пул разбора страниц
+    parse_pool.shutdown()
+    
     # Закрываем соединение с Redis
     await cache_manager.close()
     logger.info("Redis connection closed.")
@@ -255,6 +336,7 @@ app.include_router(astro_bot.router, tags=["astro_bot"])
 app.include_router(tarot_puzzlebot_router)
 app.include_router(book_czin.router)
 app.include_router(crypto_forecast.router)
+app.include_router(admin.router)
 
 # ================= ENTRY POINT =================
 
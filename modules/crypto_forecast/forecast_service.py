@@ -1,12 +1,15 @@
 """
 Сервис для генерации прогнозов криптовалют с использованием данных Bybit и моделей ИИ
 """
+import asyncio
 import logging
-import json
 from typing import Dict, List, Any, Optional
 from datetime import datetime, timedelta
 
+from fastapi import HTTPException
+
 from core.cache import CacheManager
+from core.exceptions import NetworkException
 from core.openrouter_client import OpenRouterClient
 from modules.crypto_forecast.bybit_client import BybitClient, SymbolNotFoundError
 import config
@@ -42,13 +45,13 @@ class CryptoForecastService:
     
     def _generate_cache_key(self, symbol: str, period: str) -> str:
         """
-        Генерация ключа для кэша
+        Генерация ключа для кэша в пространстве имен прогнозов
         
         :param symbol: Символ криптовалюты
         :param period: Период прогноза
         :return: Ключ для кэша
         """
-        return f"crypto_forecast_{symbol.lower()}_{period}"
+        return f"{symbol.lower()}_{period}"
     
     async def _prepare_forecast_prompt(
         self,
@@ -157,6 +160,42 @@ class CryptoForecastService:
         
         return prompt
     
+    async def _build_forecast(self, symbol: str, period: str, llm_caller: str = "crypto") -> Dict[str, Any]:
+        """
+        Генерация нового прогноза по рыночным данным (producer для get_or_compute)
+        
+        :param symbol: Символ криптовалюты с суффиксом USDT
+        :param period: Период прогноза ("hour", "day", "week")
+        :param llm_caller: Метка в учете токенов и задержек LLM
+        :return: Прогноз криптовалюты
+        """
+        # Получаем рыночные данные
+        market_data = await self.bybit_client.get_market_data(symbol)
+        
+        # Подготавливаем промпт для модели
+        prompt = await self._prepare_forecast_prompt(market_data, period)
+        
+        # Получаем конфигурацию промпта
+        prompt_config = self.prompts_config.get("default", {})
+        
+        # Генерируем прогноз с использованием модели
+        forecast_text = await self.openrouter_client.generate_text(
+            system_message=prompt_config.get("system_message", "Ты — эксперт по криптовалютам и техническому анализу."),
+            user_message=prompt,
+            max_tokens=prompt_config.get("max_tokens", 1500),
+            temperature=prompt_config.get("temperature", 0.7),
+            caller=llm_caller
+        )
+        
+        # Формируем результат
+        return {
+            "symbol": symbol,
+            "period": period,
+            "current_price": market_data["ticker"]["list"][0].get("lastPrice", "Неизвестно") if "list" in market_data["ticker"] and market_data["ticker"]["list"] else "Неизвестно",
+            "forecast": forecast_text,
+            "generated_at": datetime.now().isoformat(),
+        }
+    
     async def generate_forecast(
         self,
         symbol: str,
@@ -176,55 +215,25 @@ class CryptoForecastService:
             if not symbol.endswith("USDT"):
                 symbol = f"{symbol}USDT"
             
-            # Проверяем кэш (проверка символа произойдет на уровне bybit_client)
+            # Берем прогноз из кэша. Прогноз старше CRYPTO_FORECAST_CACHE_TTL отдается сразу
+            # и обновляется в фоне; новый прогноз генерируется один раз для всех воркеров.
+            # Проверка символа произойдет на уровне bybit_client
             cache_key = self._generate_cache_key(symbol, period)
-            
-            if not force_refresh and self.cache_manager.redis:
-                cached_data = await self.cache_manager.redis.get(cache_key)
-                if cached_data:
-                    try:
-                        forecast_data = json.loads(cached_data)
-                        logger.info(f"Получен прогноз из кэша для {symbol}, период {period}")
-                        return forecast_data
-                    except json.JSONDecodeError:
-                        logger.warning(f"Ошибка декодирования данных из кэша для {symbol}, период {period}")
-            
-            # Получаем рыночные данные
-            market_data = await self.bybit_client.get_market_data(symbol)
-            
-            # Подготавливаем промпт для модели
-            prompt = await self._prepare_forecast_prompt(market_data, period)
-            
-            # Получаем конфигурацию промпта
-            prompt_config = self.prompts_config.get("default", {})
-            
-            # Генерируем прогноз с использованием модели
-            forecast_text = await self.openrouter_client.generate_text(
-                system_message=prompt_config.get("system_message", "Ты — эксперт по криптовалютам и техническому анализу."),
-                user_message=prompt,
-                max_tokens=prompt_config.get("max_tokens", 1500),
-                temperature=prompt_config.get("temperature", 0.7)
+            forecast_data = await self.cache_manager.get_or_compute(
+                CacheManager.NS_CRYPTO_FORECAST,
+                cache_key,
+                lambda: self._build_forecast(symbol, period),
+                ttl=config.CRYPTO_FORECAST_CACHE_HARD_TTL.get(period, 14400),
+                soft_ttl=config.CRYPTO_FORECAST_CACHE_TTL.get(period, 3600),
+                force_refresh=force_refresh,
+                # Неизвестный символ и отказы LLM запоминаются ненадолго
+                negative_ttls={
+                    SymbolNotFoundError: config.NEGATIVE_CACHE_TTL_SYMBOL_NOT_FOUND,
+                    NetworkException: config.NEGATIVE_CACHE_TTL_LLM_FAILURE,
+                    HTTPException: config.NEGATIVE_CACHE_TTL_LLM_FAILURE
+                }
             )
-            
-            # Формируем результат
-            forecast_data = {
-                "symbol": symbol,
-                "period": period,
-                "current_price": market_data["ticker"]["list"][0].get("lastPrice", "Неизвестно") if "list" in market_data["ticker"] and market_data["ticker"]["list"] else "Неизвестно",
-                "forecast": forecast_text,
-                "generated_at": datetime.now().isoformat(),
-            }
-            
-            # Сохраняем в кэш с соответствующим TTL
-            if self.cache_manager.redis:
-                ttl = config.CRYPTO_FORECAST_CACHE_TTL.get(period, 3600)
-                await self.cache_manager.redis.set(
-                    cache_key,
-                    json.dumps(forecast_data),
-                    ex=ttl
-                )
-                logger.info(f"Прогноз для {symbol}, период {period} сохранен в кэш с TTL {ttl} сек.")
-            
+            logger.info(f"Прогноз для {symbol}, период {period} получен")
             return forecast_data
         
         except SymbolNotFoundError:
@@ -234,13 +243,75 @@ class CryptoForecastService:
             logger.error(f"Ошибка при генерации прогноза для {symbol}, период {period}: {e}", exc_info=True)
             raise
     
+    async def refresh_forecasts(
+        self,
+        symbols: List[str],
+        periods: List[str],
+        pause_seconds: float = 1.0
+    ) -> Dict[str, int]:
+        """
+        Пакетное обновление прогнозов: все прогнозы читаются из кэша одним запросом,
+        заново генерируются только отсутствующие и устаревшие, а новые прогнозы
+        записываются одним конвейером на каждый период.
+        
+        :param symbols: Символы криптовалют (например, "BTC", "ETH")
+        :param periods: Периоды прогнозов ("hour", "day", "week")
+        :param pause_seconds: Пауза между генерациями для снижения нагрузки
+        :return: Статистика: свежие (fresh), обновленные (updated) и ошибки (failed)
+        """
+        symbols = [symbol if symbol.endswith("USDT") else f"{symbol}USDT" for symbol in symbols]
+        keys = {
+            (symbol, period): self._generate_cache_key(symbol, period)
+            for symbol in symbols
+            for period in periods
+        }
+        cached = await self.cache_manager.get_many(CacheManager.NS_CRYPTO_FORECAST, list(keys.values()))
+        
+        stats = {"fresh": 0, "updated": 0, "failed": 0}
+        new_forecasts: Dict[str, Dict[str, Any]] = {period: {} for period in periods}
+        now = datetime.now()
+        
+        for (symbol, period), cache_key in keys.items():
+            forecast = cached.get(cache_key)
+            soft_ttl = config.CRYPTO_FORECAST_CACHE_TTL.get(period, 3600)
+            if forecast:
+                try:
+                    age = now - datetime.fromisoformat(forecast["generated_at"])
+                    if age < timedelta(seconds=soft_ttl):
+                        stats["fresh"] += 1
+                        continue
+                except (KeyError, TypeError, ValueError):
+                    pass
+            
+            try:
+                logger.info(f"Обновление прогноза для {symbol}, период {period}")
+                new_forecasts[period][cache_key] = await self._build_forecast(symbol, period, llm_caller="crypto_background")
+                stats["updated"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                logger.error(f"Ошибка при обновлении прогноза для {symbol}, период {period}: {e}", exc_info=True)
+            
+            # Небольшая пауза между запросами для снижения нагрузки
+            await asyncio.sleep(pause_seconds)
+        
+        for period, forecasts in new_forecasts.items():
+            if forecasts:
+                await self.cache_manager.set_many(
+                    CacheManager.NS_CRYPTO_FORECAST,
+                    forecasts,
+                    ttl=config.CRYPTO_FORECAST_CACHE_HARD_TTL.get(period, 14400),
+                    soft_ttl=config.CRYPTO_FORECAST_CACHE_TTL.get(period, 3600)
+                )
+        
+        return stats
+    
     async def get_available_cryptos(self) -> Dict[str, List[str]]:
         """
         Получение списка доступных криптовалют
         
         :return: Словарь со списками криптовалют
         """
-        try:
+        async def load_cryptos() -> Dict[str, List[str]]:
             popular_cryptos = await self.bybit_client.get_popular_cryptos()
             all_symbols = await self.bybit_client.get_available_symbols()
             
@@ -249,6 +320,11 @@ class CryptoForecastService:
                 "all": [symbol.replace("USDT", "") for symbol in all_symbols if symbol.endswith("USDT")]
             }
         
+        try:
+            # Список хранится в общем кэше, чтобы переживать перезапуски (снимок кэша)
+            return await self.cache_manager.get_or_compute(
+                CacheManager.NS_CRYPTO_SYMBOLS, "available", load_cryptos
+            )
         except Exception as e:
             logger.error(f"Ошибка при получении списка доступных криптовалют: {e}", exc_info=True)
             raise 
\ No newline at end of file
@@ -50,41 +50,17 @@ class CryptoForecastTasks:
             # Периоды прогнозов
             periods = ["hour", "day", "week"]
             
-            # Счетчики для статистики
             total_forecasts = len(popular_symbols) * len(periods)
-            successful_forecasts = 0
-            failed_forecasts = 0
-            
             logger.info(f"Начинаем обновление {total_forecasts} прогнозов для {len(popular_symbols)} популярных криптовалют")
             
-            # Обновляем прогнозы для каждой криптовалюты и каждого периода
-            for symbol in popular_symbols:
-                for period in periods:
-                    try:
-                        logger.info(f"Обновление прогноза для {symbol}, период {period}")
-                        
-                        # Генерируем прогноз с принудительным обновлением
-                        await self.forecast_service.generate_forecast(
-                            symbol=symbol,
-                            period=period,
-                            user_type="free",  # Используем базовый тип пользователя для кэширования
-                            force_refresh=True
-                        )
-                        
-                        successful_forecasts += 1
-                        logger.info(f"Успешно обновлен прогноз для {symbol}, период {period}")
-                        
-                        # Небольшая пауза между запросами для снижения нагрузки
-                        await asyncio.sleep(1)
-                    
-                    except Exception as e:
-                        failed_forecasts += 1
-                        logger.error(f"Ошибка при обновлении прогноза для {symbol}, период {period}: {e}", exc_info=True)
-                        
-                        # Пауза перед следующей попыткой
-                        await asyncio.sleep(5)
+            # Кэш читается и записывается пакетами, генерируются только отсутствующие
+            # и устаревшие прогнозы
+            stats = await self.forecast_service.refresh_forecasts(popular_symbols, periods)
             
-            logger.info(f"Обновление прогнозов завершено. Успешно: {successful_forecasts}, Ошибок: {failed_forecasts}")
+            logger.info(
+                f"Обновление прогнозов завершено. Актуальных: {stats['fresh']}, "
+                f"обновлено: {stats['updated']}, ошибок: {stats['failed']}"
+            )
             
         except Exception as e:
             logger.error(f"Критическая ошибка при обновлении прогнозов для популярных криптовалют: {e}", exc_info=True)
@@ -1,8 +1,9 @@
 """
 Модуль лунного календаря
 """
-from .models import MoonDayResponse, CalendarDayResponse, ApiResponse
+from .models import MoonDayResponse, CalendarDayResponse, CalendarRangeResponse, ApiResponse
 from .parser import MoonCalendarParser
+from .astronomy import MoonEphemeris
 from .service import MoonCalendarService
 from .openrouter_service import MoonCalendarOpenRouterService
 from .tasks import MoonCalendarTasks
@@ -10,8 +11,10 @@ from .tasks import MoonCalendarTasks
 __all__ = [
     'MoonDayResponse',
     'CalendarDayResponse',
+    'CalendarRangeResponse',
     'ApiResponse',
     'MoonCalendarParser',
+    'MoonEphemeris',
     'MoonCalendarService',
     'MoonCalendarOpenRouterService',
     'MoonCalendarTasks'
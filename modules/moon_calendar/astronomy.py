@@ -0,0 +1,544 @@
+"""
+Локальный расчет фаз Луны и лунных дней без загрузки страниц Rambler
+
+Моменты фаз рассчитываются по алгоритму Ж. Меёса ("Астрономические алгоритмы",
+гл. 49: средняя фаза и периодические поправки), положение Луны - по сокращенному
+ряду гл. 47 (главные члены долготы, широты и расстояния), освещенность - по
+формуле гл. 48, восходы Луны - по пересечению стандартной высоты восхода (гл. 15)
+на сетке времени с уточнением. Расчеты векторизованы NumPy по массивам моментов.
+
+Лунные дни считаются как в российских лунных календарях (и на Rambler): 1-й лунный
+день начинается в момент новолуния и длится до ближайшего восхода Луны, каждый
+следующий - от восхода до восхода, последний заканчивается в момент следующего
+новолуния. Восходы зависят от места наблюдения (по умолчанию Москва).
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import math
+import re
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - зависит от окружения
+    np = None
+
+from core.utils import format_datetime_ru
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+UNIX_EPOCH_JD = 2440587.5
+J2000_JD = 2451545.0
+SYNODIC_MONTH = 29.530588861
+# Разница TT - UT (около 69 секунд в 2020-х годах), в сутках
+DELTA_T_DAYS = 69.0 / 86400
+
+NEW_MOON, FIRST_QUARTER, FULL_MOON, LAST_QUARTER = range(4)
+PHASE_NAMES = {
+    NEW_MOON: "Новолуние",
+    FIRST_QUARTER: "Первая четверть",
+    FULL_MOON: "Полнолуние",
+    LAST_QUARTER: "Последняя четверть"
+}
+WAXING_MOON = "Растущая Луна"
+WANING_MOON = "Убывающая Луна"
+
+# Шаг сетки поиска восходов (сутки): на широтах России Луна находится над горизонтом
+# не меньше нескольких часов, поэтому два пересечения горизонта в одном шаге исключены.
+# Размер блока сетки ограничивает память матриц рядов
+RISE_GRID_STEP = 30 / 1440
+GRID_CHUNK = 8192
+
+MONTHS_RU = ("января", "февраля", "марта", "апреля", "мая", "июня",
+             "июля", "августа", "сентября", "октября", "ноября", "декабря")
+_RU_DATETIME = re.compile(r"(\d{1,2}) (\S+) (\d{4}) г\., (\d{1,2}):(\d{2})")
+
+# Периодические поправки моментов фаз (Меёс, гл. 49):
+# (коэффициент, степень E, множители M, M', F, Ω)
+_NEW_MOON_TERMS = [
+    (-0.40720, 0, 0, 1, 0, 0), (0.17241, 1, 1, 0, 0, 0), (0.01608, 0, 0, 2, 0, 0),
+    (0.01039, 0, 0, 0, 2, 0), (0.00739, 1, -1, 1, 0, 0), (-0.00514, 1, 1, 1, 0, 0),
+    (0.00208, 2, 2, 0, 0, 0)
+]
+_FULL_MOON_TERMS = [
+    (-0.40614, 0, 0, 1, 0, 0), (0.17302, 1, 1, 0, 0, 0), (0.01614, 0, 0, 2, 0, 0),
+    (0.01043, 0, 0, 0, 2, 0), (0.00734, 1, -1, 1, 0, 0), (-0.00515, 1, 1, 1, 0, 0),
+    (0.00209, 2, 2, 0, 0, 0)
+]
+# Общая часть рядов новолуния и полнолуния
+_SYZYGY_TERMS = [
+    (-0.00111, 0, 0, 1, -2, 0), (-0.00057, 0, 0, 1, 2, 0), (0.00056, 1, 1, 2, 0, 0),
+    (-0.00042, 0, 0, 3, 0, 0), (0.00042, 1, 1, 0, 2, 0), (0.00038, 1, 1, 0, -2, 0),
+    (-0.00024, 1, -1, 2, 0, 0), (-0.00017, 0, 0, 0, 0, 1), (-0.00007, 0, 2, 1, 0, 0),
+    (0.00004, 0, 0, 2, -2, 0), (0.00004, 0, 3, 0, 0, 0), (0.00003, 0, 1, 1, -2, 0),
+    (0.00003, 0, 0, 2, 2, 0), (-0.00003, 0, 1, 1, 2, 0), (0.00003, 0, -1, 1, 2, 0),
+    (-0.00002, 0, -1, 1, -2, 0), (-0.00002, 0, 1, 3, 0, 0), (0.00002, 0, 0, 4, 0, 0)
+]
+_QUARTER_TERMS = [
+    (-0.62801, 0, 0, 1, 0, 0), (0.17172, 1, 1, 0, 0, 0), (-0.01183, 1, 1, 1, 0, 0),
+    (0.00862, 0, 0, 2, 0, 0), (0.00804, 0, 0, 0, 2, 0), (0.00454, 1, -1, 1, 0, 0),
+    (0.00204, 2, 2, 0, 0, 0), (-0.00180, 0, 0, 1, -2, 0), (-0.00070, 0, 0, 1, 2, 0),
+    (-0.00040, 0, 0, 3, 0, 0), (-0.00034, 1, -1, 2, 0, 0), (0.00032, 1, 1, 0, 2, 0),
+    (0.00032, 1, 1, 0, -2, 0), (-0.00028, 2, 2, 1, 0, 0), (0.00027, 1, 1, 2, 0, 0),
+    (-0.00017, 0, 0, 0, 0, 1), (-0.00005, 0, -1, 1, -2, 0), (0.00004, 0, 0, 2, 2, 0),
+    (-0.00004, 0, 1, 1, 2, 0), (0.00004, 0, -2, 1, 0, 0), (0.00003, 0, 1, 1, -2, 0),
+    (0.00003, 0, 3, 0, 0, 0), (0.00002, 0, 0, 2, -2, 0), (0.00002, 0, -1, 1, 2, 0),
+    (-0.00002, 0, 1, 3, 0, 0)
+]
+# Планетные поправки всех фаз: (коэффициент, начальное значение, скорость на лунацию)
+_PLANETARY_TERMS = [
+    (0.000325, 299.77, 0.107408), (0.000165, 251.88, 0.016321), (0.000164, 251.83, 26.651886),
+    (0.000126, 349.42, 36.412478), (0.000110, 84.66, 18.206239), (0.000062, 141.74, 53.303771),
+    (0.000060, 207.14, 2.453732), (0.000056, 154.84, 7.306860), (0.000047, 34.52, 27.261239),
+    (0.000042, 207.19, 0.121824), (0.000040, 291.34, 1.844379), (0.000037, 161.72, 24.198154),
+    (0.000035, 239.56, 25.513099), (0.000023, 331.55, 3.592518)
+]
+
+# Долгота (1e-6 градуса) и расстояние (1e-3 км) Луны (Меёс, табл. 47.A):
+# (множители D, M, M', F, Σl, Σr)
+_LONGITUDE_TERMS = [
+    (0, 0, 1, 0, 6288774, -20905355), (2, 0, -1, 0, 1274027, -3699111), (2, 0, 0, 0, 658314, -2955968),
+    (0, 0, 2, 0, 213618, -569925), (0, 1, 0, 0, -185116, 48888), (0, 0, 0, 2, -114332, -3149),
+    (2, 0, -2, 0, 58793, 246158), (2, -1, -1, 0, 57066, -152138), (2, 0, 1, 0, 53322, -170733),
+    (2, -1, 0, 0, 45758, -204586), (0, 1, -1, 0, -40923, -129620), (1, 0, 0, 0, -34720, 108743),
+    (0, 1, 1, 0, -30383, 104755), (2, 0, 0, -2, 15327, 10321), (0, 0, 1, 2, -12528, 0),
+    (0, 0, 1, -2, 10980, 79661), (4, 0, -1, 0, 10675, -34782), (0, 0, 3, 0, 10034, -23210),
+    (4, 0, -2, 0, 8548, -21636), (2, 1, -1, 0, -7888, 24208), (2, 1, 0, 0, -6766, 30824),
+    (1, 0, -1, 0, -5163, -8379), (1, 1, 0, 0, 4987, -16675), (2, -1, 1, 0, 4036, -12831),
+    (2, 0, 2, 0, 3994, -10445), (4, 0, 0, 0, 3861, -11650), (2, 0, -3, 0, 3665, 14403),
+    (0, 1, -2, 0, -2689, -7003), (2, 0, -1, 2, -2602, 0), (2, -1, -2, 0, 2390, 10056),
+    (1, 0, 1, 0, -2348, 6322), (2, -2, 0, 0, 2236, -9884), (0, 1, 2, 0, -2120, 5751),
+    (0, 2, 0, 0, -2069, 0), (2, -2, -1, 0, 2048, -4950), (2, 0, 1, -2, -1773, 4130),
+    (2, 0, 0, 2, -1595, 0), (4, -1, -1, 0, 1215, -3958), (0, 0, 2, 2, -1110, 0),
+    (3, 0, -1, 0, -892, 3258), (2, 1, 1, 0, -810, 2616), (4, -1, -2, 0, 759, -1897),
+    (0, 2, -1, 0, -713, -2117), (2, 2, -1, 0, -700, 2354), (2, 1, -2, 0, 691, 0),
+    (2, -1, 0, -2, 596, 0), (4, 0, 1, 0, 549, -1423), (0, 0, 4, 0, 537, -1117),
+    (4, -1, 0, 0, 520, -1571), (1, 0, -2, 0, -487, -1739), (2, 1, 0, -2, -399, 0),
+    (0, 0, 2, -2, -381, -4421), (1, 1, 1, 0, 351, 0), (3, 0, -2, 0, -340, 0),
+    (4, 0, -3, 0, 330, 0), (2, -1, 2, 0, 327, 0), (0, 2, 1, 0, -323, 1165),
+    (1, 1, -1, 0, 299, 0), (2, 0, 3, 0, 294, 0), (2, 0, -1, -2, 0, 8752)
+]
+# Широта Луны (1e-6 градуса, Меёс, табл. 47.B, главные члены): (множители D, M, M', F, Σb)
+_LATITUDE_TERMS = [
+    (0, 0, 0, 1, 5128122), (0, 0, 1, 1, 280602), (0, 0, 1, -1, 277693), (2, 0, 0, -1, 173237),
+    (2, 0, -1, 1, 55413), (2, 0, -1, -1, 46271), (2, 0, 0, 1, 32573), (0, 0, 2, 1, 17198),
+    (2, 0, 1, -1, 9266), (0, 0, 2, -1, 8822), (2, -1, 0, -1, 8216), (2, 0, -2, -1, 4324),
+    (2, 0, 1, 1, 4200), (2, 1, 0, -1, -3359), (2, -1, -1, 1, 2463), (2, -1, 0, 1, 2211),
+    (2, -1, -1, -1, 2065), (0, 1, -1, -1, -1870), (4, 0, -1, -1, 1828), (0, 1, 0, 1, -1794),
+    (0, 0, 0, 3, -1749), (0, 1, -1, 1, -1565), (1, 0, 0, 1, -1491), (0, 1, 1, 1, -1475),
+    (0, 1, 1, -1, -1410), (0, 1, 0, -1, -1344), (1, 0, 0, -1, -1335), (0, 0, 3, 1, 1107),
+    (4, 0, 0, -1, 1021), (4, 0, -1, 1, 833)
+]
+
+if np is not None:
+    _PHASE_TERMS = {
+        NEW_MOON: np.array(_NEW_MOON_TERMS + _SYZYGY_TERMS, dtype=float),
+        FULL_MOON: np.array(_FULL_MOON_TERMS + _SYZYGY_TERMS, dtype=float),
+        FIRST_QUARTER: np.array(_QUARTER_TERMS, dtype=float),
+        LAST_QUARTER: np.array(_QUARTER_TERMS, dtype=float)
+    }
+    _PLANETARY = np.array(_PLANETARY_TERMS, dtype=float)
+    _LONGITUDE = np.array(_LONGITUDE_TERMS, dtype=float)
+    _LATITUDE = np.array(_LATITUDE_TERMS, dtype=float)
+
+
+def phase_times(k: "np.ndarray", phase: int) -> "np.ndarray":
+    """
+    Моменты фазы Луны для номеров лунаций (Меёс, гл. 49)
+
+    :param k: Номера лунаций от новолуния 6 января 2000 г. (целые)
+    :param phase: NEW_MOON, FIRST_QUARTER, FULL_MOON или LAST_QUARTER
+    :return: Юлианские даты фаз (UT)
+    """
+    k = np.asarray(k, dtype=float) + phase / 4
+    t = k / 1236.85
+    jde = (2451550.09766 + SYNODIC_MONTH * k + 0.00015437 * t ** 2
+           - 0.000000150 * t ** 3 + 0.00000000073 * t ** 4)
+    e = 1 - 0.002516 * t - 0.0000074 * t ** 2
+    m = np.radians(2.5534 + 29.10535670 * k - 0.0000014 * t ** 2 - 0.00000011 * t ** 3)
+    mp = np.radians(201.5643 + 385.81693528 * k + 0.0107582 * t ** 2 + 0.00001238 * t ** 3 - 0.000000058 * t ** 4)
+    f = np.radians(160.7108 + 390.67050284 * k - 0.0016118 * t ** 2 - 0.00000227 * t ** 3 + 0.000000011 * t ** 4)
+    omega = np.radians(124.7746 - 1.56375588 * k + 0.0020672 * t ** 2 + 0.00000215 * t ** 3)
+
+    terms = _PHASE_TERMS[phase]
+    args = terms[:, 2:] @ np.vstack([m, mp, f, omega])
+    correction = (terms[:, :1] * e ** terms[:, 1:2] * np.sin(args)).sum(axis=0)
+    if phase in (FIRST_QUARTER, LAST_QUARTER):
+        w = (0.00306 - 0.00038 * e * np.cos(m) + 0.00026 * np.cos(mp) - 0.00002 * np.cos(mp - m)
+             + 0.00002 * np.cos(mp + m) + 0.00002 * np.cos(2 * f))
+        correction += w if phase == FIRST_QUARTER else -w
+
+    planetary_args = np.radians(_PLANETARY[:, 1:2] + _PLANETARY[:, 2:3] * k)
+    planetary_args[0] -= np.radians(0.009173 * t ** 2)
+    correction += _PLANETARY[:, 0] @ np.sin(planetary_args)
+    return jde + correction - DELTA_T_DAYS
+
+
+def _fundamental_arguments(jd: "np.ndarray") -> Tuple["np.ndarray", ...]:
+    """Средняя долгота Луны L', элонгация D, аномалии M и M', аргумент широты F (градусы) и E"""
+    t = (jd + DELTA_T_DAYS - J2000_JD) / 36525
+    lp = 218.3164477 + 481267.88123421 * t - 0.0015786 * t ** 2 + t ** 3 / 538841 - t ** 4 / 65194000
+    d = 297.8501921 + 445267.1114034 * t - 0.0018819 * t ** 2 + t ** 3 / 545868 - t ** 4 / 113065000
+    m = 357.5291092 + 35999.0502909 * t - 0.0001536 * t ** 2 + t ** 3 / 24490000
+    mp = 134.9633964 + 477198.8675055 * t + 0.0087414 * t ** 2 + t ** 3 / 69699 - t ** 4 / 14712000
+    f = 93.2720950 + 483202.0175233 * t - 0.0036539 * t ** 2 - t ** 3 / 3526000 + t ** 4 / 863310000
+    e = 1 - 0.002516 * t - 0.0000074 * t ** 2
+    return t, lp, d, m, mp, f, e
+
+
+def moon_position(jd: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """
+    Геоцентрическое положение Луны (Меёс, гл. 47, главные члены рядов)
+
+    :param jd: Юлианские даты (UT)
+    :return: Прямое восхождение и склонение (радианы), расстояние (км)
+    """
+    t, lp, d, m, mp, f, e = _fundamental_arguments(np.asarray(jd, dtype=float))
+    fundamental = np.radians(np.vstack([d, m, mp, f]))
+
+    # Члены с аномалией Солнца M умножаются на E в степени |множителя M|
+    args = _LONGITUDE[:, :4] @ fundamental
+    e_factor = e ** np.abs(_LONGITUDE[:, 1:2])
+    sum_l = (_LONGITUDE[:, 4:5] * e_factor * np.sin(args)).sum(axis=0)
+    sum_r = (_LONGITUDE[:, 5:6] * e_factor * np.cos(args)).sum(axis=0)
+    args = _LATITUDE[:, :4] @ fundamental
+    sum_b = (_LATITUDE[:, 4:5] * e ** np.abs(_LATITUDE[:, 1:2]) * np.sin(args)).sum(axis=0)
+
+    a1 = np.radians(119.75 + 131.849 * t)
+    a2 = np.radians(53.09 + 479264.290 * t)
+    a3 = np.radians(313.45 + 481266.484 * t)
+    lp_rad, mp_rad, f_rad = np.radians(lp), np.radians(mp), np.radians(f)
+    sum_l += 3958 * np.sin(a1) + 1962 * np.sin(lp_rad - f_rad) + 318 * np.sin(a2)
+    sum_b += (-2235 * np.sin(lp_rad) + 382 * np.sin(a3) + 175 * np.sin(a1 - f_rad)
+              + 175 * np.sin(a1 + f_rad) + 127 * np.sin(lp_rad - mp_rad) - 115 * np.sin(lp_rad + mp_rad))
+
+    longitude = np.radians(lp + sum_l / 1e6)
+    latitude = np.radians(sum_b / 1e6)
+    distance = 385000.56 + sum_r / 1000
+    obliquity = np.radians(23.439291 - 0.0130042 * t)
+
+    right_ascension = np.arctan2(
+        np.sin(longitude) * np.cos(obliquity) - np.tan(latitude) * np.sin(obliquity), np.cos(longitude)
+    )
+    declination = np.arcsin(
+        np.sin(latitude) * np.cos(obliquity) + np.cos(latitude) * np.sin(obliquity) * np.sin(longitude)
+    )
+    return right_ascension, declination, distance
+
+
+def illumination(jd: "np.ndarray") -> "np.ndarray":
+    """
+    Освещенная доля диска Луны (Меёс, гл. 48, упрощенная формула фазового угла)
+
+    :param jd: Юлианские даты (UT)
+    :return: Доля от 0 (новолуние) до 1 (полнолуние)
+    """
+    _, _, d, m, mp, _, _ = _fundamental_arguments(np.asarray(jd, dtype=float))
+    d, m, mp = np.radians(d), np.radians(m), np.radians(mp)
+    phase_angle = (np.pi - d - np.radians(6.289) * np.sin(mp) + np.radians(2.100) * np.sin(m)
+                   - np.radians(1.274) * np.sin(2 * d - mp) - np.radians(0.658) * np.sin(2 * d)
+                   - np.radians(0.214) * np.sin(2 * mp) - np.radians(0.110) * np.sin(d))
+    return (1 + np.cos(phase_angle)) / 2
+
+
+def _rise_function(jd: "np.ndarray", latitude: float, longitude: float) -> "np.ndarray":
+    """Высота Луны над стандартной высотой восхода (радианы): ноль - момент восхода"""
+    right_ascension, declination, distance = moon_position(jd)
+    t = (jd - J2000_JD) / 36525
+    sidereal = np.radians(280.46061837 + 360.98564736629 * (jd - J2000_JD) + 0.000387933 * t ** 2 - t ** 3 / 38710000)
+    hour_angle = sidereal + longitude - right_ascension
+    altitude = np.arcsin(
+        np.sin(latitude) * np.sin(declination) + np.cos(latitude) * np.cos(declination) * np.cos(hour_angle)
+    )
+    # Стандартная высота: параллакс минус рефракция и полудиаметр (Меёс, гл. 15)
+    standard_altitude = 0.7275 * np.arcsin(6378.14 / distance) - np.radians(0.5667)
+    return altitude - standard_altitude
+
+
+def moonrises(jd_start: float, jd_end: float, latitude: float, longitude: float) -> "np.ndarray":
+    """
+    Моменты восхода Луны на интервале
+
+    :param jd_start: Начало интервала (юлианская дата, UT)
+    :param jd_end: Конец интервала (юлианская дата, UT)
+    :param latitude: Широта места наблюдения (радианы)
+    :param longitude: Восточная долгота места наблюдения (радианы)
+    :return: Юлианские даты восходов по возрастанию
+    """
+    grid = np.arange(jd_start, jd_end + RISE_GRID_STEP, RISE_GRID_STEP)
+    values = np.concatenate([
+        _rise_function(grid[i:i + GRID_CHUNK], latitude, longitude) for i in range(0, len(grid), GRID_CHUNK)
+    ])
+    crossing = np.nonzero((values[:-1] < 0) & (values[1:] >= 0))[0]
+    low, high = grid[crossing], grid[crossing + 1]
+    f_low, f_high = values[crossing], values[crossing + 1]
+    # Метод ложного положения: высота между узлами сетки почти линейна
+    for _ in range(3):
+        middle = low - f_low * (high - low) / (f_high - f_low)
+        f_middle = _rise_function(middle, latitude, longitude)
+        below = f_middle < 0
+        low, f_low = np.where(below, middle, low), np.where(below, f_middle, f_low)
+        high, f_high = np.where(below, high, middle), np.where(below, f_high, f_middle)
+    return low - f_low * (high - low) / (f_high - f_low)
+
+
+def parse_datetime_ru(value: str) -> Optional[datetime]:
+    """
+    Разбор даты в формате format_datetime_ru ("20 мая 2025 г., 01:34")
+
+    :param value: Строка даты
+    :return: datetime без часового пояса или None
+    """
+    match = _RU_DATETIME.fullmatch(value.strip())
+    if not match or match.group(2) not in MONTHS_RU:
+        return None
+    day, month, year, hour, minute = match.groups()
+    return datetime(int(year), MONTHS_RU.index(month) + 1, int(day), int(hour), int(minute))
+
+
+class MoonEphemeris:
+    """
+    Локальный расчет фазы Луны и лунных дней для места наблюдения.
+
+    Таблицы новолуний, фаз и восходов строятся векторно сразу на целые годы
+    (с запасом в лунацию) и достраиваются при запросе дат вне таблиц; день
+    календаря затем собирается поиском по таблицам и запоминается, поэтому
+    повторные запросы занимают микросекунды.
+    """
+
+    def __init__(self, latitude: float = 55.7558, longitude: float = 37.6173, utc_offset_hours: float = 3.0, max_cached_days: int = 4096):
+        """
+        :param latitude: Широта места наблюдения в градусах (по умолчанию Москва)
+        :param longitude: Восточная долгота места наблюдения в градусах
+        :param utc_offset_hours: Смещение местного времени от UTC в часах (время в ответах)
+        :param max_cached_days: Максимум запомненных дней календаря
+        """
+        self.latitude = math.radians(latitude)
+        self.longitude = math.radians(longitude)
+        self.tz = timezone(timedelta(hours=utc_offset_hours))
+        self.max_cached_days = max_cached_days
+
+        # Покрытые таблицами годы (включительно)
+        self._years: Optional[Tuple[int, int]] = None
+        self._day_starts = None
+        self._day_ends = None
+        self._day_numbers = None
+        self._phase_times = None
+        self._phase_codes = None
+        self._days: Dict[date, Dict[str, Any]] = {}
+
+    def _jd(self, moment: datetime) -> float:
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=self.tz)
+        return moment.timestamp() / 86400 + UNIX_EPOCH_JD
+
+    def _local_day_bounds(self, calendar_date: date) -> Tuple[float, float]:
+        start = self._jd(datetime(calendar_date.year, calendar_date.month, calendar_date.day, tzinfo=self.tz))
+        return start, start + 1
+
+    def _to_datetime(self, jd: float) -> datetime:
+        """Юлианская дата -> местное время, округленное до минуты"""
+        timestamp = round((jd - UNIX_EPOCH_JD) * 1440) * 60
+        return datetime.fromtimestamp(timestamp, self.tz)
+
+    def _ensure_years(self, first_year: int, last_year: int) -> None:
+        """Построение таблиц, покрывающих годы first_year..last_year"""
+        if self._years and self._years[0] <= first_year and last_year <= self._years[1]:
+            return
+        if self._years:
+            first_year, last_year = min(first_year, self._years[0]), max(last_year, self._years[1])
+
+        # Запас в лунацию с обеих сторон, чтобы первый и последний лунные дни были полными
+        jd_start = self._jd(datetime(first_year, 1, 1, tzinfo=self.tz)) - SYNODIC_MONTH - 1
+        jd_end = self._jd(datetime(last_year + 1, 1, 1, tzinfo=self.tz)) + SYNODIC_MONTH + 1
+        k = np.arange(
+            math.floor((jd_start - 2451550.09766) / SYNODIC_MONTH),
+            math.ceil((jd_end - 2451550.09766) / SYNODIC_MONTH) + 1
+        )
+
+        phases = {phase: phase_times(k, phase) for phase in PHASE_NAMES}
+        new_moons = phases[NEW_MOON]
+        rises = moonrises(new_moons[0], new_moons[-1], self.latitude, self.longitude)
+
+        # Границы лунных дней: новолуния и восходы; номер дня - 1 для новолуния,
+        # для восхода - порядковый номер восхода в лунации + 1
+        lunation = np.searchsorted(new_moons, rises, side="right") - 1
+        first_rise = np.searchsorted(rises, new_moons, side="right")
+        rise_numbers = np.arange(len(rises)) - first_rise[lunation] + 2
+        starts = np.concatenate([new_moons, rises])
+        numbers = np.concatenate([np.ones(len(new_moons), dtype=int), rise_numbers])
+        order = np.argsort(starts, kind="stable")
+        starts, numbers = starts[order], numbers[order]
+
+        phase_times_all = np.concatenate(list(phases.values()))
+        phase_codes = np.concatenate([np.full(len(k), phase) for phase in phases])
+        order = np.argsort(phase_times_all)
+
+        self._day_starts = starts[:-1]
+        self._day_ends = starts[1:]
+        self._day_numbers = numbers[:-1]
+        self._phase_times = phase_times_all[order]
+        self._phase_codes = phase_codes[order]
+        self._years = (first_year, last_year)
+        logger.info(f"Рассчитаны таблицы фаз Луны и лунных дней на {first_year}-{last_year} гг.: "
+                    f"{len(new_moons)} новолуний, {len(rises)} восходов Луны.")
+
+    def prepare(self, start: date, end: date) -> None:
+        """
+        Заблаговременное построение таблиц на годы диапазона
+
+        :param start: Первый день
+        :param end: Последний день (включительно)
+        """
+        self._ensure_years(start.year, end.year)
+
+    def lunar_days(self, calendar_date: date) -> List[Tuple[int, datetime, datetime]]:
+        """
+        Лунные дни, приходящиеся на календарный день (местное время)
+
+        :param calendar_date: Дата календаря
+        :return: Номер, начало и конец каждого лунного дня
+        """
+        self._ensure_years(calendar_date.year, calendar_date.year)
+        day_start, day_end = self._local_day_bounds(calendar_date)
+        first = int(np.searchsorted(self._day_ends, day_start, side="right"))
+        last = int(np.searchsorted(self._day_starts, day_end, side="left"))
+        return [
+            (int(self._day_numbers[i]), self._to_datetime(self._day_starts[i]), self._to_datetime(self._day_ends[i]))
+            for i in range(first, last)
+        ]
+
+    def _phases_on(self, calendar_date: date) -> Tuple[List[str], str, str]:
+        """Главные фазы внутри дня и состояние Луны (растущая/убывающая) в начале и в конце дня"""
+        day_start, day_end = self._local_day_bounds(calendar_date)
+        first = int(np.searchsorted(self._phase_times, day_start))
+        last = int(np.searchsorted(self._phase_times, day_end))
+        principal = [PHASE_NAMES[int(code)] for code in self._phase_codes[first:last]]
+
+        def state(index: int) -> str:
+            # Последняя главная фаза до момента: после новолуния и первой четверти Луна растет
+            return WAXING_MOON if int(self._phase_codes[index - 1]) in (NEW_MOON, FIRST_QUARTER) else WANING_MOON
+
+        return principal, state(first), state(last)
+
+    def moon_phase(self, calendar_date: date) -> str:
+        """
+        Фаза Луны для дня: главная фаза, если ее момент приходится на этот день,
+        иначе растущая или убывающая Луна
+
+        :param calendar_date: Дата календаря
+        :return: Название фазы
+        """
+        self._ensure_years(calendar_date.year, calendar_date.year)
+        principal, start_state, _ = self._phases_on(calendar_date)
+        return principal[0] if principal else start_state
+
+    def calendar_day(self, calendar_date: date) -> Dict[str, Any]:
+        """
+        День календаря в формате парсера Rambler: фаза и лунные дни (без описаний
+        и рекомендаций - они есть только на странице Rambler)
+
+        :param calendar_date: Дата календаря
+        :return: Данные календаря
+        """
+        cached = self._days.get(calendar_date)
+        if cached is None:
+            cached = {
+                "date": calendar_date.isoformat(),
+                "moon_phase": self.moon_phase(calendar_date),
+                "moon_days": [
+                    {"name": f"{number}-й лунный день", "start": format_datetime_ru(start), "end": format_datetime_ru(end), "info": ""}
+                    for number, start, end in self.lunar_days(calendar_date)
+                ],
+                "recommendations": {}
+            }
+            if len(self._days) >= self.max_cached_days:
+                self._days.clear()
+            self._days[calendar_date] = cached
+        # Копия: вызывающий код может дополнять данные дня
+        return {**cached, "moon_days": [dict(day) for day in cached["moon_days"]], "recommendations": {}}
+
+    def describe_range(self, start: date, end: date) -> Dict[str, Any]:
+        """
+        Расчет за диапазон: дни календаря с освещенностью в местный полдень и
+        моменты главных фаз
+
+        :param start: Первый день
+        :param end: Последний день (включительно)
+        :return: Дни и фазы диапазона
+        """
+        self._ensure_years(start.year, end.year)
+        dates = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+        noons = np.array([self._local_day_bounds(d)[0] + 0.5 for d in dates])
+        fractions = illumination(noons)
+
+        range_start, range_end = self._local_day_bounds(start)[0], self._local_day_bounds(end)[1]
+        first = int(np.searchsorted(self._phase_times, range_start))
+        last = int(np.searchsorted(self._phase_times, range_end))
+        return {
+            "days": [
+                {**self.calendar_day(d), "illumination": round(float(fraction), 3)}
+                for d, fraction in zip(dates, fractions)
+            ],
+            "phases": [
+                {"phase": PHASE_NAMES[int(code)], "time": self._to_datetime(jd).isoformat()}
+                for jd, code in zip(self._phase_times[first:last], self._phase_codes[first:last])
+            ]
+        }
+
+    def validate(self, calendar_data: Dict[str, Any], tolerance_minutes: float = 15) -> List[str]:
+        """
+        Сверка спарсенного дня с расчетом: фаза, номера лунных дней и их границы
+
+        :param calendar_data: Данные календаря из парсера
+        :param tolerance_minutes: Допустимое расхождение границ лунных дней в минутах
+        :return: Описания расхождений (пустой список - данные согласуются с расчетом)
+        """
+        calendar_date = date.fromisoformat(calendar_data["date"])
+        self._ensure_years(calendar_date.year, calendar_date.year)
+        issues = []
+
+        # Соглашения о фазе в дни главных фаз различаются: допускаются главная фаза
+        # дня и состояние Луны в начале и в конце дня
+        principal, start_state, end_state = self._phases_on(calendar_date)
+        phase = calendar_data.get("moon_phase")
+        if phase and phase not in {*principal, start_state, end_state}:
+            issues.append(f"фаза '{phase}', по расчету '{self.moon_phase(calendar_date)}'")
+
+        scraped_days = calendar_data.get("moon_days") or []
+        if not scraped_days:
+            issues.append("нет лунных дней")
+            return issues
+
+        computed = {f"{number}-й лунный день": (start, end) for number, start, end in self.lunar_days(calendar_date)}
+        for day in scraped_days:
+            bounds = computed.get(day.get("name"))
+            if bounds is None:
+                issues.append(f"'{day.get('name')}' отсутствует в расчете ({', '.join(computed) or 'нет дней'})")
+                continue
+            for key, expected in zip(("start", "end"), bounds):
+                actual = parse_datetime_ru(day.get(key) or "")
+                if actual is None:
+                    issues.append(f"'{day['name']}': не удалось разобрать {key} '{day.get(key)}'")
+                    continue
+                deviation = abs((actual - expected.replace(tzinfo=None)).total_seconds()) / 60
+                if deviation > tolerance_minutes:
+                    issues.append(f"'{day['name']}': {key} {day[key]}, по расчету {format_datetime_ru(expected)} "
+                                  f"(расхождение {deviation:.0f} мин)")
+        return issues
+
+
+def create_moon_ephemeris(latitude: float, longitude: float, utc_offset_hours: float) -> Optional[MoonEphemeris]:
+    """
+    Создание локального расчета Луны; без numpy расчет недоступен
+
+    :param latitude: Широта места наблюдения в градусах
+    :param longitude: Восточная долгота места наблюдения в градусах
+    :param utc_offset_hours: Смещение местного времени от UTC в часах
+    :return: MoonEphemeris или None
+    """
+    if np is None:
+        logger.warning("Пакет numpy не установлен: локальный расчет фаз Луны и лунных дней отключен.")
+        return None
+    return MoonEphemeris(latitude=latitude, longitude=longitude, utc_offset_hours=utc_offset_hours)
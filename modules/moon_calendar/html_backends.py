@@ -0,0 +1,339 @@
+"""
+Бэкенды разбора HTML страницы лунного календаря Rambler
+
+Все бэкенды извлекают одни и те же данные с одинаковой семантикой выбора
+элементов (как в исходном разборе через BeautifulSoup):
+
+- класс из одного слова совпадает, если он есть среди классов элемента;
+- класс из нескольких слов совпадает только со всем списком классов элемента;
+- описания лунных дней и тексты рекомендаций собираются в порядке документа.
+
+Сборка итогового ответа (даты, склейка описаний с днями) выполняется в MoonCalendarParser.
+"""
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+import logging
+
+from bs4 import BeautifulSoup
+
+# Опциональные зависимости для быстрого разбора
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:  # pragma: no cover - зависит от окружения
+    lxml = None
+    etree = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # pragma: no cover - зависит от окружения
+    LexborHTMLParser = None
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Классы элементов страницы
+PHASE_CLASS = "Pf77m"  # svg с фазой луны в атрибуте title
+MOON_INFO_CLASS = "eG1Gp s63PD _3IJOS"  # блок с лунными днями
+DAY_NAME_CLASS = "ZciAj"  # название лунного дня
+PERIOD_CLASS = "_4FHaJ DSpR9 v5AKG"  # период лунного дня
+DESCRIPTION_BLOCK_CLASS = "dGWT9 cidDQ"  # блок с описаниями дней
+DESCRIPTION_SEPARATOR_CLASS = "_1uCdn iVDG2"  # начало описания следующего дня
+DESCRIPTION_END_CLASS = "R2dbF inVfT _8OzEU"  # конец описаний
+PARAGRAPH_CLASS = "_5yHoW AjIPq"  # абзац описания или рекомендации
+RECOMMENDATION_HEADER_CLASS = "PzAWM AW4W0"  # заголовок рекомендации (h3)
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста элемента"""
+    return (text
+            .replace('\xa0', ' ')
+            .replace('  ', ' ')
+            .strip())
+
+
+def _collect_descriptions(items: Iterable[Tuple[str, Any]], text_of: Callable[[Any], str]) -> List[str]:
+    """
+    Описания лунных дней из элементов после блока описаний в порядке документа
+
+    :param items: Пары (нормализованный список классов, элемент)
+    :param text_of: Текст элемента (вызывается только для абзацев)
+    :return: Описания дней (абзацы одного дня через перевод строки)
+    """
+    descriptions = []
+    current_desc: List[str] = []
+    for classes, element in items:
+        if classes == DESCRIPTION_END_CLASS:
+            break
+        elif classes == DESCRIPTION_SEPARATOR_CLASS:
+            if current_desc:
+                descriptions.append("\n".join(current_desc))
+                current_desc = []
+        elif classes == PARAGRAPH_CLASS:
+            text = normalize_text(text_of(element))
+            if text:
+                current_desc.append(text)
+    if current_desc:
+        descriptions.append("\n".join(current_desc))
+    return descriptions
+
+
+def _pair_recommendations(items: Iterable[Tuple[bool, str]]) -> List[Tuple[str, str]]:
+    """
+    Пары (заголовок, текст) рекомендаций: каждому заголовку соответствует первый
+    абзац после него в порядке документа
+
+    :param items: Заголовки и абзацы в порядке документа: (это заголовок, нормализованный текст)
+    :return: Пары (заголовок, текст) в порядке заголовков
+    """
+    pairs = []
+    pending: List[str] = []
+    for is_header, text in items:
+        if is_header:
+            pending.append(text)
+        else:
+            pairs.extend((title, text) for title in pending)
+            pending = []
+    return pairs
+
+
+class HtmlBackend:
+    """Бэкенд разбора страницы лунного календаря"""
+
+    name = "base"
+
+    def parse(self, content: bytes) -> Any:
+        """Разбор HTML в документ бэкенда"""
+        raise NotImplementedError
+
+    def moon_phase_title(self, doc: Any) -> Optional[str]:
+        """Атрибут title первого svg фазы луны (None, если svg или атрибута нет)"""
+        raise NotImplementedError
+
+    def moon_days(self, doc: Any) -> Optional[Tuple[List[str], List[str]]]:
+        """Названия и периоды лунных дней (None, если блока с днями нет)"""
+        raise NotImplementedError
+
+    def descriptions(self, doc: Any) -> List[str]:
+        """Описания лунных дней"""
+        raise NotImplementedError
+
+    def recommendations(self, doc: Any) -> List[Tuple[str, str]]:
+        """Пары (заголовок, текст) рекомендаций"""
+        raise NotImplementedError
+
+
+class BeautifulSoupBackend(HtmlBackend):
+    """Исходный разбор: дерево BeautifulSoup (html.parser) и обход элементов"""
+
+    name = "bs4"
+
+    def parse(self, content: bytes) -> BeautifulSoup:
+        return BeautifulSoup(content, "html.parser")
+
+    def moon_phase_title(self, soup: BeautifulSoup) -> Optional[str]:
+        phase_svg = soup.find("svg", {"class": PHASE_CLASS})
+        if phase_svg and "title" in phase_svg.attrs:
+            return phase_svg["title"]
+        return None
+
+    def moon_days(self, soup: BeautifulSoup) -> Optional[Tuple[List[str], List[str]]]:
+        moon_info = soup.find("div", {"class": MOON_INFO_CLASS})
+        if not moon_info:
+            return None
+        day_names = [normalize_text(day.text) for day in moon_info.find_all("span", {"class": DAY_NAME_CLASS})]
+        periods = [normalize_text(period.text) for period in moon_info.find_all("span", {"class": PERIOD_CLASS})]
+        return day_names, periods
+
+    def descriptions(self, soup: BeautifulSoup) -> List[str]:
+        moon_desc = soup.find("div", {"class": DESCRIPTION_BLOCK_CLASS})
+        if not moon_desc:
+            return []
+
+        items = (
+            (" ".join(element.get("class")), element)
+            for element in moon_desc.next_elements
+            if hasattr(element, 'get') and element.get("class")
+        )
+        return _collect_descriptions(items, lambda element: element.text)
+
+    def recommendations(self, soup: BeautifulSoup) -> List[Tuple[str, str]]:
+        pairs = []
+        for header in soup.find_all("h3", {"class": RECOMMENDATION_HEADER_CLASS}):
+            content_elem = header.find_next("p", {"class": PARAGRAPH_CLASS})
+            if content_elem:
+                pairs.append((normalize_text(header.text), normalize_text(content_elem.text)))
+        return pairs
+
+
+def _xpath_class_token(name: str) -> str:
+    return f'contains(concat(" ", normalize-space(@class), " "), " {name} ")'
+
+
+def _xpath_class_exact(names: str) -> str:
+    return f'normalize-space(@class)="{names}"'
+
+
+class LxmlBackend(HtmlBackend):
+    """Разбор через lxml (libxml2) с заранее скомпилированными XPath выражениями"""
+
+    name = "lxml"
+
+    if etree is not None:
+        _PHASE = etree.XPath(f'(//svg[{_xpath_class_token(PHASE_CLASS)}])[1]')
+        _MOON_INFO = etree.XPath(f'(//div[{_xpath_class_exact(MOON_INFO_CLASS)}])[1]')
+        _DAY_NAMES = etree.XPath(f'.//span[{_xpath_class_token(DAY_NAME_CLASS)}]')
+        _PERIODS = etree.XPath(f'.//span[{_xpath_class_exact(PERIOD_CLASS)}]')
+        _DESCRIPTION_BLOCK = etree.XPath(f'(//div[{_xpath_class_exact(DESCRIPTION_BLOCK_CLASS)}])[1]')
+        # Элементы после начала блока описаний (потомки и все следующие) в порядке документа
+        _DESCRIPTION_ITEMS = etree.XPath(
+            f'(descendant::*|following::*)[{_xpath_class_exact(DESCRIPTION_END_CLASS)} or '
+            f'{_xpath_class_exact(DESCRIPTION_SEPARATOR_CLASS)} or {_xpath_class_exact(PARAGRAPH_CLASS)}]'
+        )
+        _RECOMMENDATION_ITEMS = etree.XPath(
+            f'//h3[{_xpath_class_exact(RECOMMENDATION_HEADER_CLASS)}] | //p[{_xpath_class_exact(PARAGRAPH_CLASS)}]'
+        )
+
+    def __init__(self):
+        if etree is None:
+            raise ImportError("Пакет lxml не установлен")
+        # Rambler отдает страницы в UTF-8; кодировка задается явно, чтобы libxml2
+        # не откатывался на ISO-8859-1 при отсутствии meta charset в начале документа
+        self._parser = lxml.html.HTMLParser(encoding="utf-8")
+
+    @staticmethod
+    def _classes(element) -> str:
+        return " ".join(element.get("class", "").split())
+
+    def parse(self, content: bytes):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        return lxml.html.document_fromstring(content, parser=self._parser)
+
+    def moon_phase_title(self, doc) -> Optional[str]:
+        found = self._PHASE(doc)
+        return found[0].get("title") if found else None
+
+    def moon_days(self, doc) -> Optional[Tuple[List[str], List[str]]]:
+        found = self._MOON_INFO(doc)
+        if not found:
+            return None
+        moon_info = found[0]
+        day_names = [normalize_text(day.text_content()) for day in self._DAY_NAMES(moon_info)]
+        periods = [normalize_text(period.text_content()) for period in self._PERIODS(moon_info)]
+        return day_names, periods
+
+    def descriptions(self, doc) -> List[str]:
+        found = self._DESCRIPTION_BLOCK(doc)
+        if not found:
+            return []
+        return _collect_descriptions(
+            ((self._classes(element), element) for element in self._DESCRIPTION_ITEMS(found[0])),
+            lambda element: element.text_content()
+        )
+
+    def recommendations(self, doc) -> List[Tuple[str, str]]:
+        return _pair_recommendations(
+            (element.tag == "h3", normalize_text(element.text_content()))
+            for element in self._RECOMMENDATION_ITEMS(doc)
+        )
+
+
+class SelectolaxBackend(HtmlBackend):
+    """
+    Разбор через selectolax (Lexbor) с CSS селекторами. Селектор классов выбирает
+    кандидатов, точное совпадение списка классов проверяется отдельно.
+    """
+
+    name = "selectolax"
+
+    _PHASE = f"svg.{PHASE_CLASS}"
+    _MOON_INFO = "div." + MOON_INFO_CLASS.replace(" ", ".")
+    _DAY_NAMES = f"span.{DAY_NAME_CLASS}"
+    _PERIODS = "span." + PERIOD_CLASS.replace(" ", ".")
+    _DESCRIPTION_ITEMS = ", ".join(
+        "." + classes.replace(" ", ".")
+        for classes in (DESCRIPTION_BLOCK_CLASS, DESCRIPTION_END_CLASS, DESCRIPTION_SEPARATOR_CLASS, PARAGRAPH_CLASS)
+    )
+    _RECOMMENDATION_ITEMS = "h3." + RECOMMENDATION_HEADER_CLASS.replace(" ", ".") + ", p." + PARAGRAPH_CLASS.replace(" ", ".")
+
+    def __init__(self):
+        if LexborHTMLParser is None:
+            raise ImportError("Пакет selectolax не установлен")
+
+    @staticmethod
+    def _classes(node) -> str:
+        return " ".join((node.attributes.get("class") or "").split())
+
+    def _first_exact(self, doc, selector: str, classes: str):
+        for node in doc.css(selector):
+            if self._classes(node) == classes:
+                return node
+        return None
+
+    def parse(self, content: bytes):
+        return LexborHTMLParser(content)
+
+    def moon_phase_title(self, doc) -> Optional[str]:
+        node = doc.css_first(self._PHASE)
+        return node.attributes.get("title") if node is not None and "title" in node.attributes else None
+
+    def moon_days(self, doc) -> Optional[Tuple[List[str], List[str]]]:
+        moon_info = self._first_exact(doc, self._MOON_INFO, MOON_INFO_CLASS)
+        if moon_info is None:
+            return None
+        day_names = [normalize_text(day.text(deep=True)) for day in moon_info.css(self._DAY_NAMES)]
+        periods = [
+            normalize_text(period.text(deep=True))
+            for period in moon_info.css(self._PERIODS)
+            if self._classes(period) == PERIOD_CLASS
+        ]
+        return day_names, periods
+
+    def descriptions(self, doc) -> List[str]:
+        def items():
+            started = False
+            for node in doc.css(self._DESCRIPTION_ITEMS):
+                classes = self._classes(node)
+                if not started:
+                    # Первый div блока описаний - начало обхода
+                    started = node.tag == "div" and classes == DESCRIPTION_BLOCK_CLASS
+                    continue
+                yield classes, node
+
+        return _collect_descriptions(items(), lambda node: node.text(deep=True))
+
+    def recommendations(self, doc) -> List[Tuple[str, str]]:
+        items = []
+        for node in doc.css(self._RECOMMENDATION_ITEMS):
+            classes = self._classes(node)
+            if node.tag == "h3" and classes == RECOMMENDATION_HEADER_CLASS:
+                items.append((True, normalize_text(node.text(deep=True))))
+            elif node.tag == "p" and classes == PARAGRAPH_CLASS:
+                items.append((False, normalize_text(node.text(deep=True))))
+        return _pair_recommendations(items)
+
+
+HTML_BACKENDS = {
+    BeautifulSoupBackend.name: BeautifulSoupBackend,
+    LxmlBackend.name: LxmlBackend,
+    SelectolaxBackend.name: SelectolaxBackend
+}
+
+
+def create_html_backend(name: str) -> HtmlBackend:
+    """
+    Создание бэкенда разбора по имени (bs4, lxml, selectolax). При неизвестном имени
+    или отсутствии пакета используется BeautifulSoup.
+
+    :param name: Имя бэкенда
+    :return: Бэкенд разбора
+    """
+    backend_class = HTML_BACKENDS.get(name)
+    if backend_class is None:
+        logger.warning(f"Неизвестный бэкенд разбора HTML '{name}', используется bs4.")
+        return BeautifulSoupBackend()
+    try:
+        return backend_class()
+    except ImportError as e:
+        logger.warning(f"{e}, бэкенд разбора HTML '{name}' заменен на bs4.")
+        return BeautifulSoupBackend()
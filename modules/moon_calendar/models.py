@@ -18,6 +18,15 @@ class CalendarDayResponse(BaseModel):
     moon_days: List[MoonDayResponse]
     recommendations: Dict[str, str]
 
+class CalendarRangeResponse(BaseModel):
+    """Модель ответа с данными календаря за диапазон дней"""
+    start: str  # ISO формат даты
+    end: str  # ISO формат даты
+    days: List[CalendarDayResponse]  # Полученные дни по порядку
+    cached: int = 0  # Сколько дней взято из кэша
+    errors: Dict[str, str] = {}  # Дни, которые не удалось получить (дата -> ошибка)
+    computed: List[str] = []  # Дни, рассчитанные локально без Rambler (без описаний и рекомендаций)
+
 class ApiResponse(BaseModel):
     """Общая модель ответа API"""
     date: str  # ISO формат даты
@@ -4,15 +4,19 @@
 import json
 import logging
 from datetime import date
-from typing import Dict, Any, Optional, List
+from typing import AsyncIterator, Dict, Any, Optional, List, Tuple
 
 from fastapi import HTTPException
 
-from core.exceptions import NetworkException
+from core.exceptions import (
+    DeadlineExceededException, NetworkException, ParseQueueFullException, ParserException, parser_exception_handler
+)
 from core.openrouter_client import OpenRouterClient
 from core.cache import CacheManager
-from .models import ApiResponse, CalendarDayResponse
-from .parser import MoonCalendarParser
+from .astronomy import MoonEphemeris
+from .models import ApiResponse, CalendarDayResponse, CalendarRangeResponse
+from .parser import MoonCalendarParser, date_range
+import config
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +29,7 @@ class MoonCalendarOpenRouterService:
         parser: MoonCalendarParser,
         openrouter_client: OpenRouterClient,
         prompts_config: Dict[str, Dict[str, Any]],
+        ephemeris: Optional[MoonEphemeris] = None,
     ):
         """
         Инициализация сервиса
@@ -33,11 +38,13 @@ class MoonCalendarOpenRouterService:
         :param parser: Парсер лунного календаря
         :param openrouter_client: Клиент OpenRouter
         :param prompts_config: Конфигурация промптов для разных типов пользователей
+        :param ephemeris: Локальный расчет Луны для дней, которые не удалось спарсить
         """
         self.cache_manager = cache_manager
         self.parser = parser
         self.openrouter_client = openrouter_client
         self.prompts_config = prompts_config
+        self.ephemeris = ephemeris
         
         # Сопоставление типов пользователей и моделей (с приоритетом)
         self.user_type_models = {
@@ -61,31 +68,88 @@ class MoonCalendarOpenRouterService:
         :param calendar_date: Дата календаря
         :return: Данные лунного календаря
         """
-        # Генерируем ключ кэша для даты
-        cache_key = f"moon_calendar_{calendar_date.isoformat()}"
-        
-        # Проверяем кэш
-        cached_data = await self.cache_manager.get(calendar_date)
-        
-        if cached_data:
-            logger.info(f"Использую кэшированные данные для {calendar_date}")
-            return cached_data
-        
-        # Если данных нет в кэше, парсим их
-        logger.info(f"Парсинг данных лунного календаря для {calendar_date}")
+        # Читаем только поле с календарем, без AI-ответов. При промахе данные парсит
+        # только один запрос, остальные одновременные запросы ждут его результат.
         try:
-            calendar_data = await self.parser.parse_calendar_day(calendar_date)
-            
-            # Сохраняем в кэш
-            await self.cache_manager.set(calendar_date, calendar_data)
-            
-            return calendar_data
+            return await self.cache_manager.get_or_compute(
+                CacheManager.NS_MOON_CALENDAR,
+                calendar_date,
+                lambda: self._parse_calendar_data(calendar_date),
+                field=CacheManager.CALENDAR_FIELD,
+                # Ошибки страницы (например, 404 Rambler для даты) запоминаются ненадолго
+                negative_ttls={HTTPException: config.NEGATIVE_CACHE_TTL_PARSER_ERROR}
+            )
+        except ParseQueueFullException:
+            # Перегрузка пула разбора - временная, вызывающий отвечает 503 и может повторить запрос
+            raise
         except Exception as e:
             logger.error(f"Ошибка при получении данных лунного календаря: {e}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"Ошибка при получении данных лунного календаря: {str(e)}"
+            computed_data = self._computed_calendar_data(calendar_date)
+            if computed_data is None:
+                raise ParserException(f"Ошибка при получении данных лунного календаря: {str(e)}")
+            # Рассчитанные данные не кэшируются: при следующем запросе снова пробуем Rambler
+            logger.warning(f"Rambler недоступен для {calendar_date}, используются рассчитанные фаза и лунные дни.")
+            return computed_data
+    
+    def _computed_calendar_data(self, calendar_date: date) -> Optional[Dict[str, Any]]:
+        """
+        Фаза и лунные дни из локального расчета (без описаний и рекомендаций)
+        
+        :param calendar_date: Дата календаря
+        :return: Данные календаря или None, если резервный расчет выключен
+        """
+        if self.ephemeris is None or not config.MOON_ASTRONOMY_FALLBACK_ENABLED:
+            return None
+        return self.ephemeris.calendar_day(calendar_date)
+    
+    async def get_calendar_range(self, start: date, end: date, ttl: Optional[int] = None) -> CalendarRangeResponse:
+        """
+        Данные календаря за диапазон дней: кэш читается одним пакетным запросом,
+        недостающие дни парсятся параллельно (с ограничениями парсера) и
+        записываются в кэш одним пакетом
+        
+        :param start: Первый день
+        :param end: Последний день (включительно)
+        :param ttl: Время жизни записей новых дней (по умолчанию TTL пространства имен)
+        :return: Дни диапазона и ошибки по дням; дни, которые не удалось спарсить,
+            при включенном резервном расчете рассчитываются локально
+        """
+        dates = date_range(start, end)
+        cached_data = await self.cache_manager.get_many(
+            CacheManager.NS_MOON_CALENDAR, dates, field=CacheManager.CALENDAR_FIELD
+        )
+        missing_dates = [d for d in dates if d not in cached_data]
+        
+        parsed_data = {}
+        if missing_dates:
+            logger.info(f"Парсинг {len(missing_dates)} из {len(dates)} дней лунного календаря за {start} - {end}")
+            parsed_data = await self.parser.parse_dates(missing_dates)
+            await self.cache_manager.set_many(
+                CacheManager.NS_MOON_CALENDAR, parsed_data, ttl=ttl, field=CacheManager.CALENDAR_FIELD
             )
+        
+        days = []
+        errors = {}
+        computed = []
+        for calendar_date in dates:
+            data = cached_data.get(calendar_date) or parsed_data.get(calendar_date)
+            if not data:
+                data = self._computed_calendar_data(calendar_date)
+                if data:
+                    computed.append(calendar_date.isoformat())
+            if data:
+                days.append(CalendarDayResponse(**data))
+            else:
+                errors[calendar_date.isoformat()] = "Не удалось получить данные лунного календаря"
+        
+        return CalendarRangeResponse(
+            start=start.isoformat(),
+            end=end.isoformat(),
+            days=days,
+            cached=len(cached_data),
+            errors=errors,
+            computed=computed
+        )
     
     def _prepare_user_message(self, calendar_data: Dict[str, Any], user_type: str) -> str:
         """
@@ -148,59 +212,6 @@ class MoonCalendarOpenRouterService:
         """
         return self.user_type_models.get(user_type, self.user_type_models["free"])
     
-    async def _get_cached_response(self, calendar_date: date, user_type: str) -> Optional[str]:
-        """
-        Получение кэшированного ответа OpenRouter
-        
-        :param calendar_date: Дата календаря
-        :param user_type: Тип пользователя
-        :return: Кэшированный ответ или None
-        """
-        # Проверяем кэш для конкретной даты календаря
-        cached_data = await self.cache_manager.get(calendar_date)
-        
-        # Проверяем наличие структуры кеша и ответа для конкретного типа пользователя
-        if cached_data and isinstance(cached_data, dict):
-            # Проверяем наличие ключа openrouter_responses
-            if "openrouter_responses" in cached_data:
-                responses = cached_data["openrouter_responses"]
-                # Проверяем наличие ответа для конкретного типа пользователя
-                if user_type in responses and responses[user_type]:
-                    logger.info(f"Использую кэшированный ответ OpenRouter для {calendar_date} и типа {user_type}")
-                    logger.info(f"Размер кэшированного ответа: {len(responses[user_type])} символов")
-                    return responses[user_type]
-        
-        logger.info(f"Кэшированный ответ для {calendar_date} и типа {user_type} не найден")
-        return None
-    
-    async def _cache_response(self, calendar_date: date, user_type: str, response: str) -> None:
-        """
-        Кэширование ответа OpenRouter
-        
-        :param calendar_date: Дата календаря
-        :param user_type: Тип пользователя
-        :param response: Ответ OpenRouter
-        """
-        # Получаем текущие данные календаря из кэша
-        cached_data = await self.cache_manager.get(calendar_date) or {}
-        
-        # Если данные не являются словарем, создаем новый словарь
-        if not isinstance(cached_data, dict):
-            cached_data = {}
-        
-        # Инициализируем структуру ответов, если её нет
-        if "openrouter_responses" not in cached_data:
-            cached_data["openrouter_responses"] = {}
-        
-        # Добавляем новый ответ
-        cached_data["openrouter_responses"][user_type] = response
-        
-        # Сохраняем в кэш
-        await self.cache_manager.set(calendar_date, cached_data)
-        
-        logger.info(f"Кэширован ответ OpenRouter для {calendar_date} и типа {user_type}")
-        logger.info(f"Размер сохраненного ответа: {len(response)} символов")
-    
     async def _clean_model_response(self, response: str) -> str:
         """
         Очистка ответа модели от потенциально проблемных символов
@@ -233,6 +244,78 @@ class MoonCalendarOpenRouterService:
         
         return cleaned
     
+    async def _parse_calendar_data(self, calendar_date: date) -> Dict[str, Any]:
+        """
+        Парсинг данных календаря при промахе кэша (producer для get_or_compute)
+        
+        :param calendar_date: Дата календаря
+        :return: Данные календаря
+        """
+        logger.warning(f"ДАННЫЕ для {calendar_date} НЕ НАЙДЕНЫ в кэше. Пробуем спарсить заново.")
+        calendar_data = await self.parser.parse_calendar_day(calendar_date)
+        logger.info(f"Данные для {calendar_date} успешно спарсены.")
+
+        # Страница загрузилась, но блоки Луны не найдены (например, сменилась разметка):
+        # лунные дни и фаза дополняются расчетом, рекомендации остаются со страницы
+        if not calendar_data.get("moon_days") or calendar_data.get("moon_phase") == "Не определена":
+            computed_data = self._computed_calendar_data(calendar_date)
+            if computed_data is not None:
+                logger.warning(f"На странице Rambler для {calendar_date} не найдены данные Луны, используются рассчитанные.")
+                if not calendar_data.get("moon_days"):
+                    calendar_data["moon_days"] = computed_data["moon_days"]
+                if calendar_data.get("moon_phase") == "Не определена":
+                    calendar_data["moon_phase"] = computed_data["moon_phase"]
+        return calendar_data
+    
+    async def _generate_ai_response(self, calendar_date: date, user_type: str) -> str:
+        """
+        Генерация AI-ответа (producer для get_or_compute, в том числе для фонового обновления)
+        
+        :param calendar_date: Дата календаря
+        :param user_type: Тип пользователя
+        :return: Очищенный ответ модели
+        """
+        calendar_data = await self._get_calendar_data(calendar_date)
+        
+        logger.info(f"Генерация AI-ответа для {calendar_date} и типа {user_type} в реальном времени...")
+        
+        # Получаем конфигурацию промпта
+        prompt_config = self._get_prompt_config(user_type)
+        
+        # Подготавливаем сообщение пользователя
+        user_message = self._prepare_user_message(calendar_data, user_type)
+        
+        # Получаем модели для данного типа пользователя
+        models = self._get_models_for_user_type(user_type)
+        
+        if config.OPENROUTER_HEDGING_ENABLED:
+            # Медленная модель дублируется следующей по приоритету после своего p90
+            ai_response_text = await self.openrouter_client.generate_text_hedged(
+                system_message=prompt_config["system_message"],
+                user_message=user_message,
+                max_tokens=prompt_config["max_tokens"],
+                temperature=prompt_config["temperature"],
+                models=models,
+                deadline_seconds=config.OPENROUTER_DEADLINES.get(user_type),
+                caller="moon"
+            )
+        else:
+            ai_response_text = await self.openrouter_client.generate_text(
+                system_message=prompt_config["system_message"],
+                user_message=user_message,
+                max_tokens=prompt_config["max_tokens"],
+                temperature=prompt_config["temperature"],
+                model=models[0] if models else None,
+                deadline_seconds=config.OPENROUTER_DEADLINES.get(user_type),
+                caller="moon"
+            )
+        
+        # Очищаем ответ
+        ai_response_text = await self._clean_model_response(ai_response_text)
+        logger.info(f"AI-ответ для {calendar_date} и типа {user_type} успешно сгенерирован.")
+        logger.info(f"Размер ответа: {len(ai_response_text)} символов")
+        return ai_response_text
+    
     async def get_moon_calendar_response(self, calendar_date: date, user_type: str) -> ApiResponse:
         """
         Получение ответа лунного календаря с обработкой через OpenRouter
@@ -242,78 +325,54 @@ class MoonCalendarOpenRouterService:
         :return: Ответ API
         """
         try:
-            # Проверяем наличие кэшированного ответа
-            ai_response = await self._get_cached_response(calendar_date, user_type)
-            
-            if ai_response:
-                logger.info(f"Возвращаю кэшированный AI-ответ для {calendar_date} и типа {user_type}")
-                return ApiResponse(
-                    date=calendar_date.isoformat(),
-                    response=ai_response,
-                    error=None
-                )
-            
-            # Если кэшированный ответ не найден, проверяем наличие данных календаря
-            calendar_data = await self._get_calendar_data(calendar_date)
-            
-            if not calendar_data:
-                # Если данных нет, пробуем их спарсить и сохранить
-                logger.warning(f"ДАННЫЕ для {calendar_date} НЕ НАЙДЕНЫ в кэше. Пробуем спарсить заново.")
-                try:
-                    calendar_data = await self.parser.parse_calendar_day(calendar_date)
-                    await self.cache_manager.set(calendar_date, calendar_data)
-                    logger.info(f"Данные для {calendar_date} успешно спарсены и сохранены в кэш.")
-                except Exception as e:
-                    logger.error(f"Ошибка при попытке спарсить данные для {calendar_date}: {e}", exc_info=True)
-                    return ApiResponse(
-                        date=calendar_date.isoformat(),
-                        response=None,
-                        error=f"Данные лунного календаря для {calendar_date} не найдены в кэше и не могут быть получены: {str(e)}"
-                    )
-            
-            # Теперь у нас есть данные календаря, но нет AI-ответа. Генерируем его.
-            logger.info(f"Генерация AI-ответа для {calendar_date} и типа {user_type} в реальном времени...")
-            
-            # Получаем конфигурацию промпта
-            prompt_config = self._get_prompt_config(user_type)
-            
-            # Подготавливаем сообщение пользователя
-            user_message = self._prepare_user_message(calendar_data, user_type)
-            
-            # Получаем модели для данного типа пользователя
-            models = self._get_models_for_user_type(user_type)
-            
-            # Генерируем ответ
-            try:
-                ai_response_text = await self.openrouter_client.generate_text(
-                    system_message=prompt_config["system_message"],
-                    user_message=user_message,
-                    max_tokens=prompt_config["max_tokens"],
-                    temperature=prompt_config["temperature"],
-                    model=models[0] if models else None
-                )
-                
-                # Очищаем ответ
-                ai_response_text = await self._clean_model_response(ai_response_text)
-                
-                # Кэшируем ответ
-                await self._cache_response(calendar_date, user_type, ai_response_text)
-                
-                logger.info(f"AI-ответ для {calendar_date} и типа {user_type} успешно сгенерирован и кэширован.")
-                
-                return ApiResponse(
-                    date=calendar_date.isoformat(),
-                    response=ai_response_text,
-                    error=None
-                )
-            except Exception as e:
-                logger.error(f"Ошибка при генерации AI-ответа для {calendar_date} и типа {user_type}: {e}", exc_info=True)
-                return ApiResponse(
-                    date=calendar_date.isoformat(),
-                    response=None,
-                    error=f"Ошибка при генерации AI-ответа: {str(e)}"
-                )
+            # Кэшированный ответ отдается сразу, даже если он старше soft TTL (тогда он
+            # обновляется в фоне). При промахе ответ генерируется один раз для всех воркеров.
+            ai_response_text = await self.cache_manager.get_or_compute(
+                CacheManager.NS_MOON_CALENDAR,
+                calendar_date,
+                lambda: self._generate_ai_response(calendar_date, user_type),
+                field=f"{CacheManager.AI_RESPONSE_FIELD_PREFIX}{user_type}",
+                soft_ttl=config.MOON_CALENDAR_AI_SOFT_TTL_SECONDS,
+                # Отказы LLM после всех повторов и ошибки данных календаря запоминаются ненадолго
+                negative_ttls={
+                    NetworkException: config.NEGATIVE_CACHE_TTL_LLM_FAILURE,
+                    HTTPException: config.NEGATIVE_CACHE_TTL_LLM_FAILURE,
+                    ParserException: config.NEGATIVE_CACHE_TTL_PARSER_ERROR,
+                    # TTL 0 - не запоминать: перегрузка пула разбора проходит за секунды
+                    ParseQueueFullException: 0
+                }
+            )
             
+            return ApiResponse(
+                date=calendar_date.isoformat(),
+                response=ai_response_text,
+                error=None
+            )
+        except DeadlineExceededException as e:
+            logger.error(f"AI-ответ для {calendar_date} и типа {user_type} не сгенерирован за отведенное время: {e}")
+            return ApiResponse(
+                date=calendar_date.isoformat(),
+                response=None,
+                error=f"Превышено время ожидания AI-ответа: {e.message}"
+            )
+        except ParseQueueFullException as e:
+            # Перегрузка пула разбора - временная, клиент может повторить запрос
+            logger.warning(f"Очередь разбора заполнена при запросе {calendar_date}: {e}")
+            raise parser_exception_handler(e)
+        except ParserException as e:
+            logger.error(f"Ошибка при попытке спарсить данные для {calendar_date}: {e}", exc_info=True)
+            return ApiResponse(
+                date=calendar_date.isoformat(),
+                response=None,
+                error=f"Данные лунного календаря для {calendar_date} не найдены в кэше и не могут быть получены: {str(e)}"
+            )
+        except HTTPException as e:
+            logger.error(f"Ошибка при генерации AI-ответа для {calendar_date} и типа {user_type}: {e}", exc_info=True)
+            return ApiResponse(
+                date=calendar_date.isoformat(),
+                response=None,
+                error=f"Ошибка при генерации AI-ответа: {str(e)}"
+            )
         except Exception as e:
             logger.error(f"Общая ошибка в get_moon_calendar_response для {calendar_date} и типа {user_type}: {e}", exc_info=True)
             return ApiResponse(
@@ -322,6 +381,70 @@ class MoonCalendarOpenRouterService:
                 error=f"Внутренняя ошибка сервера при получении прогноза: {str(e)}"
             )
 
+    async def stream_moon_calendar_response(
+        self,
+        calendar_date: date,
+        user_type: str
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Потоковый ответ лунного календаря: события (token, {"text"}) по мере генерации,
+        затем (done, {"date", "response", "cached"}) с полным очищенным текстом
+        или (error, {"error"}). Полный текст записывается в кэш после окончания потока.
+        
+        :param calendar_date: Дата календаря
+        :param user_type: Тип пользователя (free/premium)
+        :return: Асинхронный итератор пар (событие, данные)
+        """
+        field = f"{CacheManager.AI_RESPONSE_FIELD_PREFIX}{user_type}"
+        
+        cached_text = await self.cache_manager.get_field(CacheManager.NS_MOON_CALENDAR, calendar_date, field)
+        if cached_text:
+            yield "token", {"text": cached_text}
+            yield "done", {"date": calendar_date.isoformat(), "response": cached_text, "cached": True}
+            return
+        
+        try:
+            calendar_data = await self._get_calendar_data(calendar_date)
+        except ParserException as e:
+            logger.error(f"Ошибка при попытке спарсить данные для {calendar_date}: {e}")
+            yield "error", {"error": f"Данные лунного календаря для {calendar_date} не найдены в кэше и не могут быть получены: {str(e)}"}
+            return
+        
+        prompt_config = self._get_prompt_config(user_type)
+        user_message = self._prepare_user_message(calendar_data, user_type)
+        
+        logger.info(f"Потоковая генерация AI-ответа для {calendar_date} и типа {user_type}...")
+        chunks = []
+        try:
+            async for chunk in self.openrouter_client.stream_text(
+                system_message=prompt_config["system_message"],
+                user_message=user_message,
+                max_tokens=prompt_config["max_tokens"],
+                temperature=prompt_config["temperature"],
+                models=self._get_models_for_user_type(user_type),
+                deadline_seconds=config.OPENROUTER_DEADLINES.get(user_type),
+                caller="moon_stream"
+            ):
+                chunks.append(chunk)
+                yield "token", {"text": chunk}
+        except (NetworkException, HTTPException) as e:
+            logger.error(f"Ошибка при потоковой генерации AI-ответа для {calendar_date} и типа {user_type}: {e}")
+            yield "error", {"error": f"Ошибка при генерации AI-ответа: {str(e)}"}
+            return
+        
+        # Очистка выполняется по полному тексту, клиент заменяет им собранные фрагменты
+        ai_response_text = await self._clean_model_response("".join(chunks))
+        await self.cache_manager.set_field(CacheManager.NS_MOON_CALENDAR, calendar_date, field, ai_response_text)
+        await self.cache_manager.mark_fresh(
+            CacheManager.NS_MOON_CALENDAR,
+            calendar_date,
+            config.MOON_CALENDAR_AI_SOFT_TTL_SECONDS,
+            field=field
+        )
+        logger.info(f"Потоковый AI-ответ для {calendar_date} и типа {user_type} сохранен в кэш ({len(ai_response_text)} символов).")
+        
+        yield "done", {"date": calendar_date.isoformat(), "response": ai_response_text, "cached": False}
+
     async def background_generate_and_cache_ai_responses(self, calendar_date: date):
         """
         Фоновая генерация и кэширование AI-ответов для всех типов пользователей.
@@ -377,7 +500,9 @@ class MoonCalendarOpenRouterService:
                                 user_message=user_message,
                                 max_tokens=prompt_config["max_tokens"],
                                 temperature=prompt_config["temperature"],
-                                model=model_name
+                                model=model_name,
+                                deadline_seconds=config.OPENROUTER_BACKGROUND_DEADLINE_SECONDS,
+                                caller="moon_background"
                             )
                             
                             if response_content and response_content.strip():
@@ -414,9 +539,18 @@ class MoonCalendarOpenRouterService:
             # Это сохранит исходные спарсенные данные вместе со всеми успешно сгенерированными AI-ответами.
             # Если какие-то AI-ответы не сгенерировались, их ключи будут отсутствовать в openrouter_responses.
             # CacheManager.set сам по себе обрабатывает обновление или создание новой записи.
-            await self.cache_manager.set(calendar_date, data_to_cache_with_ai)
+            await self.cache_manager.set(CacheManager.NS_MOON_CALENDAR, calendar_date, data_to_cache_with_ai)
             logger.info(f"[BG_AI_GEN] Данные (спарсенные + AI-ответы) для {calendar_date} сохранены в кэш.")
             
+            # Свежесгенерированные ответы не должны обновляться повторно при первом чтении
+            for user_type in data_to_cache_with_ai["openrouter_responses"]:
+                await self.cache_manager.mark_fresh(
+                    CacheManager.NS_MOON_CALENDAR,
+                    calendar_date,
+                    config.MOON_CALENDAR_AI_SOFT_TTL_SECONDS,
+                    field=f"{CacheManager.AI_RESPONSE_FIELD_PREFIX}{user_type}"
+                )
+            
             logger.info(f"[BG_AI_GEN] Завершение генерации AI-ответов для {calendar_date}")
 
         except Exception as e_main:
@@ -1,17 +1,21 @@
 """
 Парсер лунного календаря
 """
-from datetime import datetime, date
-from typing import Dict, Any, Optional
+from datetime import datetime, date, timedelta
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 import asyncio
+import hashlib
 import logging
+import threading
 from enum import Enum
 
 import aiohttp
-from bs4 import BeautifulSoup
 from fastapi import HTTPException
 
+from core.parse_pool import ParsePool
+from core.rate_limiter import AsyncTokenBucket
 from core.utils import format_datetime_ru
+from .html_backends import create_html_backend
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -36,17 +40,30 @@ class MoonCalendarParser:
     
     BASE_URL = "https://horoscopes.rambler.ru/moon/calendar/{date}/"
     
-    def __init__(self, timeout: int = 10):
+    def __init__(
+        self,
+        timeout: int = 10,
+        backend: str = "bs4",
+        pool: Optional[ParsePool] = None,
+        max_concurrent_fetches: int = 4,
+        fetch_rate: float = 2.0
+    ):
+        """
+        :param timeout: Таймаут загрузки страницы в секундах
+        :param backend: Бэкенд разбора HTML: bs4, lxml или selectolax
+        :param pool: Пул разбора вне цикла событий (None - разбор в цикле событий)
+        :param max_concurrent_fetches: Максимум одновременных запросов к Rambler
+        :param fetch_rate: Запросов к Rambler в секунду (вежливость к сайту при загрузке диапазонов)
+        """
         self.timeout = timeout
-    
-    def _normalize_text(self, element) -> str:
-        """Нормализация текста элемента"""
-        if not element:
-            return ""
-        return (element.text
-                .replace('\xa0', ' ')
-                .replace('  ', ' ')
-                .strip())
+        self.backend = create_html_backend(backend)
+        self.pool = pool
+        self._fetch_slots = asyncio.Semaphore(max(1, max_concurrent_fetches))
+        self._fetch_bucket = AsyncTokenBucket(fetch_rate, max_concurrent_fetches)
+        
+        # Метрики условных запросов
+        self._conditional_stats = {"requests": 0, "not_modified": 0, "unchanged_content": 0, "parsed": 0}
+        logger.info(f"Бэкенд разбора страниц лунного календаря: {self.backend.name}")
     
     def _parse_datetime(self, date_str: str, year: int) -> datetime:
         """Преобразование строки в datetime"""
@@ -61,21 +78,44 @@ class MoonCalendarParser:
             logger.error(f"Error parsing datetime {date_str}: {e}")
             return datetime.now()
     
-    async def _fetch_page(self, calendar_date: date) -> BeautifulSoup:
-        """Асинхронное получение страницы"""
+    def _new_session(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+    
+    async def _fetch_page(self, calendar_date: date, session: Optional[aiohttp.ClientSession] = None) -> bytes:
+        """
+        Асинхронное получение страницы
+        
+        :param calendar_date: Дата календаря
+        :param session: Общая сессия для загрузки нескольких страниц (None - отдельная сессия)
+        :return: HTML страницы
+        """
+        _, content, _ = await self._fetch(calendar_date, session)
+        return content
+    
+    async def _fetch(
+        self,
+        calendar_date: date,
+        session: Optional[aiohttp.ClientSession] = None,
+        headers: Optional[Dict[str, str]] = None
+    ) -> Tuple[int, bytes, Dict[str, Optional[str]]]:
+        """
+        Запрос страницы. Запросы ко всему сайту ограничены по количеству одновременных
+        и по частоте.
+        
+        :param calendar_date: Дата календаря
+        :param session: Общая сессия для загрузки нескольких страниц (None - отдельная сессия)
+        :param headers: Дополнительные заголовки (например, условного запроса)
+        :return: Кортеж (статус 200 или 304, HTML страницы, валидаторы ETag/Last-Modified)
+        """
         url = self.BASE_URL.format(date=calendar_date)
         
         try:
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.get(url) as response:
-                    if response.status != 200:
-                        raise HTTPException(
-                            status_code=response.status, 
-                            detail=f"Failed to fetch calendar data: HTTP {response.status}"
-                        )
-                    
-                    content = await response.read()
-                    return BeautifulSoup(content, "html.parser")
+            async with self._fetch_slots:
+                await self._fetch_bucket.acquire()
+                if session is not None:
+                    return await self._get(session, url, headers)
+                async with self._new_session() as own_session:
+                    return await self._get(own_session, url, headers)
                     
         except asyncio.TimeoutError:
             raise HTTPException(status_code=408, detail="Request timeout")
@@ -83,45 +123,39 @@ class MoonCalendarParser:
             logger.error(f"Error fetching page: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to fetch calendar data: {str(e)}")
     
-    def _parse_moon_days(self, soup: BeautifulSoup, year: int) -> list[Dict]:
+    async def _get(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        headers: Optional[Dict[str, str]] = None
+    ) -> Tuple[int, bytes, Dict[str, Optional[str]]]:
+        async with session.get(url, headers=headers) as response:
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified")
+            }
+            if response.status == 304:
+                return 304, b"", validators
+            if response.status != 200:
+                raise HTTPException(
+                    status_code=response.status, 
+                    detail=f"Failed to fetch calendar data: HTTP {response.status}"
+                )
+            
+            return 200, await response.read(), validators
+    
+    def _parse_moon_days(self, doc: Any, year: int) -> list[Dict]:
         """Парсинг лунных дней"""
         moon_days = []
         
         try:
-            moon_info = soup.find("div", {"class": "eG1Gp s63PD _3IJOS"})
-            if not moon_info:
+            days = self.backend.moon_days(doc)
+            if days is None:
                 return moon_days
-            
-            day_names = [self._normalize_text(day) for day in 
-                        moon_info.findAll("span", {"class": "ZciAj"})]
-            
-            periods = [self._normalize_text(period) for period in 
-                      moon_info.findAll("span", {"class": "_4FHaJ DSpR9 v5AKG"})]
+            day_names, periods = days
             
             # Получаем описания дней
-            moon_desc = soup.find("div", {"class": "dGWT9 cidDQ"})
-            descriptions = []
-            
-            if moon_desc:
-                element = moon_desc.next
-                current_desc = []
-                
-                while element:
-                    if hasattr(element, 'get') and element.get("class") == ['R2dbF', 'inVfT', '_8OzEU']:
-                        break
-                    elif hasattr(element, 'get') and element.get("class") == ['_1uCdn', 'iVDG2']:
-                        if current_desc:
-                            descriptions.append("\n".join(current_desc))
-                            current_desc = []
-                    elif hasattr(element, 'get') and element.get("class") == ['_5yHoW', 'AjIPq']:
-                        text = self._normalize_text(element)
-                        if text:
-                            current_desc.append(text)
-                    
-                    element = element.next
-                
-                if current_desc:
-                    descriptions.append("\n".join(current_desc))
+            descriptions = self.backend.descriptions(doc)
             
             # Собираем лунные дни
             for i, (name, period) in enumerate(zip(day_names, periods)):
@@ -146,38 +180,28 @@ class MoonCalendarParser:
         
         return moon_days
     
-    def _parse_recommendations(self, soup: BeautifulSoup) -> Dict[str, str]:
+    def _parse_recommendations(self, doc: Any) -> Dict[str, str]:
         """Парсинг рекомендаций"""
         recommendations = {}
         
         try:
-            # Находим все заголовки рекомендаций h3 с классом PzAWM AW4W0
-            headers = soup.find_all("h3", {"class": "PzAWM AW4W0"})
-            
-            # Для каждого заголовка находим соответствующий текст
-            for header in headers:
-                title = self._normalize_text(header)
-                
-                # Находим следующий абзац с классом _5yHoW AjIPq
-                content_elem = header.find_next("p", {"class": "_5yHoW AjIPq"})
-                if content_elem:
-                    content = self._normalize_text(content_elem)
-                    if title and content:
-                        recommendations[title] = content
+            # Заголовки h3 и первый абзац после каждого из них
+            for title, content in self.backend.recommendations(doc):
+                if title and content:
+                    recommendations[title] = content
                 
         except Exception as e:
             logger.error(f"Error parsing recommendations: {e}")
         
         return recommendations
     
-    def _parse_moon_phase(self, soup: BeautifulSoup) -> str:
+    def _parse_moon_phase(self, doc: Any) -> str:
         """Парсинг фазы луны"""
         try:
-            # Ищем SVG элемент с классом Pf77m, содержащий информацию о фазе луны в атрибуте title
-            phase_svg = soup.find("svg", {"class": "Pf77m"})
-            if phase_svg and "title" in phase_svg.attrs:
-                # Извлекаем текст из атрибута title и удаляем префикс "Фаза луны - "
-                phase_text = phase_svg["title"]
+            # SVG элемент с классом Pf77m содержит фазу луны в атрибуте title
+            phase_text = self.backend.moon_phase_title(doc)
+            if phase_text is not None:
+                # Удаляем префикс "Фаза луны - "
                 return phase_text.replace("Фаза луны - ", "").strip()
                 
         except Exception as e:
@@ -185,13 +209,24 @@ class MoonCalendarParser:
         
         return "Не определена"
     
-    async def parse_calendar_day(self, calendar_date: date) -> Dict:
-        """Основной метод парсинга дня календаря"""
-        soup = await self._fetch_page(calendar_date)
+    def parse_html(self, content: bytes, calendar_date: date) -> Dict:
+        """
+        Разбор загруженной страницы дня календаря (синхронно, без сети)
         
-        moon_phase = self._parse_moon_phase(soup)
-        moon_days_data = self._parse_moon_days(soup, calendar_date.year)
-        recommendations_data = self._parse_recommendations(soup)
+        :param content: HTML страницы
+        :param calendar_date: Дата календаря
+        :return: Данные дня календаря
+        """
+        try:
+            doc = self.backend.parse(content)
+        except Exception as e:
+            # Например, пустой документ для lxml: результат как у пустой страницы
+            logger.error(f"Error parsing page: {e}")
+            doc = self.backend.parse(b"<html></html>")
+        
+        moon_phase = self._parse_moon_phase(doc)
+        moon_days_data = self._parse_moon_days(doc, calendar_date.year)
+        recommendations_data = self._parse_recommendations(doc)
         
         return {
             "date": calendar_date.isoformat(),
@@ -199,3 +234,126 @@ class MoonCalendarParser:
             "moon_days": moon_days_data,
             "recommendations": recommendations_data
         }
+    
+    async def _parse_content(self, content: bytes, calendar_date: date) -> Dict:
+        """Разбор загруженной страницы (в пуле, если он задан)"""
+        if self.pool is None:
+            return self.parse_html(content, calendar_date)
+        # Загрузка остается асинхронной, в пул передаются только байты страницы
+        return await self.pool.run(parse_calendar_html, self.backend.name, content, calendar_date)
+    
+    async def parse_calendar_day(self, calendar_date: date, session: Optional[aiohttp.ClientSession] = None) -> Dict:
+        """Основной метод парсинга дня календаря"""
+        content = await self._fetch_page(calendar_date, session)
+        return await self._parse_content(content, calendar_date)
+    
+    async def parse_calendar_day_if_changed(
+        self,
+        calendar_date: date,
+        page_meta: Optional[Dict[str, Optional[str]]] = None
+    ) -> Tuple[Optional[Dict], Dict[str, Optional[str]]]:
+        """
+        Условная загрузка дня календаря. С метаданными прошлой загрузки отправляются
+        If-None-Match/If-Modified-Since; при ответе 304 или той же странице (совпал
+        SHA-256 содержимого) разбор пропускается.
+        
+        :param calendar_date: Дата календаря
+        :param page_meta: Метаданные прошлой загрузки (etag, last_modified, sha256) или None
+        :return: Кортеж (данные дня или None, если страница не изменилась; новые метаданные)
+        """
+        page_meta = page_meta or {}
+        headers = {}
+        if page_meta.get("etag"):
+            headers["If-None-Match"] = page_meta["etag"]
+        if page_meta.get("last_modified"):
+            headers["If-Modified-Since"] = page_meta["last_modified"]
+        
+        self._conditional_stats["requests"] += 1
+        status, content, validators = await self._fetch(calendar_date, headers=headers or None)
+        if status == 304:
+            self._conditional_stats["not_modified"] += 1
+            logger.info(f"Страница {calendar_date} не изменилась (304), разбор пропущен")
+            return None, {
+                "etag": validators["etag"] or page_meta.get("etag"),
+                "last_modified": validators["last_modified"] or page_meta.get("last_modified"),
+                "sha256": page_meta.get("sha256")
+            }
+        
+        new_meta = dict(validators, sha256=hashlib.sha256(content).hexdigest())
+        if page_meta.get("sha256") == new_meta["sha256"]:
+            self._conditional_stats["unchanged_content"] += 1
+            logger.info(f"Содержимое страницы {calendar_date} не изменилось, разбор пропущен")
+            return None, new_meta
+        
+        self._conditional_stats["parsed"] += 1
+        return await self._parse_content(content, calendar_date), new_meta
+    
+    def get_fetch_stats(self) -> Dict[str, int]:
+        """
+        Метрики условных запросов: всего, ответов 304, страниц с тем же содержимым
+        и страниц, которые пришлось разобрать
+        """
+        return dict(self._conditional_stats)
+    
+    async def parse_dates(self, dates: Iterable[date]) -> Dict[date, Dict]:
+        """
+        Парсинг нескольких дней через одну сессию. Количество одновременных запросов
+        и их частота ограничены настройками парсера, ошибки отдельных дней логируются.
+        
+        :param dates: Даты календаря
+        :return: Данные успешно полученных дней по датам (в порядке дат)
+        """
+        unique_dates = sorted(set(dates))
+        if not unique_dates:
+            return {}
+        
+        async with self._new_session() as session:
+            results = await asyncio.gather(
+                *(self.parse_calendar_day(calendar_date, session) for calendar_date in unique_dates),
+                return_exceptions=True
+            )
+        
+        parsed = {}
+        for calendar_date, result in zip(unique_dates, results):
+            if isinstance(result, Exception):
+                logger.error(f"Ошибка при парсинге даты {calendar_date}: {result}")
+            else:
+                parsed[calendar_date] = result
+        return parsed
+    
+    async def parse_range(self, start: date, end: date) -> Dict[date, Dict]:
+        """
+        Парсинг диапазона дней (включая обе границы)
+        
+        :param start: Первый день
+        :param end: Последний день
+        :return: Данные успешно полученных дней по датам
+        """
+        return await self.parse_dates(date_range(start, end))
+
+
+def date_range(start: date, end: date) -> List[date]:
+    """Дни от start до end включительно"""
+    return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+
+_worker_state = threading.local()
+
+
+def parse_calendar_html(backend: str, content: bytes, calendar_date: date) -> Dict:
+    """
+    Разбор страницы дня календаря в потоке или процессе пула. У каждого потока
+    свой парсер: объекты парсеров lxml не рассчитаны на одновременное использование.
+
+    :param backend: Бэкенд разбора HTML
+    :param content: HTML страницы
+    :param calendar_date: Дата календаря
+    :return: Данные дня календаря
+    """
+    parsers = getattr(_worker_state, "parsers", None)
+    if parsers is None:
+        parsers = _worker_state.parsers = {}
+    parser = parsers.get(backend)
+    if parser is None:
+        parser = parsers[backend] = MoonCalendarParser(backend=backend)
+    return parser.parse_html(content, calendar_date)
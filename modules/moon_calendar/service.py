@@ -7,6 +7,8 @@ import logging
 from fastapi import HTTPException
 
 from core.cache import CacheManager
+from core.exceptions import ParseQueueFullException, parser_exception_handler
+import config
 from .models import ApiResponse, CalendarDayResponse
 from .parser import MoonCalendarParser
 
@@ -23,7 +25,9 @@ class MoonCalendarService:
         """Получение данных лунного календаря на конкретную дату"""
         try:
             # Проверяем кэш
-            cached_data = await self.cache_manager.get(calendar_date)
+            cached_data = await self.cache_manager.get_field(
+                CacheManager.NS_MOON_CALENDAR, calendar_date, CacheManager.CALENDAR_FIELD
+            )
             
             if cached_data:
                 return ApiResponse(
@@ -32,12 +36,19 @@ class MoonCalendarService:
                     cached=True
                 )
             
-            # Парсим новые данные
-            logger.info(f"Парсинг лунного календаря для {calendar_date}")
-            raw_data = await self.parser.parse_calendar_day(calendar_date)
+            # Парсим новые данные (один раз для одновременных запросов); ошибки страницы,
+            # например 404 для даты, запоминаются в негативном кэше
+            async def parse_day():
+                logger.info(f"Парсинг лунного календаря для {calendar_date}")
+                return await self.parser.parse_calendar_day(calendar_date)
             
-            # Сохраняем в кэш
-            await self.cache_manager.set(calendar_date, raw_data)
+            raw_data = await self.cache_manager.get_or_compute(
+                CacheManager.NS_MOON_CALENDAR,
+                calendar_date,
+                parse_day,
+                field=CacheManager.CALENDAR_FIELD,
+                negative_ttls={HTTPException: config.NEGATIVE_CACHE_TTL_PARSER_ERROR}
+            )
             
             return ApiResponse(
                 success=True,
@@ -47,6 +58,9 @@ class MoonCalendarService:
             
         except HTTPException:
             raise
+        except ParseQueueFullException as e:
+            # Перегрузка пула разбора - временная, клиент может повторить запрос
+            raise parser_exception_handler(e)
         except Exception as e:
             logger.error(f"Неожиданная ошибка: {e}")
             return ApiResponse(
@@ -4,13 +4,18 @@
 import asyncio
 import logging
 from datetime import date, datetime, timedelta
+from typing import Any, Dict, List
 
 from core.cache import CacheManager
+import config
 from .parser import MoonCalendarParser
 from .openrouter_service import MoonCalendarOpenRouterService
 
 logger = logging.getLogger(__name__)
 
+# Типы пользователей, для которых фоновая задача генерирует AI-ответы
+AI_USER_TYPES = ("free", "premium")
+
 class MoonCalendarTasks:
     """Класс для фоновых задач лунного календаря"""
     
@@ -26,6 +31,13 @@ class MoonCalendarTasks:
         self.parser = parser
         self.openrouter_service = openrouter_service
         self._is_updating = False # Флаг для предотвращения одновременного запуска
+        self._prefetching_months = set()  # Месяцы, предзагрузка которых уже выполняется
+        
+        # Метрики обновлений: сколько разборов и генераций удалось пропустить
+        self._stats = {
+            "runs": 0, "dates": 0, "parse_skipped": 0, "unchanged_data": 0, "llm_skipped": 0, "llm_regenerated": 0,
+            "validated": 0, "validation_mismatches": 0
+        }
     
     async def update_calendar_cache_and_generate_ai_responses(self) -> None:
         """Обновление кэша лунного календаря (спарсенные данные) и генерация AI-ответов для текущего и следующего дня."""
@@ -41,6 +53,19 @@ class MoonCalendarTasks:
 
             logger.info(f"Запуск фоновой задачи обновления кэша и генерации AI-ответов для {', '.join(map(str, dates_to_process))}")
             
+            self._stats["runs"] += 1
+            
+            # Данные в кэше и метаданные прошлой загрузки страниц (по одному пакетному запросу)
+            cached_by_date = await self.cache_manager.get_many(
+                CacheManager.NS_MOON_CALENDAR, dates_to_process, field=CacheManager.CALENDAR_FIELD
+            )
+            page_meta_by_date = await self.cache_manager.get_many(CacheManager.NS_MOON_PAGE_META, dates_to_process)
+            
+            # Сначала загружаем все даты, затем сохраняем данные одним пакетом.
+            # Это важно, т.к. _get_calendar_data в openrouter_service будет брать их из кэша.
+            parsed_by_date = {}
+            new_meta_by_date = {}
+            changed_dates = []
             for current_date in dates_to_process:
                 try:
                     # Проверяем, что current_date действительно является объектом date
@@ -49,13 +74,46 @@ class MoonCalendarTasks:
                         continue
                         
                     logger.info(f"Обновление спарсенных данных для {current_date.isoformat()}")
-                    parsed_data = await self.parser.parse_calendar_day(current_date)
+                    self._stats["dates"] += 1
+                    cached_data = cached_by_date.get(current_date)
+                    # Без данных в кэше страница загружается и разбирается безусловно
+                    page_meta = page_meta_by_date.get(current_date) if cached_data else None
+                    parsed_data, new_meta_by_date[current_date] = await self.parser.parse_calendar_day_if_changed(
+                        current_date, page_meta
+                    )
                     
-                    # Сначала сохраняем только спарсенные данные. 
-                    # Это важно, т.к. _get_calendar_data в openrouter_service будет брать их из кэша.
-                    await self.cache_manager.set(current_date, parsed_data) 
-                    logger.info(f"Спарсенные данные для {current_date.isoformat()} сохранены в кэш.")
-
+                    if parsed_data is None:
+                        # Страница не изменилась: данные из кэша перезаписываются только для продления TTL
+                        self._stats["parse_skipped"] += 1
+                        parsed_by_date[current_date] = cached_data
+                    else:
+                        parsed_by_date[current_date] = parsed_data
+                        self._validate(parsed_data)
+                        if parsed_data == cached_data:
+                            # Страница изменилась (реклама, служебная разметка), а данные дня - нет
+                            self._stats["unchanged_data"] += 1
+                        else:
+                            changed_dates.append(current_date)
+                except Exception as e:
+                    logger.error(f"Ошибка при парсинге даты {current_date} в фоновой задаче: {e}", exc_info=True)
+            
+            if parsed_by_date:
+                await self.cache_manager.set_many(
+                    CacheManager.NS_MOON_CALENDAR, parsed_by_date, field=CacheManager.CALENDAR_FIELD
+                )
+                await self.cache_manager.set_many(CacheManager.NS_MOON_PAGE_META, new_meta_by_date)
+                logger.info(f"Спарсенные данные для {', '.join(d.isoformat() for d in parsed_by_date)} сохранены в кэш.")
+            
+            # Для неизменившихся дней AI-ответы генерируются заново, только если их нет в кэше
+            unchanged_dates = [d for d in parsed_by_date if d not in changed_dates]
+            regenerate_dates = changed_dates + await self._dates_missing_ai_responses(unchanged_dates)
+            for current_date in unchanged_dates:
+                if current_date not in regenerate_dates:
+                    await self._keep_ai_responses(current_date)
+            
+            for current_date in regenerate_dates:
+                try:
+                    self._stats["llm_regenerated"] += 1
                     # Теперь генерируем и кэшируем AI ответы для этой даты
                     logger.info(f"Генерация и кэширование AI-ответов для {current_date.isoformat()}...")
                     await self.openrouter_service.background_generate_and_cache_ai_responses(current_date)
@@ -70,6 +128,99 @@ class MoonCalendarTasks:
         finally: # Гарантируем сброс флага
             self._is_updating = False
     
+    async def _dates_missing_ai_responses(self, dates: List[date]) -> List[date]:
+        """Даты, для которых в кэше нет AI-ответа хотя бы для одного типа пользователей"""
+        if not dates:
+            return []
+        missing = set()
+        for user_type in AI_USER_TYPES:
+            cached = await self.cache_manager.get_many(
+                CacheManager.NS_MOON_CALENDAR, dates, field=f"{CacheManager.AI_RESPONSE_FIELD_PREFIX}{user_type}"
+            )
+            missing.update(d for d in dates if d not in cached)
+        return [d for d in dates if d in missing]
+    
+    async def _keep_ai_responses(self, calendar_date: date) -> None:
+        """
+        Пропуск генерации для неизменившегося дня: AI-ответы в кэше отмечаются свежими,
+        чтобы чтения не запускали их обновление
+        """
+        self._stats["llm_skipped"] += 1
+        logger.info(f"Данные для {calendar_date.isoformat()} не изменились, генерация AI-ответов пропущена.")
+        for user_type in AI_USER_TYPES:
+            await self.cache_manager.mark_fresh(
+                CacheManager.NS_MOON_CALENDAR,
+                calendar_date,
+                config.MOON_CALENDAR_AI_SOFT_TTL_SECONDS,
+                field=f"{CacheManager.AI_RESPONSE_FIELD_PREFIX}{user_type}"
+            )
+    
+    def _validate(self, calendar_data: Dict[str, Any]) -> None:
+        """
+        Сверка спарсенного дня с локальным расчетом Луны. Расхождения только логируются:
+        они указывают на изменение разметки Rambler или ошибку разбора
+        """
+        ephemeris = self.openrouter_service.ephemeris
+        if ephemeris is None or not config.MOON_ASTRONOMY_VALIDATION_ENABLED:
+            return
+        self._stats["validated"] += 1
+        issues = ephemeris.validate(calendar_data, config.MOON_ASTRONOMY_TOLERANCE_MINUTES)
+        if issues:
+            self._stats["validation_mismatches"] += 1
+            logger.warning(f"Данные Rambler для {calendar_data.get('date')} расходятся с расчетом: {'; '.join(issues)}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Метрики фоновых обновлений: запуски и проверенные даты; даты, для которых разбор
+        пропущен (304 или та же страница); даты, где страница изменилась, а данные - нет;
+        пропущенные и выполненные генерации AI-ответов; сверки с локальным расчетом Луны
+        и найденные расхождения; метрики условных запросов парсера
+        """
+        return {**self._stats, "fetch": self.parser.get_fetch_stats()}
+    
+    async def prefetch_month(self, year: int, month: int) -> None:
+        """
+        Предзагрузка спарсенных данных всех дней месяца в кэш (без AI-ответов).
+        Дни, уже лежащие в кэше, не парсятся повторно.
+        
+        :param year: Год
+        :param month: Месяц (1-12)
+        """
+        if (year, month) in self._prefetching_months:
+            logger.info(f"Предзагрузка {year}-{month:02d} уже выполняется, пропуск этого запуска.")
+            return
+        
+        self._prefetching_months.add((year, month))
+        try:
+            start = date(year, month, 1)
+            end = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+            logger.info(f"Предзагрузка лунного календаря за {start} - {end}")
+            result = await self.openrouter_service.get_calendar_range(
+                start, end, ttl=config.MOON_CALENDAR_PREFETCH_TTL_SECONDS
+            )
+            logger.info(
+                f"Предзагрузка {year}-{month:02d} завершена: дней {len(result.days)}, из кэша {result.cached}, "
+                f"ошибок {len(result.errors)}"
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при предзагрузке лунного календаря за {year}-{month:02d}: {e}", exc_info=True)
+        finally:
+            self._prefetching_months.discard((year, month))
+    
+    async def get_missing_dates(self) -> List[date]:
+        """
+        Даты (текущий и следующий день), для которых в кэше нет спарсенных данных.
+        Проверяются одним пакетным запросом.
+        
+        :return: Список отсутствующих в кэше дат
+        """
+        today = date.today()
+        expected_dates = [today, today + timedelta(days=1)]
+        cached_data = await self.cache_manager.get_many(
+            CacheManager.NS_MOON_CALENDAR, expected_dates, field=CacheManager.CALENDAR_FIELD
+        )
+        return [d for d in expected_dates if d not in cached_data]
+    
     async def run_periodic_update(self, interval_minutes: int) -> None:
         """
         Запуск периодического обновления кэша и AI-ответов.
@@ -85,13 +236,13 @@ class MoonCalendarTasks:
         # Бесконечный цикл обновления с защитой от исключений
         while True:
             try:
-                # Проверяем наличие данных в кэше для текущего дня
-                today = date.today()
-                cached_data = await self.cache_manager.get(today)
+                # Проверяем наличие данных в кэше для текущего и следующего дня (один запрос)
+                missing_dates = await self.get_missing_dates()
                 
-                if cached_data is None:
-                    # Если данных для текущего дня нет в кэше, запускаем обновление немедленно
-                    logger.warning(f"Данные для текущего дня ({today}) отсутствуют в кэше. Запускаем обновление немедленно.")
+                if missing_dates:
+                    # Если данных для текущего или следующего дня нет в кэше, запускаем обновление немедленно
+                    missing = ", ".join(d.isoformat() for d in missing_dates)
+                    logger.warning(f"Данные для {missing} отсутствуют в кэше. Запускаем обновление немедленно.")
                     await self.update_calendar_cache_and_generate_ai_responses()
                     logger.info(f"Внеплановое обновление завершено. Следующее плановое обновление через {interval_minutes} минут.")
                     # Сбрасываем счетчик времени после внепланового обновления
@@ -1,11 +1,12 @@
 """
 Сервис для обработки запросов к картам Таро через OpenRouter
 """
+import hashlib
 import json
 import logging
 import random
 from datetime import datetime
-from typing import Dict, Any, Optional, List, Tuple
+from typing import AsyncIterator, Dict, Any, Optional, List, Tuple
 import asyncio
 
 from fastapi import HTTPException
@@ -15,7 +16,8 @@ from core.openrouter_client import OpenRouterClient
 from core.cache import CacheManager
 from .models import ApiResponse, TarotReading, TarotCardPosition, TarotSpread, TarotCard
 from .data import get_all_cards, get_card_by_id, get_all_spreads, get_spread_by_id
-from .prompts import get_spread_prompt, TAROT_SPREAD_PROMPTS
+from .prompts import get_spread_prompt
+import config
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +29,8 @@ class TarotOpenRouterService:
         cache_manager: CacheManager,
         openrouter_client: OpenRouterClient,
         prompts_config: Dict[str, Dict[str, Any]],
+        deadlines: Optional[Dict[str, float]] = None,
+        llm_caller: str = "tarot"
     ):
         """
         Инициализация сервиса
@@ -34,10 +38,14 @@ class TarotOpenRouterService:
         :param cache_manager: Менеджер кэша
         :param openrouter_client: Клиент OpenRouter
         :param prompts_config: Конфигурация промптов для разных типов пользователей
+        :param deadlines: Бюджет времени на генерацию по типам пользователей (по умолчанию config.OPENROUTER_DEADLINES)
+        :param llm_caller: Метка сервиса в учете токенов и задержек LLM
         """
         self.cache_manager = cache_manager
         self.openrouter_client = openrouter_client
         self.prompts_config = prompts_config
+        self.deadlines = deadlines or config.OPENROUTER_DEADLINES
+        self.llm_caller = llm_caller
         
         # Сопоставление типов пользователей и моделей
         self.user_type_models = {
@@ -83,20 +91,55 @@ class TarotOpenRouterService:
         # Для каждой карты определяем, перевернута она или нет
         return [(card, random.choice([True, False])) for card in selected_cards]
     
-    def _prepare_user_message(self, spread_id: int, drawn_cards: List[Tuple[Dict[str, Any], bool]], question: Optional[str], user_type: str) -> str:
+    def _prepare_static_context(self, spread_id: int, user_type: str) -> str:
         """
-        Подготовка сообщения пользователя для OpenRouter
+        Неизменная часть промпта для расклада и типа пользователя: описание расклада
+        и инструкции. Она передается вместе с системным сообщением, поэтому провайдер
+        может кэшировать этот префикс между запросами (prompt caching).
         
         :param spread_id: ID расклада
-        :param drawn_cards: Список вытянутых карт с их положением
-        :param question: Вопрос для гадания (опционально)
         :param user_type: Тип пользователя (free/premium)
-        :return: Сообщение пользователя
+        :return: Статический контекст
         """
         spread = get_spread_by_id(spread_id)
         
         # Формируем информацию о раскладе
-        spread_info = f"Расклад: {spread['name']}\nОписание расклада: {spread['description']}\n"
+        context = f"Расклад: {spread['name']}\nОписание расклада: {spread['description']}\n"
+        
+        # Добавляем специфичные инструкции для данного расклада
+        spread_specific_prompt = get_spread_prompt(spread_id, user_type)
+        if spread_specific_prompt:
+            context += f"\nСпециальные инструкции для этого расклада:\n{spread_specific_prompt}\n"
+        
+        # Добавляем общие инструкции в зависимости от типа пользователя
+        if user_type == "free":
+            context += (
+                "\nПожалуйста, предоставь краткую интерпретацию расклада и общий совет. "
+                "Ограничься общим толкованием и основными выводами."
+            )
+        else:
+            context += (
+                "\nПожалуйста, предоставь детальную интерпретацию расклада, включая: "
+                "1. Общий анализ расклада и его энергетики, "
+                "2. Подробное толкование каждой карты в контексте ее позиции, "
+                "3. Взаимосвязи между картами и их влияние друг на друга, "
+                "4. Конкретные советы и рекомендации на основе расклада, "
+                "5. Возможные сценарии развития ситуации."
+            )
+        
+        return context
+    
+    def _prepare_user_message(self, spread_id: int, drawn_cards: List[Tuple[Dict[str, Any], bool]], question: Optional[str]) -> str:
+        """
+        Подготовка сообщения пользователя для OpenRouter: изменяемая часть промпта
+        (вопрос и выпавшие карты)
+        
+        :param spread_id: ID расклада
+        :param drawn_cards: Список вытянутых карт с их положением
+        :param question: Вопрос для гадания (опционально)
+        :return: Сообщение пользователя
+        """
+        spread = get_spread_by_id(spread_id)
         
         # Добавляем вопрос, если он есть
         question_info = f"Вопрос: {question}\n" if question else "Вопрос не задан (общее гадание)\n"
@@ -120,31 +163,189 @@ class TarotOpenRouterService:
                 cards_info += f"   Значение в прямом положении: {card['meaning_upright']}\n"
                 cards_info += f"   Ключевые слова: {', '.join(card['keywords_upright'])}\n"
         
-        # Объединяем все части сообщения
-        message = f"{spread_info}\n{question_info}\n{cards_info}\n"
+        return f"{question_info}\n{cards_info}"
+    
+    def _make_cache_key(
+        self,
+        spread_id: int,
+        user_type: str,
+        question: Optional[str],
+        fixed_cards: Optional[List[Dict[str, Any]]] = None
+    ) -> str:
+        """
+        Формирование ключа кэша гадания
         
-        # Добавляем специфичные инструкции для данного расклада
-        spread_specific_prompt = get_spread_prompt(spread_id, user_type)
-        if spread_specific_prompt:
-            message += f"\nСпециальные инструкции для этого расклада:\n{spread_specific_prompt}\n"
+        :param spread_id: ID расклада
+        :param user_type: Тип пользователя (free/premium)
+        :param question: Вопрос для гадания (опционально)
+        :param fixed_cards: Фиксированные карты расклада (опционально)
+        :return: Ключ кэша
+        """
+        # Хэш вопроса должен совпадать во всех воркерах,
+        # поэтому используется sha1, а не встроенный hash() со случайной солью
+        cache_key = f"{spread_id}_{user_type}"
+        if question:
+            cache_key += f"_{hashlib.sha1(question.encode('utf-8')).hexdigest()}"
+        if fixed_cards:
+            # Если указаны фиксированные карты, включаем их в кэш-ключ
+            fixed_cards_str = "_".join([f"{c['card_id']}_{c['is_reversed']}" for c in fixed_cards])
+            cache_key += f"_{fixed_cards_str}"
+        return cache_key
+    
+    def _select_cards(
+        self,
+        spread: Dict[str, Any],
+        fixed_cards: Optional[List[Dict[str, Any]]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Выбор карт для расклада с учетом фиксированных карт
         
-        # Добавляем общие инструкции в зависимости от типа пользователя
-        if user_type == "free":
-            message += (
-                "Пожалуйста, предоставь краткую интерпретацию расклада и общий совет. "
-                "Ограничься общим толкованием и основными выводами."
-            )
-        else:
-            message += (
-                "Пожалуйста, предоставь детальную интерпретацию расклада, включая: "
-                "1. Общий анализ расклада и его энергетики, "
-                "2. Подробное толкование каждой карты в контексте ее позиции, "
-                "3. Взаимосвязи между картами и их влияние друг на друга, "
-                "4. Конкретные советы и рекомендации на основе расклада, "
-                "5. Возможные сценарии развития ситуации."
-            )
+        :param spread: Расклад
+        :param fixed_cards: Фиксированные карты [{"card_id": id, "is_reversed": bool}, ...] (опционально)
+        :return: Карты с позициями расклада
+        :raises ValueError: Если карты не удалось подобрать
+        """
+        # Получаем все карты
+        all_cards = get_all_cards()
+        if not all_cards:
+            raise ValueError("Не удалось получить список карт Таро")
+        
+        # Выбираем карты для расклада
+        cards_for_reading = []
+        
+        # Если есть фиксированные карты, используем их
+        if fixed_cards:
+            for fixed_card_data in fixed_cards:
+                card_id = fixed_card_data["card_id"]
+                is_reversed = fixed_card_data["is_reversed"]
+                
+                card = get_card_by_id(card_id)
+                if not card:
+                    raise ValueError(f"Карта с ID {card_id} не найдена")
+                
+                cards_for_reading.append({
+                    "card": card,
+                    "is_reversed": is_reversed
+                })
+        
+        # Добираем оставшиеся карты случайным образом
+        remaining_cards_count = spread["card_count"] - len(cards_for_reading)
+        if remaining_cards_count > 0:
+            # Создаем копию списка карт
+            available_cards = all_cards.copy()
+            
+            # Исключаем карты, которые уже выбраны как фиксированные
+            if fixed_cards:
+                fixed_card_ids = [card_data["card_id"] for card_data in fixed_cards]
+                available_cards = [card for card in available_cards if card["id"] not in fixed_card_ids]
+            
+            # Проверяем, достаточно ли осталось карт
+            if len(available_cards) < remaining_cards_count:
+                raise ValueError(f"Недостаточно карт для расклада. Требуется {remaining_cards_count}, доступно {len(available_cards)}")
+            
+            # Выбираем случайные карты
+            selected_cards = random.sample(available_cards, remaining_cards_count)
+            
+            for card in selected_cards:
+                # Определяем случайно положение карты (прямое или перевернутое)
+                is_reversed = random.choice([True, False])
+                cards_for_reading.append({
+                    "card": card,
+                    "is_reversed": is_reversed
+                })
+        
+        # Формируем данные для отправки в промпт
+        cards_with_positions = []
+        
+        for i, card_data in enumerate(cards_for_reading):
+            if i < len(spread["positions"]):
+                position = spread["positions"][i]
+            else:
+                # Если позиций меньше, чем карт (что странно), создаем дефолтную позицию
+                position = {
+                    "name": f"Позиция {i+1}",
+                    "description": f"Позиция {i+1} в раскладе"
+                }
+            
+            card = card_data["card"]
+            is_reversed = card_data["is_reversed"]
+            
+            cards_with_positions.append({
+                "card_id": card["id"],
+                "card_name": card["name"],
+                "card_arcana": card["arcana"],
+                "card_suit": card.get("suit", ""),
+                "card_keywords": card["keywords_reversed"] if is_reversed else card["keywords_upright"],
+                "card_meaning": card["meaning_reversed"] if is_reversed else card["meaning_upright"],
+                "is_reversed": is_reversed,
+                "position": i + 1,
+                "position_name": position["name"],
+                "position_description": position["description"],
+                "card_image_url": card.get("image_url", "")  # URL изображения карты, если есть
+            })
         
-        return message
+        return cards_with_positions
+    
+    def _prepare_reading_prompt(
+        self,
+        spread_id: int,
+        cards_with_positions: List[Dict[str, Any]],
+        question: Optional[str],
+        user_type: str
+    ) -> Tuple[Dict[str, Any], str, str]:
+        """
+        Подготовка промпта для выпавших карт: системное сообщение со статическим
+        контекстом расклада (кэшируемый префикс) и сообщение пользователя с вопросом и картами
+        
+        :param spread_id: ID расклада
+        :param cards_with_positions: Карты с позициями расклада
+        :param question: Вопрос для гадания (опционально)
+        :param user_type: Тип пользователя (free/premium)
+        :return: Кортеж (конфигурация промпта, системное сообщение, сообщение пользователя)
+        """
+        prompt_config = self._get_prompt_config(user_type)
+        system_message = f"{prompt_config['system_message']}\n\n{self._prepare_static_context(spread_id, user_type)}"
+        drawn_cards = [(get_card_by_id(card["card_id"]), card["is_reversed"]) for card in cards_with_positions]
+        return prompt_config, system_message, self._prepare_user_message(spread_id, drawn_cards, question)
+    
+    async def _generate_interpretation(
+        self,
+        spread_id: int,
+        cards_with_positions: List[Dict[str, Any]],
+        question: Optional[str],
+        user_type: str
+    ) -> str:
+        """
+        Генерация интерпретации расклада (с хеджированием между моделями, если оно включено)
+        
+        :param spread_id: ID расклада
+        :param cards_with_positions: Карты с позициями расклада
+        :param question: Вопрос для гадания (опционально)
+        :param user_type: Тип пользователя (free/premium)
+        :return: Текст интерпретации
+        """
+        prompt_config, system_message, user_message = self._prepare_reading_prompt(spread_id, cards_with_positions, question, user_type)
+        models = self._get_models_for_user_type(user_type)
+        
+        if config.OPENROUTER_HEDGING_ENABLED:
+            return await self.openrouter_client.generate_text_hedged(
+                system_message=system_message,
+                user_message=user_message,
+                max_tokens=prompt_config["max_tokens"],
+                temperature=prompt_config["temperature"],
+                models=models,
+                deadline_seconds=self.deadlines.get(user_type),
+                caller=self.llm_caller
+            )
+        return await self.openrouter_client.generate_text(
+            system_message=system_message,
+            user_message=user_message,
+            max_tokens=prompt_config["max_tokens"],
+            temperature=prompt_config["temperature"],
+            model=models[0] if models else None,
+            deadline_seconds=self.deadlines.get(user_type),
+            caller=self.llm_caller
+        )
     
     async def get_tarot_reading(
         self,
@@ -182,188 +383,145 @@ class TarotOpenRouterService:
                     error=f"Неверный тип пользователя. Допустимые значения: free, premium"
                 )
             
-            # Формируем кэш-ключ
-            cache_key = f"tarot_reading_{spread_id}_{user_type}"
-            if question:
-                cache_key += f"_{hash(question)}"
-            if fixed_cards:
-                # Если указаны фиксированные карты, включаем их в кэш-ключ
-                fixed_cards_str = "_".join([f"{c['card_id']}_{c['is_reversed']}" for c in fixed_cards])
-                cache_key += f"_{fixed_cards_str}"
+            cache_key = self._make_cache_key(spread_id, user_type, question, fixed_cards)
             
             # Проверяем кэш
-            cached_response = await self.cache_manager.get(cache_key)
+            cached_response = await self.cache_manager.get(CacheManager.NS_TAROT_READING, cache_key)
             if cached_response:
                 # Возвращаем кэшированный ответ
                 cached_response["cached"] = True
                 return ApiResponse(**cached_response)
             
-            # Получаем все карты
-            all_cards = get_all_cards()
-            if not all_cards:
-                return ApiResponse(
-                    success=False,
-                    error="Не удалось получить список карт Таро"
-                )
-            
-            # Выбираем карты для расклада
-            cards_for_reading = []
-            
-            # Если есть фиксированные карты, используем их
-            if fixed_cards:
-                for fixed_card_data in fixed_cards:
-                    card_id = fixed_card_data["card_id"]
-                    is_reversed = fixed_card_data["is_reversed"]
-                    
-                    card = get_card_by_id(card_id)
-                    if not card:
-                        return ApiResponse(
-                            success=False,
-                            error=f"Карта с ID {card_id} не найдена"
-                        )
-                    
-                    cards_for_reading.append({
-                        "card": card,
-                        "is_reversed": is_reversed
-                    })
-            
-            # Добираем оставшиеся карты случайным образом
-            remaining_cards_count = spread["card_count"] - len(cards_for_reading)
-            if remaining_cards_count > 0:
-                # Создаем копию списка карт
-                available_cards = all_cards.copy()
-                
-                # Исключаем карты, которые уже выбраны как фиксированные
-                if fixed_cards:
-                    fixed_card_ids = [card_data["card_id"] for card_data in fixed_cards]
-                    available_cards = [card for card in available_cards if card["id"] not in fixed_card_ids]
-                
-                # Проверяем, достаточно ли осталось карт
-                if len(available_cards) < remaining_cards_count:
-                    return ApiResponse(
-                        success=False,
-                        error=f"Недостаточно карт для расклада. Требуется {remaining_cards_count}, доступно {len(available_cards)}"
-                    )
-                
-                # Выбираем случайные карты
-                selected_cards = random.sample(available_cards, remaining_cards_count)
-                
-                for card in selected_cards:
-                    # Определяем случайно положение карты (прямое или перевернутое)
-                    is_reversed = random.choice([True, False])
-                    cards_for_reading.append({
-                        "card": card,
-                        "is_reversed": is_reversed
-                    })
-            
-            # Формируем данные для отправки в промпт
-            cards_with_positions = []
-            
-            for i, card_data in enumerate(cards_for_reading):
-                if i < len(spread["positions"]):
-                    position = spread["positions"][i]
-                else:
-                    # Если позиций меньше, чем карт (что странно), создаем дефолтную позицию
-                    position = {
-                        "name": f"Позиция {i+1}",
-                        "description": f"Позиция {i+1} в раскладе"
-                    }
-                
-                card = card_data["card"]
-                is_reversed = card_data["is_reversed"]
-                
-                cards_with_positions.append({
-                    "card_id": card["id"],
-                    "card_name": card["name"],
-                    "card_arcana": card["arcana"],
-                    "card_suit": card.get("suit", ""),
-                    "card_keywords": card["keywords_reversed"] if is_reversed else card["keywords_upright"],
-                    "card_meaning": card["meaning_reversed"] if is_reversed else card["meaning_upright"],
-                    "is_reversed": is_reversed,
-                    "position": i + 1,
-                    "position_name": position["name"],
-                    "position_description": position["description"],
-                    "card_image_url": card.get("image_url", "")  # URL изображения карты, если есть
-                })
-            
-            # Получаем соответствующий промпт
-            prompt_templates = TAROT_SPREAD_PROMPTS.get(spread_id)
-            if not prompt_templates:
+            try:
+                cards_with_positions = self._select_cards(spread, fixed_cards)
+            except ValueError as e:
                 return ApiResponse(
                     success=False,
-                    error=f"Промпт для расклада с ID {spread_id} не найден"
+                    error=str(e)
                 )
             
-            # Выбираем промпт в зависимости от типа пользователя
-            prompt_template = prompt_templates.get(user_type)
-            if not prompt_template:
+            # Генерируем интерпретацию
+            try:
+                interpretation = await self._generate_interpretation(spread_id, cards_with_positions, question, user_type)
+            except (NetworkException, HTTPException) as e:
                 return ApiResponse(
                     success=False,
-                    error=f"Промпт для типа пользователя {user_type} не найден"
+                    error=f"Ошибка при получении интерпретации: {str(e)}"
                 )
             
-            # Подготавливаем данные для промпта
-            prompt_data = {
-                "spread_name": spread["name"],
-                "spread_description": spread["description"],
+            # Формируем данные для ответа
+            response_data = {
+                "spread": spread,
+                "cards": cards_with_positions,
+                "interpretation": interpretation,
                 "question": question if question else "Общее гадание",
-                "cards": cards_with_positions
+                "timestamp": datetime.now().isoformat()
             }
             
-            # Формируем промпт
-            prompt = prompt_template.format(**prompt_data)
-            
-            # Отправляем запрос к OpenRouter
-            result = await self.openrouter_client.chat_completion(
-                messages=[
-                    {"role": "system", "content": "Вы - опытный таролог, предоставляющий глубокие интерпретации раскладов Таро."},
-                    {"role": "user", "content": prompt}
-                ],
-                model=self.prompts_config["TAROT_MODEL"]
+            # Сохраняем в кэш
+            cache_ttl_minutes = self.prompts_config.get("TAROT_CACHE_TTL")
+            await self.cache_manager.set(
+                CacheManager.NS_TAROT_READING,
+                cache_key,
+                {
+                    "success": True,
+                    "data": response_data,
+                    "error": None,
+                    "model": None
+                },
+                ttl=cache_ttl_minutes * 60 if cache_ttl_minutes else None
             )
             
-            # Формируем ответ
-            if result.get("success", False):
-                interpretation = result.get("response", "")
-                
-                # Формируем данные для ответа
-                response_data = {
-                    "spread": spread,
-                    "cards": cards_with_positions,
-                    "interpretation": interpretation,
-                    "question": question if question else "Общее гадание",
-                    "timestamp": datetime.now().isoformat()
-                }
-                
-                # Сохраняем в кэш
-                await self.cache_manager.set(
-                    key=cache_key,
-                    value={
-                        "success": True,
-                        "data": response_data,
-                        "error": None,
-                        "model": self.prompts_config["TAROT_MODEL"]
-                    },
-                    ttl_minutes=self.prompts_config.get("TAROT_CACHE_TTL", 60)
-                )
-                
-                # Возвращаем ответ
-                return ApiResponse(
-                    success=True,
-                    data=response_data,
-                    model=self.prompts_config["TAROT_MODEL"],
-                    cached=False
-                )
-            else:
-                error_message = result.get("error", "Неизвестная ошибка при получении интерпретации")
-                return ApiResponse(
-                    success=False,
-                    error=error_message
-                )
+            # Возвращаем ответ
+            return ApiResponse(
+                success=True,
+                data=response_data,
+                cached=False
+            )
         
         except Exception as e:
             logger.exception(f"Ошибка при получении гадания на Таро: {str(e)}")
             return ApiResponse(
                 success=False,
                 error=f"Ошибка при получении гадания на Таро: {str(e)}"
-            ) 
\ No newline at end of file
+            )
+    
+    async def stream_tarot_reading(
+        self,
+        spread_id: int,
+        question: Optional[str] = None,
+        user_type: str = "free"
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Потоковое гадание на Таро: сначала событие (cards, {...}) с выпавшими картами,
+        затем (token, {"text"}) по мере генерации интерпретации и (done, {...}) в формате
+        ApiResponse либо (error, {"error"}). Полный ответ записывается в кэш после
+        окончания потока под тем же ключом, что и в get_tarot_reading.
+        
+        :param spread_id: ID расклада
+        :param question: Вопрос для гадания (опционально)
+        :param user_type: Тип пользователя (free/premium)
+        :return: Асинхронный итератор пар (событие, данные)
+        """
+        spread = get_spread_by_id(spread_id)
+        if not spread:
+            yield "error", {"error": f"Расклад с ID {spread_id} не найден"}
+            return
+        
+        cache_key = self._make_cache_key(spread_id, user_type, question)
+        cached_response = await self.cache_manager.get(CacheManager.NS_TAROT_READING, cache_key)
+        if cached_response and cached_response.get("success"):
+            cached_data = cached_response["data"]
+            yield "cards", {"spread": spread, "cards": cached_data["cards"], "question": cached_data["question"]}
+            yield "token", {"text": cached_data["interpretation"]}
+            yield "done", {**cached_response, "cached": True}
+            return
+        
+        try:
+            cards_with_positions = self._select_cards(spread)
+        except ValueError as e:
+            yield "error", {"error": str(e)}
+            return
+        
+        question_text = question if question else "Общее гадание"
+        yield "cards", {"spread": spread, "cards": cards_with_positions, "question": question_text}
+        
+        prompt_config, system_message, user_message = self._prepare_reading_prompt(spread_id, cards_with_positions, question, user_type)
+        
+        logger.info(f"Потоковая генерация гадания: расклад {spread_id}, тип {user_type}")
+        chunks = []
+        try:
+            async for chunk in self.openrouter_client.stream_text(
+                system_message=system_message,
+                user_message=user_message,
+                max_tokens=prompt_config["max_tokens"],
+                temperature=prompt_config["temperature"],
+                models=self._get_models_for_user_type(user_type),
+                deadline_seconds=self.deadlines.get(user_type),
+                caller=f"{self.llm_caller}_stream"
+            ):
+                chunks.append(chunk)
+                yield "token", {"text": chunk}
+        except (NetworkException, HTTPException) as e:
+            logger.error(f"Ошибка при потоковой генерации гадания (расклад {spread_id}, тип {user_type}): {e}")
+            yield "error", {"error": f"Ошибка при получении интерпретации: {str(e)}"}
+            return
+        
+        response_data = {
+            "spread": spread,
+            "cards": cards_with_positions,
+            "interpretation": "".join(chunks),
+            "question": question_text,
+            "timestamp": datetime.now().isoformat()
+        }
+        cached_value = {"success": True, "data": response_data, "error": None, "model": None}
+        
+        cache_ttl_minutes = self.prompts_config.get("TAROT_CACHE_TTL")
+        await self.cache_manager.set(
+            CacheManager.NS_TAROT_READING,
+            cache_key,
+            cached_value,
+            ttl=cache_ttl_minutes * 60 if cache_ttl_minutes else None
+        )
+        
+        yield "done", {**cached_value, "cached": False}